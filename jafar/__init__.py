@@ -0,0 +1,7 @@
+import os
+
+# Запись/воспроизведение внешнего I/O (`jafar bench`): включается до первого сетевого запроса
+if os.environ.get("JAFAR_CASSETTE_MODE"):
+    from jafar.utils.cassette import install_from_env
+
+    install_from_env()
@@ -1,5 +1,4 @@
 import os
-import time
 from pathlib import Path
 from datetime import datetime, timedelta
 from rich.console import Console
@@ -9,28 +8,21 @@ import io
 import sys
 import re
 import json
-import shlex
 import concurrent.futures
 from jafar.utils.gemini_api import ask_gemini_with_image, ask_gemini_text_only
-from jafar.utils.news_api import get_unified_news
-from jafar.utils.topstepx_api_client import TopstepXClient
+from jafar.utils.topstepx_api_client import TopstepXClient, get_shared_client
+from jafar.utils.risk_engine import calculate_trade_metrics, scenario_summary
+from jafar.utils import analysis_memory, cassette, chart_renderer, fill_ledger, indicators, log_pipeline, prefetch
 from .telegram_handler import send_telegram_media_group, send_long_telegram_message
-from .economic_calendar_fetcher import fetch_economic_calendar_data
 from .muxlisa_voice_output_handler import speak_muxlisa_text
 
 console = Console()
 SCREENSHOT_DIR = Path("screenshot")
-ATRADE_LOG_PATH = Path("/Users/macbook/projects/jr/jafar_unified/memory/atrade_analysis_log.md")
 
-# --- НОВАЯ ФУНКЦИЯ ЛОГИРОВАНИЯ ---
+# --- ЛОГИРОВАНИЕ В ПАМЯТЬ АНАЛИЗОВ ---
 def _log_atrade_summary(instrument: str, analysis_data: dict):
-    """Сохраняет краткую сводку анализа в лог-файл в директории memory."""
+    """Сохраняет краткую сводку анализа в память анализов (SQLite)."""
     try:
-        log_file = ATRADE_LOG_PATH
-        log_file.parent.mkdir(parents=True, exist_ok=True)
-
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
         # Извлекаем основные данные для сводки
         full_analysis = analysis_data.get("full_analysis_uzbek_cyrillic", "Таҳлил матни мавжуд эмас.")
         trade_data = analysis_data.get("trade_data", {})
@@ -38,64 +30,28 @@ def _log_atrade_summary(instrument: str, analysis_data: dict):
         # Ищем ключевые выводы в тексте анализа (например, первый абзац)
         summary_paragraph = full_analysis.split('\n\n')[0]
 
-        log_entry = f"""
----
-**Дата:** {timestamp}
-**Инструмент:** {instrument.upper()}
-**План A:** {trade_data.get('action', 'N/A')} @ {trade_data.get('primary_entry', 'N/A')} (SL: {trade_data.get('stop_loss', 'N/A')}, TP1: {trade_data.get('take_profits', {}).get('tp1', 'N/A')})
-**Ключевой вывод:** {summary_paragraph}
----
-"""
-        with log_file.open("a", encoding="utf-8") as f:
-            f.write(log_entry)
-        
-        console.print(f"[dim green]Анализ '{instrument.upper()}' учун хулоса 'memory'га сақланди.[/dim green]")
+        metadata = {
+            'instrument': instrument.upper(),
+            'plan': {
+                'action': trade_data.get('action'),
+                'forecast_strength': trade_data.get('forecast_strength'),
+                'entry': trade_data.get('primary_entry'),
+                'stop_loss': trade_data.get('stop_loss'),
+                'tp1': trade_data.get('take_profits', {}).get('tp1'),
+            },
+        }
+        log_pipeline.submit_task(
+            analysis_memory.save_analysis, instrument, analysis_memory.KIND_ATRADE, metadata, summary_paragraph
+        )
 
     except Exception as e:
-        console.print(f"[red]Лог файлига ёзишда хатолик: {e}[/red]")
+        console.print(f"[red]Хотирага ёзишда хатолик: {e}[/red]")
 
 
 # --- КОНСТАНТЫ И УТИЛИТЫ ---
 DEPOSIT = 2000.0
 MAX_RISK_PERCENT_DEFAULT = 0.02
 MAX_RISK_GROUP_A = 450.0
-WINNING_DAY_TARGET_USD = 150.0
-# Заменяем константу на словарь
-MAX_CONTRACTS_MAP = {
-    "MGC": 50,
-    "GC": 5,
-    "CL": 10,
-    "ES": 10,
-    # Добавьте другие инструменты по мере необходимости
-}
-CONTRACT_MULTIPLIERS = {
-    "GC": 100.0, "MGC": 10.0, "EURUSD": 100000.0, "GBPUSD": 100000.0,
-    "USDJPY": 100000.0, "SPX500": 50.0,
-}
-
-def calculate_trade_metrics(entry_price, stop_loss, take_profit, contract_multiplier, max_risk_for_trade, contract_symbol: str):
-    # ... (эта функция остается без изменений)
-    risk_per_unit = abs(entry_price - stop_loss)
-    if risk_per_unit == 0: return {"error": "Risk per unit is zero."}
-    risk_per_contract = risk_per_unit * contract_multiplier
-    if risk_per_contract == 0: return {"error": "Risk per contract is zero."}
-    
-    # Получаем правильный лимит для текущего инструмента
-    max_contracts_for_instrument = MAX_CONTRACTS_MAP.get(contract_symbol, 1) # По умолчанию 1, если символ не найден
-
-    calculated_position_size = max_risk_for_trade / risk_per_contract
-    position_size = min(calculated_position_size, max_contracts_for_instrument)
-
-    if position_size < 0.01: return {"error": f"Calculated position size ({position_size:.2f}) is too small."}
-    profit_per_unit = abs(take_profit - entry_price)
-    total_risk_usd = position_size * risk_per_contract
-    total_profit_usd = position_size * profit_per_unit * contract_multiplier
-    risk_reward_ratio = total_profit_usd / total_risk_usd if total_risk_usd > 0 else float("inf")
-    return {
-        "position_size": round(position_size, 2), "total_risk_usd": round(total_risk_usd, 2),
-        "total_profit_usd": round(total_profit_usd, 2), "risk_reward_ratio": round(risk_reward_ratio, 2),
-        "meets_winning_day_target": total_profit_usd >= WINNING_DAY_TARGET_USD,
-    }
 
 def get_formatted_topstepx_data(instrument_query: str, contract_id: str) -> tuple[str, dict, dict, list]:
     """
@@ -105,10 +61,10 @@ def get_formatted_topstepx_data(instrument_query: str, contract_id: str) -> tupl
     """
     console.print("\n[blue]Загрузка данных из TopstepX API (параллельно)...[/blue]")
     try:
-        client = TopstepXClient()
+        client = get_shared_client()
         
-        # 1. Получаем список счетов
-        accounts_response = client.get_account_list()
+        # 1. Получаем список счетов (из упреждающей загрузки, если она была)
+        accounts_response = prefetch.fetch("account")
         if not accounts_response or not accounts_response.get("accounts"):
             return "  - Ошибка: Не удалось получить список счетов из TopstepX.", None
         
@@ -148,7 +104,8 @@ def get_formatted_topstepx_data(instrument_query: str, contract_id: str) -> tupl
 
         account_id = primary_account["id"]
         
-        # 3. Запускаем остальные запросы параллельно
+        # 3. Запускаем остальные запросы параллельно (журнал догружает только новые сделки)
+        ledger = fill_ledger.get_ledger()
         with concurrent.futures.ThreadPoolExecutor() as executor:
             end_time = datetime.utcnow()
             start_time_orders = end_time - timedelta(hours=8)
@@ -156,7 +113,7 @@ def get_formatted_topstepx_data(instrument_query: str, contract_id: str) -> tupl
 
             future_positions = executor.submit(client.get_open_positions, account_id)
             future_orders = executor.submit(client.get_orders, account_id, start_time_orders, end_time)
-            future_trades = executor.submit(client.get_trades, account_id, start_time_orders, end_time)
+            future_fills = executor.submit(ledger.sync, client, account_id)
             future_bars = executor.submit(
                 client.get_historical_bars, contract_id, start_time_bars, end_time,
                 unit=2, unit_number=5, limit=6
@@ -164,7 +121,7 @@ def get_formatted_topstepx_data(instrument_query: str, contract_id: str) -> tupl
             
             open_positions = future_positions.result()
             orders = future_orders.result()
-            trades = future_trades.result()
+            future_fills.result()
             bars_response = future_bars.result()
 
         # 4. Форматируем данные в строку
@@ -172,33 +129,14 @@ def get_formatted_topstepx_data(instrument_query: str, contract_id: str) -> tupl
         status_lines.append(f"- **Ҳисоб:** {primary_account.get('name', 'N/A')} (ID: {account_id})")
         status_lines.append(f"- **Баланс:** ${primary_account.get('balance', 0.0):,.2f}")
 
-        # --- НОВЫЙ, НАДЕЖНЫЙ РАСЧЕТ ОТКРЫТЫХ ПОЗИЦИЙ ИЗ СДЕЛОК ---
-        calculated_positions = {}
-        if trades and trades.get("trades"):
-            # Сортируем сделки по времени, чтобы правильно считать
-            sorted_trades = sorted(trades["trades"], key=lambda x: x.get("creationTimestamp", ""))
-            for trade in sorted_trades:
-                contract = trade.get("contractId")
-                size = trade.get("size", 0)
-                side = trade.get("side", 0)
-                
-                # Покупка добавляет к позиции, продажа - отнимает
-                position_change = size if side == 0 else -size
-                
-                if contract in calculated_positions:
-                    calculated_positions[contract] += position_change
-                else:
-                    calculated_positions[contract] = position_change
-
-        # Убираем закрытые позиции (где итоговый размер = 0)
-        open_calculated_positions = {k: v for k, v in calculated_positions.items() if v != 0}
+        # --- ОТКРЫТЫЕ ПОЗИЦИИ ИЗ ЖУРНАЛА ИСПОЛНЕНИЙ (FIFO, средняя цена, P&L) ---
+        if open_positions and "positions" in open_positions:
+            ledger.reconcile(account_id, open_positions["positions"])
+        open_calculated_positions = ledger.open_positions(account_id)
 
         if open_calculated_positions:
             status_lines.append(f"- **Очиқ Позициялар (ҳисобланган):** {len(open_calculated_positions)} та")
-            for contract, size in open_calculated_positions.items():
-                side_str = "Long" if size > 0 else "Short"
-                # P&L и среднюю цену входа из этого метода получить сложно, поэтому пока опускаем
-                status_lines.append(f"  - {contract}: {side_str} {abs(size)}")
+            status_lines.extend(ledger.format_positions(account_id))
         else:
             status_lines.append("- **Очиқ Позициялар:** Йўқ")
 
@@ -212,13 +150,14 @@ def get_formatted_topstepx_data(instrument_query: str, contract_id: str) -> tupl
         else:
             status_lines.append("- **Актив Ордерлар:** Йўқ")
 
-        if trades and trades.get("trades"):
-            status_lines.append(f"- **Бугунги Савдолар:** {len(trades['trades'])} та")
-            for trade in trades["trades"]:
-                side = "Sotish" if trade.get('side') == 1 else "Sotib olish"
-                if 't' in trade:
-                    trade_time = datetime.fromisoformat(trade['t'].replace('Z', '+00:00')).strftime('%H:%M:%S')
-                    status_lines.append(f"  - {trade_time}: {side} {trade.get('size')} {trade.get('contractId')} @ {trade.get('price')} (ID: {trade.get('orderId')})")
+        todays_fills = ledger.recent_fills(account_id)
+        if todays_fills:
+            day_totals = ledger.daily_totals(account_id)["total"]
+            status_lines.append(f"- **Бугунги Савдолар:** {len(todays_fills)} та (P&L: ${day_totals['realized_pnl']:,.2f}, комиссия: ${day_totals['fees']:,.2f})")
+            for fill in todays_fills:
+                side = "Sotish" if fill["side"] == 1 else "Sotib olish"
+                fill_time = datetime.fromisoformat(fill["ts"]).strftime('%H:%M:%S')
+                status_lines.append(f"  - {fill_time}: {side} {fill['size']:g} {fill['contract_id']} @ {fill['price']} (ID: {fill['order_id']})")
         else:
             status_lines.append("- **Бугунги Савдолар:** Йўқ")
             
@@ -243,7 +182,7 @@ def run_atrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
     """
     Выполняет полный "супер-анализ" на основе предоставленных данных.
     """
-    client = TopstepXClient()
+    client = get_shared_client()
 
     # --- ШАГ 0: Получаем правильный ID контракта и Tick Size ---
     console.print(f"\n[blue]Поиск актуального контракта для '{contract_symbol}'...[/blue]")
@@ -266,40 +205,31 @@ def run_atrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
 
 
     # --- ШАГ 1: Сбор данных из API ---
-    topstepx_data, primary_account, open_positions, active_orders = get_formatted_topstepx_data(instrument_query, full_contract_id)
-    if not primary_account:
-        return "Ошибка: Не удалось получить данные об аккаунте для расчета рисков."
+    with cassette.stage("fetch"):
+        topstepx_data, primary_account, open_positions, active_orders = get_formatted_topstepx_data(instrument_query, full_contract_id)
+        if not primary_account:
+            return "Ошибка: Не удалось получить данные об аккаунте для расчета рисков."
     
-    console.print(f"\n[blue]'{instrument_query}' учун янгиликлар юкланмоқда...[/blue]")
-    try:
-        # Для золота, делаем два отдельных запроса, чтобы получить больше новостей
-        if instrument_query.lower() in ["gold", "mgc", "gc", "oltin", "zoloto"]:
-            console.print("[cyan] (DXY учун ҳам янгиликлар қидирилмоқда...) [/cyan]")
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                future_gold = executor.submit(get_unified_news, instrument="gold")
-                future_dxy = executor.submit(get_unified_news, instrument="DXY")
-                
-                news_results_gold = future_gold.result()
-                news_results_dxy = future_dxy.result()
+        console.print(f"\n[blue]'{instrument_query}' учун янгиликлар юкланмоқда...[/blue]")
+        # Макро-новости не зависят от инструмента: голосовой диалог мог загрузить их заранее
+        try:
+            news_results = prefetch.fetch("news")
+        except Exception as e:
+            news_results = f"Ошибка при загрузке новостей: {e}"
+        console.print("[green]Янгиликлар юкланди.[/green]")
 
-            news_results = f"**Gold News:**\n{news_results_gold}\n\n**DXY (US Dollar Index) News:**\n{news_results_dxy}"
-        else:
-            news_results = get_unified_news(instrument=instrument_query)
-
-    except Exception as e:
-        news_results = f"Ошибка при загрузке новостей: {e}"
-    console.print("[green]Янгиликлар юкланди.[/green]")
-
-    economic_calendar_data = fetch_economic_calendar_data()
+        economic_calendar_data = prefetch.fetch("calendar")
 
     # --- ЭТАП 1.5: Предварительный анализ сентимента ---
-    news_sentiment = _get_sentiment_from_data("Новости", news_results, instrument_query)
-    calendar_sentiment = _get_sentiment_from_data("Экономический календарь", economic_calendar_data, instrument_query)
+    with cassette.stage("llm"):
+        news_sentiment = _get_sentiment_from_data("Новости", news_results, instrument_query)
+        calendar_sentiment = _get_sentiment_from_data("Экономический календарь", economic_calendar_data, instrument_query)
     _log_market_sentiment(instrument_query, news_sentiment, calendar_sentiment)
 
     # --- ШАГ 2: Формирование промпта для Gemini ---
     console.print("\n[bold blue]Супер-комплекс таҳлил бошланмоқда...[/bold blue]")
-    prompt = f"""Simulation. Role: experienced intraday trader. Instrument for analysis: {instrument_query}.
+    with cassette.stage("prompt"):
+        prompt = f"""Simulation. Role: experienced intraday trader. Instrument for analysis: {instrument_query}.
     Task: develop a detailed and flexible trading plan for the next 2-4 hours.
     Input data: 3 screenshots, news, economic calendar, and REAL DATA FROM THE TRADING ACCOUNT.
 
@@ -310,6 +240,9 @@ def run_atrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
     **DATA FROM TRADING ACCOUNT (TopstepX API):**
     ```{topstepx_data}```
 
+    **INDICATORS (COMPUTED FROM BARS, PER TIMEFRAME):**
+    ```{indicators.format_for_prompt(contract_symbol)}```
+
     **NEWS ({instrument_query}):**
     ```{news_results}```
 
@@ -349,7 +282,8 @@ def run_atrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
     try:
         image_objects = [Image.open(p) for p in screenshot_files]
         # Теперь мы ожидаем от Gemini сразу готовый JSON
-        raw_response = ask_gemini_with_image(prompt, image_objects)
+        with cassette.stage("llm"):
+            raw_response = ask_gemini_with_image(prompt, image_objects)
         
         # --- Извлечение и парсинг JSON ---
         analysis_data = None
@@ -410,6 +344,7 @@ def run_atrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
                     
                     # Множитель контракта = стоимость тика / размер тика
                     contract_multiplier = active_contract.get("tickValue") / active_contract.get("tickSize")
+                    fill_ledger.get_ledger().set_multiplier(full_contract_id, contract_multiplier)
 
                     metrics = calculate_trade_metrics(
                         entry_price, stop_loss, take_profit, 
@@ -423,6 +358,11 @@ def run_atrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
                         position_size = metrics.get("position_size", 1)
                         console.print("\n[bold cyan]--- Управление Рисками ---[/bold cyan]")
                         print_json(data=metrics)
+                        console.print("[bold cyan]--- Сценарии стопа (шире на 5–30 тиков, риск 2–20%) ---[/bold cyan]")
+                        print_json(data=scenario_summary(
+                            entry_price, stop_loss, take_profit, contract_multiplier,
+                            balance, contract_symbol, tick_size, max_risk_for_trade
+                        ))
 
                     # --- ПРОВЕРКА И ЗАКРЫТИЕ СУЩЕСТВУЮЩИХ ПОЗИЦИЙ/ОРДЕРОВ ---
                     has_open_positions = open_positions and open_positions.get("positions")
@@ -536,7 +476,7 @@ def run_atrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
 
                     if confirmation in ["ҳа", "ха", "yes", "да", "1"]:
                         console.print("[cyan]Позицияни ёпиш учун TopstepX'га уланилмоқда...[/cyan]")
-                        client = TopstepXClient()
+                        client = get_shared_client()
                         primary_account = get_primary_account(client)
                         if not primary_account:
                             console.print("[red]Ордер жойлаштириш учун ҳисоб топилмади.[/red]")
@@ -644,36 +584,26 @@ def _get_sentiment_from_data(data_type: str, data_content: str, instrument: str)
 # --- НОВАЯ ФУНКЦИЯ ЛОГИРОВАНИЯ СЕНТИМЕНТА ---
 def _log_market_sentiment(instrument: str, news_sentiment: str, calendar_sentiment: str):
     """
-    Сохраняет сентимент по новостям и календарю в лог-файл.
+    Сохраняет сентимент по новостям и календарю в память анализов.
     """
     try:
-        instrument_dir = Path("/Users/macbook/projects/jr/jafar_unified/memory") / instrument.lower()
-        instrument_dir.mkdir(parents=True, exist_ok=True)
-        log_file = instrument_dir / "market_sentiment_log.md"
-
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        log_entry = f"""
----
-date: '{timestamp}'
-instrument: {instrument.upper()}
-tags:
-- sentiment_analysis
----
-
-**Мнение по новостям:**
+        metadata = {
+            'instrument': instrument.upper(),
+            'tags': ['sentiment_analysis'],
+            'news_sentiment': news_sentiment,
+            'calendar_sentiment': calendar_sentiment,
+        }
+        log_entry = f"""**Мнение по новостям:**
 {news_sentiment}
 
 **Мнение по экономическому календарю:**
-{calendar_sentiment}
-"""
-        with log_file.open("a", encoding="utf-8") as f:
-            f.write(log_entry)
-        
-        console.print(f"[dim green]Сентимент '{instrument.upper()}' учун 'memory'га сақланди.[/dim green]")
+{calendar_sentiment}"""
+        log_pipeline.submit_task(
+            analysis_memory.save_analysis, instrument, analysis_memory.KIND_SENTIMENT, metadata, log_entry
+        )
 
     except Exception as e:
-        console.print(f"[red]Сентимент лог файлига ёзишда хатолик: {e}[/red]")
+        console.print(f"[red]Сентимент хотирага ёзишда хатолик: {e}[/red]")
 
 # --- СТАРЫЙ ОБРАБОТЧИК КОМАНД (ТЕПЕРЬ ИСПОЛЬЗУЕТ "API") ---
 def atrade_command(args: str = None):
@@ -707,7 +637,9 @@ def atrade_command(args: str = None):
     contract_id = None
 
     if args:
-        parts = shlex.split(args)
+        from jafar.cli.command_router import split_command
+
+        parts = split_command(args) or [""]
         instrument_query = parts[0].lower()
         console.print(f"[bold blue][DEBUG] Parsed instrument_query: '{instrument_query}'[/bold blue]")
     
@@ -724,20 +656,10 @@ def atrade_command(args: str = None):
         console.print(f"[red]'{instrument_query}' учун API тикери топилмади. Луғатни текширинг.[/red]"); return
 
     console.print(f"[cyan]Таҳлил учун танланди: {instrument_query.capitalize()} (API Ticker: {contract_id})[/cyan]")
-    console.print("[yellow]Интерактив скриншот олиш режими...[/yellow]")
-    
+
     timestamp_folder = datetime.now().strftime("%Y-%m-%d_%H-%M-%S_QTrade_CLI")
     current_batch_dir = SCREENSHOT_DIR / timestamp_folder
-    current_batch_dir.mkdir(parents=True, exist_ok=True)
-    for i in range(3):
-        console.print(f"\n[cyan]Скриншот #{i + 1}/3 учун тайёрланинг (3 сония)...[/cyan]")
-        time.sleep(3)
-        path = current_batch_dir / f"screenshot_{i + 1}.png"
-        os.system(f'screencapture -w "{str(path)}"')
-        if not path.exists() or path.stat().st_size == 0:
-            console.print("[red]Скриншот олиш бекор қилинди.[/red]"); return
-        console.print(f"[green]Скриншот #{i + 1} сақланди.[/green]")
-        screenshot_files.append(str(path))
+    screenshot_files = chart_renderer.charts_for_analysis(contract_id, current_batch_dir, instrument=instrument_query)
 
     if len(screenshot_files) == 3:
         # Вызываем новое ядро анализа с обоими именами
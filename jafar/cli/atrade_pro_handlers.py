@@ -1,6 +1,4 @@
 from .muxlisa_voice_output_handler import speak_muxlisa_text
-import os
-import time
 from pathlib import Path
 from datetime import datetime, timedelta
 from rich.console import Console
@@ -13,12 +11,11 @@ import re
 import json
 import shlex
 import concurrent.futures
-import yaml  # Импортируем новую библиотеку
 from jafar.utils.gemini_api import ask_gemini_with_image, ask_gemini_text_only
+from jafar.utils import analysis_memory, chart_renderer, indicators, log_pipeline, prefetch
 
 console = Console()
 SCREENSHOT_DIR = Path("screenshot")
-MEMORY_BASE_DIR = Path("/Users/macbook/projects/jr/jafar_unified/memory")
 
 # --- ОБНОВЛЕННАЯ ФУНКЦИЯ ПРОВЕРКИ ВРЕМЕНИ РАБОТЫ РЫНКА ---
 def _check_market_hours(instrument_query: str) -> str:
@@ -47,23 +44,17 @@ def _check_market_hours(instrument_query: str) -> str:
     
     return "OPEN"
 
-# --- ФУНКЦИИ ЛОГИРОВАНИЯ (без изменений) ---
+# --- ФУНКЦИИ ЛОГИРОВАНИЯ (память анализов в SQLite) ---
 
 def _log_market_sentiment(instrument: str, news_sentiment: str, calendar_sentiment: str):
-    """Сохраняет сентимент в лог-файл с YAML Front Matter."""
+    """Сохраняет сентимент в память анализов."""
     try:
-        instrument_dir = MEMORY_BASE_DIR / instrument.lower()
-        instrument_dir.mkdir(parents=True, exist_ok=True)
-        log_file = instrument_dir / "market_sentiment_log.md"
-        
-        timestamp = datetime.now()
-
         metadata = {
-            'date': timestamp.strftime("%Y-%m-%d %H:%M:%S"),
             'instrument': instrument.upper(),
-            'tags': ['sentiment_analysis']
+            'tags': ['sentiment_analysis'],
+            'news_sentiment': news_sentiment,
+            'calendar_sentiment': calendar_sentiment,
         }
-        yaml_front_matter = yaml.dump(metadata, default_flow_style=False, allow_unicode=True)
 
         log_content = f"""
 **Мнение по новостям:**
@@ -72,28 +63,20 @@ def _log_market_sentiment(instrument: str, news_sentiment: str, calendar_sentime
 **Мнение по экономическому календарю:**
 {calendar_sentiment}
 """
-        
-        log_entry = f"---\n{yaml_front_matter}---\n{log_content}"
-
-        with log_file.open("a", encoding="utf-8") as f:
-            f.write(log_entry)
-        console.print(f"[dim green]Сентимент рынка для '{instrument.upper()}' сохранен в 'memory/{instrument.lower()}'.[/dim green]")
+        log_pipeline.submit_task(
+            analysis_memory.save_analysis, instrument, analysis_memory.KIND_SENTIMENT, metadata, log_content.strip()
+        )
 
     except Exception as e:
-        console.print(f"[red]Ошибка при записи в лог сентимента: {e}[/red]")
+        console.print(f"[red]Ошибка при записи сентимента в память: {e}[/red]")
 
 
-def _log_atrade_summary(instrument: str, analysis_data: dict):
-    """Сохраняет краткую сводку анализа в лог-файл с YAML Front Matter."""
+def _log_atrade_summary(instrument: str, analysis_data: dict, setup_context: dict | None = None):
+    """Сохраняет краткую сводку анализа в память анализов (метаданные + текст + признаки сетапа)."""
     try:
-        instrument_dir = MEMORY_BASE_DIR / instrument.lower()
-        instrument_dir.mkdir(parents=True, exist_ok=True)
-        log_file = instrument_dir / "atrade_analysis_log.md"
-
-        timestamp = datetime.now()
-        
         # --- Извлечение данных из нового/старого формата ---
         plan_a_data = analysis_data.get("plan_a_primary", analysis_data.get("trade_data", {}))
+        generated_metadata = analysis_data.get("metadata", {})
         
         # --- Очистка и извлечение числовых значений ---
         def clean_and_extract_float(raw_value):
@@ -101,24 +84,27 @@ def _log_atrade_summary(instrument: str, analysis_data: dict):
             match = re.search(r'(\d+\.?\d*)', str(raw_value))
             return float(match.group(1)) if match else None
 
-        # --- Формирование метаданных для YAML ---
+        take_profits = plan_a_data.get('take_profits') or {}
+
+        # --- Формирование метаданных ---
         metadata = {
-            'date': timestamp.strftime("%Y-%m-%d %H:%M:%S"),
             'instrument': instrument.upper(),
-            'sentiment': analysis_data.get('sentiment'),
-            'strategy': plan_a_data.get('strategy_name'),
-            'key_event': analysis_data.get('key_event'),
-            'tags': analysis_data.get('tags', []),
+            'sentiment': analysis_data.get('sentiment', generated_metadata.get('sentiment')),
+            'strategy': plan_a_data.get('strategy_name', generated_metadata.get('strategy')),
+            'key_event': analysis_data.get('key_event', generated_metadata.get('key_event')),
+            'tags': analysis_data.get('tags', generated_metadata.get('tags', [])),
             'plan': {
                 'action': plan_a_data.get('action'),
-                'entry': clean_and_extract_float(plan_a_data.get('entry')),
+                'forecast_strength': plan_a_data.get('forecast_strength'),
+                'entry': clean_and_extract_float(plan_a_data.get('entry', plan_a_data.get('primary_entry'))),
                 'stop_loss': clean_and_extract_float(plan_a_data.get('stop_loss')),
-                'tp1': clean_and_extract_float(plan_a_data.get('take_profit_1'))
+                'tp1': clean_and_extract_float(plan_a_data.get('take_profit_1', take_profits.get('tp1')))
             }
         }
-        yaml_front_matter = yaml.dump(metadata, default_flow_style=False, allow_unicode=True)
+        if setup_context:
+            metadata['features'] = setup_context
 
-        # --- Формирование основного текста лога ---
+        # --- Формирование основного текста ---
         full_analysis_text = analysis_data.get("full_analysis_uzbek_cyrillic", "Таҳлил матни мавжуд эмас.")
         
         log_content = ""
@@ -130,71 +116,47 @@ def _log_atrade_summary(instrument: str, analysis_data: dict):
         else:
             log_content = str(full_analysis_text)
 
-        log_entry = f"---\n{yaml_front_matter}---\n\n{log_content}\n"
-
-        with log_file.open("a", encoding="utf-8") as f:
-            f.write(log_entry)
-        
-        console.print(f"[dim green]Анализ '{instrument.upper()}' учун хулоса 'memory/{instrument.lower()}'га сақланди.[/dim green]")
+        log_pipeline.submit_task(analysis_memory.save_analysis, instrument, analysis_memory.KIND_ATRADE, metadata, log_content)
 
     except Exception as e:
-        console.print(f"[red]Лог файлига ёзишда хатолик: {e}[/red]")
+        console.print(f"[red]Хотирага ёзишда хатолик: {e}[/red]")
 
 
-# --- НОВАЯ ФУНКЦИЯ ЗАГРУЗКИ ПАМЯТИ ---
+# --- ЗАГРУЗКА ПАМЯТИ ---
 def _load_memory_for_prompt(instrument: str, num_entries: int = 3) -> str:
     """
-    Загружает последние записи из лога анализа для указанного инструмента
+    Загружает последние записи анализа для указанного инструмента
     и форматирует их в виде строки для промпта.
     """
     console.print(f"[cyan]Загрузка памяти для '{instrument.upper()}'...[/cyan]")
-    instrument_dir = MEMORY_BASE_DIR / instrument.lower()
-    log_file = instrument_dir / "atrade_analysis_log.md"
-
-    if not log_file.exists():
-        return "Предыдущий анализ в памяти не найден."
 
-    memory_lines = ["Вот краткая сводка моих предыдущих анализов (моя память):"]
-    
     try:
-        with log_file.open("r", encoding="utf-8") as f:
-            content = f.read()
-        
-        entries = content.split('---')
-        recent_entries = [entry for entry in entries if entry.strip()][-num_entries:]
-
-        for entry in recent_entries:
-            try:
-                metadata = yaml.safe_load(entry)
-                if not metadata: continue
-
-                date = metadata.get('date', 'N/A')
-                plan = metadata.get('plan', {})
-                action = plan.get('action', 'N/A')
-                sentiment = metadata.get('sentiment', 'N/A')
-                strategy = metadata.get('strategy', 'N/A')
-                
-                summary = f"- {date}: Сентимент был '{sentiment}'. Основная стратегия: '{strategy}', План: {action}."
-                memory_lines.append(summary)
-
-            except yaml.YAMLError:
-                continue
+        recent_entries = analysis_memory.load_recent(instrument, analysis_memory.KIND_ATRADE, num_entries)
     except Exception as e:
-        console.print(f"[red]Ошибка при чтении файла памяти: {e}[/red]")
+        console.print(f"[red]Ошибка при чтении памяти: {e}[/red]")
         return "Ошибка при чтении памяти."
 
-    if len(memory_lines) == 1: # Только заголовок
+    if not recent_entries:
         return "Предыдущий анализ в памяти не найден."
 
+    memory_lines = ["Вот краткая сводка моих предыдущих анализов (моя память):"]
+    for entry in recent_entries:
+        metadata = entry["metadata"]
+        plan = metadata.get('plan') or {}
+        action = plan.get('action', 'N/A')
+        sentiment = metadata.get('sentiment', 'N/A')
+        strategy = metadata.get('strategy', 'N/A')
+        memory_lines.append(f"- {entry['created_at']}: Сентимент был '{sentiment}'. Основная стратегия: '{strategy}', План: {action}.")
+
     console.print(f"[green]Память успешно загружена. Найдено {len(memory_lines) - 1} записей.[/green]")
     return "\n".join(memory_lines)
 
 
 # --- ЯДРО АНАЛИЗА ---
-from jafar.utils.news_api import get_unified_news
 from jafar.utils.topstepx_api_client import TopstepXClient
+from jafar.utils.market_utils import get_current_trading_session
+from jafar.utils.setup_index import build_setup_context, current_level_distance_pct, format_similar_setups_for_prompt
 from .telegram_handler import send_telegram_media_group, send_long_telegram_message
-from .economic_calendar_fetcher import fetch_economic_calendar_data
 from .muxlisa_voice_output_handler import speak_muxlisa_text
 
 def run_atrade_analysis(instrument_query: str, contract_id: str, screenshot_files: list[str]) -> str:
@@ -205,14 +167,14 @@ def run_atrade_analysis(instrument_query: str, contract_id: str, screenshot_file
     console.print(f"\n[blue]'{instrument_query}' учун янгиликлар юкланмоқда (Marketaux)...[/blue]")
     
     try:
-        news_results = get_unified_news(instrument=instrument_query)
+        news_results = prefetch.fetch("news")
     except Exception as e:
         news_results = f"Ошибка при загрузке новостей из Marketaux: {e}"
 
     console.print("[green]Янгиликлар юкланди.[/green]")
 
     # --- ЭТАП 1.3: Сбор данных экономического календаря ---
-    economic_calendar_data = fetch_economic_calendar_data()
+    economic_calendar_data = prefetch.fetch("calendar")
 
     # --- ЭТАП 1.5: Предварительный анализ сентимента ---
     news_sentiment = _get_sentiment_from_data("Новости", news_results, instrument_query)
@@ -221,6 +183,10 @@ def run_atrade_analysis(instrument_query: str, contract_id: str, screenshot_file
 
     # --- ЭТАП 1.7: Загрузка памяти для промпта ---
     memory_summary = _load_memory_for_prompt(instrument_query)
+    # Сентимент для похожих сетапов — по исходным текстам, как в ctrade и btrade
+    setup_context = build_setup_context(get_current_trading_session(), news_results, economic_calendar_data,
+                                        current_level_distance_pct(contract_id, instrument_query))
+    similar_setups = format_similar_setups_for_prompt(instrument_query, setup_context)
     
     topstepx_data = "TopstepX API data is not available at the moment."
 
@@ -234,6 +200,9 @@ def run_atrade_analysis(instrument_query: str, contract_id: str, screenshot_file
     **PREVIOUS ANALYSIS SUMMARY (MY MEMORY):**
     {memory_summary}
 
+    **SIMILAR PAST SETUPS AND THEIR OUTCOMES (MY MEMORY):**
+    {similar_setups}
+
     **MY PRE-ANALYZED SENTIMENTS (IMPORTANT CONTEXT):**
     - News Sentiment: {news_sentiment}
     - Calendar Sentiment: {calendar_sentiment}
@@ -241,6 +210,9 @@ def run_atrade_analysis(instrument_query: str, contract_id: str, screenshot_file
     **DATA FROM TRADING ACCOUNT (TopstepX API):**
     ```{topstepx_data}```
 
+    **INDICATORS (COMPUTED FROM BARS, PER TIMEFRAME):**
+    ```{indicators.format_for_prompt(contract_id)}```
+
     **NEWS (FROM SPECIALIZED SOURCE - Marketaux):**
     ```{news_results}```
 
@@ -314,7 +286,7 @@ def run_atrade_analysis(instrument_query: str, contract_id: str, screenshot_file
             return "Ошибка: Не удалось получить структурированные данные от Gemini."
 
         # --- Логируем результат с новыми метаданными ---
-        _log_atrade_summary(instrument_query, analysis_data)
+        _log_atrade_summary(instrument_query, analysis_data, setup_context)
 
         # ... (остальная часть функции: вывод в консоль, озвучка, отправка в Telegram - без изменений) ...
         
@@ -359,20 +331,9 @@ def atrade_pro_command(args: str = None):
         console.print(f"[red]Инструмент '{instrument_query}' не поддерживается.[/red]"); return
 
     console.print(f"[cyan]Анализ для: {instrument_query.capitalize()} (API Ticker: {contract_id})[/cyan]")
-    console.print("[yellow]Режим интерактивного скриншота...[/yellow]")
-    
-    screenshot_files = []
+
     current_batch_dir = SCREENSHOT_DIR / datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    current_batch_dir.mkdir(parents=True, exist_ok=True)
-    for i in range(3):
-        console.print(f"\n[cyan]Приготовьтесь к скриншоту #{i + 1}/3 (3 секунды)...[/cyan]")
-        time.sleep(3)
-        path = current_batch_dir / f"screenshot_{i + 1}.png"
-        os.system(f'screencapture -w "{str(path)}"')
-        if not path.exists() or path.stat().st_size == 0:
-            console.print("[red]Скриншот отменен.[/red]"); return
-        console.print(f"[green]Скриншот #{i + 1} сохранен.[/green]")
-        screenshot_files.append(str(path))
+    screenshot_files = chart_renderer.charts_for_analysis(contract_id, current_batch_dir, instrument=instrument_query)
 
     if len(screenshot_files) == 3:
         return run_atrade_analysis(instrument_query, contract_id, screenshot_files)
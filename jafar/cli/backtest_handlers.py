@@ -0,0 +1,86 @@
+import math
+import shlex
+from pathlib import Path
+from rich.console import Console
+from rich.panel import Panel
+from rich.table import Table
+
+from jafar.utils import backtester, bar_history
+
+console = Console()
+
+
+def _fmt(value, pattern: str = "{:.2f}") -> str:
+    return "—" if value is None or (isinstance(value, float) and math.isnan(value)) else pattern.format(value)
+
+
+def _fetch_bars(symbol: str, days: int):
+    from jafar.utils.topstepx_api_client import get_shared_client
+
+    client = get_shared_client()
+    contract_info = client.search_contract(name=symbol) or {}
+    active_contract = next((c for c in contract_info.get("contracts", []) if c.get("activeContract")), None)
+    if not active_contract:
+        console.print(f"[red]Активный контракт для '{symbol}' не найден.[/red]")
+        return
+    saved = bar_history.download(client, active_contract["id"], symbol, days=days)
+    console.print(f"[green]Сохранено {saved} минутных баров {symbol.upper()} ({active_contract['id']}).[/green]")
+
+
+def backtest_command(args: str = None):
+    """
+    Бэктест сохранённых торговых планов на локальной истории баров:
+    - backtest [инструмент] [--by instrument|session|strength] [--record]
+    - backtest fetch <инструмент> [дней]   — скачать минутные бары из TopstepX
+    - backtest import <инструмент> <csv>   — загрузить бары из CSV
+    """
+    parts = shlex.split(args) if args else []
+
+    if parts and parts[0].lower() == "fetch" and len(parts) > 1:
+        _fetch_bars(parts[1], int(parts[2]) if len(parts) > 2 else 30)
+        return
+
+    if parts and parts[0].lower() == "import" and len(parts) > 2:
+        count = bar_history.import_csv(parts[1], Path(parts[2]).expanduser())
+        console.print(f"[green]Импортировано {count} баров {parts[1].upper()}.[/green]")
+        return
+
+    if parts and parts[0].lower() in ("help", "-h"):
+        console.print(Panel(backtest_command.__doc__.strip(), title="📈 Backtest", style="cyan"))
+        return
+
+    group_by = "instrument"
+    if "--by" in parts:
+        position = parts.index("--by")
+        group_by = parts[position + 1] if position + 1 < len(parts) else group_by
+        del parts[position:position + 2]
+    record = "--record" in parts
+    parts = [p for p in parts if p != "--record"]
+    if group_by not in ("instrument", "session", "strength"):
+        console.print(f"[red]Неизвестная группировка '{group_by}' (instrument|session|strength).[/red]")
+        return
+
+    plans, results = backtester.run_backtest(parts[0] if parts else None)
+    tested = int(results["has_bars"].sum())
+    if not tested:
+        console.print(
+            f"[yellow]Планов в памяти: {len(plans)}, но для них нет баров. "
+            f"Загрузите историю: backtest fetch <инструмент> [дней].[/yellow]"
+        )
+        return
+
+    table = Table(title=f"Бэктест планов ({tested} из {len(plans)} с историей)", header_style="bold blue")
+    for column in (group_by, "Планы", "Вход", "TP", "SL", "Тайм-аут", "Win", "E[R]", "MFE R", "MAE R", "мин до TP", "мин до SL"):
+        table.add_column(column, justify="left" if column == group_by else "right")
+    for row in backtester.summarize(plans, results, by=group_by):
+        table.add_row(
+            str(row[group_by]), str(row["plans"]), _fmt(row["fill_rate"], "{:.0%}"), str(row["tp"]), str(row["sl"]),
+            str(row["timeout"]), _fmt(row["win_rate"], "{:.0%}"), _fmt(row["expectancy_r"], "{:+.2f}"),
+            _fmt(row["avg_mfe_r"]), _fmt(row["avg_mae_r"]), _fmt(row["median_min_to_tp"], "{:.0f}"),
+            _fmt(row["median_min_to_sl"], "{:.0f}"),
+        )
+    console.print(table)
+
+    if record:
+        recorded = backtester.record_outcomes(plans, results)
+        console.print(f"[green]Исходы записаны в память анализов: {recorded}.[/green]")
@@ -0,0 +1,231 @@
+import json
+import os
+import shlex
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import wave
+from pathlib import Path
+from rich.console import Console
+from rich.panel import Panel
+from rich.table import Table
+
+from jafar.config.constants import JAFAR_CASSETTES_DIR
+from jafar.utils import cassette
+
+console = Console()
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+SESSIONS = ("atrade", "btrade", "ctrade", "voice")
+DEFAULT_RUNS = 3
+
+
+def _child_env(mode: str, path: Path, memory_dir: str, **extra) -> dict:
+    """
+    Окружение прогона: своя кассета, пустая временная память и кэш TTS (одинаковые
+    при записи и воспроизведении), звук никуда не выводится.
+    """
+    env = dict(
+        os.environ,
+        JAFAR_CASSETTE_MODE=mode, JAFAR_CASSETTE=str(path), JAFAR_MEMORY_DIR=memory_dir,
+        JAFAR_TTS_CACHE_DIR=str(Path(memory_dir) / "tts_cache"), JAFAR_AUDIO_SINK="null",
+        PYTHONPATH=os.pathsep.join(filter(None, [str(PROJECT_ROOT), os.environ.get("PYTHONPATH")])),
+    )
+    env.update({k: str(v) for k, v in extra.items()})
+    return env
+
+
+def _run_child(command: str, env: dict, quiet: bool) -> int:
+    output = subprocess.DEVNULL if quiet else None
+    return subprocess.run(
+        [sys.executable, "-m", "jafar.cli.bench_handlers", *shlex.split(command)],
+        cwd=PROJECT_ROOT, env=env, stdout=output, stderr=output, stdin=subprocess.DEVNULL if quiet else None,
+    ).returncode
+
+
+def voice_turn(args: list[str], audio_seconds: float = 3.0):
+    """Один голосовой ход: Muxlisa STT -> ответ Gemini -> конвейерная озвучка (как в jafar_core)."""
+    import google.generativeai as genai
+
+    from jafar.voice.jafar_core import chat_reply
+    from jafar.voice.speech import speak_long_text, stt_muxlisa
+    from jafar.voice.stt_engine import SAMPLE_RATE, read_wav_pcm
+
+    wav = Path(args[0]).expanduser() if args else None
+    # При воспроизведении сопоставление STT идёт по пути запроса: без файла хватает тишины той же длины
+    pcm = read_wav_pcm(wav) if wav and wav.exists() else bytes(int(audio_seconds * SAMPLE_RATE) * 2)
+    with cassette.stage("stt"):
+        text = stt_muxlisa(pcm)
+    genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+    with cassette.stage("llm"):
+        reply = chat_reply(genai.GenerativeModel("models/gemini-2.5-pro"), text or "salom")
+    with cassette.stage("tts"):
+        speak_long_text(reply, threading.Event())
+
+
+def run_session(argv: list[str]) -> int:
+    """Точка входа дочернего процесса: одна сессия под кассетой из окружения."""
+    active = cassette.active()
+    status = "success"
+    with cassette.stage("session"):
+        if argv[0] == "voice":
+            voice_turn(argv[1:], float((active.meta if active else {}).get("audio_seconds") or 3.0))
+        else:
+            from jafar.cli.command_router import handle_command
+
+            status = handle_command(" ".join(argv), interactive_session=False)
+        if "jafar.utils.telegram_outbox" in sys.modules:
+            with cassette.stage("telegram_flush"):
+                sys.modules["jafar.utils.telegram_outbox"].flush()
+    return 0 if status != "failure" else 1
+
+
+def record(parts: list[str]):
+    name = parts[0]
+    if "--as" in parts:
+        position = parts.index("--as")
+        name = parts[position + 1]
+        del parts[position:position + 2]
+    command = " ".join(parts)
+    meta = {"command": command, "session": parts[0]}
+    if parts[0] == "voice" and len(parts) > 1:
+        with wave.open(str(Path(parts[1]).expanduser()), "rb") as wf:
+            meta["audio_seconds"] = round(wf.getnframes() / wf.getframerate(), 2)
+    path = cassette.cassette_path(name)
+    cassette.write_meta(path, **meta)
+    console.print(f"[cyan]Запись сессии '{command}' в {path} (сеть и ответы идут как обычно)...[/cyan]")
+    with tempfile.TemporaryDirectory(prefix="jafar-bench-") as memory_dir:
+        code = _run_child(command, _child_env("record", path, memory_dir, JAFAR_CASSETTE_STARTED=1), quiet=False)
+    _, interactions = cassette.load(path)
+    style = "green" if code == 0 else "yellow"
+    console.print(f"[{style}]Кассета '{name}': {len(interactions)} обращений (код выхода {code}).[/{style}]")
+
+
+def replay(name: str, runs: int, latency: str) -> list[dict]:
+    path = cassette.cassette_path(name)
+    meta, _ = cassette.load(path)
+    reports = []
+    with tempfile.TemporaryDirectory(prefix="jafar-bench-") as scratch:
+        for run in range(runs):
+            memory_dir = Path(scratch) / f"run{run}"
+            memory_dir.mkdir()
+            report_path = memory_dir / "report.json"
+            env = _child_env("replay", path, str(memory_dir), JAFAR_CASSETTE_LATENCY=latency,
+                             JAFAR_CASSETTE_REPORT=report_path)
+            code = _run_child(meta["command"], env, quiet=True)
+            if not report_path.exists():
+                console.print(f"[red]{name}: прогон {run + 1} завершился без отчёта (код {code}).[/red]")
+                continue
+            reports.append(json.loads(report_path.read_text(encoding="utf-8")))
+    return reports
+
+
+def _ms(values: list[float]) -> tuple[str, str, str]:
+    if not values:
+        return "—", "—", "—"
+    return tuple(f"{v * 1000:.0f}" for v in (statistics.median(values), min(values), max(values)))
+
+
+def print_report(name: str, command: str, reports: list[dict], latency: str):
+    table = Table(title=f"{name}: {command} — {len(reports)} прогонов, задержка {latency}", header_style="bold blue")
+    for column in ("Этап", "Вызовов", "p50 мс", "мин мс", "макс мс"):
+        table.add_column(column, justify="left" if column == "Этап" else "right")
+    for key, label in (("wall", "сессия целиком"), ("local", "локально (CPU, без ожидания сети)"), ("io", "сеть (объединение)")):
+        table.add_row(f"[bold]{label}[/bold]", "", *_ms([r[key] for r in reports]))
+    for service in sorted({s for r in reports for s in r["services"]}):
+        if service == "stdin":
+            continue
+        stats = [r["services"].get(service) for r in reports]
+        calls = statistics.median([s["calls"] if s else 0 for s in stats])
+        table.add_row(f"  {service}", f"{calls:g}", *_ms([s["seconds"] for s in stats if s]))
+    for stage in sorted({s for r in reports for s in r["stages"]}):
+        table.add_row(f"  этап: {stage}", "", *_ms([r["stages"][stage] for r in reports if stage in r["stages"]]))
+    console.print(table)
+    misses = sum(s["misses"] for r in reports for s in r["services"].values())
+    loose = sum(s["loose"] for r in reports for s in r["services"].values())
+    if misses or loose:
+        console.print(f"[yellow]{name}: промахов кассеты {misses}, нестрогих совпадений {loose} — "
+                      f"сессия разошлась с записью, перезапишите: bench record {command}[/yellow]")
+
+
+def list_cassettes():
+    paths = sorted(JAFAR_CASSETTES_DIR.glob("*.jsonl"))
+    if not paths:
+        console.print("[yellow]Кассет нет. Запишите сессию: bench record atrade gold[/yellow]")
+        return
+    table = Table(title="Кассеты", header_style="bold blue")
+    for column in ("Имя", "Команда", "Записана", "Обращений", "Сервисы"):
+        table.add_column(column)
+    for path in paths:
+        meta, interactions = cassette.load(path)
+        services = sorted({i["service"] for i in interactions})
+        table.add_row(path.stem, meta.get("command") or "—", meta.get("recorded_at") or "—",
+                      str(len(interactions)), ", ".join(services))
+    console.print(table)
+
+
+def bench_command(args: str = None):
+    """
+    Воспроизводимые замеры сессий на записанных кассетах внешнего I/O:
+    - bench [имя ...] [--runs N] [--latency recorded|median|none|x0.5|50ms]
+    - bench record <atrade|btrade|ctrade> <инструмент> [--as имя] — записать сессию
+    - bench record voice <wav> [--as имя]                       — голосовой ход: STT -> Gemini -> TTS
+    - bench list                                                 — записанные кассеты
+    """
+    parts = shlex.split(args) if args else []
+
+    if parts and parts[0].lower() in ("help", "-h"):
+        console.print(Panel(bench_command.__doc__.strip(), title="⏱ Bench", style="cyan"))
+        return
+
+    if parts and parts[0].lower() == "list":
+        list_cassettes()
+        return
+
+    if parts and parts[0].lower() == "record":
+        if len(parts) < 2:
+            console.print("[red]Укажите сессию: bench record atrade gold | bench record voice фраза.wav[/red]")
+            return
+        record(parts[1:])
+        return
+
+    runs, latency = DEFAULT_RUNS, "recorded"
+    for flag in ("--runs", "--latency"):
+        if flag in parts:
+            position = parts.index(flag)
+            value = parts[position + 1] if position + 1 < len(parts) else None
+            del parts[position:position + 2]
+            if flag == "--runs" and value:
+                runs = max(int(value), 1)
+            elif value:
+                latency = value
+    try:
+        cassette.LatencyModel(latency)
+    except ValueError as e:
+        console.print(f"[red]{e}[/red]")
+        return
+
+    names = [p for p in parts if p != "all"]
+    if not names:
+        names = [s for s in SESSIONS if cassette.cassette_path(s).exists()] or \
+                sorted(p.stem for p in JAFAR_CASSETTES_DIR.glob("*.jsonl"))
+    missing = [n for n in names if not cassette.cassette_path(n).exists()]
+    if missing:
+        console.print(f"[red]Нет кассет: {', '.join(missing)}. Запишите: bench record {missing[0]} <инструмент>[/red]")
+        return
+    if not names:
+        list_cassettes()
+        return
+
+    for name in names:
+        meta, _ = cassette.load(cassette.cassette_path(name))
+        console.print(f"[cyan]⏱ {name}: {runs} × '{meta.get('command')}' из кассеты...[/cyan]")
+        reports = replay(name, runs, latency)
+        if reports:
+            print_report(name, meta.get("command") or name, reports, latency)
+
+
+if __name__ == "__main__":
+    sys.exit(run_session(sys.argv[1:]))
@@ -1,5 +1,4 @@
 import os
-import time
 from pathlib import Path
 from datetime import datetime, timedelta
 from rich.console import Console
@@ -14,11 +13,13 @@ import concurrent.futures
 from typing import Optional
 
 from jafar.utils.gemini_api import ask_gemini_with_image, ask_gemini_text_only
-from jafar.utils.news_api import get_unified_news, get_news_from_newsapi
-from jafar.utils.topstepx_api_client import TopstepXClient
+from jafar.utils.news_api import get_news_from_newsapi
+from jafar.utils.topstepx_api_client import get_shared_client
+from jafar.utils.risk_engine import calculate_trade_metrics, scenario_summary
 from .telegram_handler import send_telegram_media_group, send_long_telegram_message
-from .economic_calendar_fetcher import fetch_economic_calendar_data
 from jafar.utils.market_utils import get_current_trading_session
+from jafar.utils import analysis_memory, cassette, chart_renderer, fill_ledger, indicators, log_pipeline, prefetch
+from jafar.utils.setup_index import build_setup_context, current_level_distance_pct, format_similar_setups_for_prompt
 from .muxlisa_voice_output_handler import speak_muxlisa_text
 
 console = Console()
@@ -31,38 +32,11 @@ def _log_atrade_summary(instrument: str, analysis_data: dict):
 DEPOSIT = 2000.0
 MAX_RISK_PERCENT_DEFAULT = 0.02
 MAX_RISK_GROUP_A = 450.0
-WINNING_DAY_TARGET_USD = 150.0
-MAX_CONTRACTS_MAP = {
-    "MGC": 50, "GC": 5, "CL": 10, "ES": 10,
-}
-CONTRACT_MULTIPLIERS = {
-    "GC": 100.0, "MGC": 10.0, "EURUSD": 100000.0, "GBPUSD": 100000.0,
-    "USDJPY": 100000.0, "SPX500": 50.0,
-}
-
-def calculate_trade_metrics(entry_price, stop_loss, take_profit, contract_multiplier, max_risk_for_trade, contract_symbol: str):
-    risk_per_unit = abs(entry_price - stop_loss)
-    if risk_per_unit == 0: return {"error": "Risk per unit is zero."}
-    risk_per_contract = risk_per_unit * contract_multiplier
-    if risk_per_contract == 0: return {"error": "Risk per contract is zero."}
-    max_contracts_for_instrument = MAX_CONTRACTS_MAP.get(contract_symbol, 1)
-    calculated_position_size = max_risk_for_trade / risk_per_contract
-    position_size = min(calculated_position_size, max_contracts_for_instrument)
-    if position_size < 0.01: return {"error": f"Calculated position size ({position_size:.2f}) is too small."}
-    profit_per_unit = abs(take_profit - entry_price)
-    total_risk_usd = position_size * risk_per_contract
-    total_profit_usd = position_size * profit_per_unit * contract_multiplier
-    risk_reward_ratio = total_profit_usd / total_risk_usd if total_risk_usd > 0 else float("inf")
-    return {
-        "position_size": round(position_size, 2), "total_risk_usd": round(total_risk_usd, 2),
-        "total_profit_usd": round(total_profit_usd, 2), "risk_reward_ratio": round(risk_reward_ratio, 2),
-        "meets_winning_day_target": total_profit_usd >= WINNING_DAY_TARGET_USD,
-    }
 
 def get_formatted_topstepx_data(instrument_query: str, contract_id: str) -> tuple[str, dict, dict, list, dict]:
     try:
-        client = TopstepXClient()
-        accounts_response = client.get_account_list()
+        client = get_shared_client()
+        accounts_response = prefetch.fetch("account")
         if not accounts_response or not accounts_response.get("accounts"):
             return "  - Ошибка: Не удалось получить список счетов из TopstepX.", None, None, None, None
         
@@ -70,47 +44,30 @@ def get_formatted_topstepx_data(instrument_query: str, contract_id: str) -> tupl
         primary_account = next((acc for acc in all_accounts if acc.get("name") == os.environ.get("TOPSTEPX_ACCOUNT_NAME")), all_accounts[0])
         account_id = primary_account["id"]
         
+        ledger = fill_ledger.get_ledger()
         with concurrent.futures.ThreadPoolExecutor() as executor:
             end_time = datetime.utcnow()
             start_time = end_time - timedelta(hours=8)
             future_positions = executor.submit(client.get_open_positions, account_id)
             future_orders = executor.submit(client.get_orders, account_id, start_time, end_time)
-            future_trades = executor.submit(client.get_trades, account_id, start_time, end_time)
+            future_fills = executor.submit(ledger.sync, client, account_id)
             future_bars = executor.submit(client.get_historical_bars, contract_id, end_time - timedelta(minutes=30), end_time, unit=2, unit_number=5, limit=6)
             
             open_positions = future_positions.result()
             orders = future_orders.result()
-            trades = future_trades.result()
+            future_fills.result()
             bars_response = future_bars.result()
 
         status_lines = [f"**ҲИСОБ ҲОЛАТИ (API):**", f"- **Баланс:** ${primary_account.get('balance', 0.0):,.2f}"]
         
-        # --- НОВЫЙ, НАДЕЖНЫЙ РАСЧЕТ ОТКРЫТЫХ ПОЗИЦИЙ ИЗ СДЕЛОК ---
-        actual_open_positions = {}
-        if trades and trades.get("trades"):
-            # Сортируем сделки по времени, чтобы правильно считать
-            sorted_trades = sorted(trades["trades"], key=lambda x: x.get("creationTimestamp", ""))
-            for trade in sorted_trades:
-                contract = trade.get("contractId")
-                size = trade.get("size", 0)
-                side = trade.get("side", 0) # 0 = Buy, 1 = Sell
-                
-                # Покупка (0) добавляет к позиции, продажа (1) - отнимает
-                position_change = size if side == 0 else -size
-                
-                if contract in actual_open_positions:
-                    actual_open_positions[contract] += position_change
-                else:
-                    actual_open_positions[contract] = position_change
-
-        # Убираем закрытые позиции (где итоговый размер = 0)
-        actual_open_positions = {k: v for k, v in actual_open_positions.items() if v != 0}
+        # --- ОТКРЫТЫЕ ПОЗИЦИИ ИЗ ЖУРНАЛА ИСПОЛНЕНИЙ (FIFO, средняя цена, P&L) ---
+        if open_positions and "positions" in open_positions:
+            ledger.reconcile(account_id, open_positions["positions"])
+        actual_open_positions = ledger.open_positions(account_id)
 
         if actual_open_positions:
             status_lines.append(f"- **Очиқ Позициялар (ҳисобланган):** {len(actual_open_positions)} та")
-            for contract, size in actual_open_positions.items():
-                side_str = "Long" if size > 0 else "Short"
-                status_lines.append(f"  - {contract}: {side_str} {abs(size)}")
+            status_lines.extend(ledger.format_positions(account_id))
         else:
             status_lines.append("- **Очиқ Позициялар:** Йўқ")
 
@@ -147,7 +104,7 @@ def handle_order_result(order_result):
         print_json(data=order_result)
 
 def run_btrade_analysis(instrument_query: str, contract_symbol: str, screenshot_files: list[str]) -> dict:
-    client = TopstepXClient()
+    client = get_shared_client()
     try:
         contract_info = client.search_contract(name=contract_symbol)
         active_contract = next((c for c in contract_info["contracts"] if c.get("activeContract")), None)
@@ -157,7 +114,8 @@ def run_btrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
     except Exception as e:
         return {"status": "Ошибка", "full_analysis": f"Ошибка при поиске контракта: {e}"}
 
-    topstepx_data, primary_account, open_positions, active_orders, open_calculated_positions = get_formatted_topstepx_data(instrument_query, full_contract_id)
+    with cassette.stage("fetch"):
+        topstepx_data, primary_account, open_positions, active_orders, open_calculated_positions = get_formatted_topstepx_data(instrument_query, full_contract_id)
     if not primary_account:
         return {"status": "Ошибка", "full_analysis": "Ошибка: Не удалось получить данные об аккаунте для расчета рисков."}
 
@@ -172,30 +130,33 @@ def run_btrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
         position_side = "Long" if current_position_size > 0 else "Short"
         console.print(f"\n[bold yellow]Обнаружена открытая позиция: {position_side} {abs(current_position_size)} {instrument_query}. Запускаю анализ для управления...[/bold yellow]")
         
-        console.print(f"\n[blue]Загрузка новостей из всех источников...[/blue]")
-        news_results = ""
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future_marketaux = executor.submit(get_unified_news)
-            future_newsapi = executor.submit(get_news_from_newsapi)
-            marketaux_news = future_marketaux.result()
-            newsapi_news = future_newsapi.result()
-
-        news_results = f"**Новости от Marketaux:**\n{marketaux_news}\n\n**Новости от Bloomberg/Reuters (via NewsAPI):\n{newsapi_news}"
+        with cassette.stage("fetch"):
+            console.print(f"\n[blue]Загрузка новостей из всех источников...[/blue]")
+            news_results = ""
+            with concurrent.futures.ThreadPoolExecutor() as executor:
+                future_marketaux = executor.submit(prefetch.fetch, "news")
+                future_newsapi = executor.submit(get_news_from_newsapi)
+                marketaux_news = future_marketaux.result()
+                newsapi_news = future_newsapi.result()
+
+            news_results = f"**Новости от Marketaux:**\n{marketaux_news}\n\n**Новости от Bloomberg/Reuters (via NewsAPI):\n{newsapi_news}"
         
-        news_log_path = Path("/Users/macbook/projects/jr/jafar_unified/memory/btrade_last_news.txt")
-        try:
-            with news_log_path.open("w", encoding="utf-8") as f: f.write(news_results)
-            console.print(f"\n[bold green]--- Полученные Новости (сохранено в {news_log_path}) ---[/bold green]")
-            console.print(news_results)
-        except Exception as e:
-            console.print(f"[red]Ошибка сохранения новостей: {e}[/red]")
-
-        economic_calendar_data = fetch_economic_calendar_data()
-        news_sentiment = _get_sentiment_from_data("Новости", news_results, instrument_query)
-        calendar_sentiment = _get_sentiment_from_data("Экономический календарь", economic_calendar_data, instrument_query)
+            news_log_path = Path("/Users/macbook/projects/jr/jafar_unified/memory/btrade_last_news.txt")
+            try:
+                with news_log_path.open("w", encoding="utf-8") as f: f.write(news_results)
+                console.print(f"\n[bold green]--- Полученные Новости (сохранено в {news_log_path}) ---[/bold green]")
+                console.print(news_results)
+            except Exception as e:
+                console.print(f"[red]Ошибка сохранения новостей: {e}[/red]")
+
+            economic_calendar_data = prefetch.fetch("calendar")
+        with cassette.stage("llm"):
+            news_sentiment = _get_sentiment_from_data("Новости", news_results, instrument_query)
+            calendar_sentiment = _get_sentiment_from_data("Экономический календарь", economic_calendar_data, instrument_query)
         _log_market_sentiment(instrument_query, news_sentiment, calendar_sentiment)
 
-        prompt = f'''
+        with cassette.stage("prompt"):
+            prompt = f'''
         **РЕЖИМ: УПРАВЛЕНИЕ ОТКРЫТОЙ ПОЗИЦИЕЙ**
         Instrument: {instrument_query}. My position: {position_side} {abs(current_position_size)}.
         **Текущая торговая сессия:** {current_session}
@@ -204,6 +165,7 @@ def run_btrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
         - Calendar Sentiment: {calendar_sentiment}
         **LATEST DATA:**
         - Account & Market Data: ```{topstepx_data}```
+        - Indicators (computed from bars): ```{indicators.format_for_prompt(contract_symbol)}```
         - News: ```{news_results}```
         - Calendar: ```{economic_calendar_data}```
         **TASK:**
@@ -220,7 +182,8 @@ def run_btrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
         }}
         ```
         '''
-        raw_response = ask_gemini_with_image(prompt, image_objects)
+        with cassette.stage("llm"):
+            raw_response = ask_gemini_with_image(prompt, image_objects)
         json_match = re.search(r'```json\n(.*?)\n```', raw_response, re.DOTALL) or re.search(r'({.*?})', raw_response, re.DOTALL)
         if not json_match: return {"status": "Ошибка", "full_analysis": f"Ошибка: Ответ Gemini не в формате JSON: {raw_response}"}
         analysis_data = json.loads(json_match.group(1))
@@ -246,29 +209,36 @@ def run_btrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
         return {"status": "Успех", "full_analysis": analysis_data.get("full_analysis_uzbek_cyrillic", "Анализ не предоставлен."), "voice_summary": analysis_data.get("voice_summary_uzbek_cyrillic")}
     else:
         # --- РЕЖИМ 1: ПОИСК НОВОЙ СДЕЛКИ ---
-        console.print(f"\n[blue]Загрузка новостей из всех источников...[/blue]")
-        news_results = ""
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future_marketaux = executor.submit(get_unified_news)
-            future_newsapi = executor.submit(get_news_from_newsapi)
-            marketaux_news = future_marketaux.result()
-            newsapi_news = future_newsapi.result()
-
-        news_results = f"**Новости от Marketaux:**\n{marketaux_news}\n\n**Новости от Bloomberg/Reuters (via NewsAPI):\n{newsapi_news}"
+        with cassette.stage("fetch"):
+            console.print(f"\n[blue]Загрузка новостей из всех источников...[/blue]")
+            news_results = ""
+            with concurrent.futures.ThreadPoolExecutor() as executor:
+                future_marketaux = executor.submit(prefetch.fetch, "news")
+                future_newsapi = executor.submit(get_news_from_newsapi)
+                marketaux_news = future_marketaux.result()
+                newsapi_news = future_newsapi.result()
+
+            news_results = f"**Новости от Marketaux:**\n{marketaux_news}\n\n**Новости от Bloomberg/Reuters (via NewsAPI):\n{newsapi_news}"
         
-        news_log_path = Path("/Users/macbook/projects/jr/jafar_unified/memory/btrade_last_news.txt")
-        try:
-            with news_log_path.open("w", encoding="utf-8") as f: f.write(news_results)
-            console.print(f"\n[bold green]--- Полученные Новости (сохранено в {news_log_path}) ---[/bold green]")
-            console.print(news_results)
-        except Exception as e:
-            console.print(f"[red]Ошибка сохранения новостей: {e}[/red]")
-
-        economic_calendar_data = fetch_economic_calendar_data()
-        news_sentiment = _get_sentiment_from_data("Новости", news_results, instrument_query)
-        calendar_sentiment = _get_sentiment_from_data("Экономический календарь", economic_calendar_data, instrument_query)
+            news_log_path = Path("/Users/macbook/projects/jr/jafar_unified/memory/btrade_last_news.txt")
+            try:
+                with news_log_path.open("w", encoding="utf-8") as f: f.write(news_results)
+                console.print(f"\n[bold green]--- Полученные Новости (сохранено в {news_log_path}) ---[/bold green]")
+                console.print(news_results)
+            except Exception as e:
+                console.print(f"[red]Ошибка сохранения новостей: {e}[/red]")
+
+            economic_calendar_data = prefetch.fetch("calendar")
+        with cassette.stage("llm"):
+            news_sentiment = _get_sentiment_from_data("Новости", news_results, instrument_query)
+            calendar_sentiment = _get_sentiment_from_data("Экономический календарь", economic_calendar_data, instrument_query)
         _log_market_sentiment(instrument_query, news_sentiment, calendar_sentiment)
-        prompt = f'''
+        with cassette.stage("prompt"):
+            # Сентимент для похожих сетапов — по исходным текстам, как в ctrade и atrade
+            setup_context = build_setup_context(current_session, news_results, economic_calendar_data,
+                                                current_level_distance_pct(contract_symbol, instrument_query))
+            similar_setups = format_similar_setups_for_prompt(contract_symbol, setup_context)
+            prompt = f'''
         **РЕЖИМ: ПОИСК НОВОЙ СДЕЛКИ**
         Instrument: {instrument_query}.
         **Текущая торговая сессия:** {current_session}
@@ -277,8 +247,11 @@ def run_btrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
         - Calendar Sentiment: {calendar_sentiment}
         **DATA:**
         - Account Data: ```{topstepx_data}```
+        - Indicators (computed from bars): ```{indicators.format_for_prompt(contract_symbol)}```
         - News: ```{news_results}```
         - Calendar: ```{economic_calendar_data}```
+        **SIMILAR PAST SETUPS AND THEIR OUTCOMES (MY MEMORY):**
+        {similar_setups}
         **TASK:**
         1.  **Filter News:** First, critically evaluate the relevance of each news item provided. **Completely ignore any news not directly related to financial markets (e.g., celebrity, sports, social news).** Prioritize the most recent and impactful news.
         2.  **Analysis:** Based on the RELEVANT news and all other data, determine trend, sentiment, key levels, and forecast confidence (A, B, C).
@@ -305,7 +278,8 @@ def run_btrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
         }}
         ```
         '''
-        raw_response = ask_gemini_with_image(prompt, image_objects)
+        with cassette.stage("llm"):
+            raw_response = ask_gemini_with_image(prompt, image_objects)
         json_match = re.search(r'```json\n(.*?)\n```', raw_response, re.DOTALL) or re.search(r'({.*?})', raw_response, re.DOTALL)
         if not json_match: return {"status": "Ошибка", "full_analysis": f"Ошибка: Ответ Gemini не в формате JSON: {raw_response}"}
         
@@ -333,6 +307,7 @@ def run_btrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
                 balance = primary_account.get("balance", 0.0)
                 max_risk_for_trade = balance * (risk_percent / 100.0)
                 contract_multiplier = active_contract.get("tickValue") / active_contract.get("tickSize")
+                fill_ledger.get_ledger().set_multiplier(full_contract_id, contract_multiplier)
                 metrics = calculate_trade_metrics(entry_price, stop_loss, take_profit, contract_multiplier, max_risk_for_trade, contract_symbol)
                 
                 if "error" in metrics:
@@ -342,6 +317,8 @@ def run_btrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
                     position_size = metrics.get("position_size", 1)
                     console.print("\n[bold cyan]--- Управление Рисками ---[/bold cyan]")
                     print_json(data=metrics)
+                    console.print("[bold cyan]--- Сценарии стопа (шире на 5–30 тиков, риск 2–20%) ---[/bold cyan]")
+                    print_json(data=scenario_summary(entry_price, stop_loss, take_profit, contract_multiplier, balance, contract_symbol, tick_size, max_risk_for_trade))
 
                 console.print(f"\n[bold yellow]АВТОМАТИЧЕСКОЕ РАЗМЕЩЕНИЕ ОРДЕРА: {action} {int(position_size)} {contract_symbol} @ {entry_price}[/bold yellow]")
                 order_result = client.place_order(
@@ -352,6 +329,11 @@ def run_btrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
                 handle_order_result(order_result)
 
         full_analysis_text = analysis_data.get("full_analysis_uzbek_cyrillic", "Анализ не предоставлен.")
+        if trade_data:
+            log_pipeline.submit_task(
+                analysis_memory.save_trade_plan, contract_symbol, trade_data, full_analysis_text,
+                {"features": setup_context},
+            )
         send_long_telegram_message(f"BTRADE АНАЛИЗ (Новая сделка) ({instrument_query}):\n\n{full_analysis_text}")
         
         return {"status": "Успех", "full_analysis": full_analysis_text, "voice_summary": analysis_data.get("voice_summary_uzbek_cyrillic")}
@@ -376,20 +358,10 @@ def btrade_command(args: str = None):
         console.print(f"[red]Тикер для '{instrument_query}' не найден.[/red]"); return
 
     console.print(f"[cyan]Анализ для: {instrument_query.capitalize()} ({contract_symbol})[/cyan]")
-    console.print("[yellow]Режим интерактивных скриншотов...[/yellow]")
-    screenshot_files = []
     current_batch_dir = SCREENSHOT_DIR / datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    current_batch_dir.mkdir(parents=True, exist_ok=True)
-    for i in range(3):
-        console.print(f"\nСкриншот #{i + 1}/3 через 3 секунды...")
-        time.sleep(3)
-        path = current_batch_dir / f"screenshot_{i + 1}.png"
-        os.system(f'screencapture -w "{str(path)}"')
-        if path.exists() and path.stat().st_size > 0:
-            console.print(f"Скриншот #{i + 1} сохранен.")
-            screenshot_files.append(str(path))
-        else:
-            console.print("[red]Скриншот не сделан. Анализ отменен.[/red]"); return
+    screenshot_files = chart_renderer.charts_for_analysis(contract_symbol, current_batch_dir, instrument=instrument_query)
+    if not screenshot_files:
+        console.print("[red]Графики не получены. Анализ отменен.[/red]"); return
 
     if len(screenshot_files) == 3:
         analysis_result = run_btrade_analysis(instrument_query, contract_symbol, screenshot_files)
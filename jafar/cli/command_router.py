@@ -12,38 +12,57 @@ from rich.panel import Panel
 
 console = Console()
 
-from jafar.utils.assistant_api import ask_assistant
+# Тяжёлые модули (Gemini, хендлеры) импортируются по требованию, чтобы
+# одноразовый вызов `jafar <команда>` стартовал быстро.
 from jafar.utils.structured_logger import log_action
-from jafar.utils.evolution_engine import analyze_logs, load_stats
-from .intent_router import route_by_intent
+from jafar.utils.command_stats import get_command_stats
 from .print_help import print_help
-from .utils import multiline_input
 from ..utils.config_manager import load_config as load_jafar_config, save_config as save_jafar_config
 
 def _activate_safari_and_wait():
     pass
 
+def split_command(text: str) -> list[str]:
+    """
+    shlex.split, терпимый к апострофам узбекской латиницы (bo'yicha, o'sish):
+    при непарной кавычке строка делится по пробелам.
+    """
+    try:
+        return shlex.split(text)
+    except ValueError:
+        return text.split()
+
+
 def handle_command(command: str, interactive_session: bool = True):
+    """Выполняет команду и возвращает её статус ("success" / "failure"); пустая команда — None."""
     if not command or not command.strip():
         return
+    parts = split_command(command)
+    if not parts:
+        return
+    return run_command(parts[0], " ".join(parts[1:]), interactive_session, command_line=command)
 
+
+def run_command(action: str, args: str = "", interactive_session: bool = True, command_line: str | None = None):
+    """
+    Выполняет уже разобранную команду: хендлер получает `args` как есть. Так
+    выполняются намерения голосового процесса — текст пользователя не проходит
+    через shlex повторно.
+    """
+    command = command_line or f"{action} {args}".strip()
     start_time = time.time()
     status = "failure"
     error_message = None
 
     try:
-        parts = shlex.split(command)
-        if not parts:
-            return
-        action = parts[0].lower().lstrip("/")
-        args = " ".join(parts[1:])
-
-        stats = load_stats()
-        if action in stats and stats[action]["failure_rate"] > 30:
-            rate = stats[action]["failure_rate"]
+        action = action.lower().lstrip("/")
+
+        stats = get_command_stats(action)
+        if stats and stats["window_failure_rate"] > 30:
+            rate = stats["window_failure_rate"]
             console.print(
                 Panel(
-                    f"⚠️ [bold yellow]Внимание:[/bold yellow] Команда '{action}' имеет высокий процент ошибок ({rate}%) в прошлом. Будьте осторожны.",
+                    f"⚠️ [bold yellow]Внимание:[/bold yellow] Команда '{action}' имеет высокий процент ошибок ({rate}% за последние {stats['window_runs']} запусков). Будьте осторожны.",
                     title="Jafar EVO",
                     style="yellow",
                 )
@@ -89,6 +108,9 @@ def handle_command(command: str, interactive_session: bool = True):
             "test_contract": "jafar.cli.contract_handlers.test_contract_command",
             "define": "jafar.cli.define_handlers.define_command",
             "seo": "jafar.cli.seo_handlers.seo_command",
+            "memory": "jafar.cli.memory_handlers.memory_command",
+            "backtest": "jafar.cli.backtest_handlers.backtest_command",
+            "bench": "jafar.cli.bench_handlers.bench_command",
         }
 
         if action in command_handlers:
@@ -113,6 +135,8 @@ def handle_command(command: str, interactive_session: bool = True):
                 status = "success"
             # ... (add other specific command handlers here)
             else:
+                from jafar.utils.assistant_api import ask_assistant
+
                 ai_response = ask_assistant(command)
                 if isinstance(ai_response, dict):
                     message = (
@@ -139,6 +163,7 @@ def handle_command(command: str, interactive_session: bool = True):
             duration=duration,
             error_message=error_message,
         )
+    return status
 
 
 def chat_mode(start_with=None):
@@ -161,6 +186,8 @@ def chat_mode(start_with=None):
             if not user_input:
                 continue
 
+            from jafar.utils.assistant_api import ask_assistant
+
             response = ask_assistant(user_input)
             message = (
                 response.get("message")
@@ -1,6 +1,6 @@
 from rich.console import Console
 from rich import print_json
-from jafar.utils.topstepx_api_client import TopstepXClient
+from jafar.utils.topstepx_api_client import get_shared_client
 
 console = Console()
 
@@ -17,7 +17,7 @@ def test_contract_command(args: str = None):
     contract_name = args.strip().upper()
 
     try:
-        client = TopstepXClient()
+        client = get_shared_client()
         contract_info = client.search_contract(name=contract_name)
 
         console.print(f"\n[bold green]--- ПОЛНЫЙ JSON-ОТВЕТ ДЛЯ '{contract_name}' ---[/bold green]")
@@ -1,7 +1,6 @@
 import os
-import time
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime
 from rich.console import Console
 from rich.panel import Panel
 from rich.table import Table
@@ -12,27 +11,26 @@ import sys
 import re
 import json
 import shlex
+import sqlite3
 import subprocess
 import concurrent.futures
 from typing import Optional
 
 from jafar.utils.gemini_api import ask_gemini_with_image
-from jafar.utils.news_api import get_unified_news, get_news_from_newsapi
-from jafar.utils.topstepx_api_client import TopstepXClient
+from jafar.utils.news_api import get_news_from_newsapi
+from jafar.utils.topstepx_api_client import get_shared_client
+from jafar.utils.risk_engine import calculate_trade_metrics, scenario_summary
 from .telegram_handler import send_long_telegram_message
-from .economic_calendar_fetcher import fetch_economic_calendar_data
 from jafar.utils.market_utils import get_current_trading_session
+from jafar.utils import analysis_memory, cassette, chart_renderer, fill_ledger, indicators, key_levels_store, log_pipeline, prefetch
+from jafar.utils.setup_index import build_setup_context, current_level_distance_pct, format_similar_setups_for_prompt
 from .muxlisa_voice_output_handler import speak_muxlisa_text, speak_in_chunks
 from jafar.utils.text_utils import convert_numbers_to_words_in_text
 
 console = Console()
 SCREENSHOT_DIR = Path("screenshot")
-KEY_LEVELS_FILE = Path("memory/key_levels.json")
-
-KEY_LEVELS_FILE = Path("memory/key_levels.json")
-
 def save_key_levels_to_memory(instrument: str, trade_data: dict):
-    """Saves key levels from trade_data to memory/key_levels.json."""
+    """Saves key levels from trade_data to the key-levels store (atomic upsert)."""
     if not trade_data:
         return
 
@@ -43,70 +41,31 @@ def save_key_levels_to_memory(instrument: str, trade_data: dict):
 
     if entry := trade_data.get("entry_price"):
         level_type = f"ENTRY_{action.upper()}"
-        new_levels.append({"level": float(entry), "type": level_type, "source_id": source_id, "status": "active"})
+        new_levels.append({"level": float(entry), "type": level_type})
     
     if sl := trade_data.get("stop_loss"):
-        new_levels.append({"level": float(sl), "type": "STOP_LOSS", "source_id": source_id, "status": "active"})
+        new_levels.append({"level": float(sl), "type": "STOP_LOSS"})
         
     if tps := trade_data.get("take_profits"):
         for i, (tp_name, tp_level) in enumerate(tps.items()):
-            new_levels.append({"level": float(tp_level), "type": f"TAKE_PROFIT_{i+1}", "source_id": source_id, "status": "active"})
+            new_levels.append({"level": float(tp_level), "type": f"TAKE_PROFIT_{i+1}"})
 
     if not new_levels:
         console.print("[yellow]Saqlash uchun yangi darajalar topilmadi.[/yellow]")
         return
 
     try:
-        if KEY_LEVELS_FILE.exists() and KEY_LEVELS_FILE.stat().st_size > 0:
-            with open(KEY_LEVELS_FILE, 'r', encoding='utf-8') as f:
-                memory_data = json.load(f)
-        else:
-            memory_data = {}
-
-        if instrument not in memory_data:
-            memory_data[instrument] = []
+        saved = key_levels_store.upsert_levels(instrument, new_levels, source_id)
+        console.print(f"[bold green]✅ {saved} ta daraja {instrument} uchun xotiraga saqlandi.[/bold green]")
+    except (sqlite3.Error, ValueError) as e:
+        console.print(f"[red]Darajalarni xotiraga saqlashda xatolik: {e}[/red]")
 
-        # Avoid adding duplicate levels based on level value (simple check)
-        existing_levels = {lvl['level'] for lvl in memory_data[instrument]}
-        for new_level in new_levels:
-            if new_level['level'] not in existing_levels:
-                memory_data[instrument].append(new_level)
-                existing_levels.add(new_level['level'])
-
-        with open(KEY_LEVELS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(memory_data, f, indent=2, ensure_ascii=False)
-        
-        console.print(f"[bold green]✅ {len(new_levels)} ta yangi daraja {instrument} uchun xotiraga saqlandi.[/bold green]")
-
-    except (IOError, json.JSONDecodeError) as e:
-        console.print(f"[red]Xotira fayliga darajalarni saqlashda xatolik: {e}[/red]")
-
-
-# --- UTILITIES & CONSTANTS (from atrade) ---
-MAX_CONTRACTS_MAP = {"MGC": 50, "GC": 5, "CL": 10, "ES": 10}
-
-def calculate_trade_metrics(entry_price, stop_loss, take_profit, contract_multiplier, max_risk_for_trade, contract_symbol: str):
-    risk_per_unit = abs(entry_price - stop_loss)
-    if risk_per_unit == 0: return {"error": "Risk per unit is zero."}
-    risk_per_contract = risk_per_unit * contract_multiplier
-    if risk_per_contract == 0: return {"error": "Risk per contract is zero."}
-    max_contracts_for_instrument = MAX_CONTRACTS_MAP.get(contract_symbol, 1)
-    calculated_position_size = max_risk_for_trade / risk_per_contract
-    position_size = min(calculated_position_size, max_contracts_for_instrument)
-    if position_size < 0.01: return {"error": f"Calculated position size ({position_size:.2f}) is too small."}
-    profit_per_unit = abs(take_profit - entry_price)
-    total_risk_usd = position_size * risk_per_contract
-    total_profit_usd = position_size * profit_per_unit * contract_multiplier
-    risk_reward_ratio = total_profit_usd / total_risk_usd if total_risk_usd > 0 else float("inf")
-    return {
-        "position_size": round(position_size, 2), "total_risk_usd": round(total_risk_usd, 2),
-        "total_profit_usd": round(total_profit_usd, 2), "risk_reward_ratio": round(risk_reward_ratio, 2),
-    }
 
+# --- UTILITIES (from atrade) ---
 def get_formatted_topstepx_data(instrument_query: str, contract_id: str) -> tuple[str, dict, dict]:
     try:
-        client = TopstepXClient()
-        accounts_response = client.get_account_list()
+        client = get_shared_client()
+        accounts_response = prefetch.fetch("account")
         if not accounts_response or not accounts_response.get("accounts"):
             return "  - Error: Could not get account list from TopstepX.", None, None
         
@@ -114,38 +73,22 @@ def get_formatted_topstepx_data(instrument_query: str, contract_id: str) -> tupl
         primary_account = next((acc for acc in all_accounts if acc.get("name") == os.environ.get("TOPSTEPX_ACCOUNT_NAME2")), all_accounts[0])
         account_id = primary_account["id"]
         
+        ledger = fill_ledger.get_ledger()
         with concurrent.futures.ThreadPoolExecutor() as executor:
-            end_time = datetime.utcnow()
-            start_time = end_time - timedelta(hours=8)
             future_real_positions = executor.submit(client.get_open_positions, account_id)
-            future_trades = executor.submit(client.get_trades, account_id, start_time, end_time)
-            
+            future_fills = executor.submit(ledger.sync, client, account_id)
+
             real_positions_response = future_real_positions.result()
-            trades = future_trades.result()
+            future_fills.result()
 
         status_lines = [f"**ACCOUNT STATUS ({primary_account.get('name')}):**", f"- **Balance:** ${primary_account.get('balance', 0.0):,.2f}"]
         
-        open_positions_with_side = {}
-        real_open_positions = real_positions_response.get("positions", [])
-        if real_open_positions:
-            if trades and trades.get("trades"):
-                sorted_trades = sorted(trades["trades"], key=lambda x: x.get("creationTimestamp", ""))
-                temp_positions = {}
-                for trade in sorted_trades:
-                    contract = trade.get("contractId")
-                    size = trade.get("size", 0)
-                    side = trade.get("side", 0) # 0 = Buy, 1 = Sell
-                    position_change = size if side == 0 else -size
-                    temp_positions[contract] = temp_positions.get(contract, 0) + position_change
-                
-                for real_pos in real_open_positions:
-                    contract = real_pos.get("contractId")
-                    if temp_positions.get(contract) is not None:
-                         open_positions_with_side[contract] = temp_positions[contract]
-
-            for contract, size in open_positions_with_side.items():
-                side_str = "Long" if size > 0 else "Short"
-                status_lines.append(f"  - {contract}: {side_str} {abs(size)}")
+        # Позиции из журнала исполнений, сверенные с реальными позициями API
+        if real_positions_response and "positions" in real_positions_response:
+            ledger.reconcile(account_id, real_positions_response["positions"])
+        open_positions_with_side = ledger.open_positions(account_id)
+        if open_positions_with_side:
+            status_lines.extend(ledger.format_positions(account_id))
         else:
             status_lines.append("- **Open Positions:** None")
         
@@ -217,7 +160,7 @@ def _extract_and_parse_json(raw_text: str) -> dict:
         raise ValueError(f"Не удалось распарсить JSON из ответа: {e}") from e
 
 def run_ctrade_analysis(instrument_query: str, contract_symbol: str, screenshot_files: list[str]) -> dict:
-    client = TopstepXClient()
+    client = get_shared_client()
     try:
         contract_info = client.search_contract(name=contract_symbol)
         active_contract = next((c for c in contract_info["contracts"] if c.get("activeContract")), None)
@@ -227,7 +170,8 @@ def run_ctrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
     except Exception as e:
         return {"status": "Ошибка", "full_analysis": f"Kontrakt qidirishda xatolik: {e}"}
 
-    topstepx_data, primary_account, open_calculated_positions = get_formatted_topstepx_data(instrument_query, full_contract_id)
+    with cassette.stage("fetch"):
+        topstepx_data, primary_account, open_calculated_positions = get_formatted_topstepx_data(instrument_query, full_contract_id)
     if not primary_account:
         return {"status": "Ошибка", "full_analysis": "Xatolik: Riskni hisoblash uchun hisob ma'lumotlarini olib bo'lmadi."}
 
@@ -235,18 +179,25 @@ def run_ctrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
     image_objects = [Image.open(p) for p in screenshot_files]
     current_session = get_current_trading_session()
     
-    news_results, economic_calendar_data = "", ""
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        future_news = executor.submit(get_unified_news)
-        future_calendar = executor.submit(fetch_economic_calendar_data)
-        news_results = future_news.result()
-        economic_calendar_data = future_calendar.result()
-
-    if current_position_size != 0:
-        position_side = "Long" if current_position_size > 0 else "Short"
-        prompt = f"**MODE: OPEN POSITION MANAGEMENT**..." # Simplified for brevity
-    else:
-        prompt = f'''
+    with cassette.stage("fetch"):
+        news_results, economic_calendar_data = "", ""
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            # Через кэш упреждающей загрузки: повторные прогоны (super agent) не качают заново
+            future_news = executor.submit(prefetch.fetch, "news")
+            future_calendar = executor.submit(prefetch.fetch, "calendar")
+            news_results = future_news.result()
+            economic_calendar_data = future_calendar.result()
+
+    with cassette.stage("prompt"):
+        # Для поиска похожих сетапов сентимент оценивается по самим текстам новостей/календаря
+        setup_context = build_setup_context(current_session, news_results, economic_calendar_data,
+                                            current_level_distance_pct(contract_symbol, instrument_query))
+
+        if current_position_size != 0:
+            position_side = "Long" if current_position_size > 0 else "Short"
+            prompt = f"**MODE: OPEN POSITION MANAGEMENT**..." # Simplified for brevity
+        else:
+            prompt = f'''
         **TOIFA:** Savdo tahlili va reja tuzish.
         **MAQSAD:** Taqdim etilgan barcha ma'lumotlar (skrinshotlar, hisob holati, yangiliklar, kalendar) asosida `{instrument_query}` uchun savdo rejasini ishlab chiqish.
 
@@ -254,8 +205,11 @@ def run_ctrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
         - **Instrument:** {instrument_query}
         - **Joriy sessiya:** {current_session}
         - **Hisob holati:** ```{topstepx_data}```
+        - **Indikatorlar (barlardan hisoblangan):** ```{indicators.format_for_prompt(contract_symbol)}```
         - **Yangiliklar lentasi:** ```{news_results}```
         - **Iqtisodiy kalendar:** ```{economic_calendar_data}```
+        - **O'xshash o'tgan setaplar va ularning natijalari (xotira):**
+        {format_similar_setups_for_prompt(contract_symbol, setup_context)}
 
         **TOPSHIRIQ:**
         Barcha ma'lumotlarni kompleks tahlil qilib, quyidagi formatda YAGONA va TO'LIQ JSON obyektini qaytar.
@@ -282,7 +236,8 @@ def run_ctrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
         **ДИҚҚАТ:** Жавоб ФАҚАТ ва ФАҚАТ JSON форматида бўлиши шарт. Ҳеч қандай изоҳларсиз.
         '''
 
-    raw_response = ask_gemini_with_image(prompt, image_objects)
+    with cassette.stage("llm"):
+        raw_response = ask_gemini_with_image(prompt, image_objects)
     
     analysis_data = None
     error_message = ""
@@ -318,7 +273,8 @@ def run_ctrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
         """
         
         # Send correction prompt (without images, just text)
-        correction_response = ask_gemini_with_image(correction_prompt, []) # Pass empty list for images
+        with cassette.stage("llm"):
+            correction_response = ask_gemini_with_image(correction_prompt, []) # Pass empty list for images
         
         try:
             analysis_data = _extract_and_parse_json(correction_response)
@@ -360,11 +316,16 @@ def run_ctrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
             balance = primary_account.get("balance", 0.0)
             max_risk_for_trade = balance * (risk_percent / 100.0)
             contract_multiplier = active_contract.get("tickValue") / active_contract.get("tickSize")
+            fill_ledger.get_ledger().set_multiplier(full_contract_id, contract_multiplier)
             metrics = calculate_trade_metrics(entry_price, stop_loss, take_profit, contract_multiplier, max_risk_for_trade, contract_symbol)
             
             position_size = metrics.get("position_size", 1)
             if "error" in metrics:
+                console.print(f"[red]Ошибка расчета метрик: {metrics['error']}[/red]")
                 position_size = 1
+            else:
+                console.print("\n[bold cyan]--- Сценарии стопа (шире на 5–30 тиков, риск 2–20%) ---[/bold cyan]")
+                print_json(data=scenario_summary(entry_price, stop_loss, take_profit, contract_multiplier, balance, contract_symbol, tick_size, max_risk_for_trade))
 
             position_size = int(round(position_size))
             if position_size == 0:
@@ -391,6 +352,11 @@ def run_ctrade_analysis(instrument_query: str, contract_symbol: str, screenshot_
     
     # Also return trade_data so ctrade_command can display it in a table
     trade_data = analysis_data.get("trade_data")
+    if trade_data and current_position_size == 0:
+        log_pipeline.submit_task(
+            analysis_memory.save_trade_plan, contract_symbol, trade_data, analysis_data.get("full_analysis_uzbek_cyrillic"),
+            {"features": setup_context},
+        )
 
     return {
         "status": "Успех",
@@ -411,20 +377,8 @@ def ctrade_command(args: str = None):
 
     console.print(f"[cyan]Таҳлил қилинмоқда: {instrument_query.capitalize()} ({contract_symbol})[/cyan]")
     
-    screenshot_files = []
     current_batch_dir = SCREENSHOT_DIR / datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    current_batch_dir.mkdir(parents=True, exist_ok=True)
-    for i in range(3):
-        time.sleep(3)
-        path = current_batch_dir / f"screenshot_{i + 1}.png"
-        # Using -i for interactive mode to avoid window selection issues in some cases
-        os.system(f'screencapture -w "{str(path)}"')
-        if path.exists() and path.stat().st_size > 0:
-            screenshot_files.append(str(path))
-        else:
-            console.print(f"[red]Скриншот #{i+1} олинмади. Таҳлил бекор қилинди.[/red]")
-            return
-            
+    screenshot_files = chart_renderer.charts_for_analysis(contract_symbol, current_batch_dir, instrument=instrument_query)
     if len(screenshot_files) < 3:
         console.print("[red]Барча скриншотлар олинмади. Таҳлил тўхтатилди.[/red]")
         return
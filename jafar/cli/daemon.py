@@ -0,0 +1,256 @@
+"""Резидентный демон Jafar (`jafar --daemon`): выполняет команды тонкого клиента в прогретом процессе."""
+
+import io
+import os
+import sys
+import json
+import queue
+import signal
+import socket
+import importlib
+import threading
+import traceback
+from contextlib import redirect_stdout, redirect_stderr
+from pathlib import Path
+
+from jafar.cli.daemon_client import SOCKET_PATH, PING, STOP
+
+PID_FILE = Path(SOCKET_PATH).with_suffix(".pid")
+
+# Модули, которые импортируются заранее, чтобы команды не платили за импорт
+PRELOAD_MODULES = (
+    "jafar.cli.command_router",
+    "jafar.cli.atrade_handlers",
+    "jafar.cli.atrade_pro_handlers",
+    "jafar.cli.btrade_handlers",
+    "jafar.cli.ctrade_handlers",
+    "jafar.cli.order_handlers",
+    "jafar.cli.news_handlers",
+    "jafar.utils.gemini_api",
+)
+
+
+class _SocketStream(io.TextIOBase):
+    """Файлоподобный поток, пересылающий каждую запись клиенту."""
+
+    def __init__(self, conn: socket.socket, key: str):
+        self._conn = conn
+        self._key = key
+        self.broken = False
+
+    @property
+    def encoding(self):
+        return "utf-8"
+
+    def isatty(self):
+        # Rich рендерит цвета и ширину так же, как в терминале клиента
+        return True
+
+    def writable(self):
+        return True
+
+    def write(self, text: str) -> int:
+        if text and not self.broken:
+            try:
+                self._conn.sendall(json.dumps({self._key: text}, ensure_ascii=False).encode("utf-8") + b"\n")
+            except OSError:
+                # Клиент отключился — команду доводим до конца без вывода
+                self.broken = True
+        return len(text)
+
+
+class _SocketInput(io.TextIOBase):
+    """stdin команды: каждая строка запрашивается у клиента и приходит через поток чтения сокета."""
+
+    def __init__(self, conn: socket.socket, lines: queue.Queue):
+        self._conn = conn
+        self._lines = lines
+
+    @property
+    def encoding(self):
+        return "utf-8"
+
+    def readable(self):
+        return True
+
+    def readline(self, size=-1) -> str:
+        _send(self._conn, {"input": True})
+        return self._lines.get()  # "" — клиент закрыл ввод или отключился (EOF)
+
+    def read(self, size=-1) -> str:
+        return self.readline()
+
+
+# Ctrl-C из клиента доставляется в главный поток как SIGINT; флаг отличает его от Ctrl-C в терминале демона
+_client_interrupt = threading.Event()
+
+
+def _read_client(stream, lines: queue.Queue, running: threading.Event):
+    """Поток чтения сокета во время команды: строки ввода и прерывание от клиента."""
+    try:
+        for raw in stream:
+            try:
+                message = json.loads(raw)
+            except json.JSONDecodeError:
+                continue
+            if "stdin" in message:
+                lines.put(message["stdin"] or "")
+            elif message.get("interrupt") and running.is_set():
+                _client_interrupt.set()
+                signal.pthread_kill(threading.main_thread().ident, signal.SIGINT)
+    except (OSError, ValueError):
+        pass
+    lines.put("")
+
+
+def _console_width(columns: int):
+    """
+    Ширина вывода под терминал клиента. Модульные Console() хендлеров созданы при
+    прогреве, поэтому COLUMNS для них уже прочитан — ширина выставляется явно.
+    """
+    os.environ["COLUMNS"] = str(columns)
+    try:
+        from rich.console import Console
+    except ImportError:
+        return
+    for name, module in list(sys.modules.items()):
+        if not name.startswith("jafar") or module is None:
+            continue
+        for value in list(vars(module).values()):
+            if isinstance(value, Console):
+                value.width = columns
+
+
+def _preload():
+    for module_name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(module_name)
+        except Exception as e:
+            print(f"[jafard] preload {module_name} skipped: {e}", file=sys.stderr)
+
+
+def _warm_clients():
+    """Логинится в TopstepX в фоне, чтобы первая торговая команда не ждала."""
+    try:
+        from jafar.utils.topstepx_api_client import get_shared_client
+
+        get_shared_client()
+    except Exception as e:
+        print(f"[jafard] TopstepX warm-up failed: {e}", file=sys.stderr)
+
+
+def _send(conn: socket.socket, message: dict):
+    try:
+        conn.sendall(json.dumps(message).encode("utf-8") + b"\n")
+    except OSError:
+        pass
+
+
+def _run_request(conn: socket.socket, stream, request: dict) -> int:
+    from jafar.cli.command_router import handle_command
+
+    argv = request.get("argv") or []
+    # Так же, как `jafar <команда>` в main.py
+    command = " ".join(argv)
+    out, err = _SocketStream(conn, "out"), _SocketStream(conn, "err")
+    lines, running = queue.Queue(), threading.Event()
+
+    previous_cwd = os.getcwd()
+    previous_stdin = sys.stdin
+    _console_width(int(request.get("columns") or 120))
+    running.set()
+    threading.Thread(target=_read_client, args=(stream, lines, running), name="jafard-client", daemon=True).start()
+    try:
+        os.chdir(request.get("cwd") or previous_cwd)
+        sys.stdin = _SocketInput(conn, lines)
+        with redirect_stdout(out), redirect_stderr(err):
+            try:
+                status = handle_command(command, interactive_session=False)
+                return 1 if status == "failure" else 0
+            except KeyboardInterrupt:
+                print("\nКоманда прервана (Ctrl-C).", file=sys.stderr)
+                return 130
+            except SystemExit as e:
+                return e.code if isinstance(e.code, int) else 1
+            except Exception:
+                traceback.print_exc()
+                return 1
+            finally:
+                running.clear()
+    finally:
+        _client_interrupt.clear()
+        sys.stdin = previous_stdin
+        os.chdir(previous_cwd)
+
+
+def _handle_connection(conn: socket.socket) -> bool:
+    """Обслуживает одного клиента. Возвращает False, если демон нужно остановить."""
+    with conn, conn.makefile("r", encoding="utf-8") as stream:
+        try:
+            request = json.loads(stream.readline() or "{}")
+        except (OSError, json.JSONDecodeError):
+            return True
+
+        argv = request.get("argv") or []
+        if argv == [PING]:
+            _send(conn, {"out": f"Jafar daemon is running (PID: {os.getpid()}).\n"})
+            _send(conn, {"exit": 0})
+            return True
+        if argv == [STOP]:
+            _send(conn, {"out": "Jafar daemon stopped.\n"})
+            _send(conn, {"exit": 0})
+            return False
+
+        _send(conn, {"exit": _run_request(conn, stream, request)})
+        return True
+
+
+def serve(socket_path: str = SOCKET_PATH):
+    """Запускает демон в текущем процессе (блокирует до остановки)."""
+    # До импорта хендлеров: их модульные Console() должны считать вывод цветным терминалом
+    os.environ.setdefault("FORCE_COLOR", "1")
+
+    Path(socket_path).parent.mkdir(parents=True, exist_ok=True)
+    if os.path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+            print(f"Jafar daemon is already running on {socket_path}.")
+            return
+        except OSError:
+            os.unlink(socket_path)  # устаревший сокет
+        finally:
+            probe.close()
+
+    _preload()
+    threading.Thread(target=_warm_clients, name="jafard-warmup", daemon=True).start()
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    server.listen(16)
+    PID_FILE.write_text(str(os.getpid()))
+    print(f"Jafar daemon listening on {socket_path} (PID: {os.getpid()}).")
+
+    try:
+        while True:
+            try:
+                conn, _ = server.accept()
+                if not _handle_connection(conn):
+                    break
+            except KeyboardInterrupt:
+                # Запоздавший SIGINT от клиента (команда уже завершилась) демон не останавливает
+                if not _client_interrupt.is_set():
+                    raise
+                _client_interrupt.clear()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        for path in (Path(socket_path), PID_FILE):
+            path.unlink(missing_ok=True)
+        print("Jafar daemon stopped.")
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,107 @@
+"""Тонкий клиент демона Jafar: передаёт argv через Unix-сокет и печатает вывод команды.
+
+    python -m jafar.cli.daemon_client atrade GC
+"""
+
+import os
+import sys
+import json
+import socket
+
+SOCKET_PATH = os.path.expanduser("~/.jafar/jafard.sock")
+CONNECT_TIMEOUT = 0.5
+
+# Служебные команды протокола
+PING = "__ping__"
+STOP = "__stop__"
+
+
+def _terminal_columns() -> int:
+    try:
+        return os.get_terminal_size(sys.stdout.fileno()).columns
+    except (OSError, ValueError):
+        return 120
+
+
+def _send(sock: socket.socket, message: dict):
+    sock.sendall(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n")
+
+
+def forward(argv: list[str], socket_path: str = SOCKET_PATH, out=None, err=None) -> int | None:
+    """
+    Выполняет команду в демоне. Возвращает код возврата или None,
+    если демон недоступен (нет сокета / никто не слушает).
+    """
+    out = out or sys.stdout
+    err = err or sys.stderr
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(socket_path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(CONNECT_TIMEOUT)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+
+    # Команда может выполняться долго (анализ с Gemini) — дальше без таймаута
+    sock.settimeout(None)
+    request = {"argv": list(argv), "cwd": os.getcwd(), "columns": _terminal_columns()}
+    interrupted = False
+    try:
+        _send(sock, request)
+        with sock.makefile("r", encoding="utf-8") as stream:
+            while True:
+                try:
+                    line = stream.readline()
+                    if not line:
+                        break
+                    message = json.loads(line)
+                    if "out" in message:
+                        out.write(message["out"])
+                        out.flush()
+                    elif "err" in message:
+                        err.write(message["err"])
+                        err.flush()
+                    elif message.get("input"):
+                        _send(sock, {"stdin": sys.stdin.readline() if sys.stdin else ""})
+                    elif "exit" in message:
+                        return 130 if interrupted else int(message["exit"])
+                except KeyboardInterrupt:
+                    if interrupted:
+                        return 130  # повторный Ctrl-C — не ждём завершения команды
+                    interrupted = True
+                    _send(sock, {"interrupt": True})
+    except OSError:
+        pass
+    finally:
+        sock.close()
+    # Демон оборвал соединение, не прислав код возврата
+    return 130 if interrupted else 1
+
+
+def main(argv: list[str] | None = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+
+    if argv[:1] in (["--stop"], ["--status"]):
+        code = forward([STOP if argv[0] == "--stop" else PING])
+        if code is None:
+            print("Jafar daemon is not running.")
+            return 1
+        return code
+
+    code = forward(argv)
+    if code is not None:
+        return code
+
+    # Демона нет — выполняем команду здесь же
+    from jafar.cli.main import main as cli_main
+
+    sys.argv = ["jafar", "--no-daemon", *argv]
+    cli_main()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,13 +12,11 @@ from rich.columns import Columns
 from rich.table import Table
 from rich.text import Text
 from rich.markup import escape
-from prompt_toolkit import PromptSession
-from prompt_toolkit.history import FileHistory
-from prompt_toolkit.formatted_text import HTML
 
-from jafar.cli.command_router import handle_command
 from jafar.utils.market_utils import get_current_trading_session
-from jafar.cli.telegram_handler import send_long_telegram_message
+
+# prompt_toolkit, command_router and telegram_handler are imported inside the
+# functions that need them, so `jafar <command>` pays only for its own handler.
 
 console = Console()
 HISTORY_FILE = os.path.expanduser("~/.jafar_history.txt")
@@ -77,6 +75,8 @@ def display_welcome_banner():
     quote_text = Text(f'\n"{chosen_quote}"', style="italic yellow", justify="center")
 
     # Send quote to Telegram
+    from jafar.cli.telegram_handler import send_long_telegram_message
+
     send_long_telegram_message(f"**Кун Цитатаси:**\n\n_{chosen_quote}_")
 
     # Group everything together
@@ -92,29 +92,68 @@ def display_welcome_banner():
 
 def jafar_prompt():
     """Returns a simplified and clean prompt."""
+    from prompt_toolkit.formatted_text import HTML
+
     return HTML("<bold><ansiblue>(jafar)</ansiblue> <ansiwhite>❯</ansiwhite></bold> ")
 
 def main():
     try:
         os.makedirs(os.path.dirname(HISTORY_FILE), exist_ok=True)
 
-        if len(sys.argv) > 1:
-            command = " ".join(sys.argv[1:])
-            handle_command(command, interactive_session=False)
+        argv = sys.argv[1:]
+        if argv[:1] == ["--profile-startup"]:
+            from jafar.utils.startup_profiler import main as profile_startup
+
+            sys.exit(profile_startup(argv[1:]))
+
+        if argv[:1] == ["--daemon"]:
+            from jafar.cli.daemon import serve
+
+            serve()
+            return
+
+        use_daemon = "--no-daemon" not in argv
+        argv = [arg for arg in argv if arg != "--no-daemon"]
+
+        # Under a cassette the command must run in this process: the daemon would bypass recording/replay
+        if argv and use_daemon and not os.environ.get("JAFAR_CASSETTE_MODE"):
+            # A running `jafar --daemon` already has everything warm
+            from jafar.cli.daemon_client import forward
+
+            exit_code = forward(argv)
+            if exit_code is not None:
+                sys.exit(exit_code)
+
+        from jafar.cli.command_router import handle_command
+
+        if argv:
+            command = " ".join(argv)
+            status = handle_command(command, interactive_session=False)
+            if status == "failure":
+                sys.exit(1)
             return
 
         if not sys.stdout.isatty():
             return
 
+        from prompt_toolkit import PromptSession
+        from prompt_toolkit.history import FileHistory
+        from prompt_toolkit.patch_stdout import patch_stdout
+
+        from jafar.utils.command_bus import execution_lock
+
         session = PromptSession(history=FileHistory(HISTORY_FILE))
         display_welcome_banner()
 
         while True:
             try:
-                command = session.prompt(jafar_prompt()).strip()
+                # Output of voice-bus jobs running in the background stays above the prompt
+                with patch_stdout():
+                    command = session.prompt(jafar_prompt()).strip()
                 if not command:
                     continue
-                handle_command(command, interactive_session=True)
+                with execution_lock:
+                    handle_command(command, interactive_session=True)
 
             except (KeyboardInterrupt, EOFError):
                 console.print("\n👋 Хайр!")
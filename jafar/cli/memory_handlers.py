@@ -0,0 +1,70 @@
+import shlex
+from pathlib import Path
+from rich.console import Console
+from rich.panel import Panel
+from rich.table import Table
+
+from jafar.config.constants import JAFAR_MEMORY_DIR
+from jafar.utils import analysis_memory
+
+console = Console()
+
+
+def memory_command(args: str = None):
+    """
+    Управление памятью анализов:
+    - memory migrate [папка]              — перенести старые markdown-логи в SQLite
+    - memory show <инструмент> [N]        — показать последние N анализов
+    - memory export <инструмент|all> [файл] — выгрузить записи в markdown
+    """
+    parts = shlex.split(args) if args else []
+    action = parts[0].lower() if parts else "help"
+
+    if action == "migrate":
+        base_dir = Path(parts[1]).expanduser() if len(parts) > 1 else JAFAR_MEMORY_DIR
+        report = analysis_memory.migrate_markdown_logs(base_dir)
+        if not report:
+            console.print(f"[yellow]В '{base_dir}' не найдено markdown-логов для миграции.[/yellow]")
+            return
+        table = Table(title="Миграция памяти анализов", header_style="bold blue")
+        table.add_column("Лог", style="cyan")
+        table.add_column("Новых записей", style="white", justify="right")
+        for log_file, count in report.items():
+            table.add_row(log_file, str(count))
+        console.print(table)
+        return
+
+    if action == "show" and len(parts) > 1:
+        try:
+            limit = int(parts[2]) if len(parts) > 2 else 5
+        except ValueError:
+            console.print("[red]Использование: memory show <инструмент> [N] — N должно быть числом.[/red]")
+            return
+        entries = analysis_memory.load_recent(parts[1], analysis_memory.KIND_ATRADE, limit)
+        if not entries:
+            console.print(f"[yellow]Для '{parts[1].upper()}' записей в памяти нет.[/yellow]")
+            return
+        for entry in entries:
+            console.print(Panel(
+                analysis_memory.format_markdown_entry(entry),
+                title=f"{entry['instrument']} — {entry['created_at']}",
+                border_style="green",
+            ))
+        return
+
+    if action == "export" and len(parts) > 1:
+        instrument = None if parts[1].lower() == "all" else parts[1]
+        output_path = Path(parts[2]).expanduser() if len(parts) > 2 else \
+            JAFAR_MEMORY_DIR / f"{(instrument or 'all').lower()}_analysis_export.md"
+        analysis_memory.export_markdown(instrument, output_path=output_path)
+        console.print(f"[green]Память анализов выгружена в {output_path}[/green]")
+        return
+
+    console.print(Panel(
+        "[bold]Доступные команды:[/bold]\n"
+        "- [cyan]memory migrate [папка][/cyan] — перенести старые markdown-логи в SQLite\n"
+        "- [cyan]memory show <инструмент> [N][/cyan] — последние N анализов\n"
+        "- [cyan]memory export <инструмент|all> [файл][/cyan] — выгрузка в markdown",
+        title="🧠 Memory",
+        style="cyan",
+    ))
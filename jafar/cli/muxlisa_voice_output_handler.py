@@ -1,8 +1,4 @@
 import os
-import shlex
-import subprocess
-import time
-import requests
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -33,74 +29,52 @@ def load_jafar_dotenv():
 load_jafar_dotenv()
 MUXLISA_API_KEY = os.environ.get("MUXLISA_API_KEY")
 
-# --- Константы ---
-TEMP_AUDIO_FILE = "/Users/macbook/projects/jafar/temp/muxlisa_output.wav"
-
 def speak_muxlisa_text(text: str):
     """
     Озвучивает текст, используя API от Muxlisa AI.
+    Повторные фразы (алерты, статусы) берутся из кэша TTS без сетевого запроса.
     """
     if not text.strip():
         return
 
-    if not MUXLISA_API_KEY:
-        print("Ошибка: API ключ для Muxlisa не найден в .env файле.")
-        return
+    from jafar.voice.playback import play
+    from jafar.voice.tts_cache import get_audio
 
-    url = 'https://service.muxlisa.uz/api/v2/tts'
-    headers = {
-        'Content-Type': 'application/json',
-        'x-api-key': MUXLISA_API_KEY
-    }
-    payload = {
-        "text": text,
-        "speaker": 1  # 1 - Мужской голос
-    }
-
-    process = None
     try:
-        # 1. Отправляем запрос в Muxlisa AI
-        response = requests.post(url, headers=headers, json=payload)
-
-        if response.status_code == 200:
-            # 2. Сохраняем аудио-ответ во временный файл
-            os.makedirs(os.path.dirname(TEMP_AUDIO_FILE), exist_ok=True)
-            with open(TEMP_AUDIO_FILE, 'wb') as f:
-                f.write(response.content)
-
-            # 3. Воспроизводим аудиофайл с помощью afplay
-            command = f"afplay {shlex.quote(TEMP_AUDIO_FILE)}"
-            process = subprocess.Popen(command, shell=True)
-            
-            # Ждем завершения воспроизведения
-            process.wait()
-        else:
-            print(f"Ошибка от Muxlisa API: {response.status_code} - {response.text}")
-
-    except requests.exceptions.RequestException as e:
-        print(f"Сетевая ошибка при обращении к Muxlisa API: {e}")
+        # Аудио из кэша или синтез в Muxlisa AI; воспроизведение из памяти, без временных файлов
+        play(get_audio(text))
     except Exception as e:
         print(f"Ошибка синтеза речи: {e}")
-    finally:
-        # 4. Удаляем временный файл
-        if os.path.exists(TEMP_AUDIO_FILE):
-            os.remove(TEMP_AUDIO_FILE)
 
 import re
-import nltk
 
-# Убедимся, что необходимый пакет для NLTK загружен
-try:
-    nltk.data.find('tokenizers/punkt')
-    nltk.data.find('tokenizers/punkt_tab')
-except LookupError:
-    print("Загрузка недостающих пакетов ('punkt', 'punkt_tab') для NLTK...")
-    nltk.download('punkt')
-    nltk.download('punkt_tab')
+_nltk_ready = False
+
+
+def _sent_tokenize(text: str) -> list[str]:
+    """
+    Импортирует NLTK и докачивает токенизаторы только при первом вызове,
+    чтобы импорт модуля не тянул NLTK и не ходил в сеть.
+    """
+    global _nltk_ready
+    import nltk
+
+    if not _nltk_ready:
+        # Убедимся, что необходимый пакет для NLTK загружен
+        try:
+            nltk.data.find('tokenizers/punkt')
+            nltk.data.find('tokenizers/punkt_tab')
+        except LookupError:
+            print("Загрузка недостающих пакетов ('punkt', 'punkt_tab') для NLTK...")
+            nltk.download('punkt')
+            nltk.download('punkt_tab')
+        _nltk_ready = True
+    return nltk.sent_tokenize(text)
 
 def speak_in_chunks(text: str, chunk_size: int = 250):
     """
-    Разбивает текст на предложения и озвучивает их по очереди.
+    Разбивает текст на предложения и озвучивает их конвейером: следующее
+    предложение синтезируется, пока играет текущее, без пауз между ними.
     """
     if not text.strip():
         return
@@ -111,11 +85,14 @@ def speak_in_chunks(text: str, chunk_size: int = 250):
     text = re.sub(r'млн\.', 'миллионов', text, flags=re.IGNORECASE)
 
     # Разбиваем текст на предложения
-    sentences = nltk.sent_tokenize(text)
-
-    # Озвучиваем каждое предложение
-    for sentence in sentences:
-        if sentence.strip():
-            print(f"Озвучиваю: {sentence}")
-            speak_muxlisa_text(sentence)
-            time.sleep(0.3) # Небольшая пауза между предложениями
+    sentences = _sent_tokenize(text)
+
+    from jafar.voice.tts_pipeline import speak_sentences
+
+    def announced(items):
+        for sentence in items:
+            if sentence.strip():
+                print(f"Озвучиваю: {sentence}")
+                yield sentence
+
+    speak_sentences(announced(sentences))
@@ -1,7 +1,7 @@
 import os
 from rich.console import Console
 from rich.table import Table
-from jafar.utils.topstepx_api_client import TopstepXClient
+from jafar.utils.topstepx_api_client import TopstepXClient, get_shared_client
 
 console = Console()
 
@@ -30,7 +30,7 @@ def list_orders_command(args: str):
     """Fetches and displays active orders for the primary account."""
     console.print("[blue]Актив ордерлар юкланмоқда...[/blue]")
     try:
-        client = TopstepXClient()
+        client = get_shared_client()
         account_id = get_primary_account_id(client)
         
         if not account_id:
@@ -89,7 +89,7 @@ def place_test_order(args: str):
     """Places a hardcoded test order to debug the API client."""
     console.print("[bold yellow]--- API ОРДЕР ТЕСТИ ---[/bold yellow]")
     try:
-        client = TopstepXClient()
+        client = get_shared_client()
         account_id = get_primary_account_id(client)
         if not account_id:
             return
@@ -127,7 +127,7 @@ def place_market_order_test(args: str):
     """Places a hardcoded MARKET order to isolate errorCode: 8."""
     console.print("[bold magenta]--- API МАРКЕТ ОРДЕР ТЕСТИ ---[/bold magenta]")
     try:
-        client = TopstepXClient()
+        client = get_shared_client()
         account_id = get_primary_account_id(client)
         if not account_id:
             return
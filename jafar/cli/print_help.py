@@ -22,6 +22,11 @@ def print_help():
         ("check <action>", "выполнить health-чеки (git, internet, process)"),
         ("tool <action>", "выполнить dev-утилиты (zip, init, start, …)"),
         ("mode <action>", "быстрый запуск game / trainer"),
+        ("memory <migrate|show|export>", "память анализов: миграция markdown-логов, просмотр и выгрузка"),
+        ("backtest [инструмент] [--by session|strength] [--record]", "проверка сохранённых планов на минутных барах (backtest fetch <инструмент> [дней] — загрузить историю)"),
+        ("bench [atrade|btrade|ctrade|voice] [--runs N] [--latency recorded|median|none]", "воспроизведение записанных сессий без сети и замер по этапам (bench record <команда> — записать кассету)"),
+        ("--daemon", "резидентный демон: одноразовые `jafar <команда>` выполняются в прогретом процессе (--no-daemon — без него)"),
+        ("--profile-startup [--budget S]", "замер холодного старта CLI (-X importtime); с бюджетом — код ошибки при превышении"),
         ("agent-mode <prompt>", "режим агента: Jafar выполняет команды по вашему запросу"),
         ("exit", "выйти из Jafar CLI"),
         ("quit", "выйти из Jafar CLI"),
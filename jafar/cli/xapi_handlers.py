@@ -1,7 +1,7 @@
 from rich.console import Console
 from rich import print_json
 from rich.table import Table # Добавлен импорт Table
-from jafar.utils.topstepx_api_client import TopstepXClient
+from jafar.utils.topstepx_api_client import TopstepXClient, get_shared_client
 import os
 from datetime import datetime, timedelta
 
@@ -31,7 +31,7 @@ def atrade_xapi_command(args: str = None):
     console.print("[bold yellow]--- Диагностика Счета TopstepX ---[/bold yellow]")
     
     try:
-        client = TopstepXClient()
+        client = get_shared_client()
         primary_account = _get_primary_account(client)
         if not primary_account:
             return
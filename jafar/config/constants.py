@@ -1,11 +1,20 @@
+import os
 from pathlib import Path
 
-JAFAR_MEMORY_DIR = Path(__file__).parent.parent.parent / "memory"
+# JAFAR_MEMORY_DIR в окружении — отдельная память (например, для прогонов `jafar bench`)
+JAFAR_MEMORY_DIR = Path(os.environ.get("JAFAR_MEMORY_DIR") or Path(__file__).parent.parent.parent / "memory")
 JAFAR_MEMORY_DIR.mkdir(parents=True, exist_ok=True)
 JAFAR_THREAD_FILE = JAFAR_MEMORY_DIR / "thread_id.txt"
 JAFAR_LOG_FILE = JAFAR_MEMORY_DIR / "jafar.log"
 JAFAR_ACTIVE_PROJECT_FILE = JAFAR_MEMORY_DIR / "active_project.txt"
 JAFAR_AGENT_PREFERENCES_FILE = JAFAR_MEMORY_DIR / "agent_preferences.json"
+JAFAR_ANALYSIS_DB = JAFAR_MEMORY_DIR / "analysis_memory.sqlite"
+JAFAR_KEY_LEVELS_DB = JAFAR_MEMORY_DIR / "key_levels.sqlite"
+JAFAR_TELEGRAM_OUTBOX_DB = JAFAR_MEMORY_DIR / "telegram_outbox.sqlite"
+JAFAR_FILL_LEDGER_DB = JAFAR_MEMORY_DIR / "fill_ledger.sqlite"
+JAFAR_BARS_DIR = JAFAR_MEMORY_DIR / "bars"
+JAFAR_ALERT_RULES_FILE = JAFAR_MEMORY_DIR / "alert_rules.txt"
+JAFAR_CASSETTES_DIR = JAFAR_MEMORY_DIR / "cassettes"
 
 EMOJI = {
     "run": "⚙️",
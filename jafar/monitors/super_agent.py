@@ -1,10 +1,10 @@
 import os
 import time
-import json
 import sys
 import subprocess
 from pathlib import Path
 from datetime import datetime, timedelta
+from typing import Optional
 import concurrent.futures
 import speech_recognition as sr
 import pyaudio
@@ -15,9 +15,10 @@ from jafar.cli.ctrade_handlers import run_ctrade_analysis # Reusing existing log
 from jafar.cli.muxlisa_voice_output_handler import speak_muxlisa_text
 from jafar.utils.text_utils import convert_numbers_to_words_in_text
 from jafar.cli.telegram_handler import send_long_telegram_message
+from jafar.utils import alert_rules, chart_renderer, indicators, key_levels_store
+from jafar.voice.tts_cache import prewarm_async
 
 console = Console()
-KEY_LEVELS_FILE = Path("memory/key_levels.json")
 TOPSTEPX_USERNAME = os.getenv("TOPSTEPX_USERNAME")
 TOPSTEPX_API_KEY = os.getenv("TOPSTEPX_API_KEY")
 MONITOR_INTERVAL_SECONDS = 90 # How often to check prices
@@ -27,11 +28,30 @@ APPLE_SCRIPT_ACTIVATE_TOPSTEPX = Path(__file__).parent / "scripts" / "activate_t
 APPLE_SCRIPT_CLICK_SNAPSHOT = Path(__file__).parent / "scripts" / "click_topstepx_snapshot.scpt"
 
 def load_key_levels():
-    if not KEY_LEVELS_FILE.exists():
-        console.print(f"[red]Xatolik: Asosiy darajalar fayli topilmadi: {KEY_LEVELS_FILE}[/red]")
-        return {}
-    with open(KEY_LEVELS_FILE, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    """Active levels from the key-levels store, expiring stale ones first."""
+    key_levels_store.expire_stale()
+    key_levels = key_levels_store.load_levels()
+    if not key_levels:
+        console.print("[yellow]Kuzatish uchun faol darajalar yo'q. Yangi darajalar kutilmoqda...[/yellow]")
+    return key_levels
+
+def sync_level_rules(key_levels_data: dict) -> dict[str, list[dict]]:
+    """
+    Active levels -> proximity rules of the "levels" group. Returns rule id -> levels:
+    levels with the same instrument and price compile to one rule.
+    """
+    specs, active_levels = [], []
+    for instrument, levels in key_levels_data.items():
+        for level_data in levels:
+            if level_data.get("status") == key_levels_store.STATUS_ACTIVE:
+                specs.append((f"{instrument} price within {PRICE_THRESHOLD_PERCENT} % of {level_data['level']}",
+                              f"{level_data['type']} {level_data['level']}"))
+                active_levels.append(level_data)
+    rules = alert_rules.get_engine().set_group("levels", specs)
+    level_rules = {}
+    for rule, level_data in zip(rules, active_levels):
+        level_rules.setdefault(rule.id, []).append(level_data)
+    return level_rules
 
 def get_topstepx_client():
     client = TopstepXClient(TOPSTEPX_USERNAME, TOPSTEPX_API_KEY)
@@ -115,6 +135,7 @@ def listen_for_confirmation(timeout: int = 15) -> bool:
     return False
 
 def super_agent_loop():
+    prewarm_async()
     console.print("[bold green]Jafar Super Agent ishga tushirildi! Bozor kuzatilmoqda...[/bold green]")
     speak_muxlisa_text("Jafar Super Agent ishga tushirildi. Bozor kuzatilmoqda.")
 
@@ -122,10 +143,15 @@ def super_agent_loop():
     if not client:
         return # Exit if client not authenticated
 
+    # New or changed levels wake the loop immediately instead of waiting for the next cycle
+    level_feed = key_levels_store.ChangeFeed()
+
     while True:
         try:
             key_levels_data = load_key_levels()
             monitored_instruments = list(key_levels_data.keys())
+            known = {name.upper() for name in monitored_instruments}
+            monitored_instruments += sorted({rule.instrument for rule in alert_rules.get_engine().rules.values()} - known)
             
             # --- Prioritet #1: Ochiq pozitsiyalarni boshqarish ("Position Shepherd") ---
             # Placeholder: This part will be fully implemented later
@@ -133,66 +159,77 @@ def super_agent_loop():
 
             # --- Prioritet #2: Yangi savdo imkoniyatlarini izlash ("Level Guardian") ---
             console.print(f"[{datetime.now().strftime('%H:%M:%S')}] [dim]Супер Агент: Нарх даражаларини текшириш... ({', '.join(monitored_instruments)})[/dim]")
-            current_prices = get_current_prices(client, monitored_instruments)
+            current_prices = get_current_prices(client, monitored_instruments) if monitored_instruments else {}
             # console.print(f"[dim]Joriy narxlar: {current_prices}[/dim]")
 
-            for instrument, levels in key_levels_data.items():
-                current_price = current_prices.get(instrument)
-                if current_price is None: continue
-
-                for level_data in levels:
-                    if level_data.get("status") == "active":
-                        level = level_data["level"]
-                        level_type = level_data["type"]
+            # Levels are compiled into proximity rules; only rules whose state changed are evaluated
+            level_rules = sync_level_rules(key_levels_data)
+            for instrument, price in current_prices.items():
+                for alert in alert_rules.get_engine().on_price(instrument, price):
+                    levels = level_rules.get(alert.rule_id)
+                    if not levels:
+                        # User rules from memory/alert_rules.txt: notify only
+                        console.print(f"\n[bold yellow]🔔 {instrument}: {alert.name} (narx {alert.price})[/bold yellow]")
+                        send_long_telegram_message(f"[Jafar Super Agent] 🔔 {instrument}: {alert.name} (narx {alert.price})")
+                        continue
+                    level_data = levels[0]
+                    current_price = alert.price
+                    level = level_data["level"]
+                    level_type = level_data["type"]
+
+                    console.print(f"\n[bold green]Diqqat! {instrument} uchun narx {current_price} asosiy {level} ({level_type}) darajasiga yaqinlashmoqda![/bold green]")
+                    latin_summary = f"Diqqat! {convert_numbers_to_words_in_text(str(current_price))} narx {convert_numbers_to_words_in_text(str(level))} darajasiga yaqinlashmoqda. Tahlil uchun skrinshotlar tayyorlashga tayyormisiz?"
+                    speak_muxlisa_text(latin_summary)
+                    send_long_telegram_message(f"[Jafar Super Agent] Diqqat! {instrument} uchun narx {current_price} asosiy {level} ({level_type}) darajasiga yaqinlashmoqda. Tahlil uchun skrinshotlar kerak!")
+
+                    if listen_for_confirmation():
+                        current_screenshot_dir = Path("screenshot") / f"superagent_{instrument}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
+                        current_screenshot_dir.mkdir(parents=True, exist_ok=True)
                         
-                        price_diff = abs(current_price - level)
-                        threshold_value = level * (PRICE_THRESHOLD_PERCENT / 100)
-
-                        if price_diff <= threshold_value:
-                            console.print(f"\n[bold green]Diqqat! {instrument} uchun narx {current_price} asosiy {level} ({level_type}) darajasiga yaqinlashmoqda![/bold green]")
-                            latin_summary = f"Diqqat! {convert_numbers_to_words_in_text(str(current_price))} narx {convert_numbers_to_words_in_text(str(level))} darajasiga yaqinlashmoqda. Tahlil uchun skrinshotlar tayyorlashga tayyormisiz?"
-                            speak_muxlisa_text(latin_summary)
-                            send_long_telegram_message(f"[Jafar Super Agent] Diqqat! {instrument} uchun narx {current_price} asosiy {level} ({level_type}) darajasiga yaqinlashmoqda. Tahlil uchun skrinshotlar kerak!")
-
-                            if listen_for_confirmation():
-                                current_screenshot_dir = Path("screenshot") / f"superagent_{instrument}_{datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}"
-                                current_screenshot_dir.mkdir(parents=True, exist_ok=True)
+                        # Графики строятся из баров без участия пользователя; окно TopstepX — запасной путь
+                        temp_screenshot_files = chart_renderer.render_charts(
+                            instrument, current_screenshot_dir, client=client,
+                            levels=chart_renderer.levels_for(instrument))
+                        if temp_screenshot_files:
+                            console.print(f"[dim]{indicators.format_for_prompt(instrument)}[/dim]")
+                        for i in range(0 if temp_screenshot_files else 3):
+                            screenshot_path = current_screenshot_dir / f"screenshot_{i+1}.png"
+                            if shot_path := make_topstepx_screenshot(screenshot_path):
+                                temp_screenshot_files.append(shot_path)
+                            else:
+                                console.print("[red]Skrinshot olinmadi. Tahlil bekor qilindi.[/red]"); break
+
+                        if len(temp_screenshot_files) == 3:
+                            console.print("[bold blue]Skrinshotlar olindi. Gemini orqali tahlil boshlanmoqda...[/bold blue]")
+                            analysis_result = run_ctrade_analysis(instrument, instrument, temp_screenshot_files)
+                            
+                            if analysis_result.get("status") == "Успех":
+                                full_analysis_uz = analysis_result.get("full_analysis", "Noma'lum tahlil.")
+                                voice_summary_uz_latin = analysis_result.get("voice_summary", "Ovozli xulosa mavjud emas.")
+                                
+                                console.print(f"\n[bold green]--- To'liq Tahlil (Kirillcha) ---[/bold green]\n{full_analysis_uz}")
+                                if voice_summary_uz_latin:
+                                    processed_summary = convert_numbers_to_words_in_text(voice_summary_uz_latin)
+                                    speak_muxlisa_text(processed_summary)
+
+                                # Execute trade based on analysis_result (assuming ctrade_handlers does this)
+                                # For now, ctrade_handlers handles the execution internally, we just trigger it.
                                 
-                                temp_screenshot_files = []
-                                for i in range(3):
-                                    screenshot_path = current_screenshot_dir / f"screenshot_{i+1}.png"
-                                    if shot_path := make_topstepx_screenshot(screenshot_path):
-                                        temp_screenshot_files.append(shot_path)
-                                    else:
-                                        console.print("[red]Skrinshot olinmadi. Tahlil bekor qilindi.[/red]"); break
-
-                                if len(temp_screenshot_files) == 3:
-                                    console.print("[bold blue]Skrinshotlar olindi. Gemini orqali tahlil boshlanmoqda...[/bold blue]")
-                                    analysis_result = run_ctrade_analysis(instrument, instrument, temp_screenshot_files)
-                                    
-                                    if analysis_result.get("status") == "Успех":
-                                        full_analysis_uz = analysis_result.get("full_analysis", "Noma'lum tahlil.")
-                                        voice_summary_uz_latin = analysis_result.get("voice_summary", "Ovozli xulosa mavjud emas.")
-                                        
-                                        console.print(f"\n[bold green]--- To'liq Tahlil (Kirillcha) ---[/bold green]\n{full_analysis_uz}")
-                                        if voice_summary_uz_latin:
-                                            processed_summary = convert_numbers_to_words_in_text(voice_summary_uz_latin)
-                                            speak_muxlisa_text(processed_summary)
-
-                                        # Execute trade based on analysis_result (assuming ctrade_handlers does this)
-                                        # For now, ctrade_handlers handles the execution internally, we just trigger it.
-                                        
-                                    else:
-                                        console.print(f"[bold red]--- Tahlilda Xatolik ---[/bold red]\n{analysis_result.get('full_analysis', 'Noma`lum xatolik.')}")
-
-                                # Mark level as inactive or temporarily ignore to avoid re-triggering immediately
-                                level_data["status"] = "triggered" # Or add a 'last_triggered' timestamp
-                                # In a real scenario, we might want to update key_levels.json here to save the state
-                                speak_muxlisa_text(f"{instrument} bo'yicha tahlil yakunlandi.")
                             else:
-                                speak_muxlisa_text("Skrinshot olish bekor qilindi.")
+                                console.print(f"[bold red]--- Tahlilda Xatolik ---[/bold red]\n{analysis_result.get('full_analysis', 'Noma`lum xatolik.')}")
+
+                        # Persist the transition so the level is not re-triggered (also by other processes)
+                        for triggered in levels:
+                            key_levels_store.set_status(triggered["id"], key_levels_store.STATUS_TRIGGERED)
+                            triggered["status"] = key_levels_store.STATUS_TRIGGERED
+                        speak_muxlisa_text(f"{instrument} bo'yicha tahlil yakunlandi.")
+                    else:
+                        speak_muxlisa_text("Skrinshot olish bekor qilindi.")
 
-            time.sleep(MONITOR_INTERVAL_SECONDS) # Wait before next check
+            # Wait before next price check; returns early when levels change
+            changes = level_feed.wait(MONITOR_INTERVAL_SECONDS)
+            if changes:
+                console.print(f"[dim]Супер Агент: {len(changes)} ta daraja o'zgarishi qabul qilindi.[/dim]")
 
         except Exception as e:
             console.print(f"[bold red]Super Agentda kutilmagan xatolik: {e}[/bold red]")
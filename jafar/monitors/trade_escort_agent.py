@@ -12,8 +12,12 @@ project_root = Path(__file__).resolve().parent.parent.parent
 sys.path.append(str(project_root))
 
 from jafar.utils.topstepx_api_client import TopstepXClient
+from jafar.utils.bar_aggregator import BarAggregator
+from jafar.utils.alert_rules import AlertEngine, symbol_of
 from jafar.cli.muxlisa_voice_output_handler import speak_muxlisa_text
 from jafar.cli.telegram_handler import send_long_telegram_message
+from jafar.utils.log_pipeline import PipelineLogHandler
+from jafar.voice.tts_cache import prewarm_async
 
 # --- Agent Configuration ---
 LOGS_DIR = project_root / "logs" / "trade_agents"
@@ -23,9 +27,13 @@ LOGS_DIR.mkdir(exist_ok=True)
 STATE_CHECK_INTERVAL_PENDING = 20  # How often to check if the order is filled
 STATE_CHECK_INTERVAL_ACTIVE = 60   # How often to check the active position (1-min candles)
 
-# Proximity Alert Configuration
+# Proximity Alert Configuration (compiled into alert rules; extra rules come from memory/alert_rules.txt)
 PRICE_PROXIMITY_TICKS = 15 # Ticks away from SL/TP to trigger an alert
 
+# Bar feed: 1-min bars (incl. the forming one) are pulled incrementally and resampled locally
+ESCORT_TIMEFRAMES = ("1m", "5m", "15m")
+BAR_BACKFILL_MINUTES = 15
+
 class TradeEscortAgent:
     """
     An intelligent agent to monitor the lifecycle of a single TopstepX order.
@@ -51,12 +59,25 @@ class TradeEscortAgent:
         self.take_profit = None
         self.tick_size = 0.1 # Default, will be updated
 
+        self.bars = BarAggregator(ESCORT_TIMEFRAMES, capacity=500)
+        self.bars.subscribe(on_close=self.on_bar_close)
+
+        # Alert rules are evaluated on every bar update pushed by the aggregator
+        self.alerts = AlertEngine()
+        self.alerts.load_file()
+        self.alerts.subscribe(self.on_alert)
+        self.alerts.attach(self.bars, self.contract_id)
+
     def _setup_logger(self) -> logging.Logger:
         """Sets up a dedicated logger for this agent instance."""
         logger = logging.getLogger(f"TradeEscortAgent_{self.order_id}")
         logger.setLevel(logging.INFO)
         log_file = LOGS_DIR / f"{self.order_id}.log"
-        handler = logging.FileHandler(log_file, mode='w')
+        # Each run starts a fresh log (as FileHandler mode='w' did); writes then go through
+        # the shared log pipeline so the agent loop never blocks on disk I/O
+        log_file.parent.mkdir(parents=True, exist_ok=True)
+        log_file.write_text("", encoding="utf-8")
+        handler = PipelineLogHandler(log_file)
         formatter = logging.Formatter('[%(asctime)s] - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
         handler.setFormatter(formatter)
         logger.addHandler(handler)
@@ -75,6 +96,8 @@ class TradeEscortAgent:
     def run(self):
         """The main loop of the agent, driven by the state machine."""
         self.logger.info(f"Агент запущен. Цель: Ордер #{self.order_id} ({self.expected_side} {self.contract_id}). Состояние: {self.state}.")
+        # Alerts ("Савдо ёпилди!" etc.) are synthesized ahead so they play without a network round-trip
+        prewarm_async()
         try:
             while self.state != "COMPLETED":
                 if self.state == "PENDING":
@@ -104,19 +127,33 @@ class TradeEscortAgent:
         except Exception as e:
             self.logger.warning(f"Ошибка при проверке статуса ордера: {e}")
 
+    def _entry_tag(self) -> str | None:
+        """customTag of the tracked entry order; brackets carry it as a prefix when the API has no linkedOrderId."""
+        end_time = datetime.utcnow()
+        response = self.client.get_orders(self.account_id, end_time - timedelta(hours=24), end_time)
+        entry = next((o for o in (response or {}).get("orders", []) if o.get("id") == self.order_id), None)
+        return (entry or {}).get("customTag")
+
+    def _is_bracket(self, order: dict, entry_tag: str | None) -> bool:
+        linked = order.get("linkedOrderId")
+        if linked is not None:
+            return linked == self.order_id
+        return bool(entry_tag) and order.get("id") != self.order_id and entry_tag in (order.get("customTag") or "")
+
     def transition_to_active(self):
         """Handles the transition from PENDING to ACTIVE."""
         self.state = "ACTIVE"
         self.logger.info("ОБНАРУЖЕНО ИСПОЛНЕНИЕ ОРДЕРА! Позиция открыта.")
         
-        # Fetch SL/TP orders associated with the new position
+        # Fetch the SL/TP brackets of the tracked entry order (not just any working order on the contract)
         try:
+            entry_tag = self._entry_tag()
             orders = self.client.get_working_orders(self.account_id)
             for order in orders.get("orders", []):
-                if order.get("contractId") == self.contract_id:
-                    if order.get("type") == 3: # Stop Loss
+                if order.get("contractId") == self.contract_id and self._is_bracket(order, entry_tag):
+                    if order.get("type") in (3, 4): # Stop Loss (StopLimit / Stop)
                         self.stop_loss = order.get("stopPrice")
-                    elif order.get("type") == 2: # Take Profit (usually a Limit order)
+                    elif order.get("type") == 1: # Take Profit (Limit)
                         self.take_profit = order.get("limitPrice")
             
             # Get tick size for proximity calculations
@@ -125,6 +162,7 @@ class TradeEscortAgent:
                 self.tick_size = contract_info['contracts'][0].get('tickSize', 0.1)
 
             self.logger.info(f"Позиция активна. SL: {self.stop_loss}, TP: {self.take_profit}, Tick Size: {self.tick_size}")
+            self.set_proximity_rules()
 
         except Exception as e:
             self.logger.error(f"Не удалось получить детали SL/TP для активной позиции: {e}")
@@ -148,42 +186,55 @@ class TradeEscortAgent:
                 self.transition_to_completed()
                 return
 
-            # Fetch the last closed 1-minute bar
-            end_time = datetime.utcnow()
-            start_time = end_time - timedelta(minutes=1)
-            bars_data = self.client.get_historical_bars(self.contract_id, start_time, end_time, unit_number=1, unit=2, limit=1)
-            
-            if not bars_data or not bars_data.get("bars"):
+            # Only the 1-min bars since the last one seen (plus the forming bar); 5m/15m are built locally.
+            # Tactical monitoring (SL/TP proximity, user rules) runs from the aggregator callbacks.
+            if not self.poll_bars():
                 self.logger.warning("Не удалось получить данные по последней свече.")
-                return
-            
-            last_candle = bars_data["bars"][0]
-            close_price = last_candle.get("c")
-            self.logger.info(f"Последняя 1-мин свеча. Close: {close_price}, O: {last_candle.get('o')}, H: {last_candle.get('h')}, L: {last_candle.get('l')}")
-
-            # Tactical Monitoring
-            self.check_price_proximity(close_price)
-            # self.analyze_candle_patterns(last_candle) # Placeholder for future logic
 
         except Exception as e:
             self.logger.warning(f"Ошибка при обработке активного состояния: {e}")
 
-    def check_price_proximity(self, current_price: float):
-        """Checks if the current price is close to SL or TP and sends alerts."""
-        if not current_price: return
+    def poll_bars(self) -> bool:
+        """Feeds new 1-min bars into the aggregator; closes bars whose time is up. False if no data."""
+        end_time = datetime.utcnow()
+        last_t = self.bars.last_time()
+        start_time = (datetime.utcfromtimestamp(last_t) if last_t
+                      else end_time - timedelta(minutes=BAR_BACKFILL_MINUTES))
+        bars_data = self.client.get_historical_bars(self.contract_id, start_time, end_time, unit_number=1, unit=2,
+                                                    limit=BAR_BACKFILL_MINUTES + 5, include_partial_bar=True)
+        bars = (bars_data or {}).get("bars") or []
+        self.bars.add_api_bars(bars)
+        # Bars with no new data are closed by the clock, one poll late so the API's final update still lands
+        self.bars.close_due(time.time() - STATE_CHECK_INTERVAL_ACTIVE)
+        return bool(bars) or last_t is not None
 
-        proximity_threshold = PRICE_PROXIMITY_TICKS * self.tick_size
+    def on_bar_close(self, timeframe: str, bar: dict):
+        """Aggregator callback: a bar of any escort timeframe has closed."""
+        self.logger.info(f"Закрыта {timeframe} свеча. Close: {bar['c']}, O: {bar['o']}, H: {bar['h']}, L: {bar['l']}, V: {bar['v']:g}")
 
+    def set_proximity_rules(self):
+        """SL/TP proximity as alert rules: fired once on approach, then cooled down."""
+        self.alerts.tick_sizes[symbol_of(self.contract_id)] = self.tick_size
+        specs = []
         if self.stop_loss:
-            if abs(current_price - self.stop_loss) <= proximity_threshold:
-                self.logger.warning(f"ЦЕНА ({current_price}) ПРИБЛИЖАЕТСЯ К STOP-LOSS ({self.stop_loss})!")
-                speak_muxlisa_text("Диққат! Нарх стоп-лоссга яқинлашмоқда!")
-                send_long_telegram_message(f"⚠️ **{self.contract_id}**: Цена ({current_price}) приближается к Stop-Loss ({self.stop_loss})!")
-        
+            specs.append((f"{self.contract_id} price within {PRICE_PROXIMITY_TICKS} ticks of {self.stop_loss}", "stop_loss"))
         if self.take_profit:
-            if abs(current_price - self.take_profit) <= proximity_threshold:
-                self.logger.info(f"Цена ({current_price}) приближается к Take-Profit ({self.take_profit}).")
-                send_long_telegram_message(f"ℹ️ **{self.contract_id}**: Цена ({current_price}) приближается к Take-Profit ({self.take_profit}).")
+            specs.append((f"{self.contract_id} price within {PRICE_PROXIMITY_TICKS} ticks of {self.take_profit}", "take_profit"))
+        self.alerts.set_group("escort", specs)
+
+    def on_alert(self, alert):
+        """Alert engine callback: SL/TP proximity or a user rule has fired."""
+        current_price = alert.price
+        if alert.name == "stop_loss":
+            self.logger.warning(f"ЦЕНА ({current_price}) ПРИБЛИЖАЕТСЯ К STOP-LOSS ({self.stop_loss})!")
+            speak_muxlisa_text("Диққат! Нарх стоп-лоссга яқинлашмоқда!")
+            send_long_telegram_message(f"⚠️ **{self.contract_id}**: Цена ({current_price}) приближается к Stop-Loss ({self.stop_loss})!")
+        elif alert.name == "take_profit":
+            self.logger.info(f"Цена ({current_price}) приближается к Take-Profit ({self.take_profit}).")
+            send_long_telegram_message(f"ℹ️ **{self.contract_id}**: Цена ({current_price}) приближается к Take-Profit ({self.take_profit}).")
+        else:
+            self.logger.info(f"Сработало правило '{alert.name}' при цене {current_price}.")
+            send_long_telegram_message(f"🔔 **{self.contract_id}**: {alert.name} (цена {current_price})")
 
     def transition_to_completed(self):
         """Handles the final transition to the COMPLETED state."""
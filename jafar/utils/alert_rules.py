@@ -0,0 +1,491 @@
+"""Декларативные правила оповещений над потоком цен и баров.
+
+    MGC price within 15 ticks of 2342.5 cooldown 10m
+    MGC 5m candle bullish_engulfing and time 13:30-16:00
+
+    python -m jafar.utils.alert_rules bench
+"""
+
+import hashlib
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from jafar.config.constants import JAFAR_ALERT_RULES_FILE
+from jafar.utils.indicators import IndicatorEngine
+
+RULES_FILE = JAFAR_ALERT_RULES_FILE
+DEFAULT_COOLDOWN_SECONDS = 300
+TICK_SIZES = {
+    "GC": 0.1, "MGC": 0.1, "CL": 0.01, "MCL": 0.01,
+    "ES": 0.25, "MES": 0.25, "NQ": 0.25, "MNQ": 0.25,
+}
+DEFAULT_TICK_SIZE = 0.01
+CANDLE_PATTERNS = ("bullish", "bearish", "doji", "hammer", "shooting_star",
+                   "bullish_engulfing", "bearish_engulfing", "inside_bar")
+_OPS = {">": np.greater, "<": np.less, ">=": np.greater_equal, "<=": np.less_equal}
+_DURATION = {"s": 1, "m": 60, "h": 3600}
+
+
+class RuleSyntaxError(ValueError):
+    pass
+
+
+@dataclass
+class Alert:
+    rule_id: str
+    name: str
+    instrument: str
+    text: str
+    price: float | None
+    t: float
+
+
+@dataclass
+class Rule:
+    id: str
+    name: str
+    text: str
+    instrument: str
+    conditions: list[tuple]
+    cooldown: float = DEFAULT_COOLDOWN_SECONDS
+    group: str = ""
+    value: bool = False
+    last_fired: float | None = None
+    fired: int = 0
+
+
+def symbol_of(contract: str) -> str:
+    """CON.F.US.MGC.Z25 -> MGC; обычный тикер возвращается как есть (в верхнем регистре)."""
+    parts = contract.upper().split(".")
+    return parts[3] if len(parts) >= 5 and parts[0] == "CON" else contract.upper()
+
+
+# --- Разбор ---
+
+def _number(token: str, text: str) -> float:
+    try:
+        return float(token)
+    except (TypeError, ValueError):
+        raise RuleSyntaxError(f"Expected a number, got '{token}' in: {text}") from None
+
+
+def _parse_duration(token: str, text: str) -> float:
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([smh]?)", token)
+    if not match:
+        raise RuleSyntaxError(f"Bad duration '{token}' in: {text}")
+    return float(match.group(1)) * _DURATION[match.group(2) or "s"]
+
+
+def _parse_condition(tokens: list[str], instrument: str, tick_size: float, text: str) -> tuple:
+    """Один фрагмент между `and` -> ключ узла (кортеж, он же ключ общего подвыражения)."""
+    head = tokens[0]
+    if head == "time":
+        match = re.fullmatch(r"(\d\d?):(\d\d)-(\d\d?):(\d\d)", "".join(tokens[1:]))
+        if not match:
+            raise RuleSyntaxError(f"Expected time HH:MM-HH:MM (UTC) in: {text}")
+        h1, m1, h2, m2 = map(int, match.groups())
+        return ("time", h1 * 60 + m1, h2 * 60 + m2)
+
+    if head == "price":
+        rest = tokens[1:]
+        if rest[:1] == ["crosses"]:
+            direction = {"above": 1, "below": -1}.get(rest[1], 0) if len(rest) > 2 else 0
+            return ("cross", instrument, _number(rest[-1], text), direction)
+        if rest[:1] == ["within"] and len(rest) == 5 and rest[3] == "of":
+            amount, unit, level = _number(rest[1], text), rest[2], _number(rest[4], text)
+            width = {"ticks": amount * tick_size, "tick": amount * tick_size, "points": amount,
+                     "%": level * amount / 100.0, "percent": level * amount / 100.0}.get(unit)
+            if width is None:
+                raise RuleSyntaxError(f"Unit must be ticks, points or % in: {text}")
+            return ("within", instrument, level, round(width, 10))
+        if len(rest) == 2 and rest[0] in _OPS:
+            return ("price", instrument, rest[0], _number(rest[1], text))
+        raise RuleSyntaxError(f"Unknown price condition in: {text}")
+
+    timeframe, rest = head, tokens[1:]
+    if not re.fullmatch(r"\d+[smhd]|session", timeframe) or not rest:
+        raise RuleSyntaxError(f"Expected price, time or <timeframe> condition in: {text}")
+    if rest[0] == "candle" and len(rest) == 2:
+        if rest[1] not in CANDLE_PATTERNS:
+            raise RuleSyntaxError(f"Unknown candle pattern '{rest[1]}' ({', '.join(CANDLE_PATTERNS)})")
+        return ("candle", instrument, timeframe, rest[1])
+    if len(rest) >= 3 and rest[1] == "crosses":
+        direction = {"above": 1, "below": -1}.get(rest[2], 0) if len(rest) == 4 else 0
+        right = rest[-1]
+        return ("ind_cross", instrument, timeframe, rest[0], direction, _operand(right))
+    if len(rest) == 3 and rest[1] in _OPS:
+        return ("ind", instrument, timeframe, rest[0], rest[1], _operand(rest[2]))
+    raise RuleSyntaxError(f"Unknown indicator condition in: {text}")
+
+
+def _operand(token: str):
+    try:
+        return float(token)
+    except ValueError:
+        return token
+
+
+def parse_rule(text: str, name: str | None = None, group: str = "", tick_sizes: dict | None = None) -> Rule:
+    """`INSTRUMENT cond [and cond ...] [cooldown 10m]` -> Rule. Ошибки — RuleSyntaxError."""
+    normalized = " ".join(text.strip().split())
+    tokens = normalized.lower().split(" ")
+    if len(tokens) < 3:
+        raise RuleSyntaxError(f"Rule is too short: {text}")
+    instrument = symbol_of(tokens[0])
+    tick_size = (tick_sizes or TICK_SIZES).get(instrument, DEFAULT_TICK_SIZE)
+    cooldown = DEFAULT_COOLDOWN_SECONDS
+    if "cooldown" in tokens:
+        position = tokens.index("cooldown")
+        if position + 2 != len(tokens):
+            raise RuleSyntaxError(f"cooldown must be the last option in: {text}")
+        cooldown = _parse_duration(tokens[-1], text)
+        tokens = tokens[:position]
+    conditions, current = [], []
+    for token in tokens[1:] + ["and"]:
+        if token == "and":
+            if not current:
+                raise RuleSyntaxError(f"Empty condition in: {text}")
+            conditions.append(_parse_condition(current, instrument, tick_size, text))
+            current = []
+        else:
+            current.append(token)
+    canonical = f"{instrument} " + " and ".join(map(repr, sorted(set(conditions), key=repr)))
+    rule_id = hashlib.sha1(canonical.encode()).hexdigest()[:12]
+    return Rule(rule_id, name or normalized, normalized, instrument, list(dict.fromkeys(conditions)),
+                cooldown, group)
+
+
+# --- Свечные модели ---
+
+def candle_matches(pattern: str, bar: dict, prev: dict | None) -> bool:
+    o, h, l, c = bar["o"], bar["h"], bar["l"], bar["c"]
+    body, span = abs(c - o), h - l
+    if pattern == "bullish":
+        return c > o
+    if pattern == "bearish":
+        return c < o
+    if span <= 0:
+        return pattern == "doji"
+    upper, lower = h - max(o, c), min(o, c) - l
+    if pattern == "doji":
+        return body <= span * 0.1
+    if pattern == "hammer":
+        return lower >= 2 * body and upper <= span * 0.25
+    if pattern == "shooting_star":
+        return upper >= 2 * body and lower <= span * 0.25
+    if prev is None:
+        return False
+    po, pc = prev["o"], prev["c"]
+    if pattern == "bullish_engulfing":
+        return pc < po and c > o and o <= pc and c >= po
+    if pattern == "bearish_engulfing":
+        return pc > po and c < o and o >= pc and c <= po
+    if pattern == "inside_bar":
+        return h <= prev["h"] and l >= prev["l"]
+    return False
+
+
+# --- Движок ---
+
+class _Book:
+    """Скомпилированные узлы одного инструмента."""
+
+    def __init__(self):
+        self.cross_levels = np.empty(0)
+        self.cross_dirs = np.empty(0, dtype=np.int8)
+        self.cross_keys: list[tuple] = []
+        self.within_levels = np.empty(0)
+        self.within_widths = np.empty(0)
+        self.within_keys: list[tuple] = []
+        self.within_state = np.zeros(0, dtype=bool)
+        self.price_keys: list[tuple] = []
+        self.bar_keys: dict[str, list[tuple]] = {}
+
+
+class AlertEngine:
+    """Правила по всем инструментам; события — on_price/on_bar, оповещения — подписчикам."""
+
+    def __init__(self, tick_sizes: dict | None = None):
+        self.tick_sizes = dict(TICK_SIZES, **(tick_sizes or {}))
+        self.rules: dict[str, Rule] = {}
+        self._values: dict[tuple, bool] = {}
+        self._rules_by_key: dict[tuple, list[str]] = {}
+        self._books: dict[str, _Book] = {}
+        self._time_keys: list[tuple] = []
+        self._last_price: dict[str, float] = {}
+        self._last_bars: dict[tuple[str, str], tuple[dict, dict | None]] = {}
+        self._last_summary: dict[tuple[str, str], dict] = {}
+        self._indicators = IndicatorEngine()
+        self._subscribers = []
+        self._lock = threading.RLock()
+
+    # --- Правила ---
+
+    def subscribe(self, callback):
+        """callback(alert: Alert) — вызывается вне блокировки движка."""
+        self._subscribers.append(callback)
+
+    def add(self, text: str, name: str | None = None, group: str = "", cooldown: float | None = None) -> Rule:
+        rule = parse_rule(text, name, group, self.tick_sizes)
+        if cooldown is not None:
+            rule.cooldown = cooldown
+        with self._lock:
+            if rule.id not in self.rules:
+                self.rules[rule.id] = rule
+                self._compile()
+            return self.rules[rule.id]
+
+    def remove(self, rule_id: str):
+        with self._lock:
+            if self.rules.pop(rule_id, None):
+                self._compile()
+
+    def set_group(self, group: str, specs: list[tuple[str, str | None]]) -> list[Rule]:
+        """Заменяет правила группы списком (текст, имя); неизменившиеся сохраняют состояние и cooldown."""
+        parsed = [parse_rule(text, name, group, self.tick_sizes) for text, name in specs]
+        with self._lock:
+            keep = {rule.id for rule in parsed}
+            for rule_id in [r.id for r in self.rules.values() if r.group == group and r.id not in keep]:
+                del self.rules[rule_id]
+            for rule in parsed:
+                self.rules.setdefault(rule.id, rule)
+            self._compile()
+            return [self.rules[rule.id] for rule in parsed]
+
+    def load_file(self, path: Path = RULES_FILE, group: str = "file") -> list[Rule]:
+        """Правила из текстового файла: одно на строку, `#` — комментарий."""
+        if not Path(path).exists():
+            return []
+        lines = [line.split("#", 1)[0].strip() for line in Path(path).read_text(encoding="utf-8").splitlines()]
+        return self.set_group(group, [(line, None) for line in lines if line])
+
+    def _compile(self):
+        """Перестраивает общие узлы и индексы уровней. Состояние правил (value, cooldown) сохраняется."""
+        rules_by_key: dict[tuple, list[str]] = {}
+        for rule in self.rules.values():
+            for key in rule.conditions:
+                rules_by_key.setdefault(key, []).append(rule.id)
+        books: dict[str, _Book] = {}
+        crosses, withins = {}, {}
+        self._time_keys = []
+        for key in rules_by_key:
+            kind = key[0]
+            if kind == "time":
+                self._time_keys.append(key)
+                continue
+            book = books.setdefault(key[1], _Book())
+            if kind == "cross":
+                crosses.setdefault(key[1], []).append(key)
+            elif kind == "within":
+                withins.setdefault(key[1], []).append(key)
+            elif kind == "price":
+                book.price_keys.append(key)
+            else:
+                book.bar_keys.setdefault(key[2], []).append(key)
+        for instrument, keys in crosses.items():
+            keys.sort(key=lambda k: k[2])
+            book = books[instrument]
+            book.cross_keys = keys
+            book.cross_levels = np.array([k[2] for k in keys])
+            book.cross_dirs = np.array([k[3] for k in keys], dtype=np.int8)
+        for instrument, keys in withins.items():
+            book = books[instrument]
+            book.within_keys = keys
+            book.within_levels = np.array([k[2] for k in keys])
+            book.within_widths = np.array([k[3] for k in keys])
+            book.within_state = np.array([self._values.get(k, False) for k in keys], dtype=bool)
+        self._values = {key: self._values.get(key, False) for key in rules_by_key}
+        self._rules_by_key = rules_by_key
+        self._books = books
+
+    # --- События ---
+
+    def on_price(self, instrument: str, price: float, t: float | None = None) -> list[Alert]:
+        """Новая цена (тик или обновление незакрытого бара)."""
+        instrument = symbol_of(instrument)
+        t = time.time() if t is None else t
+        with self._lock:
+            changed, pulses = self._price_step(instrument, float(price))
+            alerts = self._evaluate(instrument, changed, pulses, float(price), t)
+        self._dispatch(alerts)
+        return alerts
+
+    def on_bar(self, instrument: str, timeframe: str, bar: dict, t: float | None = None) -> list[Alert]:
+        """
+        Закрытый бар таймфрейма: свечные модели и индикаторы. Цену бар не двигает —
+        закрытие старшего таймфрейма приходит после обновления младшего новой ценой.
+        """
+        instrument = symbol_of(instrument)
+        t = time.time() if t is None else t
+        with self._lock:
+            changed, pulses = self._bar_step(instrument, timeframe, bar)
+            price = self._last_price.get(instrument, float(bar["c"]))
+            alerts = self._evaluate(instrument, changed, pulses, price, t)
+        self._dispatch(alerts)
+        return alerts
+
+    def _set(self, key: tuple, value: bool, changed: set):
+        if self._values.get(key) != value:
+            self._values[key] = value
+            changed.add(key)
+
+    def _price_step(self, instrument: str, price: float) -> tuple[set, list]:
+        changed, pulses = set(), []
+        previous = self._last_price.get(instrument)
+        self._last_price[instrument] = price
+        book = self._books.get(instrument)
+        if book is None:
+            return changed, pulses
+
+        if previous is not None and price != previous and len(book.cross_levels):
+            # Пересечённые уровни: (previous, price] при росте, [price, previous) при падении
+            if price > previous:
+                lo = np.searchsorted(book.cross_levels, previous, side="right")
+                hi = np.searchsorted(book.cross_levels, price, side="right")
+                wanted = 1
+            else:
+                lo = np.searchsorted(book.cross_levels, price, side="left")
+                hi = np.searchsorted(book.cross_levels, previous, side="left")
+                wanted = -1
+            for i in range(lo, hi):
+                if book.cross_dirs[i] in (0, wanted):
+                    pulses.append(book.cross_keys[i])
+
+        if len(book.within_levels):
+            state = np.abs(book.within_levels - price) <= book.within_widths + 1e-9
+            for i in np.flatnonzero(state != book.within_state):
+                self._set(book.within_keys[i], bool(state[i]), changed)
+            book.within_state = state
+
+        for key in book.price_keys:
+            self._set(key, bool(_OPS[key[2]](price, key[3])), changed)
+        return changed, pulses
+
+    def _bar_step(self, instrument: str, timeframe: str, bar: dict) -> tuple[set, list]:
+        changed, pulses = set(), []
+        series = (instrument, timeframe)
+        previous_bar = self._last_bars.get(series, (None, None))[0]
+        self._last_bars[series] = (bar, previous_bar)
+        self._indicators.update(instrument, timeframe, int(bar["t"]), bar["o"], bar["h"], bar["l"], bar["c"],
+                                bar.get("v") or 0.0)
+        summary = self._indicators.summary(instrument, timeframe)
+        before = self._last_summary.get(series, {})
+        self._last_summary[series] = summary
+
+        book = self._books.get(instrument)
+        for key in (book.bar_keys.get(timeframe, []) if book else []):
+            kind = key[0]
+            if kind == "candle":
+                self._set(key, candle_matches(key[3], bar, previous_bar), changed)
+            elif kind == "ind":
+                left, right = summary.get(key[3]), _resolve(key[5], summary)
+                self._set(key, left is not None and right is not None and bool(_OPS[key[4]](left, right)), changed)
+            elif kind == "ind_cross":
+                left_now, right_now = summary.get(key[3]), _resolve(key[5], summary)
+                left_before, right_before = before.get(key[3]), _resolve(key[5], before)
+                if None in (left_now, right_now, left_before, right_before):
+                    continue
+                up = left_before <= right_before and left_now > right_now
+                down = left_before >= right_before and left_now < right_now
+                if (key[4] >= 0 and up) or (key[4] <= 0 and down):
+                    pulses.append(key)
+        return changed, pulses
+
+    def _evaluate(self, instrument: str, changed: set, pulses: list, price: float, t: float) -> list[Alert]:
+        minute = int(t // 60 % 1440)
+        for key in self._time_keys:
+            start, end = key[1], key[2]
+            inside = start <= minute < end if start <= end else (minute >= start or minute < end)
+            self._set(key, inside, changed)
+
+        for key in pulses:
+            self._values[key] = True
+        candidates = {rule_id for key in (*changed, *pulses) for rule_id in self._rules_by_key.get(key, ())}
+        alerts = []
+        for rule_id in candidates:
+            rule = self.rules[rule_id]
+            value = all(self._values.get(key, False) for key in rule.conditions)
+            if value and not rule.value and (rule.last_fired is None or t - rule.last_fired >= rule.cooldown):
+                rule.last_fired = t
+                rule.fired += 1
+                alerts.append(Alert(rule.id, rule.name, rule.instrument, rule.text,
+                                    price if rule.instrument == instrument else self._last_price.get(rule.instrument), t))
+            rule.value = value
+        # Пересечения — импульсы: истинны только в момент события
+        for key in pulses:
+            self._values[key] = False
+            for rule_id in self._rules_by_key.get(key, ()):
+                self.rules[rule_id].value = False
+        return alerts
+
+    def _dispatch(self, alerts: list[Alert]):
+        for alert in alerts:
+            for callback in self._subscribers:
+                callback(alert)
+
+    def attach(self, aggregator, instrument: str):
+        """Подписывает движок на BarAggregator: закрытые бары и обновления незакрытых."""
+        aggregator.subscribe(
+            on_close=lambda tf, bar: self.on_bar(instrument, tf, bar),
+            on_update=lambda tf, bar: bar and self.on_price(instrument, bar["c"]),
+        )
+
+
+def _resolve(operand, summary: dict):
+    return operand if isinstance(operand, float) else summary.get(operand)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> AlertEngine:
+    """Общий движок процесса с правилами из memory/alert_rules.txt."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AlertEngine()
+            _engine.load_file()
+    return _engine
+
+
+def benchmark(n_rules: int = 5000, n_prices: int = 100_000):
+    rng = np.random.default_rng(11)
+    engine = AlertEngine()
+    fired = []
+    engine.subscribe(fired.append)
+    instruments = ("MGC", "ES", "NQ", "CL")
+    started = time.perf_counter()
+    specs = []
+    for i in range(n_rules):
+        level = round(2300 + rng.uniform(0, 100), 1)
+        if i % 2:
+            specs.append((f"MGC price within {int(rng.integers(5, 30))} ticks of {level} cooldown 2m", None))
+        else:
+            specs.append((f"{instruments[i % 4]} price crosses {'above' if i % 4 else 'below'} {level}", None))
+    engine.set_group("bench", specs)
+    compile_time = time.perf_counter() - started
+    keys = len(engine._values)
+
+    prices = 2350 + np.cumsum(rng.normal(0, 0.3, n_prices))
+    t0 = 1_700_000_000.0
+    started = time.perf_counter()
+    for i, price in enumerate(prices.tolist()):
+        engine.on_price("MGC", price, t0 + i)
+    elapsed = time.perf_counter() - started
+    print(f"{len(engine.rules)} rules -> {keys} shared nodes, compiled in {compile_time * 1000:.0f} ms")
+    print(f"{n_prices} prices in {elapsed:.2f} s ({elapsed / n_prices * 1e6:.1f} µs/price), alerts {len(fired)}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        benchmark()
+    else:
+        for line in sys.argv[1:]:
+            print(parse_rule(line))
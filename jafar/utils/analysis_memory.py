@@ -0,0 +1,321 @@
+"""Память анализов и торговых планов в SQLite с JSON-метаданными."""
+
+import hashlib
+import json
+import re
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+import yaml
+
+from jafar.config.constants import JAFAR_ANALYSIS_DB, JAFAR_MEMORY_DIR
+
+DB_PATH = JAFAR_ANALYSIS_DB
+
+KIND_ATRADE = "atrade"
+KIND_SENTIMENT = "sentiment"
+
+# Имена markdown-логов, которые писали старые версии хендлеров
+LEGACY_LOG_FILES = {
+    "atrade_analysis_log.md": KIND_ATRADE,
+    "market_sentiment_log.md": KIND_SENTIMENT,
+}
+
+_schema_ready = False
+
+# Подписчики на новые записи (например, индекс похожих сетапов)
+_save_listeners = []
+
+
+def _connect() -> sqlite3.Connection:
+    """Подключается к базе и при первом вызове создаёт схему."""
+    global _schema_ready
+    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=10)
+    conn.row_factory = sqlite3.Row
+    if not _schema_ready:
+        _init_schema(conn)
+        _schema_ready = True
+    return conn
+
+
+def _init_schema(conn: sqlite3.Connection):
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS analysis (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            instrument TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            metadata TEXT NOT NULL DEFAULT '{}' CHECK (json_valid(metadata)),
+            body TEXT,
+            fingerprint TEXT UNIQUE
+        );
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_analysis_instrument_kind_ts
+        ON analysis (instrument, kind, created_at);
+    """)
+    conn.commit()
+
+
+def _fingerprint(instrument: str, kind: str, created_at: str, body: str | None) -> str:
+    raw = f"{instrument}|{kind}|{created_at}|{body or ''}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _row_to_dict(row: sqlite3.Row) -> dict:
+    return {
+        "id": row["id"],
+        "instrument": row["instrument"],
+        "kind": row["kind"],
+        "created_at": row["created_at"],
+        "metadata": json.loads(row["metadata"]),
+        "body": row["body"],
+    }
+
+
+def add_save_listener(callback):
+    """Регистрирует callback(entry: dict), вызываемый после сохранения новой записи."""
+    if callback not in _save_listeners:
+        _save_listeners.append(callback)
+
+
+def save_analysis(instrument: str, kind: str, metadata: dict, body: str | None = None,
+                  created_at: datetime | str | None = None) -> int | None:
+    """
+    Сохраняет запись анализа. Возвращает id новой записи или None,
+    если такая запись уже есть (повторная миграция того же лога).
+    """
+    if isinstance(created_at, datetime):
+        created_at = created_at.strftime("%Y-%m-%d %H:%M:%S")
+    created_at = created_at or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    instrument = instrument.upper()
+
+    conn = _connect()
+    try:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO analysis(instrument, kind, created_at, metadata, body, fingerprint) "
+            "VALUES (?,?,?,?,?,?)",
+            (
+                instrument, kind, created_at,
+                json.dumps(metadata or {}, ensure_ascii=False, default=str),
+                body,
+                _fingerprint(instrument, kind, created_at, body),
+            ),
+        )
+        conn.commit()
+        new_id = cur.lastrowid if cur.rowcount else None
+    finally:
+        conn.close()
+
+    if new_id:
+        entry = {"id": new_id, "instrument": instrument, "kind": kind, "created_at": created_at,
+                 "metadata": metadata or {}, "body": body}
+        for callback in list(_save_listeners):
+            callback(entry)
+    return new_id
+
+
+def save_trade_plan(instrument: str, trade_data: dict, body: str | None = None,
+                    extra_metadata: dict | None = None) -> int | None:
+    """Сохраняет торговый план (trade_data от Gemini) как запись анализа."""
+    trade_data = trade_data or {}
+    take_profits = trade_data.get("take_profits") or {}
+    metadata = {
+        "instrument": instrument.upper(),
+        "plan": {
+            "action": trade_data.get("action"),
+            "forecast_strength": trade_data.get("forecast_strength"),
+            "entry": trade_data.get("entry_price", trade_data.get("primary_entry")),
+            "stop_loss": trade_data.get("stop_loss"),
+            "tp1": take_profits.get("tp1"),
+        },
+        **(extra_metadata or {}),
+    }
+    return save_analysis(instrument, KIND_ATRADE, metadata, body)
+
+
+def update_metadata(analysis_id: int, patch: dict):
+    """Дописывает поля в JSON-метаданные записи (например, фактический исход сделки)."""
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE analysis SET metadata = json_patch(metadata, ?) WHERE id = ?",
+            (json.dumps(patch, ensure_ascii=False, default=str), analysis_id),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def load_by_ids(ids: list[int]) -> dict[int, dict]:
+    """Загружает записи по списку id."""
+    if not ids:
+        return {}
+    conn = _connect()
+    try:
+        placeholders = ",".join("?" * len(ids))
+        rows = conn.execute(f"SELECT * FROM analysis WHERE id IN ({placeholders})", list(ids)).fetchall()
+    finally:
+        conn.close()
+    return {row["id"]: _row_to_dict(row) for row in rows}
+
+
+def load_recent(instrument: str, kind: str = KIND_ATRADE, limit: int = 3) -> list[dict]:
+    """
+    Возвращает последние `limit` записей по инструменту (от старых к новым).
+    Запрос идёт по индексу, поэтому стоимость не растёт вместе с историей.
+    """
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            "SELECT * FROM analysis WHERE instrument = ? AND kind = ? "
+            "ORDER BY created_at DESC, id DESC LIMIT ?",
+            (instrument.upper(), kind, limit),
+        ).fetchall()
+    finally:
+        conn.close()
+    return [_row_to_dict(row) for row in reversed(rows)]
+
+
+def iter_analyses(instrument: str | None = None, kind: str | None = None):
+    """Итерирует все записи (по возрастанию времени), опционально с фильтрами."""
+    query = "SELECT * FROM analysis"
+    conditions, params = [], []
+    if instrument:
+        conditions.append("instrument = ?")
+        params.append(instrument.upper())
+    if kind:
+        conditions.append("kind = ?")
+        params.append(kind)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY created_at, id"
+
+    conn = _connect()
+    try:
+        for row in conn.execute(query, params):
+            yield _row_to_dict(row)
+    finally:
+        conn.close()
+
+
+# --- Миграция старых markdown-логов ---
+
+def _try_front_matter(lines: list[str]) -> dict | None:
+    """Пробует распарсить блок как YAML front matter записи лога."""
+    try:
+        data = yaml.safe_load("\n".join(lines))
+    except yaml.YAMLError:
+        return None
+    if isinstance(data, dict) and "date" in data:
+        return data
+    return None
+
+
+def _parse_front_matter_log(text: str) -> list[tuple[dict, str]]:
+    """
+    Разбирает лог формата `---\\n<yaml>---\\n<markdown>`.
+    Разделители `---` внутри текста анализа не ломают разбор: новая запись
+    начинается только там, где между двумя `---` лежит валидный front matter.
+    """
+    lines = text.splitlines()
+    markers = [i for i, line in enumerate(lines) if line.strip() == "---"]
+    starts = []
+    for a, b in zip(markers, markers[1:]):
+        if starts and a <= starts[-1][1]:
+            continue
+        meta = _try_front_matter(lines[a + 1:b])
+        if meta is not None:
+            starts.append((a, b, meta))
+
+    entries = []
+    for idx, (_, meta_end, meta) in enumerate(starts):
+        body_end = starts[idx + 1][0] if idx + 1 < len(starts) else len(lines)
+        body = "\n".join(lines[meta_end + 1:body_end]).strip()
+        entries.append((meta, body))
+    return entries
+
+
+_LEGACY_ATRADE_ENTRY = re.compile(
+    r"\*\*Дата:\*\*\s*(?P<date>.+?)\n"
+    r"\*\*Инструмент:\*\*\s*(?P<instrument>.+?)\n"
+    r"\*\*План A:\*\*\s*(?P<action>\S+) @ (?P<entry>\S+) \(SL: (?P<sl>[^,]+), TP1: (?P<tp1>[^)]+)\)\n"
+    r"\*\*Ключевой вывод:\*\*\s*(?P<summary>.*?)\n---",
+    re.DOTALL,
+)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_legacy_atrade_log(text: str) -> list[tuple[dict, str]]:
+    """Разбирает старый формат atrade_handlers (`**Дата:** ... **План A:** ...`)."""
+    entries = []
+    for match in _LEGACY_ATRADE_ENTRY.finditer(text):
+        meta = {
+            "date": match["date"].strip(),
+            "instrument": match["instrument"].strip().upper(),
+            "plan": {
+                "action": match["action"],
+                "entry": _to_float(match["entry"]),
+                "stop_loss": _to_float(match["sl"]),
+                "tp1": _to_float(match["tp1"]),
+            },
+        }
+        entries.append((meta, match["summary"].strip()))
+    return entries
+
+
+def migrate_markdown_log(log_file: Path, kind: str, instrument: str | None = None) -> int:
+    """Переносит один markdown-лог в базу. Возвращает число новых записей."""
+    text = Path(log_file).read_text(encoding="utf-8")
+    entries = _parse_front_matter_log(text) or _parse_legacy_atrade_log(text)
+    migrated = 0
+    for meta, body in entries:
+        entry_instrument = str(meta.get("instrument") or instrument or "UNKNOWN")
+        if save_analysis(entry_instrument, kind, meta, body, created_at=str(meta["date"])):
+            migrated += 1
+    return migrated
+
+
+def migrate_markdown_logs(base_dir: Path = JAFAR_MEMORY_DIR) -> dict:
+    """
+    Ищет старые markdown-логи в `base_dir` (включая папки по инструментам)
+    и переносит их в базу. Повторный запуск безопасен.
+    """
+    base_dir = Path(base_dir)
+    report = {}
+    for file_name, kind in LEGACY_LOG_FILES.items():
+        for log_file in sorted(base_dir.rglob(file_name)):
+            instrument = log_file.parent.name if log_file.parent != base_dir else None
+            report[str(log_file)] = migrate_markdown_log(log_file, kind, instrument)
+    return report
+
+
+# --- Экспорт для человека ---
+
+def format_markdown_entry(entry: dict) -> str:
+    """Форматирует запись так же, как её писали старые markdown-логи."""
+    metadata = dict(entry["metadata"])
+    metadata.setdefault("date", entry["created_at"])
+    metadata.setdefault("instrument", entry["instrument"])
+    front_matter = yaml.dump(metadata, default_flow_style=False, allow_unicode=True)
+    return f"---\n{front_matter}---\n\n{entry.get('body') or ''}\n"
+
+
+def export_markdown(instrument: str | None = None, kind: str | None = None,
+                    output_path: Path | None = None) -> str:
+    """Выгружает записи в markdown. Если задан `output_path`, пишет в файл."""
+    content = "".join(format_markdown_entry(e) for e in iter_analyses(instrument, kind))
+    if output_path:
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        output_path.write_text(content, encoding="utf-8")
+    return content
@@ -1,4 +1,3 @@
-import google.generativeai as genai
 from jafar.config.settings import GEMINI_API_KEY
 import json
 import re
@@ -7,8 +6,22 @@ from rich.markdown import Markdown
 from rich.panel import Panel
 
 console = Console()
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel('gemini-pro')
+_model = None
+
+
+def get_model():
+    """
+    Настраивает Gemini и создаёт модель при первом запросе, а не при импорте:
+    импорт google.generativeai заметно удлиняет запуск CLI.
+    """
+    global _model
+    if _model is None:
+        import google.generativeai as genai
+
+        genai.configure(api_key=GEMINI_API_KEY)
+        _model = genai.GenerativeModel('gemini-pro')
+    return _model
+
 
 def ask_assistant(prompt: str, response_type: str = "text") -> dict:
     """
@@ -24,10 +37,13 @@ def ask_assistant(prompt: str, response_type: str = "text") -> dict:
 
     try:
         console.print("[blue]📨 I send a request to Gemini...[/blue]")
-        response = model.generate_content(prompt)
+        from jafar.utils import cassette
+
+        raw_text = cassette.call("gemini", "models/gemini-pro:generateContent", {"kind": "text"},
+                                 lambda: get_model().generate_content(prompt).text)
         console.print("[yellow]⏳ ...[/yellow]")
-        
-        raw_text = response.text.strip()
+
+        raw_text = raw_text.strip()
         result = robust_parse_response(raw_text)
 
         # Унифицируем формат
@@ -45,9 +61,6 @@ def ask_assistant(prompt: str, response_type: str = "text") -> dict:
             "note": f"Ошибка: {e}",
         }
 
-import json
-import re
-
 def robust_parse_response(raw):
     # 1. Попробуй как json (прямой ответ)
     try:
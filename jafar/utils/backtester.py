@@ -0,0 +1,309 @@
+"""Проверка сохранённых торговых планов на истории минутных баров.
+
+    python -m jafar.utils.backtester bench
+"""
+
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+import numpy as np
+
+from jafar.utils import analysis_memory, bar_history
+
+FILL_WINDOW_MINUTES = 240
+HORIZON_MINUTES = 24 * 60
+CHUNK_SIZE = 1024  # планов за проход: матрица CHUNK_SIZE × горизонт в памяти
+
+NO_FILL, TP, SL, TIMEOUT = 0, 1, 2, 3
+OUTCOME_NAMES = {NO_FILL: "NO_FILL", TP: "TP1", SL: "SL", TIMEOUT: "TIMEOUT"}
+
+# atrade пишет в память имя из запроса (GOLD), btrade/ctrade — символ контракта (MGC)
+INSTRUMENT_ALIASES = {
+    "GOLD": "MGC", "OLTIN": "MGC", "ZOLOTO": "MGC",
+    "OIL": "CL", "NEFT": "CL",
+    "S&P": "ES", "SIPI": "ES",
+    "NASDAQ": "NQ",
+    "BITCOIN": "BTC", "BITKOIN": "BTC",
+    "ETHEREUM": "ETH", "EFIR": "ETH",
+    "EVRO": "EURUSD", "FRANK": "USDCHF", "POUND": "GBPUSD",
+}
+
+_LONG_ACTIONS = ("BUY", "LONG")
+_SHORT_ACTIONS = ("SELL", "SHORT")
+
+
+def _to_float(value):
+    try:
+        return float(str(value).replace(",", ""))
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class Plans:
+    ids: np.ndarray
+    instrument: np.ndarray
+    session: np.ndarray
+    strength: np.ndarray
+    t0: np.ndarray        # время анализа, секунды UTC
+    side: np.ndarray      # +1 long, -1 short
+    entry: np.ndarray     # NaN — вход по рынку
+    stop_loss: np.ndarray
+    take_profit: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def subset(self, mask) -> "Plans":
+        return Plans(*(getattr(self, name)[mask] for name in self.__dataclass_fields__))
+
+
+def normalize_instrument(name: str) -> str:
+    """Имя инструмента из памяти анализов → символ контракта ('gold' → 'MGC')."""
+    name = str(name or "").upper()
+    return INSTRUMENT_ALIASES.get(name, name)
+
+
+def _session_label(metadata: dict, created: datetime) -> str:
+    from jafar.utils.setup_index import SESSION_KEYS, session_flags
+
+    sessions = (metadata.get("features") or {}).get("sessions")
+    if sessions is None:
+        flags = session_flags(None, created.astimezone(timezone.utc).hour)
+        sessions = [key for key in SESSION_KEYS if flags[key]]
+    return "+".join(sessions) or "off_hours"
+
+
+def load_plans(instrument: str | None = None) -> Plans:
+    """Планы с направлением, стопом и целью из памяти анализов (записи без них пропускаются)."""
+    instrument = normalize_instrument(instrument) if instrument else None
+    rows = []
+    for entry in analysis_memory.iter_analyses(None, analysis_memory.KIND_ATRADE):
+        symbol = normalize_instrument(entry["instrument"])
+        if instrument and symbol != instrument:
+            continue
+        plan = entry["metadata"].get("plan") or {}
+        action = str(plan.get("action") or "").upper()
+        side = 1 if action in _LONG_ACTIONS else -1 if action in _SHORT_ACTIONS else 0
+        stop_loss, take_profit = _to_float(plan.get("stop_loss")), _to_float(plan.get("tp1"))
+        if not side or stop_loss is None or take_profit is None:
+            continue
+        entry_price = _to_float(plan.get("entry"))
+        # created_at пишется локальным временем (datetime.now())
+        created = datetime.strptime(entry["created_at"][:19], "%Y-%m-%d %H:%M:%S").astimezone()
+        rows.append((
+            entry["id"], symbol, _session_label(entry["metadata"], created),
+            str(plan.get("forecast_strength") or "N/A"), int(created.timestamp()), side,
+            np.nan if entry_price is None else entry_price, stop_loss, take_profit,
+        ))
+    rows_t = list(zip(*rows)) if rows else [[] for _ in range(9)]
+    return Plans(
+        np.array(rows_t[0], dtype=np.int64), np.array(rows_t[1], dtype=object), np.array(rows_t[2], dtype=object),
+        np.array(rows_t[3], dtype=object), np.array(rows_t[4], dtype=np.int64), np.array(rows_t[5], dtype=np.int8),
+        *(np.array(rows_t[i], dtype=float) for i in (6, 7, 8)),
+    )
+
+
+def _first_true(mask: np.ndarray) -> np.ndarray:
+    """Индекс первого True в каждой строке; ширина матрицы, если True нет."""
+    return np.where(mask.any(axis=1), mask.argmax(axis=1), mask.shape[1])
+
+
+def _empty_results(n: int) -> dict[str, np.ndarray]:
+    result = {"outcome": np.full(n, NO_FILL, dtype=np.int8)}
+    for key in ("r_multiple", "mfe_r", "mae_r", "fill_price", "minutes_to_fill", "minutes_in_trade"):
+        result[key] = np.full(n, np.nan)
+    return result
+
+
+def simulate(plans: Plans, bars: bar_history.Bars, fill_window_minutes: int = FILL_WINDOW_MINUTES,
+             horizon_minutes: int = HORIZON_MINUTES) -> dict[str, np.ndarray]:
+    """
+    Проигрывает планы одного инструмента на его барах. Возвращает массивы
+    длины len(plans): outcome, r_multiple, mfe_r, mae_r, fill_price,
+    minutes_to_fill, minutes_in_trade.
+    """
+    n = len(plans)
+    result = _empty_results(n)
+    if not n or not len(bars):
+        return result
+
+    # Бары минутные, но с разрывами (выходные, клиринг): окно ограничивается и по индексу, и по времени
+    width = horizon_minutes
+    for lo in range(0, n, CHUNK_SIZE):
+        chunk = slice(lo, min(n, lo + CHUNK_SIZE))
+        t0 = plans.t0[chunk]
+        side = plans.side[chunk].astype(float)[:, None]
+        start = np.searchsorted(bars.t, t0)
+        idx = start[:, None] + np.arange(width)[None, :]
+        in_range = idx < len(bars)
+        idx = np.minimum(idx, len(bars) - 1)
+        t = bars.t[idx]
+        valid = in_range & (t < (t0 + horizon_minutes * 60)[:, None])
+        high, low = bars.h[idx], bars.l[idx]
+
+        # --- Вход ---
+        entry = plans.entry[chunk].copy()
+        market = np.isnan(entry)
+        entry[market] = bars.o[idx[market, 0]]
+        entry_col = entry[:, None]
+        touches = np.where(side > 0, low <= entry_col, high >= entry_col)
+        touches[market, 0] = True
+        fill_mask = valid & touches & (t < (t0 + fill_window_minutes * 60)[:, None])
+        fill_col = _first_true(fill_mask)
+        filled = fill_col < width
+
+        # --- Выход ---
+        stop = plans.stop_loss[chunk][:, None]
+        target = plans.take_profit[chunk][:, None]
+        risk = np.abs(entry - plans.stop_loss[chunk])
+        # Стоп должен быть по другую сторону от входа, чем цель
+        sane = (risk > 0) & (side[:, 0] * (plans.take_profit[chunk] - entry) > 0) & \
+               (side[:, 0] * (entry - plans.stop_loss[chunk]) > 0)
+        filled &= sane
+        cols = np.arange(width)[None, :]
+        after = valid & (cols >= fill_col[:, None]) & filled[:, None]
+        sl_col = _first_true(after & np.where(side > 0, low <= stop, high >= stop))
+        tp_col = _first_true(after & np.where(side > 0, high >= target, low <= target))
+        last_col = np.where(valid.any(axis=1), width - 1 - valid[:, ::-1].argmax(axis=1), 0)
+
+        outcome = np.where(sl_col <= tp_col, SL, TP)
+        outcome = np.where((sl_col == width) & (tp_col == width), TIMEOUT, outcome)
+        outcome = np.where(filled, outcome, NO_FILL)
+        exit_col = np.select([outcome == SL, outcome == TP], [sl_col, tp_col], last_col)
+        exit_col = np.minimum(exit_col, width - 1)
+
+        rows = np.arange(len(t0))
+        exit_close = bars.c[idx[rows, exit_col]]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r_multiple = np.select(
+                [outcome == SL, outcome == TP],
+                [-1.0, np.abs(plans.take_profit[chunk] - entry) / risk],
+                side[:, 0] * (exit_close - entry) / risk,
+            )
+            in_trade = after & (cols <= exit_col[:, None])
+            favorable = np.where(side > 0, high - entry_col, entry_col - low)
+            adverse = np.where(side > 0, entry_col - low, high - entry_col)
+            mfe = np.max(np.where(in_trade, favorable, -np.inf), axis=1) / risk
+            mae = np.max(np.where(in_trade, adverse, -np.inf), axis=1) / risk
+
+        fill_t = t[rows, np.minimum(fill_col, width - 1)]
+        result["outcome"][chunk] = outcome
+        result["r_multiple"][chunk] = np.where(filled, r_multiple, np.nan)
+        result["mfe_r"][chunk] = np.where(filled, np.maximum(mfe, 0.0), np.nan)
+        result["mae_r"][chunk] = np.where(filled, np.minimum(np.maximum(mae, 0.0), 1.0), np.nan)
+        result["fill_price"][chunk] = np.where(filled, entry, np.nan)
+        result["minutes_to_fill"][chunk] = np.where(filled, (fill_t - t0) / 60, np.nan)
+        result["minutes_in_trade"][chunk] = np.where(filled, (t[rows, exit_col] - fill_t) / 60, np.nan)
+    return result
+
+
+def run_backtest(instrument: str | None = None, plans: Plans | None = None, **options) -> tuple[Plans, dict]:
+    """
+    Все планы (или по инструменту) против локальной истории баров их инструментов.
+    has_bars — история покрывает план целиком: от времени анализа до конца горизонта.
+    """
+    horizon_seconds = options.get("horizon_minutes", HORIZON_MINUTES) * 60
+    plans = plans if plans is not None else load_plans(instrument)
+    merged = _empty_results(len(plans))
+    merged["has_bars"] = np.zeros(len(plans), dtype=bool)
+    for symbol in np.unique(plans.instrument) if len(plans) else []:
+        mask = plans.instrument == symbol
+        subset = plans.subset(mask)
+        bars = bar_history.load_bars(symbol, datetime.fromtimestamp(int(subset.t0.min()), tz=timezone.utc))
+        if not len(bars):
+            continue
+        covered = (bars.t[0] <= subset.t0) & (subset.t0 + horizon_seconds <= bars.t[-1])
+        if not covered.any():
+            continue
+        rows = np.flatnonzero(mask)[covered]
+        merged["has_bars"][rows] = True
+        for key, values in simulate(subset.subset(covered), bars, **options).items():
+            merged[key][rows] = values
+    return plans, merged
+
+
+def summarize(plans: Plans, results: dict, by: str = "instrument") -> list[dict]:
+    """
+    Статистика по группам (instrument | session | strength): число планов,
+    доля входов, win rate, матожидание в R, средние MFE/MAE, медианное время до TP/SL.
+    """
+    tested = results["has_bars"]
+    keys = getattr(plans, by)[tested]
+    rows = []
+    for key in sorted(set(keys)):
+        mask = keys == key
+        outcome = results["outcome"][tested][mask]
+        filled = outcome != NO_FILL
+        r_multiple = results["r_multiple"][tested][mask][filled]
+        minutes = results["minutes_in_trade"][tested][mask]
+        wins, losses = int((outcome == TP).sum()), int((outcome == SL).sum())
+        rows.append({
+            by: key,
+            "plans": int(mask.sum()),
+            "filled": int(filled.sum()),
+            "fill_rate": float(filled.mean()),
+            "tp": wins,
+            "sl": losses,
+            "timeout": int((outcome == TIMEOUT).sum()),
+            "win_rate": wins / (wins + losses) if wins + losses else float("nan"),
+            "expectancy_r": float(r_multiple.mean()) if len(r_multiple) else float("nan"),
+            "avg_mfe_r": float(np.nanmean(results["mfe_r"][tested][mask][filled])) if filled.any() else float("nan"),
+            "avg_mae_r": float(np.nanmean(results["mae_r"][tested][mask][filled])) if filled.any() else float("nan"),
+            "median_min_to_tp": float(np.median(minutes[outcome == TP])) if wins else float("nan"),
+            "median_min_to_sl": float(np.median(minutes[outcome == SL])) if losses else float("nan"),
+        })
+    return rows
+
+
+def record_outcomes(plans: Plans, results: dict, overwrite: bool = False) -> int:
+    """Пишет исходы в память анализов (setup_index.record_outcome), чтобы похожие сетапы показывали результат."""
+    from jafar.utils.setup_index import record_outcome
+
+    existing = analysis_memory.load_by_ids([int(i) for i in plans.ids[results["has_bars"]]])
+    recorded = 0
+    for i in np.flatnonzero(results["has_bars"]):
+        analysis_id = int(plans.ids[i])
+        outcome = (existing.get(analysis_id) or {}).get("metadata", {}).get("outcome") or {}
+        # Исход, внесённый вручную, бэктест не перезаписывает
+        if outcome and outcome.get("notes") != "backtest" and not overwrite:
+            continue
+        r_multiple = results["r_multiple"][i]
+        record_outcome(analysis_id, OUTCOME_NAMES[int(results["outcome"][i])],
+                       None if np.isnan(r_multiple) else round(float(r_multiple), 2), notes="backtest")
+        recorded += 1
+    return recorded
+
+
+def benchmark(years: int = 3, n_plans: int = 5000):
+    rng = np.random.default_rng(11)
+    n_bars = years * 252 * 23 * 60
+    t = 1_600_000_000 + np.arange(n_bars, dtype=np.int64) * 60
+    close = 2000 + np.cumsum(rng.normal(0, 0.3, n_bars))
+    spread = np.abs(rng.normal(0, 0.2, n_bars))
+    bars = bar_history.Bars(t, close, close + spread, close - spread, close, np.ones(n_bars))
+    t0 = rng.choice(t[:-HORIZON_MINUTES], n_plans)
+    side = rng.choice(np.array([1, -1], dtype=np.int8), n_plans)
+    entry = bars.c[np.searchsorted(t, t0)] - side * rng.uniform(0, 2, n_plans)
+    plans = Plans(np.arange(n_plans), np.full(n_plans, "SYN", dtype=object), np.full(n_plans, "n/a", dtype=object),
+                  rng.choice(np.array(["A", "B", "C"], dtype=object), n_plans), t0, side, entry,
+                  entry - side * rng.uniform(2, 6, n_plans), entry + side * rng.uniform(3, 12, n_plans))
+    started = time.perf_counter()
+    results = simulate(plans, bars)
+    elapsed = time.perf_counter() - started
+    results["has_bars"] = np.ones(n_plans, dtype=bool)
+    print(f"{n_plans} plans over {n_bars:,} one-minute bars ({years}y): {elapsed:.2f} s")
+    for row in summarize(plans, results, by="strength"):
+        print(f"  {row['strength']}: fill {row['fill_rate']:.0%}, win {row['win_rate']:.0%}, "
+              f"E={row['expectancy_r']:+.2f}R, MFE {row['avg_mfe_r']:.2f}R, MAE {row['avg_mae_r']:.2f}R")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        benchmark()
+    else:
+        tested_plans, tested_results = run_backtest(sys.argv[1] if len(sys.argv) > 1 else None)
+        for summary_row in summarize(tested_plans, tested_results):
+            print(summary_row)
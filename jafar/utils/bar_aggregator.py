@@ -0,0 +1,270 @@
+"""Потоковая сборка баров нескольких таймфреймов из тиков или минутных баров.
+
+    python -m jafar.utils.bar_aggregator bench
+"""
+
+import re
+import sys
+import threading
+import time
+
+import numpy as np
+
+from jafar.utils.indicators import SESSION_START_UTC_HOUR, session_of
+
+DEFAULT_CAPACITY = 2000
+FIELDS = ("t", "o", "h", "l", "c", "v")
+_UNIT_SECONDS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_timeframe(timeframe: str) -> int | None:
+    """'3m' -> 180, '4h' -> 14400; 'session' и '1d' -> None (граница торгового дня)."""
+    if timeframe in ("session", "1d"):
+        return None
+    match = re.fullmatch(r"(\d+)([smhd])", timeframe)
+    if not match:
+        raise ValueError(f"Unknown timeframe '{timeframe}' (examples: 30s, 3m, 15m, 4h, session)")
+    return int(match.group(1)) * _UNIT_SECONDS[match.group(2)]
+
+
+class BarSeries:
+    """Один таймфрейм: кольцевые буферы закрытых баров + текущий незакрытый бар."""
+
+    def __init__(self, timeframe: str, capacity: int = DEFAULT_CAPACITY):
+        self.timeframe = timeframe
+        self.seconds = parse_timeframe(timeframe)
+        self.capacity = capacity
+        self._t = np.zeros(capacity, dtype=np.int64)
+        self._ohlcv = np.zeros((capacity, 5))
+        self._head = 0   # позиция следующей записи
+        self._count = 0
+        # Незакрытый бар = _base (всё, кроме последнего источника) + _source (последний минутный бар)
+        self._bucket = None
+        self._base = None
+        self._source = None
+        self._last_closed = None  # начало последнего закрытого бара
+
+    # --- Границы ---
+
+    def bucket_start(self, t: int) -> int:
+        """Начало бара, которому принадлежит время t (часы и дни выровнены по началу сессии)."""
+        anchor = SESSION_START_UTC_HOUR * 3600
+        if self.seconds is None:
+            return session_of(t) * 86400 + anchor
+        if self.seconds >= 3600:
+            return (t - anchor) // self.seconds * self.seconds + anchor
+        return t // self.seconds * self.seconds
+
+    def bucket_end(self, start: int) -> int:
+        return start + (self.seconds or 86400)
+
+    # --- Обновление ---
+
+    @staticmethod
+    def _merge(bar, o, h, l, c, v):
+        if bar is None:
+            return [o, h, l, c, v]
+        return [bar[0], max(bar[1], h), min(bar[2], l), c, bar[4] + v]
+
+    def _roll(self, t: int):
+        """Закрывает текущий бар, если t относится к следующему. Возвращает закрытый бар или None."""
+        bucket = self.bucket_start(t)
+        # Запоздавшие данные для уже закрытого бара (в т.ч. закрытого по таймеру) игнорируются
+        if self._last_closed is not None and bucket <= self._last_closed:
+            return False
+        if self._bucket is None:
+            self._bucket = bucket
+            return None
+        if bucket == self._bucket:
+            return None
+        closed = self.close()
+        self._bucket = bucket
+        return closed
+
+    def add_tick(self, t: int, price: float, size: float = 0.0):
+        """Тик. Возвращает закрытый им бар (dict), None или False для запоздавшего тика."""
+        closed = self._roll(t)
+        if closed is False:
+            return False
+        self._base = self._merge(self._base, price, price, price, price, size)
+        return closed
+
+    def add_bar(self, t: int, o: float, h: float, l: float, c: float, v: float = 0.0):
+        """
+        Бар-источник (обычно минутный) с временем начала t. Тот же t повторно —
+        обновление незакрытого источника: его прежний вклад заменяется.
+        """
+        if self._source is not None and t == self._source[0]:
+            self._source = (t, o, h, l, c, v)
+            return None
+        closed = self._roll(t)
+        if closed is False or (self._source is not None and t < self._source[0]):
+            return False
+        if self._source is not None:
+            self._base = self._merge(self._base, *self._source[1:])
+        self._source = (t, o, h, l, c, v)
+        return closed
+
+    def close(self) -> dict | None:
+        """Принудительно закрывает текущий бар (например, по таймеру) и пишет его в буфер."""
+        bar = self.partial()
+        if bar is None:
+            return None
+        self._t[self._head] = bar["t"]
+        self._ohlcv[self._head] = (bar["o"], bar["h"], bar["l"], bar["c"], bar["v"])
+        self._head = (self._head + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+        self._last_closed = bar["t"]
+        self._bucket = self._base = self._source = None
+        return bar
+
+    def close_due(self, now: int) -> dict | None:
+        """Закрывает бар, если его время вышло, даже без новых данных."""
+        if self._bucket is not None and now >= self.bucket_end(self._bucket):
+            return self.close()
+        return None
+
+    # --- Чтение ---
+
+    def partial(self) -> dict | None:
+        bar = self._base
+        if self._source is not None:
+            bar = self._merge(bar, *self._source[1:])
+        if bar is None:
+            return None
+        return dict(zip(FIELDS, (self._bucket, *bar)))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def arrays(self, n: int | None = None, include_partial: bool = False) -> dict[str, np.ndarray]:
+        """Последние n закрытых баров (и незакрытый в конце) колонками по возрастанию времени."""
+        n = self._count if n is None else min(n, self._count)
+        index = (self._head - n + np.arange(n)) % self.capacity
+        columns = {"t": self._t[index]}
+        for i, key in enumerate(FIELDS[1:]):
+            columns[key] = self._ohlcv[index, i]
+        if include_partial and (bar := self.partial()):
+            columns = {k: np.append(values, bar[k]) for k, values in columns.items()}
+        return columns
+
+    def last(self) -> dict | None:
+        if not self._count:
+            return None
+        i = (self._head - 1) % self.capacity
+        return dict(zip(FIELDS, (int(self._t[i]), *self._ohlcv[i].tolist())))
+
+    @property
+    def nbytes(self) -> int:
+        return self._t.nbytes + self._ohlcv.nbytes
+
+
+class BarAggregator:
+    """Рассылает тики/бары одного контракта по рядам таймфреймов и вызывает подписчиков."""
+
+    def __init__(self, timeframes=("1m", "5m", "15m"), capacity: int = DEFAULT_CAPACITY):
+        self.series = {tf: BarSeries(tf, capacity) for tf in timeframes}
+        self._on_close = []
+        self._on_update = []
+        self._last_source_t = None
+        self._lock = threading.Lock()
+
+    def add_series(self, timeframe: str, capacity: int = DEFAULT_CAPACITY) -> BarSeries:
+        with self._lock:
+            return self.series.setdefault(timeframe, BarSeries(timeframe, capacity))
+
+    def subscribe(self, on_close=None, on_update=None):
+        """on_close(timeframe, bar) — бар закрыт; on_update(timeframe, partial_bar) — изменился незакрытый."""
+        if on_close:
+            self._on_close.append(on_close)
+        if on_update:
+            self._on_update.append(on_update)
+
+    def _dispatch(self, events: list):
+        for kind, timeframe, bar in events:
+            for callback in self._on_close if kind == "close" else self._on_update:
+                callback(timeframe, bar)
+
+    def _feed(self, method: str, t: int, *args) -> list[tuple]:
+        events = []
+        with self._lock:
+            for tf, series in self.series.items():
+                closed = getattr(series, method)(t, *args)
+                if closed is False:
+                    continue
+                if closed:
+                    events.append(("close", tf, closed))
+                if self._on_update:
+                    events.append(("update", tf, series.partial()))
+        # Колбэки — вне блокировки: подписчик может читать ряды или слать уведомления
+        self._dispatch(events)
+        return events
+
+    def add_tick(self, t: int, price: float, size: float = 0.0) -> list[tuple]:
+        return self._feed("add_tick", int(t), float(price), float(size))
+
+    def add_bar(self, t: int, o: float, h: float, l: float, c: float, v: float = 0.0) -> list[tuple]:
+        self._last_source_t = max(int(t), self._last_source_t or 0)
+        return self._feed("add_bar", int(t), float(o), float(h), float(l), float(c), float(v or 0.0))
+
+    def add_api_bars(self, bars: list[dict]) -> int:
+        """Бары из ответа /History/retrieveBars (в любом порядке). Возвращает число закрытых баров."""
+        parsed = sorted(
+            (int(np.datetime64(b["t"].replace("Z", "").split("+")[0], "s").astype(np.int64)), b) for b in bars
+        )
+        closed = 0
+        for t, b in parsed:
+            events = self.add_bar(t, b["o"], b["h"], b["l"], b["c"], b.get("v") or 0.0)
+            closed += sum(kind == "close" for kind, _, _ in events)
+        return closed
+
+    def close_due(self, now: float | None = None) -> list[tuple]:
+        """Закрывает бары, время которых истекло (вызывать по таймеру, если данных нет)."""
+        now = int(time.time() if now is None else now)
+        events = []
+        with self._lock:
+            for tf, series in self.series.items():
+                if closed := series.close_due(now):
+                    events.append(("close", tf, closed))
+        self._dispatch(events)
+        return events
+
+    def last_time(self) -> int | None:
+        """Время последнего бара-источника (для запроса только новых баров)."""
+        return self._last_source_t
+
+
+def benchmark(minutes: int = 20_000, ticks_per_minute: int = 20):
+    rng = np.random.default_rng(5)
+    t0 = 1_700_000_000 // 86400 * 86400
+    n_ticks = minutes * ticks_per_minute
+    times = t0 + np.sort(rng.integers(0, minutes * 60, n_ticks))
+    prices = (2350 + np.cumsum(rng.normal(0, 0.1, n_ticks))).tolist()
+    sizes = rng.integers(1, 10, n_ticks).astype(float).tolist()
+    times = times.tolist()
+
+    closed = []
+    aggregator = BarAggregator(("1m", "3m", "15m", "4h", "session"), capacity=DEFAULT_CAPACITY)
+    aggregator.subscribe(on_close=lambda tf, bar: closed.append(tf))
+    started = time.perf_counter()
+    for i in range(n_ticks):
+        aggregator.add_tick(times[i], prices[i], sizes[i])
+    elapsed = time.perf_counter() - started
+    print(f"{n_ticks} ticks x {len(aggregator.series)} series in {elapsed:.2f} s "
+          f"({elapsed / n_ticks * 1e6:.1f} µs/tick), closed bars {len(closed)}, "
+          f"memory {sum(s.nbytes for s in aggregator.series.values()) / 1024:.0f} KiB total")
+
+    # Сверка: 15m из тиков против 15m из собранных минуток
+    from_minutes = BarSeries("15m")
+    one_minute = aggregator.series["1m"].arrays(include_partial=True)
+    for row in zip(*(one_minute[k].tolist() for k in FIELDS)):
+        from_minutes.add_bar(*row)
+    direct = aggregator.series["15m"].arrays(include_partial=True)
+    rebuilt = from_minutes.arrays(include_partial=True)
+    same = all(np.allclose(direct[k][-100:], rebuilt[k][-100:]) for k in FIELDS)
+    print(f"15m from ticks == 15m from 1m bars (last 100): {same}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        benchmark()
@@ -0,0 +1,132 @@
+"""Локальная история минутных баров (NumPy .npz по месяцам) для бэктестов."""
+
+import csv
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import numpy as np
+
+from jafar.config.constants import JAFAR_BARS_DIR
+
+BARS_DIR = JAFAR_BARS_DIR
+FIELDS = ("t", "o", "h", "l", "c", "v")
+MAX_BARS_PER_REQUEST = 20000  # лимит /History/retrieveBars
+
+
+@dataclass
+class Bars:
+    t: np.ndarray
+    o: np.ndarray
+    h: np.ndarray
+    l: np.ndarray
+    c: np.ndarray
+    v: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.t)
+
+    @classmethod
+    def empty(cls) -> "Bars":
+        return cls(np.empty(0, dtype=np.int64), *(np.empty(0) for _ in FIELDS[1:]))
+
+
+def _epoch(moment: datetime) -> int:
+    """Наивное время считается UTC (как и всё в TopstepX)."""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+
+def _symbol_dir(symbol: str) -> Path:
+    return BARS_DIR / symbol.upper()
+
+
+def save_bars(symbol: str, t, o, h, l, c, v=None) -> int:
+    """Добавляет бары в помесячные файлы (повторы по времени заменяются). Возвращает число баров."""
+    t = np.asarray(t, dtype=np.int64)
+    if not len(t):
+        return 0
+    columns = {"t": t, "o": o, "h": h, "l": l, "c": c, "v": np.zeros(len(t)) if v is None else v}
+    columns = {k: np.asarray(val) if k == "t" else np.asarray(val, dtype=float) for k, val in columns.items()}
+    month_of = np.datetime_as_string(t.astype("datetime64[s]").astype("datetime64[M]"), unit="M")
+    directory = _symbol_dir(symbol)
+    directory.mkdir(parents=True, exist_ok=True)
+    for month in np.unique(month_of):
+        mask = month_of == month
+        path = directory / f"{month}.npz"
+        merged = {k: val[mask] for k, val in columns.items()}
+        if path.exists():
+            with np.load(path) as existing:
+                merged = {k: np.concatenate([existing[k], merged[k]]) for k in FIELDS}
+        # Последнее значение побеждает: новые бары перезаписывают старые с тем же t
+        order = np.argsort(merged["t"], kind="stable")
+        merged = {k: val[order] for k, val in merged.items()}
+        keep = np.append(merged["t"][1:] != merged["t"][:-1], True)
+        np.savez(path, **{k: val[keep] for k, val in merged.items()})
+    return len(t)
+
+
+def load_bars(symbol: str, start: datetime | None = None, end: datetime | None = None) -> Bars:
+    """Бары инструмента за период (или вся история), отсортированные по времени."""
+    directory = _symbol_dir(symbol)
+    files = sorted(directory.glob("*.npz")) if directory.exists() else []
+    if start:
+        files = [f for f in files if f.stem >= start.strftime("%Y-%m")]
+    if end:
+        files = [f for f in files if f.stem <= end.strftime("%Y-%m")]
+    if not files:
+        return Bars.empty()
+    parts = []
+    for path in files:
+        with np.load(path) as data:
+            parts.append({k: data[k] for k in FIELDS})
+    bars = Bars(*(np.concatenate([p[k] for p in parts]) for k in FIELDS))
+    lo = np.searchsorted(bars.t, _epoch(start)) if start else 0
+    hi = np.searchsorted(bars.t, _epoch(end), side="right") if end else len(bars)
+    return Bars(*(getattr(bars, k)[lo:hi] for k in FIELDS))
+
+
+def symbols() -> list[str]:
+    return sorted(p.name for p in BARS_DIR.iterdir() if p.is_dir()) if BARS_DIR.exists() else []
+
+
+def import_csv(symbol: str, path: str | Path) -> int:
+    """
+    CSV с колонками time,open,high,low,close[,volume]; time — ISO-строка (UTC)
+    или секунды epoch. Первая строка может быть заголовком.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = [row for row in csv.reader(f) if row]
+    if rows and not rows[0][1].replace(".", "", 1).replace("-", "", 1).isdigit():
+        rows = rows[1:]
+    if not rows:
+        return 0
+    columns = list(zip(*rows))
+    raw_time = np.array(columns[0])
+    if raw_time[0].replace(".", "", 1).isdigit():
+        t = raw_time.astype(float).astype(np.int64)
+    else:
+        cleaned = np.char.replace(np.char.replace(raw_time, "Z", ""), " ", "T")
+        t = np.array(cleaned, dtype="datetime64[s]").astype(np.int64)
+    volume = np.array(columns[5], dtype=float) if len(columns) > 5 else None
+    return save_bars(symbol, t, *(np.array(columns[i], dtype=float) for i in range(1, 5)), volume)
+
+
+def download(client, contract_id: str, symbol: str, days: int = 30, unit_number: int = 1) -> int:
+    """Скачивает минутные бары TopstepX за последние `days` дней блоками по лимиту API."""
+    end = datetime.utcnow()
+    start = end - timedelta(days=days)
+    step = timedelta(minutes=MAX_BARS_PER_REQUEST * unit_number)
+    total = 0
+    chunk_end = end
+    while chunk_end > start:
+        chunk_start = max(start, chunk_end - step)
+        response = client.get_historical_bars(contract_id, chunk_start, chunk_end, unit=2,
+                                              unit_number=unit_number, limit=MAX_BARS_PER_REQUEST)
+        bars = (response or {}).get("bars") or []
+        if bars:
+            t = np.array([b["t"].replace("Z", "").split("+")[0] for b in bars], dtype="datetime64[s]").astype(np.int64)
+            total += save_bars(symbol, t, *([b[k] for b in bars] for k in ("o", "h", "l", "c", "v")))
+        chunk_end = chunk_start
+    return total
@@ -0,0 +1,492 @@
+"""Запись и воспроизведение внешнего I/O (HTTP, Gemini, ввод пользователя) для замеров.
+
+    JAFAR_CASSETTE_MODE=record JAFAR_CASSETTE=atrade jafar atrade gold
+    python -m jafar.utils.cassette show atrade
+"""
+
+import atexit
+import base64
+import builtins
+import hashlib
+import json
+import os
+import re
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from jafar.config.constants import JAFAR_CASSETTES_DIR
+
+MODES = ("record", "replay", "passthrough", "offline")
+ENV_MODE = "JAFAR_CASSETTE_MODE"
+ENV_CASSETTE = "JAFAR_CASSETTE"
+ENV_LATENCY = "JAFAR_CASSETTE_LATENCY"
+ENV_REPORT = "JAFAR_CASSETTE_REPORT"
+ENV_REPEAT = "JAFAR_CASSETTE_REPEAT"
+ENV_STARTED = "JAFAR_CASSETTE_STARTED"  # `jafar bench record` уже записал meta — дописывать, а не начинать заново
+FORMAT_VERSION = 1
+
+# Суффикс хоста -> сервис (для правил сопоставления и отчёта)
+SERVICES = (
+    ("topstepx.com", "topstepx"), ("marketaux.com", "marketaux"), ("newsapi.org", "newsapi"),
+    ("investing.com", "investing"), ("muxlisa.uz", "muxlisa"), ("telegram.org", "telegram"),
+    ("googleapis.com", "gemini"),
+)
+# Из чего строится ключ запроса; всё остальное различается только порядком вызовов
+MATCH_RULES = {
+    "topstepx": ("method", "path", "body"),
+    "marketaux": ("method", "path", "query"),
+    "newsapi": ("method", "path", "query"),
+    "investing": ("method", "path"),
+    "gemini": ("method", "path", "body"),
+    "muxlisa": ("method", "path"),
+    "telegram": ("method", "path"),
+    "stdin": ("method", "path"),
+    "*": ("method", "host", "path", "query", "body"),
+}
+# Меняются от запуска к запуску — в ключ не входят
+VOLATILE_FIELDS = {
+    "startTime", "endTime", "startTimestamp", "endTimestamp", "from", "to",
+    "published_after", "published_before", "date_from", "date_to",
+}
+SECRET_FIELDS = {"api_token", "apiKey", "apikey", "api_key", "key", "token", "userName", "password"}
+# Без этих переменных клиенты не доходят до запроса; при replay подставляются заглушки
+CREDENTIAL_ENV = (
+    "GOOGLE_API_KEY", "GEMINI_API_KEY", "MARKETAUX_API_KEY", "MARKETAUX_API_TOKEN", "NEWSAPI_API_KEY",
+    "MUXLISA_API_KEY", "TELEGRAM_BOT_TOKEN", "TELEGRAM_CHANNEL_ID", "TELEGRAM_CHAT_ID",
+    "TOPSTEPX_USERNAME", "TOPSTEPX_API_KEY",
+)
+_BOT_TOKEN = re.compile(r"/bot[^/]+/")
+
+_active = None
+
+
+class CassetteError(ConnectionError):
+    """Запрос нельзя выполнить: промах при replay, режим offline или записанная ошибка."""
+
+
+def cassette_path(name: str) -> Path:
+    """Имя кассеты ('atrade') или путь к файлу .jsonl."""
+    path = Path(name).expanduser()
+    return path if path.suffix else JAFAR_CASSETTES_DIR / f"{name}.jsonl"
+
+
+def load(path: Path) -> tuple[dict, list[dict]]:
+    meta, interactions = {}, []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "meta" in record:
+                meta.update(record["meta"])
+            else:
+                interactions.append(record)
+    return meta, interactions
+
+
+def write_meta(path: Path, **meta):
+    """Начинает новую кассету (перезаписывает старую) строкой метаданных."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    meta = {"version": FORMAT_VERSION, "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"), **meta}
+    path.write_text(json.dumps({"meta": meta}, ensure_ascii=False) + "\n", encoding="utf-8")
+
+
+def service_of(url: str) -> str:
+    host = urlsplit(url).hostname or ""
+    for suffix, service in SERVICES:
+        if host == suffix or host.endswith("." + suffix):
+            return service
+    # Локальный симулятор TopstepX (TOPSTEPX_API_BASE_URL) — тот же сервис
+    base = os.environ.get("TOPSTEPX_API_BASE_URL")
+    if base and urlsplit(base).netloc == urlsplit(url).netloc:
+        return "topstepx"
+    return host or urlsplit(url).scheme
+
+
+def redact_url(url: str) -> str:
+    parts = urlsplit(url)
+    query = urlencode([(k, "***" if k in SECRET_FIELDS else v)
+                       for k, v in parse_qsl(parts.query, keep_blank_values=True)])
+    return urlunsplit(parts._replace(path=_BOT_TOKEN.sub("/bot***/", parts.path), query=query))
+
+
+def _fingerprint(body, content_type: str = "") -> str:
+    """Тело запроса без изменчивых и секретных полей (JSON) или хэш байтов."""
+    if body is None or body == b"" or body == "":
+        return ""
+    if isinstance(body, dict):
+        data = body
+    else:
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        if not isinstance(body, bytes):
+            return type(body).__name__  # поток/файл — только тип
+        if "boundary=" in content_type:
+            body = body.replace(content_type.split("boundary=", 1)[1].encode(), b"BOUNDARY")
+        try:
+            data = json.loads(body)
+        except (ValueError, UnicodeDecodeError):
+            return hashlib.sha256(body).hexdigest()[:16]
+    if isinstance(data, dict):
+        data = {k: v for k, v in data.items() if k not in VOLATILE_FIELDS and k not in SECRET_FIELDS}
+    return json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def request_key(service: str, method: str, url: str, body=None, content_type: str = "") -> str:
+    parts = urlsplit(url)
+    fields = {
+        "method": method.upper(),
+        "host": parts.hostname or "",
+        "path": _BOT_TOKEN.sub("/bot***/", parts.path),
+        "query": sorted((k, v) for k, v in parse_qsl(parts.query)
+                        if k not in VOLATILE_FIELDS and k not in SECRET_FIELDS),
+        "body": _fingerprint(body, content_type),
+    }
+    rule = MATCH_RULES.get(service, MATCH_RULES["*"])
+    return hashlib.sha1(json.dumps([fields[f] for f in rule], ensure_ascii=False).encode()).hexdigest()[:16]
+
+
+class LatencyModel:
+    """
+    Задержка воспроизводимого ответа: recorded — как при записи; median — медиана
+    сервиса по кассете (без сетевых выбросов); none — сразу; x0.5 — записанная × k;
+    50ms — фиксированная. Ответы пользователя (stdin) всегда без задержки.
+    """
+
+    def __init__(self, spec: str = "recorded", interactions=()):
+        self.spec = spec
+        self.scale, self.fixed = 1.0, None
+        if spec == "none":
+            self.fixed = 0.0
+        elif spec.startswith("x"):
+            self.scale = float(spec[1:])
+        elif spec.endswith("ms"):
+            self.fixed = float(spec[:-2]) / 1000
+        elif spec not in ("recorded", "median"):
+            raise ValueError(f"Unknown latency model '{spec}' (recorded|median|none|x0.5|50ms)")
+        by_service = defaultdict(list)
+        for record in interactions:
+            by_service[record["service"]].append(record.get("elapsed", 0.0))
+        self.medians = {service: statistics.median(values) for service, values in by_service.items()}
+
+    def delay(self, record: dict) -> float:
+        if record["service"] == "stdin":
+            return 0.0
+        if self.fixed is not None:
+            return self.fixed
+        if self.spec == "median":
+            return self.medians.get(record["service"], record.get("elapsed", 0.0))
+        return record.get("elapsed", 0.0) * self.scale
+
+
+class Cassette:
+    """Одна кассета в одном процессе: запись, воспроизведение и замеры вызовов."""
+
+    def __init__(self, path: Path | None, mode: str, latency: str = "recorded", repeat: bool = False,
+                 started: bool = False):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cassette mode '{mode}' ({'|'.join(MODES)})")
+        self.path, self.mode, self.repeat = path, mode, repeat
+        self.meta, self.interactions = {}, []
+        self.calls = []    # (service, start, end, outcome)
+        self.spans = []    # (stage, start, end)
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._file = None
+        self._seq = 0
+        if mode == "replay":
+            self.meta, self.interactions = load(path)
+            self._used = [False] * len(self.interactions)
+            self._exact, self._loose = defaultdict(list), defaultdict(list)
+            for i, record in enumerate(self.interactions):
+                self._exact[record["key"]].append(i)
+                self._loose[(record["service"], record["method"], record["path"])].append(i)
+        elif mode == "record":
+            # Повторная запись под тем же именем начинает кассету заново, иначе сессии копятся
+            if not started or not path.exists() or not path.stat().st_size:
+                write_meta(path, command=" ".join(sys.argv))
+            self._file = open(path, "a", encoding="utf-8")
+        self.latency = LatencyModel(latency, self.interactions)
+
+    # --- Замеры ---
+
+    def _timed(self, service: str, started: float, outcome: str):
+        with self._lock:
+            self.calls.append((service, started, time.perf_counter(), outcome))
+
+    def report(self) -> dict:
+        """Сводка по процессу: время сессии, сетевое (объединение интервалов), локальное и по сервисам."""
+        now = time.perf_counter()
+        session = [(start, end) for name, start, end in self.spans if name == "session"]
+        begin, finish = session[-1] if session else (self._origin, now)
+        services, stages, waiting = {}, defaultdict(float), 0.0
+        intervals = []
+        for service, start, end, outcome in self.calls:
+            stats = services.setdefault(service, {"calls": 0, "seconds": 0.0, "max": 0.0, "misses": 0, "loose": 0})
+            stats["calls"] += 1
+            stats["seconds"] += end - start
+            stats["max"] = max(stats["max"], end - start)
+            stats["misses"] += outcome == "miss"
+            stats["loose"] += outcome == "loose"
+            if service == "stdin":
+                waiting += end - start
+            else:
+                intervals.append((max(start, begin), min(end, finish)))
+        busy, reach = 0.0, begin
+        for start, end in sorted(intervals):
+            if end > reach:
+                busy += end - max(start, reach)
+                reach = end
+        for name, start, end in self.spans:
+            if name != "session":
+                stages[name] += end - start
+        wall = finish - begin - waiting
+        return {
+            "mode": self.mode, "latency": self.latency.spec, "wall": wall, "io": busy, "local": wall - busy,
+            "user_input": waiting, "services": services, "stages": dict(stages),
+        }
+
+    def write_report(self, path: Path):
+        Path(path).write_text(json.dumps(self.report(), ensure_ascii=False, indent=1), encoding="utf-8")
+
+    # --- Запись / воспроизведение ---
+
+    def _write(self, record: dict):
+        with self._lock:
+            self._seq += 1
+            record = {"seq": self._seq, "offset": round(time.perf_counter() - self._origin, 4), **record}
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def _take(self, key: str, loose_key: tuple) -> tuple[dict | None, str]:
+        with self._lock:
+            for outcome, candidates in (("hit", self._exact.get(key, ())), ("loose", self._loose.get(loose_key, ()))):
+                for i in candidates:
+                    if not self._used[i]:
+                        self._used[i] = True
+                        return self.interactions[i], outcome
+            # Опрос в цикле (мониторы) — по желанию повторяем последний ответ
+            candidates = self._exact.get(key) or self._loose.get(loose_key)
+            if self.repeat and candidates:
+                return self.interactions[candidates[-1]], "loose"
+        return None, "miss"
+
+    def _replay(self, service: str, method: str, url: str, key: str) -> tuple[dict, float]:
+        started = time.perf_counter()
+        if self.mode == "offline":
+            self._timed(service, started, "miss")
+            raise CassetteError(f"cassette offline: {method} {redact_url(url)}")
+        path = _BOT_TOKEN.sub("/bot***/", urlsplit(url).path)
+        record, outcome = self._take(key, (service, method, path))
+        if record is None:
+            self._timed(service, started, "miss")
+            raise CassetteError(f"cassette miss: {method} {redact_url(url)}")
+        delay = self.latency.delay(record)
+        if delay:
+            time.sleep(delay)
+        self._timed(service, started, outcome)
+        if record.get("error"):
+            raise CassetteError(record["error"])
+        return record, delay
+
+    def send(self, adapter, request, original, **kwargs):
+        """Замена HTTPAdapter.send."""
+        import requests
+
+        service = service_of(request.url)
+        key = request_key(service, request.method, request.url, request.body, request.headers.get("Content-Type", ""))
+        if self.mode in ("replay", "offline"):
+            try:
+                record, delay = self._replay(service, request.method, request.url, key)
+            except CassetteError as e:
+                raise requests.exceptions.ConnectionError(str(e), request=request) from None
+            return _response(record, request, adapter, delay)
+
+        started = time.perf_counter()
+        try:
+            response = original(adapter, request, **kwargs)
+            content = response.content
+        except Exception as e:
+            self._timed(service, started, "live")
+            if self.mode == "record":
+                self._write(self._entry(service, request.method, request.url, key, started,
+                                        error=f"{type(e).__name__}: {e}"))
+            raise
+        self._timed(service, started, "live")
+        if self.mode == "record":
+            body, encoding = _encode_body(content, response.headers.get("Content-Type", ""))
+            self._write(self._entry(
+                service, request.method, request.url, key, started, status=response.status_code,
+                reason=response.reason, headers={"Content-Type": response.headers.get("Content-Type", "")},
+                body=body, encoding=encoding,
+            ))
+        return response
+
+    def call(self, service: str, endpoint: str, request: dict, fn):
+        """Не-HTTP вызов (SDK, ввод пользователя): результат должен сериализоваться в JSON."""
+        url = f"{service}://{service}/{endpoint}"
+        key = request_key(service, "CALL", url, request)
+        if self.mode in ("replay", "offline"):
+            record, _ = self._replay(service, "CALL", url, key)
+            return record.get("result")
+        started = time.perf_counter()
+        try:
+            result = fn()
+        except Exception as e:
+            self._timed(service, started, "live")
+            if self.mode == "record":
+                self._write(self._entry(service, "CALL", url, key, started, error=f"{type(e).__name__}: {e}"))
+            raise
+        self._timed(service, started, "live")
+        if self.mode == "record":
+            self._write(self._entry(service, "CALL", url, key, started, result=result))
+        return result
+
+    @staticmethod
+    def _entry(service: str, method: str, url: str, key: str, started: float, **fields) -> dict:
+        return {
+            "service": service, "method": method, "url": redact_url(url),
+            "path": _BOT_TOKEN.sub("/bot***/", urlsplit(url).path), "key": key,
+            "elapsed": round(time.perf_counter() - started, 4), **fields,
+        }
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+def _encode_body(content: bytes, content_type: str) -> tuple[str, str]:
+    try:
+        text = content.decode("utf-8")
+    except UnicodeDecodeError:
+        return base64.b64encode(content).decode("ascii"), "base64"
+    if "json" in content_type:
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return text, "text"
+        if isinstance(data, dict) and data.get("token"):
+            data["token"] = "cassette-token"  # токен сессии TopstepX не храним
+            text = json.dumps(data, ensure_ascii=False)
+    return text, "text"
+
+
+def _response(record: dict, request, adapter, delay: float):
+    from requests.models import Response
+    from requests.structures import CaseInsensitiveDict
+    from requests.utils import get_encoding_from_headers
+
+    response = Response()
+    response.status_code = record["status"]
+    response.reason = record.get("reason") or ""
+    response.headers = CaseInsensitiveDict(record.get("headers") or {})
+    body = record.get("body") or ""
+    response._content = base64.b64decode(body) if record.get("encoding") == "base64" else body.encode("utf-8")
+    response._content_consumed = True
+    response.encoding = get_encoding_from_headers(response.headers)
+    response.url = request.url
+    response.request = request
+    response.connection = adapter
+    response.elapsed = timedelta(seconds=delay)
+    return response
+
+
+def active():
+    return _active
+
+
+def install(cassette: Cassette) -> Cassette:
+    """Делает кассету активной в процессе; HTTPAdapter.send и input подменяются один раз."""
+    import requests.adapters
+
+    global _active
+    original_send = requests.adapters.HTTPAdapter.send
+    if not getattr(original_send, "_cassette", False):
+        def send(adapter, request, **kwargs):
+            if _active is None:
+                return original_send(adapter, request, **kwargs)
+            return _active.send(adapter, request, original_send, **kwargs)
+
+        send._cassette = True
+        requests.adapters.HTTPAdapter.send = send
+
+        original_input = builtins.input
+
+        def cassette_input(prompt=""):
+            if _active is None:
+                return original_input(prompt)
+            return _active.call("stdin", "input", {}, lambda: original_input(prompt))
+
+        builtins.input = cassette_input
+    _active = cassette
+    return cassette
+
+
+def install_from_env() -> Cassette | None:
+    """Включает кассету по JAFAR_CASSETTE_MODE (вызывается при импорте пакета jafar)."""
+    mode = os.environ.get(ENV_MODE, "").strip().lower()
+    if not mode:
+        return None
+    path = cassette_path(os.environ.get(ENV_CASSETTE) or "session") if mode in ("record", "replay") else None
+    if mode == "replay":
+        for name in CREDENTIAL_ENV:
+            os.environ.setdefault(name, "replay")
+    cassette = install(Cassette(path, mode, os.environ.get(ENV_LATENCY, "recorded"),
+                                repeat=os.environ.get(ENV_REPEAT) == "1",
+                                started=os.environ.pop(ENV_STARTED, None) == "1"))
+    # Дочерние процессы (агент сопровождения из ctrade) не пишут в ту же кассету и не расходуют её ответы
+    if mode == "record":
+        os.environ[ENV_MODE] = "passthrough"
+    elif mode == "replay":
+        os.environ[ENV_MODE] = "offline"
+    if report := os.environ.pop(ENV_REPORT, None):
+        atexit.register(cassette.write_report, Path(report))
+    atexit.register(cassette.close)
+    return cassette
+
+
+def call(service: str, endpoint: str, request: dict, fn):
+    """Вызов `fn()` через активную кассету; без кассеты — просто `fn()`."""
+    if _active is None:
+        return fn()
+    return _active.call(service, endpoint, request, fn)
+
+
+@contextmanager
+def stage(name: str):
+    """Отмечает этап сессии для отчёта `jafar bench` (без кассеты ничего не делает)."""
+    cassette = _active
+    if cassette is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        with cassette._lock:
+            cassette.spans.append((name, started, time.perf_counter()))
+
+
+def show(name: str):
+    meta, interactions = load(cassette_path(name))
+    print(f"{cassette_path(name)}: {meta.get('command')} (recorded {meta.get('recorded_at')}), "
+          f"{len(interactions)} interactions")
+    by_service = defaultdict(list)
+    for record in interactions:
+        by_service[record["service"]].append(record.get("elapsed", 0.0))
+    for service, values in sorted(by_service.items()):
+        print(f"  {service:10s} n={len(values):4d}  median {statistics.median(values) * 1000:8.1f} ms  "
+              f"total {sum(values):7.2f} s")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "show":
+        show(sys.argv[2])
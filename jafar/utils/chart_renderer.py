@@ -0,0 +1,336 @@
+"""Свечные графики из баров TopstepX для vision-анализа (запасной путь — screencapture).
+
+    python -m jafar.utils.chart_renderer bench
+"""
+
+import atexit
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+from rich.console import Console
+
+from jafar.utils import cassette
+from jafar.utils.indicators import SESSION_START_UTC_HOUR, get_engine
+
+console = Console()
+
+CHART_SOURCE = os.getenv("JAFAR_CHART_SOURCE", "render").lower()  # render | screen
+
+# таймфрейм -> (unit TopstepX, unit_number, число баров на графике)
+TIMEFRAMES = {
+    "1m": (2, 1, 240),
+    "5m": (2, 5, 200),
+    "15m": (2, 15, 160),
+    "1h": (3, 1, 120),
+    "4h": (3, 4, 120),
+    "1d": (4, 1, 120),
+}
+DEFAULT_TIMEFRAMES = ("5m", "15m", "1h")
+UNIT_SECONDS = {2: 60, 3: 3600, 4: 86400}
+LOOKBACK_FACTOR = 3  # запас на выходные и паузы в торгах
+EMA_PERIODS = (9, 21)
+FIGSIZE = (12, 7)
+DPI = 100
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# --- Данные ---
+
+def _parse_bars(response) -> dict[str, np.ndarray] | None:
+    """Ответ /History/retrieveBars -> колонки NumPy по возрастанию времени."""
+    bars = (response or {}).get("bars") or []
+    if not bars:
+        return None
+    t = np.array([b["t"].replace("Z", "").split("+")[0] for b in bars], dtype="datetime64[s]").astype(np.int64)
+    order = np.argsort(t, kind="stable")
+    columns = {"t": t[order]}
+    for key in ("o", "h", "l", "c", "v"):
+        columns[key] = np.array([b.get(key) or 0.0 for b in bars], dtype=float)[order]
+    return columns
+
+
+def resolve_contract(client, symbol: str) -> str | None:
+    contract_info = client.search_contract(name=symbol) or {}
+    active_contract = next((c for c in contract_info.get("contracts", []) if c.get("activeContract")), None)
+    return active_contract["id"] if active_contract else None
+
+
+def fetch_timeframes(client, contract_id: str, timeframes=DEFAULT_TIMEFRAMES) -> dict[str, dict]:
+    """Бары всех таймфреймов параллельными запросами; таймфреймы без данных пропускаются."""
+    end = datetime.utcnow()
+
+    def fetch(tf):
+        unit, unit_number, count = TIMEFRAMES[tf]
+        start = end - timedelta(seconds=UNIT_SECONDS[unit] * unit_number * count * LOOKBACK_FACTOR)
+        response = client.get_historical_bars(contract_id, start, end, unit=unit, unit_number=unit_number,
+                                              limit=count, include_partial_bar=True)
+        columns = _parse_bars(response)
+        return tf, {k: v[-count:] for k, v in columns.items()} if columns else None
+
+    with ThreadPoolExecutor(max_workers=len(timeframes), thread_name_prefix="bars") as executor:
+        return {tf: data for tf, data in executor.map(fetch, timeframes) if data}
+
+
+def levels_for(*instruments: str) -> list[tuple[float, str]]:
+    """Активные уровни из key_levels_store для любого из имён инструмента (gold, MGC, ...)."""
+    from jafar.utils import key_levels_store
+
+    wanted = {name.lower() for name in instruments if name}
+    return [
+        (float(level["level"]), level.get("type") or "")
+        for instrument, levels in key_levels_store.load_levels().items()
+        if instrument.lower() in wanted
+        for level in levels
+    ]
+
+
+# --- Индикаторы ---
+
+def ema(values: np.ndarray, period: int) -> np.ndarray:
+    alpha = 2.0 / (period + 1)
+    result = np.empty(len(values))
+    current = values[0] if len(values) else 0.0
+    for i, value in enumerate(values):
+        current += alpha * (value - current)
+        result[i] = current
+    return result
+
+
+def session_vwap(t, h, l, c, v) -> np.ndarray:
+    """VWAP с обнулением в начале каждого торгового дня (по типичной цене)."""
+    typical = (h + l + c) / 3.0
+    session = (t - SESSION_START_UTC_HOUR * 3600) // 86400
+    cum_pv = np.cumsum(typical * v)
+    cum_v = np.cumsum(v)
+    starts = np.flatnonzero(np.r_[True, session[1:] != session[:-1]])
+    base = np.repeat(starts, np.diff(np.r_[starts, len(t)]))
+    offset_pv = cum_pv[base] - (typical * v)[base]
+    offset_v = cum_v[base] - v[base]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vwap = (cum_pv - offset_pv) / (cum_v - offset_v)
+    return np.where(np.isfinite(vwap), vwap, typical)
+
+
+# --- Отрисовка (в процессах пула) ---
+
+def _init_worker():
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot  # noqa: F401 — прогрев импорта
+
+
+def _warm():
+    return os.getpid()
+
+
+def _render_job(job: dict) -> str:
+    """Рисует один график и сохраняет PNG. Выполняется в процессе пула."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    bars = job["bars"]
+    t, o, h, l, c, v = (bars[k] for k in ("t", "o", "h", "l", "c", "v"))
+    x = np.arange(len(t))
+    up = c >= o
+    colors = np.where(up, "#26a69a", "#ef5350")
+
+    fig, (ax, ax_vol) = plt.subplots(2, 1, figsize=FIGSIZE, dpi=DPI, sharex=True,
+                                     gridspec_kw={"height_ratios": [4, 1], "hspace": 0.03})
+    fig.subplots_adjust(left=0.03, right=0.93, top=0.95, bottom=0.06)
+    try:
+        right_edge = len(x) + max(8, len(x) // 12)
+        # Свечи и объём — по одной коллекции линий вместо сотен прямоугольников bar()
+        body_width = 0.6 * FIGSIZE[0] * 72 * 0.91 / (right_edge + 1)
+        min_body = (h.max() - l.min()) * 0.001
+        ax.vlines(x, l, h, colors=colors, linewidth=0.8)
+        ax.vlines(x, np.minimum(o, c), np.maximum(o, c) + (np.abs(c - o) < min_body) * min_body,
+                  colors=colors, linewidth=body_width)
+
+        for period, color in zip(EMA_PERIODS, ("#1e88e5", "#fb8c00")):
+            ax.plot(x, ema(c, period), color=color, linewidth=1.1, label=f"EMA {period}")
+        if v.any():
+            ax.plot(x, session_vwap(t, h, l, c, v), color="#8e24aa", linewidth=1.1, linestyle="--", label="VWAP")
+
+        # Уровни — только попадающие в видимый диапазон цены (с небольшим запасом)
+        low, high = l.min(), h.max()
+        margin = (high - low) * 0.15
+        for price, label in job.get("levels", []):
+            if low - margin <= price <= high + margin:
+                ax.axhline(price, color="#616161", linewidth=0.9, linestyle=":")
+                ax.text(right_edge - 0.5, price, f"{label} {price:g}", ha="right", va="bottom",
+                        fontsize=8, color="#424242")
+
+        last = c[-1]
+        ax.axhline(last, color=colors[-1], linewidth=0.6, alpha=0.6)
+        ax.text(right_edge - 0.5, last, f"{last:g}", ha="right", va="top", fontsize=9, fontweight="bold",
+                color=colors[-1])
+        ax.set_xlim(-1, right_edge)
+        ax.set_title(f"{job['symbol']} · {job['timeframe']} · "
+                     f"{np.datetime_as_string(np.datetime64(int(t[-1]), 's'), unit='m').replace('T', ' ')} UTC",
+                     loc="left", fontsize=11)
+        ax.legend(loc="upper left", fontsize=8, frameon=False)
+        ax.grid(alpha=0.2)
+        ax.yaxis.tick_right()
+
+        ax_vol.vlines(x, 0, v, colors=colors, linewidth=body_width)
+        ax_vol.set_ylim(0, v.max() * 1.05 if v.any() else 1)
+        ax_vol.grid(alpha=0.2)
+        ax_vol.yaxis.tick_right()
+        ticks = x[:: max(1, len(x) // 8)]
+        ax_vol.set_xticks(ticks)
+        labels = np.datetime_as_string(t[ticks].astype("datetime64[s]"), unit="m")
+        ax_vol.set_xticklabels([s[5:].replace("T", " ") for s in labels], fontsize=8)
+
+        fig.savefig(job["path"])
+    finally:
+        plt.close(fig)
+    return job["path"]
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """Общий пул процессов отрисовки (spawn: в процессе Jafar работают фоновые потоки)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = max(1, min(len(DEFAULT_TIMEFRAMES), os.cpu_count() or 1))
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=_init_worker)
+    return _pool
+
+
+def warmup():
+    """Запускает процессы пула заранее, не дожидаясь их готовности."""
+    pool = get_pool()
+    for _ in range(pool._max_workers):
+        pool.submit(_warm)
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+atexit.register(shutdown)
+
+
+def render_bars(symbol: str, bars_by_tf: dict[str, dict], out_dir: Path,
+                levels: list[tuple[float, str]] | None = None) -> list[str]:
+    """Рисует готовые бары параллельно; возвращает пути PNG в порядке таймфреймов."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    jobs = [
+        {"symbol": symbol.upper(), "timeframe": tf, "bars": bars, "levels": levels or [],
+         "path": str(out_dir / f"chart_{i + 1}_{tf}.png")}
+        for i, (tf, bars) in enumerate(bars_by_tf.items())
+    ]
+    return list(get_pool().map(_render_job, jobs))
+
+
+def render_charts(symbol: str, out_dir: Path, timeframes=DEFAULT_TIMEFRAMES, client=None,
+                  levels: list[tuple[float, str]] | None = None, contract_id: str | None = None) -> list[str]:
+    """Графики активного контракта `symbol` по таймфреймам. Пустой список, если данных нет или запрос не удался."""
+    started = time.perf_counter()
+    try:
+        if client is None:
+            from jafar.utils.topstepx_api_client import get_shared_client
+
+            client = get_shared_client()
+        warmup()  # процессы стартуют, пока идут запросы баров
+        contract_id = contract_id or resolve_contract(client, symbol)
+        if not contract_id:
+            console.print(f"[yellow]Активный контракт для '{symbol}' не найден — графики не построены.[/yellow]")
+            return []
+        bars_by_tf = fetch_timeframes(client, contract_id, timeframes)
+        # Те же бары досчитывают индикаторы для числового контекста промпта
+        for tf, bars in bars_by_tf.items():
+            get_engine().update_bars(symbol, tf, bars)
+        if len(bars_by_tf) < len(timeframes):
+            missing = [tf for tf in timeframes if tf not in bars_by_tf]
+            console.print(f"[yellow]Нет баров {symbol} для таймфреймов: {', '.join(missing)}.[/yellow]")
+            return []
+        files = render_bars(symbol, bars_by_tf, out_dir, levels)
+    except Exception as e:
+        console.print(f"[yellow]Не удалось построить графики {symbol}: {e}[/yellow]")
+        return []
+    console.print(f"[green]Графики {symbol} ({', '.join(timeframes)}) построены "
+                  f"за {time.perf_counter() - started:.2f} с.[/green]")
+    return files
+
+
+def capture_screens(out_dir: Path, count: int = 3, delay: float = 3.0) -> list[str]:
+    """Прежний режим: интерактивный `screencapture -w` (только macOS). Пустой список при отмене."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    files = []
+    for i in range(count):
+        console.print(f"\n[cyan]Скриншот #{i + 1}/{count} через {delay:g} сек...[/cyan]")
+        time.sleep(delay)
+        path = out_dir / f"screenshot_{i + 1}.png"
+        subprocess.run(["screencapture", "-w", str(path)])
+        if not path.exists() or path.stat().st_size == 0:
+            console.print("[red]Скриншот отменен.[/red]")
+            return []
+        console.print(f"[green]Скриншот #{i + 1} сохранен.[/green]")
+        files.append(str(path))
+    return files
+
+
+def charts_for_analysis(symbol: str, out_dir: Path, instrument: str | None = None,
+                        timeframes=DEFAULT_TIMEFRAMES) -> list[str]:
+    """
+    Изображения для vision-анализа: отрисованные графики с уровнями инструмента,
+    а если рендер невозможен или выбран JAFAR_CHART_SOURCE=screen — screencapture.
+    """
+    if CHART_SOURCE != "screen":
+        with cassette.stage("charts"):
+            files = render_charts(symbol, out_dir, timeframes, levels=levels_for(symbol, instrument))
+        if files:
+            return files
+    if sys.platform == "darwin":
+        console.print("[yellow]Режим интерактивных скриншотов...[/yellow]")
+        return capture_screens(out_dir, count=len(timeframes))
+    return []
+
+
+def _synthetic_bars(count: int, step: int, seed: int) -> dict[str, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    t = int(time.time()) // step * step - step * np.arange(count)[::-1]
+    c = 2350 + np.cumsum(rng.normal(0, 1.5, count))
+    o = np.r_[c[0], c[:-1]]
+    spread = np.abs(rng.normal(0, 1.0, count))
+    return {"t": t.astype(np.int64), "o": o, "h": np.maximum(o, c) + spread, "l": np.minimum(o, c) - spread,
+            "c": c, "v": rng.integers(50, 800, count).astype(float)}
+
+
+def benchmark(out_dir: Path = Path("/tmp/jafar_chart_bench")):
+    """Холодный и тёплый рендер трёх таймфреймов на синтетических барах (без сети)."""
+    bars_by_tf = {
+        tf: _synthetic_bars(TIMEFRAMES[tf][2], UNIT_SECONDS[TIMEFRAMES[tf][0]] * TIMEFRAMES[tf][1], seed)
+        for seed, tf in enumerate(DEFAULT_TIMEFRAMES)
+    }
+    levels = [(2355.0, "ENTRY_BUY"), (2340.0, "STOP_LOSS"), (2370.0, "TAKE_PROFIT_1")]
+    for label in ("cold", "warm", "warm"):
+        started = time.perf_counter()
+        files = render_bars("MGC", bars_by_tf, out_dir, levels)
+        print(f"{label}: {len(files)} charts in {time.perf_counter() - started:.2f} s -> {files[0]}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        benchmark()
@@ -0,0 +1,197 @@
+"""Шина команд между голосовым процессом и CLI: намерения туда, события задач обратно."""
+
+import uuid
+import queue
+import builtins
+import threading
+from dataclasses import dataclass, field
+from multiprocessing.connection import Connection
+
+# Общий замок исполнения: команды из шины и из интерактивного CLI
+# не выполняются одновременно и не перемешивают вывод в терминале.
+execution_lock = threading.RLock()
+
+
+# --- Сообщения ---
+
+@dataclass(frozen=True)
+class Intent:
+    """Намерение пользователя: команда роутера и её аргументы."""
+    command: str
+    args: str = ""
+    source: str = "voice"
+    request_id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+
+    @property
+    def command_line(self) -> str:
+        return f"{self.command} {self.args}".strip()
+
+
+@dataclass(frozen=True)
+class Prefetch:
+    """Просьба заранее загрузить контекст (новости, календарь, счёт), пока пользователь договаривает."""
+    sources: tuple = ("news", "calendar", "account")
+
+
+@dataclass(frozen=True)
+class JobStarted:
+    request_id: str
+    queue_position: int = 0
+
+
+@dataclass(frozen=True)
+class JobProgress:
+    request_id: str
+    message: str
+
+
+@dataclass(frozen=True)
+class JobResult:
+    request_id: str
+    ok: bool
+    status: str | None = None
+    error: str | None = None
+
+
+@dataclass(frozen=True)
+class Shutdown:
+    """Закрывает шину с любой стороны."""
+    reason: str = ""
+
+
+# --- Сторона голосового процесса ---
+
+class BusClient:
+    """Публикует намерения и читает события исполнителя."""
+
+    def __init__(self, conn: Connection):
+        self._conn = conn
+
+    def publish(self, intent: Intent) -> str:
+        self._conn.send(intent)
+        return intent.request_id
+
+    def prefetch(self, *sources: str):
+        self._conn.send(Prefetch(tuple(sources)) if sources else Prefetch())
+
+    def poll_events(self, timeout: float = 0.0) -> list:
+        """Все события, пришедшие за `timeout` секунд (0 — без ожидания)."""
+        events = []
+        try:
+            if not self._conn.poll(timeout):
+                return events
+            while self._conn.poll():
+                events.append(self._conn.recv())
+        except (EOFError, OSError):
+            events.append(Shutdown("executor closed"))
+        return events
+
+    def close(self):
+        try:
+            self._conn.send(Shutdown("client closed"))
+        except (OSError, ValueError):
+            pass
+        self._conn.close()
+
+
+# --- Сторона исполнителя (основной процесс) ---
+
+def _run_intent(intent: Intent) -> str | None:
+    from jafar.cli.command_router import run_command
+
+    # Команда и аргументы уже разобраны: текст пользователя уходит хендлеру как есть
+    return run_command(intent.command, intent.args, interactive_session=False)
+
+
+_job_thread = threading.local()
+
+
+def _refuse_input_in_jobs():
+    """Подменяет builtins.input (один раз): в потоке задачи шины ввод недоступен."""
+    original = builtins.input
+    if getattr(original, "_command_bus_guard", False):
+        return
+
+    def guarded_input(prompt=""):
+        if getattr(_job_thread, "active", False):
+            raise EOFError("interactive input is not available in command-bus jobs; run the command in the CLI")
+        return original(prompt)
+
+    guarded_input._command_bus_guard = True
+    builtins.input = guarded_input
+
+
+def _start_prefetch(sources: tuple):
+    from jafar.utils.prefetch import prefetch_context
+
+    prefetch_context(sources)
+
+
+class BusExecutor:
+    """
+    Принимает намерения из шины и выполняет их по очереди в одном рабочем
+    потоке через `run_command`. `runner` можно заменить (например, для
+    демона или тестового прогона).
+    """
+
+    def __init__(self, conn: Connection, runner=_run_intent, prefetcher=_start_prefetch):
+        self._conn = conn
+        self._runner = runner
+        self._prefetcher = prefetcher
+        self._jobs = queue.Queue()
+        self._send_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._reader = threading.Thread(target=self._read_loop, name="command-bus-reader", daemon=True)
+        self._worker = threading.Thread(target=self._work_loop, name="command-bus-worker", daemon=True)
+
+    def start(self):
+        _refuse_input_in_jobs()
+        self._reader.start()
+        self._worker.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._jobs.put(None)
+        self._send(Shutdown("executor stopped"))
+
+    def _send(self, message):
+        with self._send_lock:
+            try:
+                self._conn.send(message)
+            except (OSError, ValueError, BrokenPipeError):
+                pass
+
+    def _read_loop(self):
+        while not self._stopped.is_set():
+            try:
+                message = self._conn.recv()
+            except (EOFError, OSError):
+                break
+            if isinstance(message, Shutdown):
+                break
+            if isinstance(message, Prefetch):
+                # Мимо очереди задач: загрузка идёт в фоне и не ждёт текущую команду
+                try:
+                    self._prefetcher(message.sources)
+                except Exception:
+                    pass
+            elif isinstance(message, Intent):
+                self._send(JobStarted(message.request_id, self._jobs.qsize()))
+                self._jobs.put(message)
+        self._stopped.set()
+        self._jobs.put(None)
+
+    def _work_loop(self):
+        _job_thread.active = True
+        while True:
+            intent = self._jobs.get()
+            if intent is None:
+                return
+            self._send(JobProgress(intent.request_id, f"running: {intent.command_line}"))
+            try:
+                with execution_lock:
+                    status = self._runner(intent)
+                self._send(JobResult(intent.request_id, ok=status != "failure", status=status))
+            except Exception as e:
+                self._send(JobResult(intent.request_id, ok=False, error=str(e)))
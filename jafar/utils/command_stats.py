@@ -0,0 +1,255 @@
+import os
+import json
+import math
+import threading
+from collections import deque
+
+from jafar.utils.log_pipeline import read_segment, rotated_segments, shared_lock
+
+LOG_FILE_PATH = os.path.expanduser("~/.jafar/structured_log.jsonl")
+CHECKPOINT_PATH = os.path.expanduser("~/.jafar/command_stats_checkpoint.json")
+
+# Number of most recent runs per command used for the rolling failure rate
+ROLLING_WINDOW = 50
+# Relative precision of latency buckets (HDR-style log buckets, ~2% error)
+BUCKET_GROWTH = 1.02
+MIN_LATENCY_MS = 0.1
+
+_LOG_BASE = math.log(BUCKET_GROWTH)
+
+
+def _bucket_index(duration_seconds: float) -> int:
+    millis = max(duration_seconds * 1000.0, MIN_LATENCY_MS)
+    return int(math.log(millis / MIN_LATENCY_MS) / _LOG_BASE)
+
+
+def _bucket_upper_seconds(index: int) -> float:
+    return MIN_LATENCY_MS * BUCKET_GROWTH ** (index + 1) / 1000.0
+
+
+class LatencyHistogram:
+    """
+    Log-bucketed latency histogram. Memory is bounded by the dynamic range of
+    durations (not by the number of samples) and quantiles are accurate to
+    the bucket precision.
+    """
+
+    def __init__(self, buckets: dict | None = None):
+        self.buckets = {int(k): v for k, v in (buckets or {}).items()}
+        self.count = sum(self.buckets.values())
+
+    def record(self, duration_seconds: float):
+        index = _bucket_index(duration_seconds)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+
+    def quantile(self, q: float) -> float | None:
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return _bucket_upper_seconds(index)
+        return _bucket_upper_seconds(max(self.buckets))
+
+    def to_dict(self) -> dict:
+        return {str(k): v for k, v in self.buckets.items()}
+
+
+class _CommandAggregate:
+    def __init__(self, data: dict | None = None):
+        data = data or {}
+        self.total_runs = data.get("total_runs", 0)
+        self.success = data.get("success", 0)
+        self.failure = data.get("failure", 0)
+        self.total_duration = data.get("total_duration", 0.0)
+        self.recent = deque(data.get("recent", []), maxlen=ROLLING_WINDOW)
+        self.latency = LatencyHistogram(data.get("latency_buckets"))
+
+    def add(self, ok: bool, duration: float):
+        self.total_runs += 1
+        self.total_duration += duration
+        if ok:
+            self.success += 1
+        else:
+            self.failure += 1
+        self.recent.append(0 if ok else 1)
+        self.latency.record(duration)
+
+    def summary(self) -> dict:
+        """Stats in the evolution_stats.json format plus rolling/percentile fields."""
+        runs = self.total_runs or 1
+        window = len(self.recent) or 1
+        p50, p95, p99 = (self.latency.quantile(q) for q in (0.5, 0.95, 0.99))
+        return {
+            "total_runs": self.total_runs,
+            "success": self.success,
+            "failure": self.failure,
+            "total_duration": round(self.total_duration, 4),
+            "average_duration": round(self.total_duration / runs, 4),
+            "failure_rate": round(self.failure / runs * 100, 2),
+            "window_runs": len(self.recent),
+            "window_failure_rate": round(sum(self.recent) / window * 100, 2),
+            "p50_duration": None if p50 is None else round(p50, 4),
+            "p95_duration": None if p95 is None else round(p95, 4),
+            "p99_duration": None if p99 is None else round(p99, 4),
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "total_runs": self.total_runs,
+            "success": self.success,
+            "failure": self.failure,
+            "total_duration": self.total_duration,
+            "recent": list(self.recent),
+            "latency_buckets": self.latency.to_dict(),
+        }
+
+
+class CommandStatsEngine:
+    """
+    Incremental aggregator over the structured command log.
+
+    Keeps running aggregates in memory and persists them together with the
+    byte offset of the last consumed line, so each refresh only reads lines
+    appended since the previous one.
+    """
+
+    def __init__(self, log_path: str = LOG_FILE_PATH, checkpoint_path: str = CHECKPOINT_PATH):
+        self.log_path = log_path
+        self.checkpoint_path = checkpoint_path
+        self.offset = 0
+        self.inode = None
+        self.segment = self._newest_segment()  # last rotated segment already folded in
+        self.commands: dict[str, _CommandAggregate] = {}
+        self._lock = threading.Lock()
+        self._load_checkpoint()
+
+    def _load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        self.offset = data.get("offset", 0)
+        self.inode = data.get("inode")
+        self.segment = data.get("segment", self.segment)
+        self.commands = {name: _CommandAggregate(agg) for name, agg in data.get("commands", {}).items()}
+
+    def _save_checkpoint(self):
+        os.makedirs(os.path.dirname(self.checkpoint_path), exist_ok=True)
+        tmp_path = self.checkpoint_path + ".tmp"
+        data = {
+            "offset": self.offset,
+            "inode": self.inode,
+            "segment": self.segment,
+            "commands": {name: agg.to_dict() for name, agg in self.commands.items()},
+        }
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _reset(self):
+        self.offset = 0
+        self.commands = {}
+
+    def _fold_line(self, line: bytes):
+        try:
+            log_entry = json.loads(line)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            # Ignore corrupted log lines
+            return
+        command = (log_entry.get("command") or "unknown_command").strip()
+        base_command = command.split(" ")[0] if command else "unknown_command"
+        aggregate = self.commands.get(base_command)
+        if aggregate is None:
+            aggregate = self.commands[base_command] = _CommandAggregate()
+        aggregate.add(log_entry.get("status") == "success", float(log_entry.get("duration") or 0.0))
+
+    def _newest_segment(self) -> str | None:
+        segments = rotated_segments(self.log_path)
+        return os.path.basename(segments[-1][0]).removesuffix(".gz") if segments else None
+
+    def _fold_rotated(self) -> int | None:
+        """
+        Folds in segments rotated since the last refresh: the first of them is
+        the file that was being read (its unread tail from `offset`), the rest
+        are read whole. Returns the number of lines, or None if nothing rotated.
+        """
+        segments = [segment for segment, _ in rotated_segments(self.log_path)
+                    if self.segment is None or os.path.basename(segment).removesuffix(".gz") > self.segment]
+        if not segments:
+            return None
+        folded = 0
+        for i, segment in enumerate(segments):
+            try:
+                data = read_segment(segment)
+            except OSError:
+                continue
+            for line in data[self.offset if i == 0 else 0:].splitlines():
+                if line.strip():
+                    self._fold_line(line)
+                    folded += 1
+        self.segment = os.path.basename(segments[-1]).removesuffix(".gz")
+        self.offset = 0
+        return folded
+
+    def refresh(self) -> int:
+        """Folds in lines appended since the last refresh. Returns the number of new lines."""
+        # The shared lock keeps the log pipeline from rotating the file mid-read
+        with self._lock, shared_lock(self.log_path):
+            rotated = self._fold_rotated()
+            try:
+                with open(self.log_path, "rb") as f:
+                    stat = os.fstat(f.fileno())
+                    size = stat.st_size
+                    if rotated is None and self.inode is not None and stat.st_ino != self.inode:
+                        # Replaced, but the segment is gone (pruned): keep the aggregates, read the new file
+                        self.offset = 0
+                    elif rotated is None and size < self.offset:
+                        # The log was truncated in place: start over
+                        self._reset()
+                    self.inode = stat.st_ino
+                    f.seek(self.offset)
+                    chunk = f.read(size - self.offset)
+            except OSError:
+                chunk = b""
+            # A partially written last line is left for the next refresh
+            end = chunk.rfind(b"\n") + 1
+            lines = chunk[:end].splitlines()
+            for line in lines:
+                if line.strip():
+                    self._fold_line(line)
+            self.offset += end
+            if lines or rotated:
+                self._save_checkpoint()
+            return len(lines) + (rotated or 0)
+
+    def get(self, command: str) -> dict | None:
+        """Current stats for one base command (refreshes first)."""
+        self.refresh()
+        aggregate = self.commands.get(command)
+        return aggregate.summary() if aggregate else None
+
+    def snapshot(self) -> dict:
+        """Stats for all commands (refreshes first)."""
+        self.refresh()
+        return {name: agg.summary() for name, agg in self.commands.items()}
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> CommandStatsEngine:
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = CommandStatsEngine()
+    return _engine
+
+
+def get_command_stats(command: str) -> dict | None:
+    return get_engine().get(command)
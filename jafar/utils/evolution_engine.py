@@ -1,44 +1,23 @@
 
 import os
 import json
-from collections import defaultdict
 
-LOG_FILE_PATH = os.path.expanduser("~/.jafar/structured_log.jsonl")
+from jafar.utils.command_stats import LOG_FILE_PATH, get_engine
+
 STATS_FILE_PATH = os.path.expanduser("~/.jafar/evolution_stats.json")
 
-def analyze_logs():
+def analyze_logs(args: str = None):
     """
-    Analyzes the structured logs to generate command execution statistics.
+    Generates command execution statistics from the structured logs.
+
+    Only log lines appended since the previous run are read: the running
+    aggregates live in the command_stats checkpoint.
     """
     if not os.path.exists(LOG_FILE_PATH):
         print("Log file not found. Nothing to analyze.")
         return
 
-    command_stats = defaultdict(lambda: {"total_runs": 0, "success": 0, "failure": 0, "total_duration": 0.0})
-
-    with open(LOG_FILE_PATH, "r", encoding="utf-8") as f:
-        for line in f:
-            try:
-                log_entry = json.loads(line)
-                command = log_entry.get("command", "unknown_command").strip()
-                base_command = command.split(" ")[0]
-
-                stats = command_stats[base_command]
-                stats["total_runs"] += 1
-                stats["total_duration"] += log_entry.get("duration", 0.0)
-                if log_entry.get("status") == "success":
-                    stats["success"] += 1
-                else:
-                    stats["failure"] += 1
-            except json.JSONDecodeError:
-                # Ignore corrupted log lines
-                continue
-
-    # Calculate averages and failure rates
-    for command, stats in command_stats.items():
-        stats["average_duration"] = round(stats["total_duration"] / stats["total_runs"], 4)
-        failure_rate = (stats["failure"] / stats["total_runs"]) * 100
-        stats["failure_rate"] = round(failure_rate, 2)
+    command_stats = get_engine().snapshot()
 
     # Save the analysis results
     save_stats(command_stats)
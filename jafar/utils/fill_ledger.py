@@ -0,0 +1,431 @@
+"""Журнал исполнений TopstepX в SQLite: FIFO-лоты, позиции, P&L и дневные итоги."""
+
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from jafar.config.constants import JAFAR_FILL_LEDGER_DB
+
+DB_PATH = JAFAR_FILL_LEDGER_DB
+DEFAULT_LOOKBACK_HOURS = 8
+SYNC_OVERLAP_SECONDS = 2       # перекрытие окна: дубликаты отсекает PRIMARY KEY
+MIN_SYNC_INTERVAL_SECONDS = 2.0
+TRADING_DAY_ROLL_HOUR_UTC = 22
+
+SIDE_BUY = 0
+SIDE_SELL = 1
+
+_schema_ready = False
+
+
+def _connect() -> sqlite3.Connection:
+    global _schema_ready
+    Path(DB_PATH).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=10, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    if not _schema_ready:
+        _init_schema(conn)
+        _schema_ready = True
+    return conn
+
+
+def _init_schema(conn: sqlite3.Connection):
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS fills (
+            account_id INTEGER NOT NULL,
+            trade_id INTEGER NOT NULL,
+            contract_id TEXT NOT NULL,
+            side INTEGER NOT NULL,
+            size REAL NOT NULL,
+            price REAL NOT NULL,
+            fees REAL NOT NULL DEFAULT 0,
+            api_pnl REAL,
+            realized_pnl REAL NOT NULL DEFAULT 0,
+            order_id INTEGER,
+            ts TEXT NOT NULL,
+            trading_day TEXT NOT NULL,
+            PRIMARY KEY (account_id, trade_id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_fills_day ON fills(account_id, trading_day);
+        CREATE TABLE IF NOT EXISTS lots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            account_id INTEGER NOT NULL,
+            contract_id TEXT NOT NULL,
+            qty REAL NOT NULL,
+            price REAL NOT NULL,
+            opened_at TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_lots_contract ON lots(account_id, contract_id, id);
+        CREATE TABLE IF NOT EXISTS positions (
+            account_id INTEGER NOT NULL,
+            contract_id TEXT NOT NULL,
+            net_qty REAL NOT NULL DEFAULT 0,
+            avg_price REAL,
+            realized_pnl REAL NOT NULL DEFAULT 0,
+            fees REAL NOT NULL DEFAULT 0,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (account_id, contract_id)
+        );
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            account_id INTEGER NOT NULL,
+            trading_day TEXT NOT NULL,
+            contract_id TEXT NOT NULL,
+            fills INTEGER NOT NULL DEFAULT 0,
+            volume REAL NOT NULL DEFAULT 0,
+            realized_pnl REAL NOT NULL DEFAULT 0,
+            api_pnl REAL NOT NULL DEFAULT 0,
+            fees REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (account_id, trading_day, contract_id)
+        );
+        CREATE TABLE IF NOT EXISTS multipliers (
+            contract_id TEXT PRIMARY KEY,
+            multiplier REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS sync_state (
+            account_id INTEGER PRIMARY KEY,
+            high_water TEXT NOT NULL,
+            synced_at REAL NOT NULL
+        );
+    """)
+
+
+def _parse_ts(value: str) -> datetime:
+    """ISO-время API (с 'Z' или смещением, с микросекундами любой длины) → aware UTC."""
+    value = value.replace("Z", "+00:00")
+    value = re.sub(r"\.(\d+)", lambda m: "." + m.group(1)[:6].ljust(6, "0"), value)
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def trading_day(ts: datetime) -> str:
+    return (ts + timedelta(hours=24 - TRADING_DAY_ROLL_HOUR_UTC)).date().isoformat()
+
+
+def contract_symbol(contract_id: str) -> str:
+    """'CON.F.US.MGC.Z25' → 'MGC'."""
+    parts = contract_id.split(".")
+    return parts[3] if len(parts) >= 5 else contract_id
+
+
+def _stamp(conn: sqlite3.Connection, account_id: int) -> str | None:
+    """Отметка последней записи позиций счёта (любым процессом)."""
+    return conn.execute("SELECT MAX(updated_at) FROM positions WHERE account_id = ?", (account_id,)).fetchone()[0]
+
+
+def _load_account(conn: sqlite3.Connection, account_id: int) -> dict[str, "Position"]:
+    positions = {
+        row["contract_id"]: Position(account_id, row["contract_id"], row["net_qty"], row["avg_price"],
+                                     row["realized_pnl"], row["fees"])
+        for row in conn.execute("SELECT * FROM positions WHERE account_id = ?", (account_id,))
+    }
+    for row in conn.execute("SELECT * FROM lots WHERE account_id = ? ORDER BY id", (account_id,)):
+        positions.setdefault(row["contract_id"], Position(account_id, row["contract_id"])).lots.append(
+            [row["qty"], row["price"], row["opened_at"]]
+        )
+    return positions
+
+
+@dataclass
+class Position:
+    account_id: int
+    contract_id: str
+    net_qty: float = 0.0
+    avg_price: float | None = None
+    realized_pnl: float = 0.0
+    fees: float = 0.0
+    lots: list = field(default_factory=list)  # [[qty со знаком, цена, opened_at], ...] от старых к новым
+
+    @property
+    def side(self) -> str:
+        return "Long" if self.net_qty > 0 else "Short" if self.net_qty < 0 else "Flat"
+
+    def unrealized_pnl(self, mark_price: float, multiplier: float) -> float:
+        return sum((mark_price - price) * qty for qty, price, _ in self.lots) * multiplier
+
+
+class FillLedger:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._positions: dict[int, dict[str, Position]] = {}
+        self._stamps: dict[int, str | None] = {}  # MAX(positions.updated_at) на момент загрузки
+        self._multipliers: dict[str, float] | None = None
+        self._last_sync: dict[int, float] = {}
+
+    # --- Чтение (из памяти) ---
+
+    def _account(self, account_id: int) -> dict[str, Position]:
+        conn = _connect()
+        try:
+            stamp = _stamp(conn, account_id)
+            if account_id not in self._positions or self._stamps.get(account_id) != stamp:
+                self._positions[account_id] = _load_account(conn, account_id)
+                self._stamps[account_id] = stamp
+        finally:
+            conn.close()
+        return self._positions[account_id]
+
+    def position(self, account_id: int, contract_id: str) -> Position:
+        with self._lock:
+            return self._account(account_id).get(contract_id) or Position(account_id, contract_id)
+
+    def open_positions(self, account_id: int) -> dict[str, float]:
+        """{contract_id: чистый объём со знаком} — то, что хендлеры раньше считали из сделок."""
+        with self._lock:
+            return {c: p.net_qty for c, p in self._account(account_id).items() if p.net_qty}
+
+    def multiplier(self, contract_id: str) -> float:
+        with self._lock:
+            if self._multipliers is None:
+                conn = _connect()
+                try:
+                    self._multipliers = {row["contract_id"]: row["multiplier"]
+                                         for row in conn.execute("SELECT * FROM multipliers")}
+                finally:
+                    conn.close()
+            if contract_id in self._multipliers:
+                return self._multipliers[contract_id]
+        from jafar.utils.risk_engine import CONTRACT_MULTIPLIERS
+
+        return CONTRACT_MULTIPLIERS.get(contract_symbol(contract_id), 1.0)
+
+    def set_multiplier(self, contract_id: str, multiplier: float):
+        """Множитель контракта (tickValue / tickSize). Уже начисленный P&L не пересчитывается."""
+        self.multiplier(contract_id)
+        with self._lock:
+            if self._multipliers.get(contract_id) == multiplier:
+                return
+            conn = _connect()
+            try:
+                conn.execute("INSERT OR REPLACE INTO multipliers (contract_id, multiplier) VALUES (?, ?)",
+                             (contract_id, multiplier))
+            finally:
+                conn.close()
+            self._multipliers[contract_id] = multiplier
+
+    def daily_totals(self, account_id: int, day: str | None = None) -> dict:
+        """Итоги торгового дня (по умолчанию текущего): общие и по контрактам."""
+        day = day or trading_day(datetime.now(timezone.utc))
+        conn = _connect()
+        try:
+            rows = conn.execute(
+                "SELECT * FROM daily_totals WHERE account_id = ? AND trading_day = ?", (account_id, day)
+            ).fetchall()
+        finally:
+            conn.close()
+        by_contract = {
+            row["contract_id"]: {k: row[k] for k in ("fills", "volume", "realized_pnl", "api_pnl", "fees")}
+            for row in rows
+        }
+        total = {k: sum(c[k] for c in by_contract.values()) for k in ("fills", "volume", "realized_pnl", "api_pnl", "fees")}
+        total["net_pnl"] = total["realized_pnl"] - total["fees"]
+        return {"trading_day": day, "total": total, "contracts": by_contract}
+
+    def recent_fills(self, account_id: int, day: str | None = None) -> list[dict]:
+        day = day or trading_day(datetime.now(timezone.utc))
+        conn = _connect()
+        try:
+            return [dict(row) for row in conn.execute(
+                "SELECT * FROM fills WHERE account_id = ? AND trading_day = ? ORDER BY ts, trade_id", (account_id, day)
+            )]
+        finally:
+            conn.close()
+
+    # --- Запись ---
+
+    def high_water(self, account_id: int) -> datetime | None:
+        conn = _connect()
+        try:
+            row = conn.execute("SELECT high_water FROM sync_state WHERE account_id = ?", (account_id,)).fetchone()
+        finally:
+            conn.close()
+        return _parse_ts(row["high_water"]) if row else None
+
+    def sync(self, client, account_id: int, lookback_hours: int = DEFAULT_LOOKBACK_HOURS, force: bool = False) -> int:
+        """Догружает сделки новее отметки. Возвращает число новых исполнений."""
+        with self._lock:
+            if not force and time.monotonic() - self._last_sync.get(account_id, -1e9) < MIN_SYNC_INTERVAL_SECONDS:
+                return 0
+            self._last_sync[account_id] = time.monotonic()
+        end = datetime.now(timezone.utc)
+        mark = self.high_water(account_id)
+        start = mark - timedelta(seconds=SYNC_OVERLAP_SECONDS) if mark else end - timedelta(hours=lookback_hours)
+        # Клиент TopstepX ждёт наивное UTC-время и сам добавляет 'Z'
+        response = client.get_trades(account_id, start.replace(tzinfo=None), end.replace(tzinfo=None))
+        if not response or not response.get("success", True):
+            return 0
+        return self.ingest(account_id, response.get("trades") or [])
+
+    def ingest(self, account_id: int, trades: list[dict]) -> int:
+        """Применяет сделки API (в любом порядке); уже известные и аннулированные пропускаются."""
+        trades = sorted(
+            (t for t in trades if not t.get("voided") and t.get("creationTimestamp")),
+            key=lambda t: (_parse_ts(t["creationTimestamp"]), t.get("id", 0)),
+        )
+        if not trades:
+            return 0
+        with self._lock:
+            conn = _connect()
+            added, touched = 0, set()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                # Только состояние из базы: другой процесс мог записать исполнения после нашей загрузки
+                positions = _load_account(conn, account_id)
+                known = {row[0] for row in conn.execute(
+                    "SELECT trade_id FROM fills WHERE account_id = ? AND trade_id IN (%s)" % ",".join("?" * len(trades)),
+                    (account_id, *(t.get("id") for t in trades)),
+                )}
+                high_water = None
+                for trade in trades:
+                    high_water = trade["creationTimestamp"]
+                    if trade.get("id") in known:
+                        continue
+                    contract_id = trade["contractId"]
+                    position = positions.setdefault(contract_id, Position(account_id, contract_id))
+                    self._apply(conn, position, trade)
+                    touched.add(contract_id)
+                    added += 1
+                for contract_id in touched:
+                    self._save_position(conn, positions[contract_id])
+                if high_water:
+                    conn.execute(
+                        "INSERT INTO sync_state (account_id, high_water, synced_at) VALUES (?, ?, ?) "
+                        "ON CONFLICT(account_id) DO UPDATE SET high_water = excluded.high_water, synced_at = excluded.synced_at",
+                        (account_id, high_water, time.time()),
+                    )
+                stamp = _stamp(conn, account_id)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+            self._positions[account_id], self._stamps[account_id] = positions, stamp
+            return added
+
+    def _apply(self, conn: sqlite3.Connection, position: Position, trade: dict):
+        ts = _parse_ts(trade["creationTimestamp"])
+        size = float(trade.get("size", 0))
+        price = float(trade["price"])
+        signed = size if trade.get("side", SIDE_BUY) == SIDE_BUY else -size
+        multiplier = self.multiplier(position.contract_id)
+        fees = float(trade.get("fees") or 0.0)
+
+        # FIFO: встречное исполнение закрывает самые старые лоты
+        realized = 0.0
+        remaining = signed
+        while remaining and position.lots and (position.lots[0][0] > 0) != (remaining > 0):
+            lot = position.lots[0]
+            matched = min(abs(remaining), abs(lot[0]))
+            direction = 1.0 if lot[0] > 0 else -1.0
+            realized += (price - lot[1]) * matched * direction * multiplier
+            lot[0] -= matched * direction
+            remaining += matched * direction
+            if abs(lot[0]) < 1e-9:
+                position.lots.pop(0)
+        if abs(remaining) > 1e-9:
+            position.lots.append([remaining, price, ts.isoformat()])
+
+        position.net_qty = sum(lot[0] for lot in position.lots)
+        position.avg_price = (sum(lot[0] * lot[1] for lot in position.lots) / position.net_qty) if position.net_qty else None
+        position.realized_pnl += realized
+        position.fees += fees
+
+        day = trading_day(ts)
+        api_pnl = trade.get("profitAndLoss")
+        conn.execute(
+            "INSERT INTO fills (account_id, trade_id, contract_id, side, size, price, fees, api_pnl, realized_pnl, "
+            "order_id, ts, trading_day) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (position.account_id, trade.get("id"), position.contract_id, trade.get("side", SIDE_BUY), size, price,
+             fees, api_pnl, realized, trade.get("orderId"), ts.isoformat(), day),
+        )
+        conn.execute(
+            "INSERT INTO daily_totals (account_id, trading_day, contract_id, fills, volume, realized_pnl, api_pnl, fees) "
+            "VALUES (?, ?, ?, 1, ?, ?, ?, ?) ON CONFLICT(account_id, trading_day, contract_id) DO UPDATE SET "
+            "fills = fills + 1, volume = volume + excluded.volume, realized_pnl = realized_pnl + excluded.realized_pnl, "
+            "api_pnl = api_pnl + excluded.api_pnl, fees = fees + excluded.fees",
+            (position.account_id, day, position.contract_id, size, realized, api_pnl or 0.0, fees),
+        )
+
+    def _save_position(self, conn: sqlite3.Connection, position: Position):
+        conn.execute("DELETE FROM lots WHERE account_id = ? AND contract_id = ?", (position.account_id, position.contract_id))
+        conn.executemany(
+            "INSERT INTO lots (account_id, contract_id, qty, price, opened_at) VALUES (?, ?, ?, ?, ?)",
+            [(position.account_id, position.contract_id, qty, price, opened_at) for qty, price, opened_at in position.lots],
+        )
+        conn.execute(
+            "INSERT INTO positions (account_id, contract_id, net_qty, avg_price, realized_pnl, fees, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(account_id, contract_id) DO UPDATE SET "
+            "net_qty = excluded.net_qty, avg_price = excluded.avg_price, realized_pnl = excluded.realized_pnl, "
+            "fees = excluded.fees, updated_at = excluded.updated_at",
+            (position.account_id, position.contract_id, position.net_qty, position.avg_price,
+             position.realized_pnl, position.fees, datetime.now(timezone.utc).isoformat()),
+        )
+
+    def reconcile(self, account_id: int, api_positions: list[dict]) -> list[str]:
+        """
+        Сверяет журнал с /Position/searchOpen. Если позиция открылась до начала
+        журнала или часть сделок не попала в окно, лоты заменяются одним лотом
+        по данным API. Возвращает контракты, которые пришлось поправить.
+        """
+        expected = {}
+        for pos in api_positions or []:
+            # type: 1 = Long, 2 = Short (в части ответов встречается side: 0/1)
+            short = pos.get("type") == 2 or pos.get("side") == SIDE_SELL
+            expected[pos["contractId"]] = (-1.0 if short else 1.0) * float(pos.get("size", 0)), pos.get("averagePrice")
+        fixed = []
+        with self._lock:
+            conn = _connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                positions = _load_account(conn, account_id)
+                for contract_id in set(expected) | {c for c, p in positions.items() if p.net_qty}:
+                    qty, avg_price = expected.get(contract_id, (0.0, None))
+                    position = positions.setdefault(contract_id, Position(account_id, contract_id))
+                    if abs(position.net_qty - qty) < 1e-9:
+                        continue
+                    price = float(avg_price or position.avg_price or 0.0)
+                    position.lots = [[qty, price, datetime.now(timezone.utc).isoformat()]] if qty else []
+                    position.net_qty = qty
+                    position.avg_price = position.lots[0][1] if qty else None
+                    self._save_position(conn, position)
+                    fixed.append(contract_id)
+                stamp = _stamp(conn, account_id)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+            self._positions[account_id], self._stamps[account_id] = positions, stamp
+        return fixed
+
+    def format_positions(self, account_id: int, marks: dict[str, float] | None = None) -> list[str]:
+        """Строки для промпта: сторона, объём, средняя цена, реализованный/нереализованный P&L."""
+        lines = []
+        for contract_id in self.open_positions(account_id):
+            position = self.position(account_id, contract_id)
+            line = f"  - {contract_id}: {position.side} {abs(position.net_qty):g} @ {position.avg_price:.2f}"
+            mark = (marks or {}).get(contract_id)
+            if mark is not None:
+                line += f", unrealized ${position.unrealized_pnl(mark, self.multiplier(contract_id)):,.2f}"
+            lines.append(line)
+        return lines
+
+
+_ledger: FillLedger | None = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger() -> FillLedger:
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = FillLedger()
+        return _ledger
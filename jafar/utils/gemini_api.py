@@ -5,6 +5,10 @@ import os
 import google.generativeai as genai
 from PIL import Image
 
+from jafar.utils import cassette
+
+MODEL_NAME = "gemini-2.5-pro"
+
 
 def ask_gemini_with_image(prompt: str, images: list[Image.Image]) -> str:
     """
@@ -25,13 +29,14 @@ def ask_gemini_with_image(prompt: str, images: list[Image.Image]) -> str:
     genai.configure(api_key=api_key)
 
     # Выбираем модель, которая поддерживает работу с изображениями
-    model = genai.GenerativeModel("gemini-2.5-pro")
+    model = genai.GenerativeModel(MODEL_NAME)
 
     try:
         # Создаем список содержимого для отправки: сначала изображения, затем промпт
         contents = [*images, prompt]
-        response = model.generate_content(contents)
-        return response.text
+        # Через кассету `jafar bench`: промпт содержит время, поэтому ключ — модель и вид запроса
+        return cassette.call("gemini", f"models/{MODEL_NAME}:generateContent", {"kind": "image", "images": len(images)},
+                             lambda: model.generate_content(contents).text)
     except Exception as e:
         return f"Ошибка при обращении к Gemini API: {e}"
 
@@ -51,10 +56,10 @@ def ask_gemini_text_only(prompt: str) -> str:
         return "Ошибка: GOOGLE_API_KEY не установлен в переменных окружения."
 
     genai.configure(api_key=api_key)
-    model = genai.GenerativeModel("gemini-2.5-pro")
+    model = genai.GenerativeModel(MODEL_NAME)
 
     try:
-        response = model.generate_content(prompt)
-        return response.text
+        return cassette.call("gemini", f"models/{MODEL_NAME}:generateContent", {"kind": "text"},
+                             lambda: model.generate_content(prompt).text)
     except Exception as e:
         return f"Ошибка при обращении к Gemini API: {e}"
\ No newline at end of file
@@ -0,0 +1,344 @@
+"""Инкрементальные технические индикаторы по контракту и таймфрейму для промптов.
+
+    python -m jafar.utils.indicators bench
+"""
+
+import math
+import sys
+import threading
+import time
+
+import numpy as np
+
+EMA_PERIODS = (9, 21, 50)
+SMA_PERIODS = (20,)
+ATR_PERIOD = 14
+RSI_PERIOD = 14
+VALUE_AREA_SHARE = 0.70
+# Торговый день CME начинается в 17:00 по Чикаго; 22:00 UTC — без учёта летнего времени
+SESSION_START_UTC_HOUR = 22
+
+
+def session_of(t: int) -> int:
+    """Номер торгового дня для времени бара (секунды UTC)."""
+    return (int(t) - SESSION_START_UTC_HOUR * 3600) // 86400
+
+
+def default_bucket_size(price: float) -> float:
+    """Шаг профиля объёма: ~1/1000 цены, округлённый до степени десяти (GC 2350 -> 1.0)."""
+    return 10.0 ** (math.floor(math.log10(abs(price))) - 3) if price else 1.0
+
+
+class IndicatorState:
+    """Состояние индикаторов одного ряда баров. Не потокобезопасно — см. IndicatorEngine."""
+
+    def __init__(self, ema_periods=EMA_PERIODS, sma_periods=SMA_PERIODS, atr_period: int = ATR_PERIOD,
+                 rsi_period: int = RSI_PERIOD, bucket_size: float | None = None):
+        self.ema_periods = tuple(ema_periods)
+        self.sma_periods = tuple(sma_periods)
+        self.atr_period = atr_period
+        self.rsi_period = rsi_period
+        self.bucket_size = bucket_size
+        self._rings = {p: np.zeros(p) for p in self.sma_periods}
+        self._profile: dict[int, float] = {}
+        self._last_bucket = None  # (корзина, объём) последнего бара — для отката
+        # Все скалярные величины — в одном словаре, чтобы снимок для отката был одной копией
+        self._s = {
+            "t": None, "count": 0, "close": None, "prev_close": None,
+            "ema": {p: None for p in self.ema_periods},
+            "sma_sum": {p: 0.0 for p in self.sma_periods},
+            "atr": None, "tr_sum": 0.0,
+            "avg_gain": None, "avg_loss": None, "gain_sum": 0.0, "loss_sum": 0.0,
+            "session": None, "session_open": None, "session_high": None, "session_low": None,
+            "pv": 0.0, "volume": 0.0,
+        }
+        self._undo = None
+
+    # --- Обновление ---
+
+    def update(self, t: int, o: float, h: float, l: float, c: float, v: float = 0.0) -> bool:
+        """Применяет бар. Бар старше последнего игнорируется (False); тот же t заменяет последний."""
+        last_t = self._s["t"]
+        if last_t is not None and t < last_t:
+            return False
+        if last_t is not None and t == last_t:
+            self._rollback()
+        self._snapshot(t)
+        self._apply(t, o, h, l, c, v)
+        return True
+
+    def _snapshot(self, t: int):
+        s = self._s
+        count = s["count"]
+        slots = {p: self._rings[p][count % p] for p in self.sma_periods}
+        self._undo = (
+            {**s, "ema": dict(s["ema"]), "sma_sum": dict(s["sma_sum"])},
+            slots,
+            self._profile if session_of(t) != s["session"] else None,
+        )
+
+    def _rollback(self):
+        scalars, slots, profile = self._undo
+        count = scalars["count"]
+        for p, value in slots.items():
+            self._rings[p][count % p] = value
+        if profile is not None:
+            self._profile = profile
+        elif self._last_bucket is not None:
+            bucket, volume = self._last_bucket
+            remaining = self._profile[bucket] - volume
+            if remaining > 0:
+                self._profile[bucket] = remaining
+            else:
+                del self._profile[bucket]
+        self._s = scalars
+
+    def _apply(self, t, o, h, l, c, v):
+        s = self._s
+        count = s["count"]
+        prev_close = s["close"]
+
+        for p in self.ema_periods:
+            previous = s["ema"][p]
+            s["ema"][p] = c if previous is None else previous + 2.0 / (p + 1) * (c - previous)
+
+        for p in self.sma_periods:
+            ring = self._rings[p]
+            slot = count % p
+            s["sma_sum"][p] += c - ring[slot]
+            ring[slot] = c
+
+        # ATR и RSI: первые N значений — простое среднее, дальше сглаживание Уайлдера
+        true_range = h - l if prev_close is None else max(h, prev_close) - min(l, prev_close)
+        n = self.atr_period
+        if count < n:
+            s["tr_sum"] += true_range
+            s["atr"] = s["tr_sum"] / (count + 1)
+        else:
+            s["atr"] += (true_range - s["atr"]) / n
+        if prev_close is not None:
+            change = c - prev_close
+            gain, loss = max(change, 0.0), max(-change, 0.0)
+            n = self.rsi_period
+            if count <= n:
+                s["gain_sum"] += gain
+                s["loss_sum"] += loss
+                if count == n:
+                    s["avg_gain"], s["avg_loss"] = s["gain_sum"] / n, s["loss_sum"] / n
+            else:
+                s["avg_gain"] += (gain - s["avg_gain"]) / n
+                s["avg_loss"] += (loss - s["avg_loss"]) / n
+
+        # Сессия: VWAP, экстремумы и профиль объёма обнуляются в начале торгового дня
+        session = session_of(t)
+        if session != s["session"]:
+            s.update(session=session, session_open=o, session_high=h, session_low=l, pv=0.0, volume=0.0)
+            self._profile = {}
+        else:
+            s["session_high"] = max(s["session_high"], h)
+            s["session_low"] = min(s["session_low"], l)
+        typical = (h + l + c) / 3.0
+        s["pv"] += typical * v
+        s["volume"] += v
+        if self.bucket_size is None:
+            self.bucket_size = default_bucket_size(c)
+        self._last_bucket = None
+        if v:
+            bucket = round(typical / self.bucket_size)
+            self._profile[bucket] = self._profile.get(bucket, 0.0) + v
+            self._last_bucket = (bucket, v)
+
+        s.update(t=int(t), count=count + 1, close=c, prev_close=prev_close)
+
+    def update_many(self, t, o, h, l, c, v=None) -> int:
+        """Досчитывает пачку баров (по возрастанию t). Возвращает число применённых."""
+        v = np.zeros(len(t)) if v is None else v
+        applied = 0
+        for row in zip(np.asarray(t).tolist(), np.asarray(o, float).tolist(), np.asarray(h, float).tolist(),
+                       np.asarray(l, float).tolist(), np.asarray(c, float).tolist(), np.asarray(v, float).tolist()):
+            applied += self.update(*row)
+        return applied
+
+    # --- Чтение ---
+
+    def sma(self, period: int) -> float | None:
+        count = self._s["count"]
+        return self._s["sma_sum"][period] / period if count >= period else None
+
+    def rsi(self) -> float | None:
+        avg_gain, avg_loss = self._s["avg_gain"], self._s["avg_loss"]
+        if avg_gain is None:
+            return None
+        if avg_loss == 0:
+            return 100.0 if avg_gain > 0 else 50.0
+        return 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+
+    def volume_profile(self) -> dict | None:
+        """POC и границы зоны стоимости (70% объёма сессии вокруг POC)."""
+        if not self._profile:
+            return None
+        buckets = np.array(sorted(self._profile))
+        volumes = np.array([self._profile[b] for b in buckets])
+        poc = int(np.argmax(volumes))
+        lo = hi = poc
+        covered, target = volumes[poc], volumes.sum() * VALUE_AREA_SHARE
+        while covered < target and (lo > 0 or hi < len(buckets) - 1):
+            below = volumes[lo - 1] if lo > 0 else -1.0
+            above = volumes[hi + 1] if hi < len(buckets) - 1 else -1.0
+            if above >= below:
+                hi += 1
+                covered += above
+            else:
+                lo -= 1
+                covered += below
+        size = self.bucket_size
+        return {"poc": buckets[poc] * size, "va_low": buckets[lo] * size, "va_high": buckets[hi] * size}
+
+    def summary(self) -> dict:
+        s = self._s
+        if not s["count"]:
+            return {}
+        result = {
+            "t": s["t"], "bars": s["count"], "close": s["close"],
+            **{f"ema{p}": value for p, value in s["ema"].items()},
+            **{f"sma{p}": self.sma(p) for p in self.sma_periods},
+            f"atr{self.atr_period}": s["atr"],
+            f"rsi{self.rsi_period}": self.rsi(),
+            "vwap": s["pv"] / s["volume"] if s["volume"] else None,
+            "session_open": s["session_open"], "session_high": s["session_high"], "session_low": s["session_low"],
+        }
+        if profile := self.volume_profile():
+            result.update(profile)
+        return result
+
+
+class IndicatorEngine:
+    """Реестр состояний по (контракт, таймфрейм) с общей блокировкой."""
+
+    def __init__(self):
+        self._states: dict[tuple[str, str], IndicatorState] = {}
+        self._lock = threading.Lock()
+
+    def state(self, contract: str, timeframe: str) -> IndicatorState:
+        key = (contract.upper(), timeframe)
+        with self._lock:
+            if key not in self._states:
+                self._states[key] = IndicatorState()
+            return self._states[key]
+
+    def update(self, contract: str, timeframe: str, t, o, h, l, c, v=0.0) -> bool:
+        state = self.state(contract, timeframe)
+        with self._lock:
+            return state.update(t, o, h, l, c, v)
+
+    def update_bars(self, contract: str, timeframe: str, bars: dict) -> int:
+        """Колонки баров {"t","o","h","l","c","v"} по возрастанию времени (как в chart_renderer)."""
+        state = self.state(contract, timeframe)
+        with self._lock:
+            return state.update_many(*(bars[k] for k in ("t", "o", "h", "l", "c")), bars.get("v"))
+
+    def summary(self, contract: str, timeframe: str) -> dict:
+        key = (contract.upper(), timeframe)
+        with self._lock:
+            state = self._states.get(key)
+            return state.summary() if state else {}
+
+    def timeframes(self, contract: str) -> list[str]:
+        with self._lock:
+            return [tf for (name, tf) in self._states if name == contract.upper()]
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> IndicatorEngine:
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = IndicatorEngine()
+    return _engine
+
+
+def _num(value, digits: int = 2) -> str:
+    return "—" if value is None else f"{value:.{digits}f}"
+
+
+def format_summary(timeframe: str, summary: dict) -> str:
+    """Одна строка чисел на таймфрейм."""
+    close = summary["close"]
+    emas = " ".join(f"{k.upper()} {_num(v)}" for k, v in summary.items() if k.startswith(("ema", "sma")))
+    atr = next(v for k, v in summary.items() if k.startswith("atr"))
+    rsi = next(v for k, v in summary.items() if k.startswith("rsi"))
+    line = f"{timeframe}: close {_num(close)} | {emas} | ATR {_num(atr)} | RSI {_num(rsi, 1)}"
+    if summary.get("vwap") is not None:
+        line += f" | VWAP {_num(summary['vwap'])} ({close - summary['vwap']:+.2f})"
+    line += f" | session O/H/L {_num(summary['session_open'])}/{_num(summary['session_high'])}/{_num(summary['session_low'])}"
+    if "poc" in summary:
+        line += f" | POC {_num(summary['poc'])} VA {_num(summary['va_low'])}-{_num(summary['va_high'])}"
+    return line
+
+
+def format_for_prompt(contract: str, timeframes=None) -> str:
+    """Сводка индикаторов по всем (или указанным) таймфреймам контракта для промпта."""
+    engine = get_engine()
+    lines = []
+    for tf in timeframes or engine.timeframes(contract):
+        if summary := engine.summary(contract, tf):
+            lines.append(format_summary(tf, summary))
+    return "\n".join(lines) if lines else "Indicator data is not available."
+
+
+def _pandas_reference(df, state: IndicatorState) -> dict:
+    # Полный пересчёт по всему DataFrame — то, что делал бы pandas-ta на каждом баре
+    result = {f"ema{p}": df["c"].ewm(span=p, adjust=False).mean().iloc[-1] for p in state.ema_periods}
+    result.update({f"sma{p}": df["c"].rolling(p).mean().iloc[-1] for p in state.sma_periods})
+    prev_close = df["c"].shift()
+    true_range = np.maximum(df["h"], prev_close.fillna(df["h"])) - np.minimum(df["l"], prev_close.fillna(df["l"]))
+    result["atr"] = true_range.ewm(alpha=1 / state.atr_period, adjust=False).mean().iloc[-1]
+    session = (df["t"] - SESSION_START_UTC_HOUR * 3600) // 86400
+    typical = (df["h"] + df["l"] + df["c"]) / 3
+    last = session == session.iloc[-1]
+    result["vwap"] = (typical[last] * df["v"][last]).sum() / df["v"][last].sum()
+    return result
+
+
+def benchmark(history: int = 5000, stream: int = 500):
+    import pandas as pd
+
+    rng = np.random.default_rng(3)
+    n = history + stream
+    t = 1_700_000_000 + 60 * np.arange(n)
+    c = 2350 + np.cumsum(rng.normal(0, 0.8, n))
+    o = np.r_[c[0], c[:-1]]
+    h = np.maximum(o, c) + np.abs(rng.normal(0, 0.4, n))
+    l = np.minimum(o, c) - np.abs(rng.normal(0, 0.4, n))
+    v = rng.integers(10, 500, n).astype(float)
+
+    state = IndicatorState()
+    state.update_many(t[:history], o[:history], h[:history], l[:history], c[:history], v[:history])
+    started = time.perf_counter()
+    for i in range(history, n):
+        state.update(int(t[i]), o[i], h[i], l[i], c[i], v[i])
+        state.summary()
+    incremental = time.perf_counter() - started
+
+    df = pd.DataFrame({"t": t, "o": o, "h": h, "l": l, "c": c, "v": v})
+    started = time.perf_counter()
+    for i in range(history, n):
+        reference = _pandas_reference(df.iloc[: i + 1], state)
+    full = time.perf_counter() - started
+
+    summary = state.summary()
+    print(f"{stream} new bars on {history} history: incremental {incremental * 1000:.1f} ms "
+          f"({incremental / stream * 1e6:.0f} µs/bar), pandas recompute {full * 1000:.0f} ms "
+          f"({full / incremental:.0f}x)")
+    for key in ("ema9", "ema50", "sma20", "vwap"):
+        print(f"  {key}: {summary[key]:.4f} vs pandas {reference[key]:.4f}")
+    print(f"  atr14: {summary['atr14']:.4f} vs pandas {reference['atr']:.4f} (pandas seeds ATR with the first TR)")
+    print(format_summary("1m", summary))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        benchmark()
@@ -0,0 +1,361 @@
+"""Ключевые уровни Super Agent в SQLite с журналом изменений и уведомлениями."""
+
+import os
+import json
+import time
+import uuid
+import select
+import socket
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from jafar.config.constants import JAFAR_KEY_LEVELS_DB, JAFAR_MEMORY_DIR
+
+DB_PATH = JAFAR_KEY_LEVELS_DB
+FEED_DIR = Path.home() / ".jafar" / "key_levels_feed"
+
+# Старые JSON-файлы уровней (ctrade писал относительно текущей папки)
+LEGACY_JSON_FILES = (Path("memory/key_levels.json"), JAFAR_MEMORY_DIR / "key_levels.json")
+
+DEFAULT_TTL_HOURS = 24
+
+STATUS_ACTIVE = "active"
+STATUS_TRIGGERED = "triggered"
+STATUS_EXPIRED = "expired"
+STATUS_CANCELLED = "cancelled"
+
+# Разрешённые переходы: новый статус -> из каких статусов в него можно перейти
+ALLOWED_TRANSITIONS = {
+    STATUS_ACTIVE: (STATUS_TRIGGERED, STATUS_EXPIRED, STATUS_CANCELLED),
+    STATUS_TRIGGERED: (STATUS_ACTIVE,),
+    STATUS_EXPIRED: (STATUS_ACTIVE, STATUS_TRIGGERED),
+    STATUS_CANCELLED: (STATUS_ACTIVE, STATUS_TRIGGERED),
+}
+
+_schema_ready = False
+_subscribers = []
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _connect() -> sqlite3.Connection:
+    """Подключается к базе; при первом вызове создаёт схему и переносит старый JSON."""
+    global _schema_ready
+    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=10, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    if not _schema_ready:
+        _init_schema(conn)
+        _schema_ready = True
+        _migrate_legacy_json(conn)
+    return conn
+
+
+def _init_schema(conn: sqlite3.Connection):
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS key_levels (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            instrument TEXT NOT NULL,
+            level REAL NOT NULL,
+            type TEXT,
+            source_id TEXT,
+            status TEXT NOT NULL DEFAULT 'active'
+                CHECK (status IN ('active', 'triggered', 'expired', 'cancelled')),
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            expires_at TEXT,
+            UNIQUE (instrument, level)
+        );
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_key_levels_status ON key_levels (status, instrument);")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS level_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            level_id INTEGER NOT NULL,
+            instrument TEXT NOT NULL,
+            status TEXT NOT NULL,
+            changed_at TEXT NOT NULL
+        );
+    """)
+
+
+def _record_change(conn: sqlite3.Connection, level_id: int, instrument: str, status: str):
+    conn.execute(
+        "INSERT INTO level_changes(level_id, instrument, status, changed_at) VALUES (?,?,?,?)",
+        (level_id, instrument, status, _now()),
+    )
+
+
+def _row_to_dict(row: sqlite3.Row) -> dict:
+    return {key: row[key] for key in row.keys()}
+
+
+# --- Запись ---
+
+def upsert_levels(instrument: str, levels: list[dict], source_id: str | None = None,
+                  ttl_hours: float | None = DEFAULT_TTL_HOURS) -> int:
+    """
+    Атомарно добавляет уровни инструмента. Уровень с тем же значением
+    обновляется и снова становится активным. Возвращает число изменённых уровней.
+    """
+    if not levels:
+        return 0
+    instrument = instrument.upper()
+    now = _now()
+    expires_at = (datetime.now() + timedelta(hours=ttl_hours)).strftime("%Y-%m-%d %H:%M:%S") if ttl_hours else None
+
+    conn = _connect()
+    changed = []
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for level in levels:
+            row = conn.execute(
+                """
+                INSERT INTO key_levels(instrument, level, type, source_id, status, created_at, updated_at, expires_at)
+                VALUES (?,?,?,?,'active',?,?,?)
+                ON CONFLICT(instrument, level) DO UPDATE SET
+                    type = excluded.type,
+                    source_id = excluded.source_id,
+                    status = 'active',
+                    updated_at = excluded.updated_at,
+                    expires_at = excluded.expires_at
+                RETURNING id
+                """,
+                (instrument, float(level["level"]), level.get("type"),
+                 level.get("source_id", source_id), now, now, level.get("expires_at", expires_at)),
+            ).fetchone()
+            _record_change(conn, row["id"], instrument, STATUS_ACTIVE)
+            changed.append(row["id"])
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    _notify()
+    return len(changed)
+
+
+def set_status(level_id: int, status: str) -> bool:
+    """
+    Переводит уровень в новый статус, если переход разрешён (compare-and-set).
+    Возвращает False, если уровень уже в другом состоянии (например, его
+    параллельно отметил другой процесс).
+    """
+    allowed_from = ALLOWED_TRANSITIONS[status]
+    placeholders = ",".join("?" * len(allowed_from))
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            f"UPDATE key_levels SET status = ?, updated_at = ? "
+            f"WHERE id = ? AND status IN ({placeholders}) RETURNING instrument",
+            (status, _now(), level_id, *allowed_from),
+        ).fetchone()
+        if row:
+            _record_change(conn, level_id, row["instrument"], status)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    if row:
+        _notify()
+    return row is not None
+
+
+def expire_stale(now: datetime | None = None) -> int:
+    """Помечает истёкшими активные уровни с прошедшим `expires_at`."""
+    now_str = (now or datetime.now()).strftime("%Y-%m-%d %H:%M:%S")
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute(
+            "UPDATE key_levels SET status = 'expired', updated_at = ? "
+            "WHERE status = 'active' AND expires_at IS NOT NULL AND expires_at <= ? "
+            "RETURNING id, instrument",
+            (now_str, now_str),
+        ).fetchall()
+        for row in rows:
+            _record_change(conn, row["id"], row["instrument"], STATUS_EXPIRED)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    if rows:
+        _notify()
+    return len(rows)
+
+
+# --- Чтение ---
+
+def load_levels(status: str | None = STATUS_ACTIVE) -> dict[str, list[dict]]:
+    """Возвращает уровни в формате старого key_levels.json: {инструмент: [уровни]}."""
+    query = "SELECT * FROM key_levels"
+    params = []
+    if status:
+        query += " WHERE status = ?"
+        params.append(status)
+    query += " ORDER BY instrument, level"
+
+    conn = _connect()
+    try:
+        rows = conn.execute(query, params).fetchall()
+    finally:
+        conn.close()
+
+    result = {}
+    for row in rows:
+        result.setdefault(row["instrument"], []).append(_row_to_dict(row))
+    return result
+
+
+def last_seq() -> int:
+    conn = _connect()
+    try:
+        return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM level_changes").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def changes_since(seq: int) -> list[dict]:
+    """Изменения после `seq` (по возрастанию)."""
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT * FROM level_changes WHERE seq > ? ORDER BY seq", (seq,)).fetchall()
+    finally:
+        conn.close()
+    return [_row_to_dict(row) for row in rows]
+
+
+# --- Лента изменений ---
+
+def subscribe(callback):
+    """Регистрирует callback() для изменений, сделанных в этом процессе."""
+    if callback not in _subscribers:
+        _subscribers.append(callback)
+
+
+def _notify():
+    for callback in list(_subscribers):
+        try:
+            callback()
+        except Exception:
+            pass
+    if not hasattr(socket, "AF_UNIX") or not FEED_DIR.exists():
+        return
+    payload = str(os.getpid()).encode()
+    for sock_path in FEED_DIR.glob("*.sock"):
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sender.sendto(payload, str(sock_path))
+        except (ConnectionRefusedError, FileNotFoundError):
+            # Слушатель завершился, не убрав сокет
+            sock_path.unlink(missing_ok=True)
+        except OSError:
+            pass
+        finally:
+            sender.close()
+
+
+class ChangeFeed:
+    """
+    Подписка на изменения уровней из любого процесса.
+
+    `wait(timeout)` возвращает новые записи `level_changes`, как только они
+    появились, или пустой список по таймауту. На системах без Unix-сокетов
+    лента опрашивает `seq` в базе (дешёвый индексный запрос).
+    """
+
+    POLL_FALLBACK_SECONDS = 2.0
+
+    def __init__(self):
+        self.seq = last_seq()
+        self._sock = None
+        self._path = None
+        if hasattr(socket, "AF_UNIX"):
+            FEED_DIR.mkdir(parents=True, exist_ok=True)
+            self._path = FEED_DIR / f"{os.getpid()}-{uuid.uuid4().hex[:8]}.sock"
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sock.bind(str(self._path))
+        self._local = threading.Event()
+        self._callback = self._local.set
+        subscribe(self._callback)
+
+    def _drain_socket(self):
+        while True:
+            try:
+                self._sock.recv(64, socket.MSG_DONTWAIT)
+            except (BlockingIOError, OSError):
+                return
+
+    def wait(self, timeout: float) -> list[dict]:
+        deadline = time.monotonic() + timeout
+        while True:
+            changes = changes_since(self.seq)
+            if changes:
+                self.seq = changes[-1]["seq"]
+                self._local.clear()
+                if self._sock:
+                    self._drain_socket()
+                return changes
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+            if self._local.is_set():
+                self._local.clear()
+                continue
+            if self._sock:
+                ready, _, _ = select.select([self._sock], [], [], min(remaining, self.POLL_FALLBACK_SECONDS))
+                if ready:
+                    self._drain_socket()
+            else:
+                self._local.wait(min(remaining, self.POLL_FALLBACK_SECONDS))
+
+    def close(self):
+        if self._callback in _subscribers:
+            _subscribers.remove(self._callback)
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+        if self._path:
+            self._path.unlink(missing_ok=True)
+
+
+# --- Миграция старого JSON ---
+
+def _migrate_legacy_json(conn: sqlite3.Connection):
+    """Однократно переносит key_levels.json (файл переименовывается в *.migrated)."""
+    for json_path in LEGACY_JSON_FILES:
+        if not json_path.exists():
+            continue
+        try:
+            data = json.loads(json_path.read_text(encoding="utf-8") or "{}")
+        except (OSError, json.JSONDecodeError):
+            continue
+        now = _now()
+        conn.execute("BEGIN IMMEDIATE")
+        for instrument, levels in data.items():
+            for level in levels:
+                status = level.get("status", STATUS_ACTIVE)
+                if status not in ALLOWED_TRANSITIONS:
+                    status = STATUS_ACTIVE
+                conn.execute(
+                    "INSERT OR IGNORE INTO key_levels(instrument, level, type, source_id, status, created_at, updated_at) "
+                    "VALUES (?,?,?,?,?,?,?)",
+                    (instrument.upper(), float(level["level"]), level.get("type"), level.get("source_id"),
+                     status, now, now),
+                )
+        conn.execute("COMMIT")
+        json_path.rename(json_path.with_suffix(".json.migrated"))
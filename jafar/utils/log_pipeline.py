@@ -0,0 +1,405 @@
+"""Асинхронная запись логов с ротацией и gzip; безопасна при записи из нескольких процессов."""
+
+import os
+import sys
+import gzip
+import time
+import queue
+import atexit
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: без межпроцессной блокировки
+    fcntl = None
+
+FLUSH_INTERVAL = 0.2    # сек: как часто писатель сбрасывает пачку на диск
+FSYNC_INTERVAL = 1.0    # сек: как часто делать fsync
+MAX_BATCH = 1000        # записей за один проход писателя
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+
+_STOP = object()
+
+
+class _Sink:
+    """Открытый файл лога с параметрами ротации."""
+
+    def __init__(self, path: str, max_bytes: int, backup_count: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.file = None
+        self.dirty = False
+        self.locked = False
+        self._lock_fd = None
+
+    def open(self):
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.file = open(self.path, "a", encoding="utf-8")
+        return self.file
+
+    def close(self):
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.file = None
+            self.dirty = False
+
+    # --- Межпроцессная блокировка ---
+
+    def _flock(self, operation: str):
+        if fcntl is None:
+            return
+        if self._lock_fd is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._lock_fd = os.open(self.path + ".lock", os.O_CREAT | os.O_RDWR, 0o644)
+        fcntl.flock(self._lock_fd, getattr(fcntl, operation))
+
+    def _rotated_away(self) -> bool:
+        """Наш дескриптор указывает не на тот файл, что сейчас лежит по пути (ротация другим процессом)."""
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self.file.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def begin(self):
+        """Начало пачки: разделяемая блокировка и переоткрытие файла после чужой ротации."""
+        if self.locked:
+            return
+        self._flock("LOCK_SH")
+        self.locked = True
+        if self.file is not None and self._rotated_away():
+            self.close()
+
+    def write(self, text: str):
+        self.begin()
+        self.open().write(text)
+        self.dirty = True
+
+    def end(self):
+        """Конец пачки: данные уходят в файл до снятия блокировки, затем проверка размера."""
+        if not self.locked:
+            return
+        try:
+            if self.file is not None:
+                self.file.flush()
+        finally:
+            self._flock("LOCK_UN")
+            self.locked = False
+        self.rotate_if_needed()
+
+    def release(self):
+        self.end()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    # --- Ротация ---
+
+    def rotate_if_needed(self):
+        if not self.max_bytes or self.file is None or os.fstat(self.file.fileno()).st_size < self.max_bytes:
+            return
+        self._flock("LOCK_EX")
+        try:
+            if self._rotated_away():
+                # Сегмент уже ротировал другой процесс: просто пишем в новый файл
+                self.close()
+                return
+            inode = os.fstat(self.file.fileno()).st_ino
+            self.close()
+            stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+            segment = f"{self.path}.{stamp}.{inode}"
+            os.replace(self.path, segment)
+        finally:
+            self._flock("LOCK_UN")
+        # Сжатие — вне блокировки: в переименованный сегмент больше никто не пишет
+        with open(segment, "rb") as src, gzip.open(segment + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(segment)
+        self._prune_segments()
+
+    def _prune_segments(self):
+        segments = [segment for segment, _ in rotated_segments(self.path) if segment.endswith(".gz")]
+        for segment in segments[:-self.backup_count] if self.backup_count else []:
+            os.remove(segment)
+
+
+def rotated_segments(path) -> list[tuple[str, int | None]]:
+    """
+    Ротированные сегменты лога от старых к новым: [(путь, inode исходного файла или None)].
+    Сегмент, который ещё сжимается, отдаётся несжатым.
+    """
+    path = str(path)
+    directory = os.path.dirname(path) or "."
+    prefix = os.path.basename(path) + "."
+    try:
+        names = set(os.listdir(directory))
+    except FileNotFoundError:
+        return []
+    segments = {}
+    for name in sorted(names):
+        if not name.startswith(prefix):
+            continue
+        stem = name[len(prefix):]
+        compressed = stem.endswith(".gz")
+        stem = stem.removesuffix(".gz")
+        parts = stem.split(".")
+        inode = int(parts[1]) if len(parts) == 2 and parts[1].isdigit() else None
+        if not compressed and inode is None:
+            continue  # .lock и прочие файлы рядом
+        if compressed and stem in segments:
+            continue  # пока несжатый сегмент существует, он полный, а .gz рядом может быть недописан
+        segments[stem] = (os.path.join(directory, name), inode)
+    return [segments[stem] for stem in sorted(segments)]
+
+
+@contextmanager
+def shared_lock(path):
+    """Разделяемая блокировка лога для читателя: пока она взята, ротации не будет."""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(str(path)) or ".", exist_ok=True)
+    fd = os.open(f"{path}.lock", os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        yield
+    finally:
+        os.close(fd)
+
+
+def read_segment(segment: str) -> bytes:
+    """Содержимое сегмента; несжатый мог успеть смениться своим .gz."""
+    if not segment.endswith(".gz"):
+        try:
+            with open(segment, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            segment += ".gz"
+    with gzip.open(segment, "rb") as f:
+        return f.read()
+
+
+class LogPipeline:
+    """Очередь записей + фоновый поток-писатель."""
+
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL, fsync_interval: float = FSYNC_INTERVAL):
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self._queue = queue.SimpleQueue()
+        self._sinks: dict[str, _Sink] = {}
+        self._sink_config: dict[str, tuple[int, int]] = {}
+        self._last_fsync = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="jafar-log-writer", daemon=True)
+        self._closed = False
+        self._thread.start()
+
+    # --- API для вызывающего кода (не блокирует) ---
+
+    def configure(self, path, max_bytes: int = DEFAULT_MAX_BYTES, backup_count: int = DEFAULT_BACKUP_COUNT):
+        """Задаёт параметры ротации для файла (0 — не ротировать)."""
+        self._sink_config[str(path)] = (max_bytes, backup_count)
+
+    def write(self, path, text: str):
+        """Ставит текст в очередь на дозапись в файл `path`."""
+        if self._closed:
+            _append_now(str(path), text)
+            return
+        self._queue.put((str(path), text))
+
+    def submit_task(self, func, *args, **kwargs):
+        """
+        Выполняет func(*args, **kwargs) в потоке-писателе, в порядке очереди.
+        Для записей, которые идут не в файл (например, память анализов в SQLite).
+        """
+        if self._closed:
+            func(*args, **kwargs)
+            return
+        self._queue.put((func, args, kwargs))
+
+    def flush(self, timeout: float | None = 5.0) -> bool:
+        """Дожидается, пока всё, что уже в очереди, записано и синхронизировано."""
+        if self._closed:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 5.0):
+        """Дописывает очередь и закрывает файлы (вызывается через atexit)."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    # --- Поток-писатель ---
+
+    def _sink(self, path: str) -> _Sink:
+        sink = self._sinks.get(path)
+        if sink is None:
+            max_bytes, backup_count = self._sink_config.get(path, (DEFAULT_MAX_BYTES, DEFAULT_BACKUP_COUNT))
+            sink = self._sinks[path] = _Sink(path, max_bytes, backup_count)
+        return sink
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self._sync(force=False)
+                continue
+
+            batch = [item]
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            waiters = []
+            for record in batch:
+                if record is _STOP:
+                    stop = True
+                elif isinstance(record, threading.Event):
+                    waiters.append(record)
+                else:
+                    self._handle(record)
+            for sink in self._sinks.values():
+                if sink.locked:
+                    self._safe(sink.end)
+
+            self._sync(force=bool(waiters) or stop)
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                for sink in self._sinks.values():
+                    self._safe(sink.close)
+                    self._safe(sink.release)
+                return
+
+    def _handle(self, record):
+        if len(record) == 3:
+            func, args, kwargs = record
+            self._safe(func, *args, **kwargs)
+            return
+        path, text = record
+        sink = self._sink(path)
+        try:
+            sink.write(text)
+        except OSError as e:
+            print(f"Critical: Failed to write to log file {path}. Error: {e}", file=sys.stderr)
+
+    def _sync(self, force: bool):
+        dirty = [sink for sink in self._sinks.values() if sink.dirty and sink.file is not None]
+        if not dirty:
+            return
+        for sink in dirty:
+            self._safe(sink.file.flush)
+        now = time.monotonic()
+        if force or now - self._last_fsync >= self.fsync_interval:
+            for sink in dirty:
+                self._safe(os.fsync, sink.file.fileno())
+                sink.dirty = False
+            self._last_fsync = now
+
+    @staticmethod
+    def _safe(func, *args, **kwargs):
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            print(f"Log pipeline error in {getattr(func, '__name__', func)}: {e}", file=sys.stderr)
+
+
+def _append_now(path: str, text: str):
+    """Синхронная дозапись (после закрытия конвейера и для бенчмарка)."""
+    sink = _Sink(path, 0, 0)
+    try:
+        sink.write(text)
+    finally:
+        sink.close()
+        sink.release()
+
+
+class PipelineLogHandler(logging.Handler):
+    """logging.Handler, отправляющий отформатированные записи в конвейер."""
+
+    def __init__(self, path, pipeline: LogPipeline | None = None):
+        super().__init__()
+        self.path = str(path)
+        self.pipeline = pipeline
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            (self.pipeline or get_pipeline()).write(self.path, self.format(record) + "\n")
+        except Exception:
+            self.handleError(record)
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline() -> LogPipeline:
+    """Общий конвейер процесса (создаётся при первом обращении)."""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = LogPipeline()
+            atexit.register(_pipeline.close)
+    return _pipeline
+
+
+def write(path, text: str):
+    get_pipeline().write(path, text)
+
+
+def submit_task(func, *args, **kwargs):
+    get_pipeline().submit_task(func, *args, **kwargs)
+
+
+def flush(timeout: float | None = 5.0) -> bool:
+    return get_pipeline().flush(timeout)
+
+
+if __name__ == "__main__":
+    # Бенчмарк: стоимость одной записи лога на пути команды — до и после.
+    # python -m jafar.utils.log_pipeline [кол-во записей]
+    import json
+    import tempfile
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    line = json.dumps({"command": "atrade GC", "status": "success", "duration": 1.2345}) + "\n"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sync_path = os.path.join(tmp, "sync.jsonl")
+        start = time.perf_counter()
+        for _ in range(count):
+            with open(sync_path, "a", encoding="utf-8") as f:
+                f.write(line)
+        sync_elapsed = time.perf_counter() - start
+
+        pipeline = LogPipeline()
+        async_path = os.path.join(tmp, "async.jsonl")
+        start = time.perf_counter()
+        for _ in range(count):
+            pipeline.write(async_path, line)
+        async_elapsed = time.perf_counter() - start
+        pipeline.flush(timeout=None)
+        drain_elapsed = time.perf_counter() - start
+        pipeline.close()
+
+        assert os.path.getsize(async_path) == os.path.getsize(sync_path)
+
+    print(f"Записей: {count}")
+    print(f"open/append/close:  {sync_elapsed / count * 1e6:8.2f} мкс на запись")
+    print(f"конвейер (вызов):   {async_elapsed / count * 1e6:8.2f} мкс на запись")
+    print(f"конвейер (до диска): {drain_elapsed:.3f} с всего, {count / drain_elapsed:,.0f} записей/с")
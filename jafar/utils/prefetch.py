@@ -0,0 +1,144 @@
+"""Упреждающая фоновая загрузка новостей, календаря и счетов для анализа."""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+
+DEFAULT_SOURCES = ("news", "calendar", "account")
+
+
+class SourceUnavailable(Exception):
+    """Загрузчик вернул ошибку вместо данных: `value` отдаётся вызывающему, но не кэшируется."""
+
+    def __init__(self, value):
+        super().__init__(str(value))
+        self.value = value
+
+
+def _checked_text(text: str) -> str:
+    if not text or text.startswith("Ошибка"):
+        raise SourceUnavailable(text)
+    return text
+
+
+def _load_news():
+    from jafar.utils.news_api import get_unified_news
+
+    return _checked_text(get_unified_news())
+
+
+def _load_calendar():
+    from jafar.cli.economic_calendar_fetcher import fetch_economic_calendar_data
+
+    return _checked_text(fetch_economic_calendar_data())
+
+
+def _load_account_list():
+    from jafar.utils.topstepx_api_client import get_shared_client
+
+    accounts = get_shared_client().get_account_list()
+    if not accounts or not accounts.get("accounts"):
+        raise SourceUnavailable(accounts)
+    return accounts
+
+
+# имя -> (загрузчик, TTL в секундах)
+SOURCES = {
+    "news": (_load_news, 300.0),
+    "calendar": (_load_calendar, 180.0),
+    "account": (_load_account_list, 30.0),
+}
+
+
+class PrefetchCache:
+    """Кэш с TTL, где каждая запись — Future: параллельные запросы к одному ключу сливаются в один."""
+
+    def __init__(self, max_workers: int = 4):
+        self._entries: dict[str, tuple[Future, float]] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh(self, key: str, ttl: float) -> Future | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        future, started = entry
+        if future.done() and (future.exception() is not None or time.monotonic() - started > ttl):
+            del self._entries[key]
+            return None
+        return future
+
+    def prefetch(self, key: str, loader, ttl: float) -> Future:
+        """Запускает загрузку в фоне (если свежего результата или загрузки в процессе ещё нет)."""
+        with self._lock:
+            future = self._fresh(key, ttl)
+            if future is None:
+                future = self._pool.submit(loader)
+                self._entries[key] = (future, time.monotonic())
+            return future
+
+    def get(self, key: str, loader, ttl: float):
+        """Свежий результат, результат идущей загрузки или синхронная загрузка."""
+        with self._lock:
+            future = self._fresh(key, ttl)
+            if future is None:
+                self.misses += 1
+                future = Future()
+                self._entries[key] = (future, time.monotonic())
+                owner = True
+            else:
+                self.hits += 1
+                owner = False
+        if not owner:
+            try:
+                return future.result()
+            except Exception:
+                # Фоновая загрузка упала — пробуем ещё раз, уже синхронно
+                return loader()
+        # Грузим в текущем потоке; остальные ждут этот же Future
+        try:
+            result = loader()
+        except BaseException as e:
+            future.set_exception(e)
+            with self._lock:
+                if self._entries.get(key, (None,))[0] is future:
+                    del self._entries[key]
+            raise
+        future.set_result(result)
+        return result
+
+    def invalidate(self, key: str | None = None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+_cache = PrefetchCache()
+
+
+def prefetch_context(names=DEFAULT_SOURCES) -> list[str]:
+    """Фоновая загрузка источников по именам. Возвращает запущенные имена."""
+    started = []
+    for name in names:
+        if name in SOURCES:
+            loader, ttl = SOURCES[name]
+            _cache.prefetch(name, loader, ttl)
+            started.append(name)
+    return started
+
+
+def fetch(name: str):
+    """Данные источника: из кэша / идущей загрузки, иначе загрузка сейчас."""
+    loader, ttl = SOURCES[name]
+    try:
+        return _cache.get(name, loader, ttl)
+    except SourceUnavailable as e:
+        return e.value
+
+
+def invalidate(name: str | None = None):
+    _cache.invalidate(name)
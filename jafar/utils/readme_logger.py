@@ -3,6 +3,8 @@ import json
 from datetime import datetime
 from pathlib import Path
 
+from jafar.utils import log_pipeline
+
 # Директория для логов
 MARKDOWN_DIR = Path.home() / ".jafar_cache" / "markdown"
 MARKDOWN_DIR.mkdir(parents=True, exist_ok=True)
@@ -15,7 +17,7 @@ def log_to_readme(
     action_type, description, result=None, notes=None, errors=None, stdout=None
 ):
     """
-    Логирует действия в markdown-файл.
+    Логирует действия в markdown-файл (запись идёт через фоновый конвейер логов).
     """
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     entry = f"\n---\n## 🗓️ {timestamp}\n"
@@ -38,7 +40,6 @@ def log_to_readme(
         errors_str = str(errors)
         entry += f"\n#### ❌ Ошибки\n```\n{errors_str.strip()}\n```\n"
 
-    with open(README_PATH, "a", encoding="utf-8") as f:
-        f.write(entry)
+    log_pipeline.write(README_PATH, entry)
 
     return entry  # можно возвращать для логов или повторного вывода
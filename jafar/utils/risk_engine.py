@@ -0,0 +1,228 @@
+"""Расчёт риска и размера позиции для торговых хендлеров (векторно на NumPy).
+
+    python -m jafar.utils.risk_engine bench
+"""
+
+import sys
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+WINNING_DAY_TARGET_USD = 150.0
+MIN_POSITION_SIZE = 0.01
+DEFAULT_MAX_CONTRACTS = 1  # для инструментов, которых нет в MAX_CONTRACTS_MAP
+
+MAX_CONTRACTS_MAP = {
+    "MGC": 50,
+    "GC": 5,
+    "CL": 10,
+    "ES": 10,
+}
+CONTRACT_MULTIPLIERS = {
+    "GC": 100.0, "MGC": 10.0, "EURUSD": 100000.0, "GBPUSD": 100000.0,
+    "USDJPY": 100000.0, "SPX500": 50.0,
+}
+
+# Коды ошибок в массиве `error` (0 — вариант корректен)
+OK = 0
+ERR_ZERO_RISK = 1
+ERR_TOO_SMALL = 2
+ERR_UNKNOWN_INSTRUMENT = 3
+ERROR_MESSAGES = {
+    ERR_ZERO_RISK: "Risk per unit is zero.",
+    ERR_TOO_SMALL: "Calculated position size is too small.",
+    ERR_UNKNOWN_INSTRUMENT: "Unknown instrument: no contract multiplier.",
+}
+
+
+def max_contracts_for(symbols) -> np.ndarray:
+    return np.array([MAX_CONTRACTS_MAP.get(s, DEFAULT_MAX_CONTRACTS) for s in np.atleast_1d(symbols)], dtype=float)
+
+
+def multipliers_for(symbols) -> np.ndarray:
+    """Множители из справочника; неизвестный символ даёт NaN (передайте tickValue/tickSize явно)."""
+    return np.array([CONTRACT_MULTIPLIERS.get(s, np.nan) for s in np.atleast_1d(symbols)], dtype=float)
+
+
+def compute_metrics(entry, stop_loss, take_profit, multiplier, max_risk_usd, max_contracts,
+                    day_target_usd: float = WINNING_DAY_TARGET_USD) -> dict[str, np.ndarray]:
+    """
+    Векторный расчёт метрик сделки. Все аргументы — числа или массивы
+    совместимой формы. Возвращает словарь массивов одной формы; у вариантов
+    с error != 0 остальные поля равны 0.
+    """
+    entry, stop_loss, take_profit, multiplier, max_risk_usd, max_contracts = np.broadcast_arrays(
+        *(np.asarray(a, dtype=float) for a in (entry, stop_loss, take_profit, multiplier, max_risk_usd, max_contracts))
+    )
+    risk_per_contract = np.abs(entry - stop_loss) * multiplier
+    known = np.isfinite(multiplier) & (multiplier > 0)
+    error = np.where(~known, ERR_UNKNOWN_INSTRUMENT, np.where(risk_per_contract > 0, OK, ERR_ZERO_RISK))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        position_size = np.minimum(max_risk_usd / risk_per_contract, max_contracts)
+    error = np.where((error == OK) & ~(position_size >= MIN_POSITION_SIZE), ERR_TOO_SMALL, error)
+    valid = error == OK
+    position_size = np.where(valid, position_size, 0.0)
+
+    total_risk_usd = position_size * risk_per_contract
+    total_profit_usd = position_size * np.abs(take_profit - entry) * multiplier
+    with np.errstate(divide="ignore", invalid="ignore"):
+        risk_reward_ratio = np.where(total_risk_usd > 0, total_profit_usd / total_risk_usd, np.inf)
+    total_risk_usd = np.where(valid, total_risk_usd, 0.0)
+    total_profit_usd = np.where(valid, total_profit_usd, 0.0)
+    return {
+        "position_size": position_size,
+        "total_risk_usd": total_risk_usd,
+        "total_profit_usd": total_profit_usd,
+        "risk_reward_ratio": np.where(valid, risk_reward_ratio, 0.0),
+        "meets_winning_day_target": valid & (total_profit_usd >= day_target_usd),
+        "error": error,
+    }
+
+
+def evaluate_plans(entries, stops, targets, risk_percents, symbols, balance: float, multipliers=None) -> dict[str, np.ndarray]:
+    """
+    Пачка планов по разным инструментам: риск задаётся в процентах от баланса,
+    лимит контрактов и (если multipliers не передан) множитель берутся по символу.
+    """
+    if multipliers is None:
+        multipliers = multipliers_for(symbols)
+    max_risk_usd = balance * np.asarray(risk_percents, dtype=float) / 100.0
+    return compute_metrics(entries, stops, targets, multipliers, max_risk_usd, max_contracts_for(symbols))
+
+
+def calculate_trade_metrics(entry_price, stop_loss, take_profit, contract_multiplier, max_risk_for_trade, contract_symbol: str):
+    """Скалярный интерфейс хендлеров: словарь с округлёнными метриками или {"error": ...}."""
+    metrics = compute_metrics(
+        entry_price, stop_loss, take_profit, contract_multiplier, max_risk_for_trade,
+        MAX_CONTRACTS_MAP.get(contract_symbol, DEFAULT_MAX_CONTRACTS),
+    )
+    error = int(metrics["error"])
+    if error in (ERR_ZERO_RISK, ERR_UNKNOWN_INSTRUMENT):
+        return {"error": ERROR_MESSAGES[error]}
+    if error == ERR_TOO_SMALL:
+        raw_size = max_risk_for_trade / (abs(entry_price - stop_loss) * contract_multiplier)
+        return {"error": f"Calculated position size ({raw_size:.2f}) is too small."}
+    return {
+        "position_size": round(float(metrics["position_size"]), 2),
+        "total_risk_usd": round(float(metrics["total_risk_usd"]), 2),
+        "total_profit_usd": round(float(metrics["total_profit_usd"]), 2),
+        "risk_reward_ratio": round(float(metrics["risk_reward_ratio"]), 2),
+        "meets_winning_day_target": bool(metrics["meets_winning_day_target"]),
+    }
+
+
+@dataclass
+class ScenarioGrid:
+    """Результат перебора: строки — расширение стопа в тиках, столбцы — риск в процентах."""
+    sl_widen_ticks: np.ndarray
+    risk_percents: np.ndarray
+    stop_loss: np.ndarray
+    metrics: dict[str, np.ndarray]
+
+    @property
+    def size(self) -> int:
+        return self.metrics["position_size"].size
+
+    def best(self, key: str = "total_profit_usd", max_risk_usd: float | None = None) -> dict | None:
+        """Лучший корректный вариант по key (с необязательным потолком риска в USD)."""
+        mask = self.metrics["error"] == OK
+        if max_risk_usd is not None:
+            mask &= self.metrics["total_risk_usd"] <= max_risk_usd
+        if not mask.any():
+            return None
+        score = np.where(mask, self.metrics[key], -np.inf)
+        row, col = np.unravel_index(np.argmax(score), score.shape)
+        return self._row(row, col)
+
+    def _row(self, row: int, col: int) -> dict:
+        result = {
+            "sl_widen_ticks": int(self.sl_widen_ticks[row]),
+            "risk_percent": float(self.risk_percents[col]),
+            "stop_loss": float(self.stop_loss[row]),
+        }
+        for name, values in self.metrics.items():
+            if name != "error":
+                value = values[row, col]
+                result[name] = bool(value) if values.dtype == bool else round(float(value), 2)
+        return result
+
+    def to_rows(self) -> list[dict]:
+        rows, cols = self.metrics["position_size"].shape
+        return [self._row(r, c) for r in range(rows) for c in range(cols) if self.metrics["error"][r, c] == OK]
+
+
+def scenario_grid(entry: float, stop_loss: float, take_profit: float, multiplier: float, balance: float,
+                  contract_symbol: str, tick_size: float, sl_widen_ticks=range(5, 31),
+                  risk_percents=np.arange(2.0, 20.5, 0.5)) -> ScenarioGrid:
+    """
+    Варианты плана «что если стоп на N тиков дальше от входа при риске P%».
+    Стоп отодвигается от входа в сторону исходного стопа; вход и цель не меняются.
+    Стоп, равный входу, не задаёт направления сделки — это ValueError.
+    """
+    if stop_loss == entry:
+        raise ValueError("Stop-loss equals entry: trade direction is undefined.")
+    ticks = np.asarray(list(sl_widen_ticks), dtype=float)
+    percents = np.asarray(risk_percents, dtype=float)
+    direction = np.sign(stop_loss - entry)
+    stops = stop_loss + direction * ticks * tick_size
+    metrics = compute_metrics(
+        entry, stops[:, None], take_profit, multiplier, balance * percents[None, :] / 100.0,
+        MAX_CONTRACTS_MAP.get(contract_symbol, DEFAULT_MAX_CONTRACTS),
+    )
+    return ScenarioGrid(ticks, percents, stops, metrics)
+
+
+def scenario_summary(entry: float, stop_loss: float, take_profit: float, multiplier: float, balance: float,
+                     contract_symbol: str, tick_size: float, max_risk_usd: float) -> dict:
+    """Сводка сетки для подтверждения ордера: сколько вариантов с более широким стопом укладывается в риск сделки и лучший из них."""
+    grid = scenario_grid(float(entry), float(stop_loss), float(take_profit), multiplier, balance, contract_symbol, tick_size)
+    valid = grid.metrics["error"] == OK
+    within_risk = valid & (grid.metrics["total_risk_usd"] <= max_risk_usd)
+    return {
+        "variants": grid.size,
+        "valid": int(valid.sum()),
+        "within_risk": int(within_risk.sum()),
+        "best_within_risk": grid.best(max_risk_usd=max_risk_usd),
+    }
+
+
+def _scalar_reference(entry_price, stop_loss, take_profit, contract_multiplier, max_risk_for_trade, contract_symbol):
+    # Прежняя построчная реализация — только для сравнения в бенчмарке
+    risk_per_contract = abs(entry_price - stop_loss) * contract_multiplier
+    if risk_per_contract == 0:
+        return None
+    position_size = min(max_risk_for_trade / risk_per_contract, MAX_CONTRACTS_MAP.get(contract_symbol, 1))
+    if position_size < MIN_POSITION_SIZE:
+        return None
+    total_profit_usd = position_size * abs(take_profit - entry_price) * contract_multiplier
+    return position_size, position_size * risk_per_contract, total_profit_usd
+
+
+def benchmark(n: int = 100_000):
+    rng = np.random.default_rng(7)
+    entries = rng.uniform(2300, 2400, n)
+    stops = entries - rng.uniform(0.5, 15, n)
+    targets = entries + rng.uniform(1, 40, n)
+    risk_usd = rng.uniform(50, 500, n)
+    started = time.perf_counter()
+    for i in range(n):
+        _scalar_reference(entries[i], stops[i], targets[i], 10.0, risk_usd[i], "MGC")
+    scalar = time.perf_counter() - started
+    started = time.perf_counter()
+    metrics = compute_metrics(entries, stops, targets, 10.0, risk_usd, MAX_CONTRACTS_MAP["MGC"])
+    vectorized = time.perf_counter() - started
+    print(f"{n} plans: scalar loop {scalar * 1000:.1f} ms, vectorized {vectorized * 1000:.2f} ms "
+          f"({scalar / vectorized:.0f}x); valid {int((metrics['error'] == OK).sum())}")
+
+    started = time.perf_counter()
+    grid = scenario_grid(2350.0, 2345.0, 2365.0, 10.0, 50_000.0, "MGC", 0.1)
+    print(f"scenario grid {grid.metrics['position_size'].shape} = {grid.size} variants "
+          f"in {(time.perf_counter() - started) * 1000:.2f} ms; best: {grid.best()}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        benchmark()
+    else:
+        print(calculate_trade_metrics(2350.0, 2345.0, 2365.0, 10.0, 600.0, "MGC"))
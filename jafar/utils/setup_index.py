@@ -0,0 +1,289 @@
+"""Поиск похожих прошлых сетапов по вектору признаков анализа."""
+
+import math
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+
+from jafar.utils import analysis_memory
+
+SESSION_KEYS = ("asia", "london", "new_york")
+FEATURE_NAMES = (
+    "session_asia", "session_london", "session_new_york",
+    "hour_sin", "hour_cos",
+    "news_sentiment", "calendar_sentiment",
+    "level_distance",
+)
+# Вес признака при сравнении: сессия и сентимент важнее времени суток
+FEATURE_WEIGHTS = np.array([1.0, 1.0, 1.0, 0.5, 0.5, 1.5, 1.0, 1.2], dtype=np.float32)
+DIM = len(FEATURE_NAMES)
+
+# С какого размера включать приближённый поиск (LSH)
+APPROX_MIN_ENTRIES = 20000
+LSH_PLANES = 10
+
+_BULLISH_WORDS = ("бычий", "bullish", "буқа", "бука", "рост", "buqa", "o'sish")
+_BEARISH_WORDS = ("медвежий", "bearish", "айиқ", "медвед", "падение", "ayiq", "pasayish")
+
+
+# --- Признаки ---
+
+def sentiment_score(text: str | None) -> float:
+    """Грубая оценка сентимента текста в диапазоне [-1, 1]."""
+    if not text:
+        return 0.0
+    lowered = str(text).lower()
+    bull = sum(lowered.count(word) for word in _BULLISH_WORDS)
+    bear = sum(lowered.count(word) for word in _BEARISH_WORDS)
+    if bull + bear == 0:
+        return 0.0
+    return (bull - bear) / (bull + bear)
+
+
+def session_flags(session: str | None, hour: int) -> dict:
+    """Определяет активные сессии по строке get_current_trading_session() или по часу UTC."""
+    if session:
+        lowered = session.lower()
+        return {
+            "asia": any(w in lowered for w in ("азиат", "токио", "tokyo", "asia")),
+            "london": any(w in lowered for w in ("лондон", "london", "европ")),
+            "new_york": any(w in lowered for w in ("нью-йорк", "new york", "америк")),
+        }
+    return {"asia": 0 <= hour < 9, "london": 7 <= hour < 16, "new_york": 12 <= hour < 21}
+
+
+def nearest_level_distance_pct(price: float | None, levels: list[float] | None) -> float | None:
+    """Знаковое расстояние (в %) от цены до ближайшего ключевого уровня."""
+    if not price or not levels:
+        return None
+    nearest = min(levels, key=lambda level: abs(price - level))
+    return (price - nearest) / price * 100
+
+
+def current_level_distance_pct(contract: str, *instruments: str) -> float | None:
+    """
+    Расстояние от последней цены контракта (движок индикаторов) до ближайшего
+    активного ключевого уровня; без сохранённых уровней — до high/low сессии, VWAP и POC.
+    """
+    from jafar.utils import indicators, key_levels_store
+
+    engine = indicators.get_engine()
+    summaries = [summary for tf in engine.timeframes(contract) if (summary := engine.summary(contract, tf))]
+    if not summaries:
+        return None
+    latest = max(summaries, key=lambda summary: summary["t"])
+    wanted = {name.lower() for name in (contract, *instruments) if name}
+    levels = [
+        float(level["level"])
+        for instrument, stored in key_levels_store.load_levels().items()
+        if instrument.lower() in wanted
+        for level in stored
+    ]
+    if not levels:
+        levels = [latest[key] for key in ("session_high", "session_low", "vwap", "poc") if latest.get(key)]
+    return nearest_level_distance_pct(latest["close"], levels)
+
+
+def build_setup_context(session: str | None = None, news_sentiment: str | None = None,
+                        calendar_sentiment: str | None = None, level_distance_pct: float | None = None,
+                        timestamp: datetime | None = None) -> dict:
+    """
+    Собирает сырые признаки сетапа. Этот словарь сохраняется в метаданных
+    анализа (`features`) и используется как запрос к индексу. Сентимент
+    оценивается по исходным текстам новостей и календаря (одинаково во всех
+    командах), время — в UTC.
+    """
+    timestamp = timestamp or datetime.utcnow()
+    flags = session_flags(session, timestamp.hour)
+    return {
+        "hour_utc": timestamp.hour + timestamp.minute / 60,
+        "sessions": [key for key in SESSION_KEYS if flags[key]],
+        "news_sentiment": round(sentiment_score(news_sentiment), 3),
+        "calendar_sentiment": round(sentiment_score(calendar_sentiment), 3),
+        "level_distance_pct": None if level_distance_pct is None else round(level_distance_pct, 4),
+    }
+
+
+def vectorize(context: dict) -> np.ndarray:
+    """Превращает словарь признаков в взвешенный нормированный вектор."""
+    hour = float(context.get("hour_utc") or 0.0)
+    sessions = context.get("sessions") or []
+    distance = context.get("level_distance_pct")
+    angle = 2 * math.pi * hour / 24
+    vector = np.array([
+        1.0 if "asia" in sessions else 0.0,
+        1.0 if "london" in sessions else 0.0,
+        1.0 if "new_york" in sessions else 0.0,
+        math.sin(angle),
+        math.cos(angle),
+        float(context.get("news_sentiment") or 0.0),
+        float(context.get("calendar_sentiment") or 0.0),
+        0.0 if distance is None else math.tanh(float(distance) / 0.5),
+    ], dtype=np.float32) * FEATURE_WEIGHTS
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+# --- Индекс ---
+
+class _InstrumentMatrix:
+    """Растущая матрица векторов одного инструмента (ёмкость удваивается)."""
+
+    def __init__(self, capacity: int = 256):
+        self.vectors = np.zeros((capacity, DIM), dtype=np.float32)
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.codes = np.zeros(capacity, dtype=np.int64)  # LSH-корзины
+        self.size = 0
+
+    def append(self, analysis_id: int, vector: np.ndarray, code: int):
+        if self.size == len(self.ids):
+            self.vectors = np.concatenate([self.vectors, np.zeros_like(self.vectors)])
+            self.ids = np.concatenate([self.ids, np.zeros_like(self.ids)])
+            self.codes = np.concatenate([self.codes, np.zeros_like(self.codes)])
+        self.vectors[self.size] = vector
+        self.ids[self.size] = analysis_id
+        self.codes[self.size] = code
+        self.size += 1
+
+
+class SetupIndex:
+    """kNN-индекс похожих сетапов по всем инструментам."""
+
+    def __init__(self):
+        self._matrices: dict[str, _InstrumentMatrix] = {}
+        self._lock = threading.Lock()
+        rng = np.random.default_rng(42)
+        self._planes = rng.standard_normal((LSH_PLANES, DIM)).astype(np.float32)
+        self._bit_weights = 1 << np.arange(LSH_PLANES)
+
+    def add(self, instrument: str, analysis_id: int, context: dict):
+        vector = vectorize(context)
+        code = int(self._hash(vector[None, :])[0])
+        with self._lock:
+            matrix = self._matrices.setdefault(instrument.upper(), _InstrumentMatrix())
+            matrix.append(analysis_id, vector, code)
+
+    def add_entry(self, entry: dict):
+        """Callback для analysis_memory: индексирует новый анализ."""
+        if entry.get("kind") != analysis_memory.KIND_ATRADE:
+            return
+        metadata = entry.get("metadata") or {}
+        context = metadata.get("features")
+        if not context:
+            # Старые (мигрированные) записи без признаков: восстанавливаем то, что можно
+            try:
+                created_at = datetime.strptime(entry["created_at"], "%Y-%m-%d %H:%M:%S")
+            except (TypeError, ValueError):
+                return
+            # created_at пишется в локальном времени, а живые запросы строятся по UTC
+            timestamp = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+            context = build_setup_context(news_sentiment=metadata.get("sentiment"), timestamp=timestamp)
+        self.add(entry["instrument"], entry["id"], context)
+
+    def __len__(self):
+        return sum(m.size for m in self._matrices.values())
+
+    def _hash(self, vectors: np.ndarray) -> np.ndarray:
+        return ((vectors @ self._planes.T) > 0) @ self._bit_weights
+
+    def _candidates(self, matrix: _InstrumentMatrix, query: np.ndarray) -> np.ndarray:
+        """Индексы-кандидаты из LSH-корзины запроса и соседних корзин (расстояние Хэмминга 1)."""
+        code = int(self._hash(query[None, :])[0])
+        codes = [code] + [code ^ (1 << bit) for bit in range(LSH_PLANES)]
+        return np.flatnonzero(np.isin(matrix.codes[:matrix.size], codes))
+
+    def query(self, instrument: str, context: dict, k: int = 3, approximate: bool | None = None,
+              exclude_ids: set | None = None) -> list[tuple[int, float]]:
+        """Возвращает [(analysis_id, сходство)] для k самых похожих сетапов."""
+        query = vectorize(context)
+        with self._lock:
+            matrix = self._matrices.get(instrument.upper())
+            if not matrix or matrix.size == 0:
+                return []
+            if approximate is None:
+                approximate = matrix.size >= APPROX_MIN_ENTRIES
+
+            rows = None
+            if approximate:
+                rows = self._candidates(matrix, query)
+                if len(rows) < k:
+                    rows = None  # слишком мало кандидатов — точный поиск
+            vectors = matrix.vectors[:matrix.size] if rows is None else matrix.vectors[rows]
+            ids = matrix.ids[:matrix.size] if rows is None else matrix.ids[rows]
+            similarities = vectors @ query
+
+        if exclude_ids:
+            mask = ~np.isin(ids, list(exclude_ids))
+            ids, similarities = ids[mask], similarities[mask]
+        if len(ids) == 0:
+            return []
+        top_k = min(k, len(ids))
+        top = np.argpartition(-similarities, top_k - 1)[:top_k]
+        top = top[np.argsort(-similarities[top])]
+        return [(int(ids[i]), float(similarities[i])) for i in top]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_setup_index() -> SetupIndex:
+    """Строит индекс из памяти анализов при первом обращении и подписывает его на новые записи."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            index = SetupIndex()
+            for entry in analysis_memory.iter_analyses(kind=analysis_memory.KIND_ATRADE):
+                index.add_entry(entry)
+            analysis_memory.add_save_listener(index.add_entry)
+            _index = index
+    return _index
+
+
+def record_outcome(analysis_id: int, outcome: str, r_multiple: float | None = None, notes: str | None = None):
+    """Фиксирует фактический исход сетапа (TP1, SL, BE, NO_FILL ...) для будущих подсказок."""
+    analysis_memory.update_metadata(analysis_id, {
+        "outcome": {"result": outcome, "r_multiple": r_multiple, "notes": notes,
+                    "recorded_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")},
+    })
+
+
+def find_similar_setups(instrument: str, context: dict, k: int = 3) -> list[dict]:
+    """Возвращает k похожих прошлых анализов (записи памяти + поле `similarity`)."""
+    matches = get_setup_index().query(instrument, context, k=k)
+    entries = analysis_memory.load_by_ids([analysis_id for analysis_id, _ in matches])
+    result = []
+    for analysis_id, similarity in matches:
+        if entry := entries.get(analysis_id):
+            entry["similarity"] = similarity
+            result.append(entry)
+    return result
+
+
+def format_similar_setups_for_prompt(instrument: str, context: dict, k: int = 3) -> str:
+    """Готовит блок «похожие прошлые сетапы» для промпта Gemini."""
+    try:
+        similar = find_similar_setups(instrument, context, k=k)
+    except Exception as e:
+        return f"Похожие сетапы недоступны: {e}"
+    if not similar:
+        return "Похожих прошлых сетапов в памяти нет."
+
+    lines = ["Похожие прошлые сетапы по этому инструменту (сессия, сентимент, уровни) и их исходы:"]
+    for entry in similar:
+        metadata = entry["metadata"]
+        plan = metadata.get("plan") or {}
+        features = metadata.get("features") or {}
+        outcome = metadata.get("outcome") or {}
+        outcome_text = outcome.get("result", "исход не зафиксирован")
+        if outcome.get("r_multiple") is not None:
+            outcome_text += f" ({outcome['r_multiple']:+.2f}R)"
+        lines.append(
+            f"- {entry['created_at']} (сходство {entry['similarity']:.2f}): "
+            f"сессии {', '.join(features.get('sessions') or []) or 'n/a'}, "
+            f"сентимент новостей {features.get('news_sentiment', 'n/a')}, "
+            f"план {plan.get('action', 'N/A')} @ {plan.get('entry', 'N/A')} "
+            f"(SL {plan.get('stop_loss', 'N/A')}, TP1 {plan.get('tp1', 'N/A')}) → исход: {outcome_text}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,104 @@
+"""Замер холодного старта CLI через `-X importtime`.
+
+    python -m jafar.utils.startup_profiler [--budget СЕКУНДЫ]
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+import subprocess
+from pathlib import Path
+
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+# Что импортирует `jafar <команда>` до вызова самого хендлера
+DEFAULT_MODULES = ("jafar.cli.main", "jafar.cli.command_router")
+DEFAULT_BUDGET_SECONDS = 0.8
+DEFAULT_RUNS = 3
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def parse_importtime(stderr: str) -> list[dict]:
+    """Разбирает вывод `-X importtime` в список {module, self_us, cumulative_us, depth}."""
+    entries = []
+    for line in stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            entries.append({
+                "module": match.group(4),
+                "self_us": int(match.group(1)),
+                "cumulative_us": int(match.group(2)),
+                "depth": (len(match.group(3)) - 1) // 2,
+            })
+    return entries
+
+
+def run_cold_start(modules=DEFAULT_MODULES) -> tuple[float, list[dict]]:
+    """Импортирует модули в свежем интерпретаторе. Возвращает (секунды, importtime-записи)."""
+    code = "; ".join(f"import {module}" for module in modules)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(PROJECT_ROOT), os.environ.get("PYTHONPATH")])))
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, cwd=PROJECT_ROOT, env=env,
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        last_line = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "unknown error"
+        raise RuntimeError(f"Импорт завершился с ошибкой: {last_line}")
+    return elapsed, parse_importtime(result.stderr)
+
+
+def top_imports(entries: list[dict], limit: int = 15, root_only: bool = False) -> list[dict]:
+    """Самые дорогие импорты по накопленному времени (root_only — только верхнего уровня)."""
+    candidates = [e for e in entries if e["depth"] == 0] if root_only else entries
+    return sorted(candidates, key=lambda e: e["cumulative_us"], reverse=True)[:limit]
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="jafar --profile-startup", description="Профиль холодного старта Jafar CLI.")
+    parser.add_argument("--budget", type=float, default=None,
+                        help=f"бюджет холодного старта в секундах (например, {DEFAULT_BUDGET_SECONDS})")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="число запусков (берётся лучший)")
+    parser.add_argument("--top", type=int, default=15, help="сколько модулей показать")
+    parser.add_argument("--module", action="append", dest="modules",
+                        help="модуль для импорта (можно несколько; по умолчанию путь одноразовой команды)")
+    args = parser.parse_args(argv)
+    modules = tuple(args.modules or DEFAULT_MODULES)
+
+    try:
+        runs = [run_cold_start(modules) for _ in range(max(1, args.runs))]
+    except RuntimeError as e:
+        console.print(f"[red]{e}[/red]")
+        return 2
+    best_elapsed, entries = min(runs, key=lambda run: run[0])
+
+    table = Table(title=f"Холодный старт: {', '.join(modules)}", header_style="bold blue")
+    table.add_column("Модуль", style="cyan")
+    table.add_column("Накопл., мс", justify="right")
+    table.add_column("Собств., мс", justify="right", style="dim")
+    for entry in top_imports(entries, args.top, root_only=True):
+        table.add_row(entry["module"], f"{entry['cumulative_us'] / 1000:.1f}", f"{entry['self_us'] / 1000:.1f}")
+    console.print(table)
+
+    import_total = sum(e["cumulative_us"] for e in entries if e["depth"] == 0) / 1e6
+    console.print(f"Импорты: [bold]{import_total:.3f} с[/bold], весь процесс (лучший из {len(runs)}): "
+                  f"[bold]{best_elapsed:.3f} с[/bold]")
+
+    if args.budget is not None:
+        if best_elapsed > args.budget:
+            console.print(f"[bold red]❌ Бюджет {args.budget:.3f} с превышен на {best_elapsed - args.budget:.3f} с[/bold red]")
+            return 1
+        console.print(f"[green]✅ В пределах бюджета {args.budget:.3f} с[/green]")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,13 +1,13 @@
 
 
-import os
 import json
 import uuid
 from datetime import datetime
 
-LOG_FILE_PATH = os.path.expanduser("~/.jafar/structured_log.jsonl")
+from jafar.utils import log_pipeline
+from jafar.utils.command_stats import LOG_FILE_PATH
 
-def log_action(command: str, status: str, duration: float, error_message: str = None):
+def log_action(command: str, status: str, duration: float = 0.0, error_message: str = None, message: str = None):
     """
     Logs a structured event of a command execution.
 
@@ -16,11 +16,11 @@ def log_action(command: str, status: str, duration: float, error_message: str =
         status (str): The execution status ('success' or 'failure').
         duration (float): The execution time in seconds.
         error_message (str, optional): The error message if the command failed.
-    """
-    log_dir = os.path.dirname(LOG_FILE_PATH)
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
+        message (str, optional): An extra note about the result.
 
+    The entry is queued to the log pipeline; the file write happens in the
+    background writer thread.
+    """
     log_entry = {
         "operation_id": str(uuid.uuid4()),
         "timestamp": datetime.now().isoformat(),
@@ -29,12 +29,9 @@ def log_action(command: str, status: str, duration: float, error_message: str =
         "duration": round(duration, 4),
         "error_message": error_message,
     }
+    if message:
+        log_entry["message"] = message
 
-    try:
-        with open(LOG_FILE_PATH, "a", encoding="utf-8") as f:
-            f.write(json.dumps(log_entry, ensure_ascii=False) + "\n")
-    except IOError as e:
-        # If logging fails, we print an error but don't crash the application
-        print(f"Critical: Failed to write to log file {LOG_FILE_PATH}. Error: {e}")
+    log_pipeline.write(LOG_FILE_PATH, json.dumps(log_entry, ensure_ascii=False) + "\n")
 
 
@@ -0,0 +1,458 @@
+"""Очередь исходящих сообщений Telegram в SQLite с фоновым отправителем."""
+
+import os
+import json
+import time
+import atexit
+import shutil
+import sqlite3
+import threading
+import uuid
+from pathlib import Path
+
+from jafar.config.constants import JAFAR_TELEGRAM_OUTBOX_DB
+
+DB_PATH = JAFAR_TELEGRAM_OUTBOX_DB
+SPOOL_DIR = Path(DB_PATH).parent / "telegram_outbox_files"
+API_URL = "https://api.telegram.org/bot{token}/{method}"
+
+MAX_MESSAGE_LENGTH = 4096
+COALESCE_LINGER_SECONDS = 0.3   # сколько ждать, чтобы собрать пачку сообщений
+GLOBAL_RATE_PER_SECOND = 25.0
+CHAT_MIN_INTERVAL_SECONDS = 1.0
+CHAT_MAX_PER_MINUTE = 20
+MAX_ATTEMPTS = 8
+BACKOFF_BASE_SECONDS = 2.0
+BACKOFF_MAX_SECONDS = 300.0
+CLAIM_TIMEOUT_SECONDS = 120.0   # «зависшая» отправка другого процесса возвращается в очередь
+FLUSH_ON_EXIT_SECONDS = 5.0
+PURGE_AFTER_DAYS = 7
+PURGE_INTERVAL_SECONDS = 6 * 3600
+
+STATUS_PENDING = "pending"
+STATUS_SENDING = "sending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+
+_schema_ready = False
+
+
+def _connect() -> sqlite3.Connection:
+    global _schema_ready
+    Path(DB_PATH).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=10, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    if not _schema_ready:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id TEXT NOT NULL,
+                method TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                files TEXT,
+                coalesce_key TEXT,
+                status TEXT NOT NULL DEFAULT 'pending'
+                    CHECK (status IN ('pending', 'sending', 'sent', 'failed')),
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                claimed_by TEXT,
+                claimed_at REAL,
+                created_at REAL NOT NULL,
+                sent_at REAL,
+                last_error TEXT
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox(status, id)")
+        _schema_ready = True
+    return conn
+
+
+def _credentials() -> tuple[str | None, str | None]:
+    return os.getenv("TELEGRAM_BOT_TOKEN"), os.getenv("TELEGRAM_CHANNEL_ID")
+
+
+# --- Постановка в очередь ---
+
+def _spool(paths: list[str]) -> list[str]:
+    """Копирует файлы в спул очереди: отправка не зависит от жизни исходных файлов."""
+    SPOOL_DIR.mkdir(parents=True, exist_ok=True)
+    spooled = []
+    for path in paths:
+        target = SPOOL_DIR / f"{uuid.uuid4().hex}{Path(path).suffix}"
+        shutil.copyfile(path, target)
+        spooled.append(str(target))
+    return spooled
+
+
+def enqueue(method: str, payload: dict, files: dict | None = None, chat_id: str | None = None,
+            coalesce_key: str | None = None) -> int:
+    """
+    Ставит вызов Bot API в очередь. files — {имя поля: путь}; coalesce_key —
+    одинаковый у сообщений, которые можно склеивать (текст с тем же parse_mode).
+    """
+    chat_id = chat_id or _credentials()[1]
+    spooled = dict(zip(files.keys(), _spool(list(files.values())))) if files else None
+    conn = _connect()
+    try:
+        cursor = conn.execute(
+            "INSERT INTO outbox (chat_id, method, payload, files, coalesce_key, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (str(chat_id), method, json.dumps(payload, ensure_ascii=False),
+             json.dumps(spooled) if spooled else None, coalesce_key, time.time()),
+        )
+        message_id = cursor.lastrowid
+    finally:
+        conn.close()
+    get_sender().wake()
+    return message_id
+
+
+def enqueue_text(text: str, parse_mode: str | None = None, chat_id: str | None = None, escape=None) -> list[int]:
+    """
+    Текст режется по строкам на части до 4096 символов. escape применяется
+    к каждой части отдельно, чтобы разрез не пришёлся на экранированный символ.
+    """
+    payload = {"parse_mode": parse_mode} if parse_mode else {}
+    return [
+        enqueue("sendMessage", {**payload, "text": part}, chat_id=chat_id, coalesce_key=f"text:{parse_mode or ''}")
+        for part in _escaped_parts(text, escape)
+    ]
+
+
+def _escaped_parts(text: str, escape, limit: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    parts = []
+    for part in split_text(text, limit):
+        escaped = escape(part) if escape else part
+        if len(escaped) > MAX_MESSAGE_LENGTH and limit > 64:
+            parts.extend(_escaped_parts(part, escape, limit // 2))
+        else:
+            parts.append(escaped)
+    return parts
+
+
+def split_text(text: str, limit: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    if len(text) <= limit:
+        return [text] if text.strip() else []
+    parts, current = [], ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(line[:limit])
+            line = line[limit:]
+        if current and len(current) + len(line) + 1 > limit:
+            parts.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    parts.append(current)
+    return [part for part in parts if part.strip()]
+
+
+# --- Лимиты ---
+
+class _RateLimiter:
+    """Глобальный интервал + на чат: минимальный интервал и окно в минуту."""
+
+    def __init__(self):
+        self._global_next = 0.0
+        self._chat_last: dict[str, float] = {}
+        self._chat_window: dict[str, list[float]] = {}
+
+    def ready_at(self, chat_id: str, now: float) -> float:
+        ready = max(self._global_next, self._chat_last.get(chat_id, 0.0) + CHAT_MIN_INTERVAL_SECONDS)
+        window = [t for t in self._chat_window.get(chat_id, []) if now - t < 60.0]
+        self._chat_window[chat_id] = window
+        if len(window) >= CHAT_MAX_PER_MINUTE:
+            ready = max(ready, window[0] + 60.0)
+        return ready
+
+    def record(self, chat_id: str, now: float):
+        self._global_next = now + 1.0 / GLOBAL_RATE_PER_SECOND
+        self._chat_last[chat_id] = now
+        self._chat_window.setdefault(chat_id, []).append(now)
+
+    def pause_chat(self, chat_id: str, until: float):
+        self._chat_last[chat_id] = until - CHAT_MIN_INTERVAL_SECONDS
+
+
+# --- Отправитель ---
+
+class OutboxSender:
+    def __init__(self):
+        self._wake = threading.Event()
+        self._idle = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._limiter = _RateLimiter()
+        self._session = None
+        self._owner = f"{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._flush_deadline = None
+        self._next_purge = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="telegram-outbox", daemon=True)
+                self._thread.start()
+        return self
+
+    def wake(self):
+        self._idle.clear()
+        self.start()
+        self._wake.set()
+
+    def flush(self, timeout: float = FLUSH_ON_EXIT_SECONDS) -> bool:
+        """Ждёт, пока очередь (готовая к отправке сейчас) опустеет. True — всё отправлено."""
+        if self._thread is None:
+            return True
+        # Сообщения в backoff дольше срока ожидания не держат выход процесса
+        self._flush_deadline = time.time() + timeout
+        self._wake.set()
+        return self._idle.wait(timeout)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _http(self):
+        if self._session is None:
+            import requests
+
+            self._session = requests.Session()
+        return self._session
+
+    def _purge_if_due(self):
+        if time.time() < self._next_purge:
+            return
+        self._next_purge = time.time() + PURGE_INTERVAL_SECONDS
+        purge_sent(PURGE_AFTER_DAYS)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._purge_if_due()
+                delay = self._drain_once()
+            except Exception as e:
+                print(f"[telegram-outbox] {e}")
+                delay = BACKOFF_BASE_SECONDS
+            # «Простой» для flush(): отправлять нечего или следующая попытка позже его срока
+            beyond_deadline = (delay is not None and self._flush_deadline is not None
+                               and time.time() + delay > self._flush_deadline)
+            if (delay is None or beyond_deadline) and not self._wake.is_set():
+                self._idle.set()
+            if delay is None:
+                self._wake.wait()
+            else:
+                self._wake.wait(delay)
+            self._wake.clear()
+
+    def _drain_once(self) -> float | None:
+        """Отправляет всё, что можно отправить сейчас. Возвращает паузу до следующей попытки или None."""
+        now = time.time()
+        conn = _connect()
+        try:
+            conn.execute(
+                "UPDATE outbox SET status = 'pending', claimed_by = NULL WHERE status = 'sending' AND claimed_at < ?",
+                (now - CLAIM_TIMEOUT_SECONDS,),
+            )
+            rows = conn.execute(
+                "SELECT * FROM outbox WHERE status IN ('pending', 'sending') ORDER BY id"
+            ).fetchall()
+        finally:
+            conn.close()
+        if not rows:
+            return None
+
+        # Голова очереди каждого чата: порядок внутри чата сохраняется
+        heads, blocked = {}, set()
+        for row in rows:
+            chat = row["chat_id"]
+            if chat in heads or chat in blocked:
+                continue
+            if row["status"] == STATUS_SENDING:
+                blocked.add(chat)  # этот чат сейчас отправляет другой процесс
+                continue
+            heads[chat] = row
+
+        next_wakeup = None
+        for chat, row in heads.items():
+            age = time.time() - row["created_at"]
+            if age < COALESCE_LINGER_SECONDS:
+                wait = COALESCE_LINGER_SECONDS - age
+            else:
+                wait = max(row["next_attempt_at"], self._limiter.ready_at(chat, time.time())) - time.time()
+                if wait <= 0:
+                    self._send_head(chat, [r for r in rows if r["chat_id"] == chat and r["status"] == STATUS_PENDING])
+                    wait = 0.0
+            next_wakeup = wait if next_wakeup is None else min(next_wakeup, wait)
+        return next_wakeup if next_wakeup is not None else (1.0 if blocked else None)
+
+    def _claim(self, ids: list[int]) -> bool:
+        conn = _connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            placeholders = ",".join("?" * len(ids))
+            pending = conn.execute(
+                f"SELECT COUNT(*) FROM outbox WHERE id IN ({placeholders}) AND status = 'pending'", ids
+            ).fetchone()[0]
+            if pending != len(ids):
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute(
+                f"UPDATE outbox SET status = 'sending', claimed_by = ?, claimed_at = ? WHERE id IN ({placeholders})",
+                (self._owner, time.time(), *ids),
+            )
+            conn.execute("COMMIT")
+            return True
+        finally:
+            conn.close()
+
+    def _coalesce(self, queue: list[sqlite3.Row]) -> tuple[list[sqlite3.Row], dict]:
+        """Голова + следующие тексты с тем же coalesce_key, пока влезают в одно сообщение."""
+        head = queue[0]
+        payload = json.loads(head["payload"])
+        batch = [head]
+        if head["method"] != "sendMessage" or not head["coalesce_key"]:
+            return batch, payload
+        text = payload["text"]
+        for row in queue[1:]:
+            if row["coalesce_key"] != head["coalesce_key"]:
+                break
+            next_text = json.loads(row["payload"])["text"]
+            if len(text) + 2 + len(next_text) > MAX_MESSAGE_LENGTH:
+                break
+            text = f"{text}\n\n{next_text}"
+            batch.append(row)
+        payload["text"] = text
+        return batch, payload
+
+    def _send_head(self, chat_id: str, queue: list[sqlite3.Row]):
+        batch, payload = self._coalesce(queue)
+        ids = [row["id"] for row in batch]
+        if not self._claim(ids):
+            return
+        head = batch[0]
+        token = _credentials()[0]
+        files = json.loads(head["files"]) if head["files"] else {}
+        self._limiter.record(chat_id, time.time())
+        error, retry_after, permanent = None, None, False
+        if not token:
+            error = "TELEGRAM_BOT_TOKEN is not set"
+        else:
+            handles = {}
+            try:
+                handles = {name: open(path, "rb") for name, path in files.items()}
+                data = {"chat_id": chat_id, **{k: json.dumps(v) if isinstance(v, (list, dict)) else v
+                                                 for k, v in payload.items()}}
+                response = self._http().post(
+                    API_URL.format(token=token, method=head["method"]),
+                    data=data, files=handles or None, timeout=60 if handles else 15,
+                )
+                body = response.json() if response.content else {}
+                if response.status_code == 200 and body.get("ok"):
+                    self._finish(ids, STATUS_SENT)
+                    self._remove_files(files)
+                    return
+                error = body.get("description") or f"HTTP {response.status_code}"
+                retry_after = (body.get("parameters") or {}).get("retry_after")
+                # 4xx (кроме 429) — ошибка самого сообщения, повтор не поможет
+                permanent = 400 <= response.status_code < 500 and response.status_code != 429
+            except FileNotFoundError as e:
+                error, permanent = str(e), True
+            except Exception as e:
+                error = str(e)
+            finally:
+                for handle in handles.values():
+                    handle.close()
+
+        if permanent and len(batch) > 1:
+            # Ошибка в одной из склеенных частей (например, разметка MarkdownV2) не должна
+            # ронять остальные: части уходят в очередь без склейки и отправляются по одной
+            self._release(ids, attempts=None, delay=0.0, error=error, split=True)
+            return
+        attempts = max(row["attempts"] for row in batch) + 1
+        if permanent or attempts >= MAX_ATTEMPTS:
+            print(f"[telegram-outbox] Сообщение #{head['id']} не доставлено: {error}")
+            self._finish(ids, STATUS_FAILED, error)
+            self._remove_files(files)
+            return
+        if retry_after:
+            delay = float(retry_after)
+            self._limiter.pause_chat(chat_id, time.time() + delay)
+        else:
+            delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+        # Вся пачка возвращается в очередь и при повторе склеится снова
+        self._release(ids, attempts, delay, error)
+
+    def _release(self, ids: list[int], attempts: int | None, delay: float, error: str | None, split: bool = False):
+        conn = _connect()
+        try:
+            conn.execute(
+                f"UPDATE outbox SET status = 'pending', claimed_by = NULL, attempts = COALESCE(?, attempts), "
+                f"next_attempt_at = ?, last_error = ?{', coalesce_key = NULL' if split else ''} "
+                f"WHERE id IN ({','.join('?' * len(ids))})",
+                (attempts, time.time() + delay, error, *ids),
+            )
+        finally:
+            conn.close()
+
+    def _finish(self, ids: list[int], status: str, error: str | None = None):
+        conn = _connect()
+        try:
+            conn.execute(
+                f"UPDATE outbox SET status = ?, sent_at = ?, last_error = ? WHERE id IN ({','.join('?' * len(ids))})",
+                (status, time.time(), error, *ids),
+            )
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _remove_files(files: dict):
+        for path in files.values():
+            Path(path).unlink(missing_ok=True)
+
+
+_sender: OutboxSender | None = None
+_sender_lock = threading.Lock()
+
+
+def get_sender() -> OutboxSender:
+    global _sender
+    with _sender_lock:
+        if _sender is None:
+            _sender = OutboxSender()
+            atexit.register(_sender.flush)
+        return _sender
+
+
+def start():
+    """Запускает отправителя, чтобы дослать сообщения, оставшиеся от прошлых запусков."""
+    get_sender().wake()
+
+
+def flush(timeout: float = FLUSH_ON_EXIT_SECONDS) -> bool:
+    return get_sender().flush(timeout)
+
+
+def stats() -> dict:
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT status, COUNT(*) AS n FROM outbox GROUP BY status").fetchall()
+    finally:
+        conn.close()
+    return {row["status"]: row["n"] for row in rows}
+
+
+def purge_sent(older_than_days: int = 7) -> int:
+    conn = _connect()
+    try:
+        cursor = conn.execute(
+            "DELETE FROM outbox WHERE status IN ('sent', 'failed') AND created_at < ?",
+            (time.time() - older_than_days * 86400,),
+        )
+        return cursor.rowcount
+    finally:
+        conn.close()
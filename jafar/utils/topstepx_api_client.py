@@ -1,22 +1,30 @@
 import os
+import threading
 import requests
 from dotenv import load_dotenv
 from rich.console import Console
 from datetime import datetime, timedelta
+from urllib.parse import urlsplit
 
 # Загружаем переменные окружения из корневой папки проекта
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '..', '.env'))
 console = Console()
 
 # --- Конфигурация API ---
-API_BASE_URL = "https://api.topstepx.com/api" 
+DEFAULT_API_BASE_URL = "https://api.topstepx.com/api"
+# TOPSTEPX_API_BASE_URL направляет клиент на локальный симулятор (python -m jafar.utils.topstepx_simulator)
+# или на прокси к боевому API. Симулятором считается только localhost или явный TOPSTEPX_SIMULATOR=1.
+API_BASE_URL = os.environ.get("TOPSTEPX_API_BASE_URL", DEFAULT_API_BASE_URL).rstrip("/")
+SIMULATED = (os.environ.get("TOPSTEPX_SIMULATOR", "").lower() in ("1", "true", "yes")
+             or urlsplit(API_BASE_URL).hostname in ("localhost", "127.0.0.1", "::1"))
 API_KEY = os.environ.get("TOPSTEPX_API_KEY")
 USERNAME = os.environ.get("TOPSTEPX_USERNAME")
 
 class TopstepXClient:
-    def __init__(self):
-        self._api_key = os.environ.get("TOPSTEPX_API_KEY")
-        self._username = os.environ.get("TOPSTEPX_USERNAME")
+    def __init__(self, username: str = None, api_key: str = None):
+        # Симулятор принимает любые учётные данные — без .env клиент представляется как "sim"
+        self._username = username or os.environ.get("TOPSTEPX_USERNAME") or ("sim" if SIMULATED else None)
+        self._api_key = api_key or os.environ.get("TOPSTEPX_API_KEY") or ("sim" if SIMULATED else None)
         
         if not self._api_key or not self._username:
             raise ValueError("API ключ или имя пользователя не найдены. Убедитесь, что TOPSTEPX_API_KEY и TOPSTEPX_USERNAME заданы в .env файле.")
@@ -24,6 +32,8 @@ class TopstepXClient:
         self._session_token = None
         self._token_expiry = None
         self._headers = {"Content-Type": "application/json", "accept": "text/plain"}
+        # Одна HTTP-сессия на клиента: keep-alive соединения переиспользуются между запросами
+        self._http = requests.Session()
         self._authenticate()
 
     def _authenticate(self):
@@ -38,7 +48,7 @@ class TopstepXClient:
         }
         
         try:
-            response = requests.post(url, headers=self._headers, json=payload)
+            response = self._http.post(url, headers=self._headers, json=payload)
             response.raise_for_status()
             data = response.json()
             
@@ -82,7 +92,7 @@ class TopstepXClient:
 
         url = f"{API_BASE_URL}{endpoint}"
         try:
-            response = requests.request(method, url, headers=self._headers, params=params, json=data)
+            response = self._http.request(method, url, headers=self._headers, params=params, json=data)
             response.raise_for_status()
             # Для некоторых запросов API может возвращать пустой ответ с кодом 200
             if response.text:
@@ -138,6 +148,14 @@ class TopstepXClient:
         }
         return self._make_request("POST", "/Order/search", data=payload)
 
+    def get_working_orders(self, account_id: int):
+        """
+        Получает активные (не исполненные и не отменённые) ордера счета.
+        """
+        console.print(f"[cyan]Запрос активных ордеров для счета {account_id}...[/cyan]")
+        payload = {"accountId": account_id}
+        return self._make_request("POST", "/Order/searchOpen", data=payload)
+
     def get_trades(self, account_id: int, start_timestamp: datetime, end_timestamp: datetime):
         """
 
@@ -253,6 +271,23 @@ class TopstepXClient:
 
         return self._make_request("POST", "/Order/place", data=payload)
 
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+
+def get_shared_client() -> TopstepXClient:
+    """
+    Возвращает один аутентифицированный клиент на процесс. В резидентном
+    демоне Jafar это избавляет каждую команду от повторного логина; токен
+    обновляется самим клиентом по истечении срока.
+    """
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = TopstepXClient()
+    return _shared_client
+
+
 # --- Тестовый запуск ---
 if __name__ == "__main__":
     console.print("[bold yellow]--- Тестирование API клиента TopstepX ---[/bold yellow]")
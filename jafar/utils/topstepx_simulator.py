@@ -0,0 +1,661 @@
+"""Локальный симулятор TopstepX API с детерминированным исполнением ордеров.
+
+    python -m jafar.utils.topstepx_simulator --scenario gc_breakout
+    export TOPSTEPX_API_BASE_URL=http://127.0.0.1:8765/api
+"""
+
+import argparse
+import heapq
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+
+from jafar.utils.bar_aggregator import parse_timeframe
+
+DEFAULT_PORT = 8765
+SCENARIOS_DIR = Path(__file__).parent.parent / "assets" / "sim_scenarios"
+
+ORDER_OPEN, ORDER_FILLED, ORDER_CANCELLED = 1, 2, 3
+TYPE_LIMIT, TYPE_MARKET, TYPE_STOP_LIMIT, TYPE_STOP = 1, 2, 3, 4
+SIDE_BUY, SIDE_SELL = 0, 1
+POSITION_LONG, POSITION_SHORT = 1, 2
+# unit /History/retrieveBars -> секунд (1=Second, 2=Minute, 3=Hour, 4=Day, 5=Week)
+UNIT_SECONDS = {1: 1, 2: 60, 3: 3600, 4: 86400, 5: 7 * 86400}
+# endTime не старше этого считается «сейчас» и отсчитывается от часов симулятора
+LIVE_EDGE_SECONDS = 120
+
+DEFAULT_SCENARIO = {
+    "seed": 7,
+    "start": "now",            # ISO-время UTC или "now"
+    "speed": 1.0,              # секунд симуляции на секунду реального времени
+    "step_seconds": None,      # шаг часов на каждый запрос вместо реального времени
+    "history_days": 7,
+    "horizon_hours": 24,
+    "credentials": None,       # {"userName": "apiKey"}; None — принимаются любые
+    "accounts": [{"id": 1001, "name": "SIM-50K", "balance": 50000.0}],
+    "contracts": [
+        {"id": "CON.F.US.GCE.Z25", "name": "GCZ5", "symbol": "GC", "description": "Gold (Dec 25)",
+         "tickSize": 0.1, "tickValue": 10.0, "fees": 2.34, "price": 2350.0, "volatility": 0.6},
+        {"id": "CON.F.US.MGC.Z25", "name": "MGCZ5", "symbol": "MGC", "description": "Micro Gold (Dec 25)",
+         "tickSize": 0.1, "tickValue": 1.0, "fees": 0.74, "price": 2350.0, "volatility": 0.6},
+        {"id": "CON.F.US.EP.Z25", "name": "ESZ5", "symbol": "ES", "description": "E-mini S&P 500 (Dec 25)",
+         "tickSize": 0.25, "tickValue": 12.5, "fees": 2.8, "price": 5000.0, "volatility": 0.5},
+        {"id": "CON.F.US.ENQ.Z25", "name": "NQZ5", "symbol": "NQ", "description": "E-mini Nasdaq-100 (Dec 25)",
+         "tickSize": 0.25, "tickValue": 5.0, "fees": 2.8, "price": 17500.0, "volatility": 1.2},
+        {"id": "CON.F.US.CLE.Z25", "name": "CLZ5", "symbol": "CL", "description": "Crude Light (Dec 25)",
+         "tickSize": 0.01, "tickValue": 10.0, "fees": 2.84, "price": 75.0, "volatility": 0.5},
+    ],
+    "latency_ms": {},          # {"*" | "Order/place": [среднее, разброс]}
+    "errors": {},              # {"History/retrieveBars": {"rate": 0.05, "status": 503}}
+}
+
+
+def _iso(t: float) -> str:
+    return datetime.fromtimestamp(int(t), timezone.utc).isoformat()
+
+
+def _epoch(value: str) -> float:
+    """ISO-время клиента ('...000Z' или со смещением) -> секунды UTC."""
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def _offset_seconds(value) -> int:
+    """Смещение опорной точки: 90, "+45m", "-2h"."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    sign = -1 if value.startswith("-") else 1
+    return sign * parse_timeframe(value.lstrip("+-"))
+
+
+def load_scenario(name_or_path: str | None = None) -> dict:
+    """Сценарий из файла или по имени из assets/sim_scenarios поверх DEFAULT_SCENARIO."""
+    scenario = dict(DEFAULT_SCENARIO)
+    if name_or_path:
+        path = Path(name_or_path).expanduser()
+        if not path.exists():
+            path = SCENARIOS_DIR / f"{name_or_path}.json"
+        scenario.update(json.loads(path.read_text(encoding="utf-8")))
+    return scenario
+
+
+class SimError(Exception):
+    """Ошибка бизнес-логики: отдаётся как success=false с кодом."""
+
+    def __init__(self, message: str, code: int = 1):
+        super().__init__(message)
+        self.code = code
+
+
+class Simulator:
+    """Состояние биржи и счетов. Все изменения — под одной блокировкой."""
+
+    def __init__(self, scenario: dict | None = None):
+        self.scenario = scenario = dict(DEFAULT_SCENARIO, **(scenario or {}))
+        start = scenario["start"]
+        self.start_t = int(time.time() if start == "now" else _epoch(start))
+        self.t0 = self.start_t - int(scenario["history_days"] * 86400)
+        self.t_end = self.start_t + int(scenario["horizon_hours"] * 3600)
+        self.speed = float(scenario["speed"])
+        self.step_seconds = scenario.get("step_seconds")
+        self._started = time.monotonic()
+        self._offset = 0
+        self._requests = 0
+
+        self._lock = threading.Lock()
+        self._rng = random.Random(scenario["seed"])  # задержки и ошибки
+        self.credentials = scenario.get("credentials")
+        self.tokens = set()
+
+        self.contracts = {c["id"]: dict(c) for c in scenario["contracts"]}
+        self.paths, self.volumes = {}, {}
+        for i, contract in enumerate(self.contracts.values()):
+            self.paths[contract["id"]], self.volumes[contract["id"]] = self._build_path(contract, scenario["seed"] + i)
+
+        self.accounts = {a["id"]: {"canTrade": True, "isVisible": True, "simulated": True, **a}
+                         for a in scenario["accounts"]}
+        self.orders = {}          # id -> ордер в формате API + служебные поля "_*"
+        self.open_orders = set()
+        self.positions = {}       # (account_id, contract_id) -> {"id", "size", "avg", "opened"}
+        self.trades = []
+        self._ids = {"order": 9_000_000, "trade": 70_000_000, "position": 300_000}
+
+    # --- Цена ---
+
+    def _build_path(self, contract: dict, seed: int) -> tuple[np.ndarray, np.ndarray]:
+        """Посекундный путь цены от t0 до t_end, проходящий через start-цену и waypoints."""
+        n = self.t_end - self.t0 + 1
+        rng = np.random.default_rng(seed)
+        tick = contract["tickSize"]
+        walk = np.cumsum(rng.normal(0.0, contract.get("volatility", 0.5) * tick, n))
+        anchors = {self.start_t - self.t0: contract["price"]}
+        for point in contract.get("waypoints", []):
+            index = self.start_t - self.t0 + _offset_seconds(point["at"])
+            if 0 <= index < n:
+                anchors[index] = point["price"]
+        index = np.array(sorted(anchors))
+        target = np.array([anchors[i] for i in index])
+        # Броуновский мост: линейная поправка между опорами, за крайними — сдвиг на константу
+        path = walk + np.interp(np.arange(n), index, target - walk[index])
+        path = np.maximum(np.round(np.round(path / tick) * tick, 8), tick)
+        return path, rng.poisson(contract.get("volume_rate", 3.0), n).astype(float)
+
+    def now(self) -> int:
+        """Время симуляции (секунды UTC), не дальше конца пути."""
+        if self.step_seconds:
+            t = self.start_t + self._requests * self.step_seconds
+        else:
+            t = self.start_t + (time.monotonic() - self._started) * self.speed
+        return int(min(t + self._offset, self.t_end))
+
+    def price(self, contract_id: str, t: int | None = None) -> float:
+        return float(self.paths[contract_id][(self.now() if t is None else t) - self.t0])
+
+    def _window(self, payload: dict, start_key: str, end_key: str) -> tuple[int, int]:
+        """
+        Окно запроса в часах симуляции. endTime «сейчас» по настенным часам — это
+        текущее время симуляции; начало окна, оказавшееся в будущем симуляции
+        (сценарий с фиксированной датой), сдвигается вместе с концом.
+        """
+        now = self.now()
+        end = _epoch(payload[end_key]) if payload.get(end_key) else now
+        start = _epoch(payload[start_key]) if payload.get(start_key) else self.t0
+        if end >= time.time() - LIVE_EDGE_SECONDS:
+            shift = now - end
+            end = now
+            if start > now:
+                start += shift
+        return int(max(start, self.t0)), int(min(end, now))
+
+    # --- Исполнение ---
+
+    def _trigger(self, order: dict, lo: int, hi: int):
+        """Первое касание ордера на отрезке пути [lo, hi]: (индекс, цена) или None."""
+        segment = self.paths[order["contractId"]][lo:hi + 1]
+        if not segment.size:
+            return None
+        buy = order["side"] == SIDE_BUY
+        if order["type"] == TYPE_MARKET:
+            return lo, float(segment[0])
+        if order["type"] == TYPE_LIMIT:
+            level = order["limitPrice"]
+            hit = segment <= level if buy else segment >= level
+            pick = min if buy else max
+        else:
+            level = order["stopPrice"]
+            hit = segment >= level if buy else segment <= level
+            pick = max if buy else min
+        i = int(np.argmax(hit))
+        if not hit[i]:
+            return None
+        return lo + i, float(pick(level, segment[i]))
+
+    def _advance(self):
+        """Исполняет все ордера, сработавшие на пути с прошлого вызова, в порядке времени."""
+        now_index = self.now() - self.t0
+        heap = []
+        for order_id in self.open_orders:
+            order = self.orders[order_id]
+            if hit := self._trigger(order, order["_since"], now_index):
+                heapq.heappush(heap, (hit[0], order_id, hit[1]))
+        while heap:
+            index, order_id, price = heapq.heappop(heap)
+            if self.orders[order_id]["status"] != ORDER_OPEN:
+                continue  # снят OCO-соседом раньше по времени
+            for child in self._fill(self.orders[order_id], index, price):
+                if hit := self._trigger(child, child["_since"], now_index):
+                    heapq.heappush(heap, (hit[0], child["id"], hit[1]))
+        for order_id in self.open_orders:
+            self.orders[order_id]["_since"] = now_index + 1
+
+    def _new_order(self, account_id: int, contract_id: str, side: int, order_type: int, size: int,
+                   limit_price=None, stop_price=None, since: int | None = None, **extra) -> dict:
+        self._ids["order"] += 1
+        t = self.now() if since is None else self.t0 + since
+        order = {
+            "id": self._ids["order"], "accountId": account_id, "contractId": contract_id,
+            "creationTimestamp": _iso(t), "updateTimestamp": _iso(t), "status": ORDER_OPEN,
+            "type": order_type, "side": side, "size": size, "limitPrice": limit_price, "stopPrice": stop_price,
+            "fillVolume": 0, "filledPrice": None, "customTag": extra.pop("customTag", None),
+            "_since": t - self.t0, **extra,
+        }
+        self.orders[order["id"]] = order
+        self.open_orders.add(order["id"])
+        return order
+
+    def _cancel(self, order: dict, t: int):
+        order["status"] = ORDER_CANCELLED
+        order["updateTimestamp"] = _iso(t)
+        self.open_orders.discard(order["id"])
+
+    def _fill(self, order: dict, index: int, price: float) -> list[dict]:
+        """Исполняет ордер: позиция, сделка, баланс, OCO и брекеты. Возвращает новые ордера."""
+        t = self.t0 + index
+        contract = self.contracts[order["contractId"]]
+        account = self.accounts[order["accountId"]]
+        key = (order["accountId"], order["contractId"])
+        order.update(status=ORDER_FILLED, fillVolume=order["size"], filledPrice=price, updateTimestamp=_iso(t))
+        self.open_orders.discard(order["id"])
+
+        qty = order["size"] if order["side"] == SIDE_BUY else -order["size"]
+        position = self.positions.setdefault(key, {"id": 0, "size": 0, "avg": 0.0, "opened": t})
+        pnl = None
+        if position["size"] and (position["size"] > 0) != (qty > 0):
+            closed = min(abs(position["size"]), abs(qty))
+            direction = 1 if position["size"] > 0 else -1
+            pnl = round((price - position["avg"]) * closed * direction * contract["tickValue"] / contract["tickSize"], 2)
+            remaining = position["size"] + qty
+            if remaining and (remaining > 0) != (position["size"] > 0):
+                self._ids["position"] += 1  # разворот: остаток — новая позиция по цене исполнения
+                position.update(id=self._ids["position"], avg=price, opened=t)
+            position["size"] = remaining
+        else:
+            size = position["size"] + qty
+            if not position["size"]:
+                self._ids["position"] += 1
+                position.update(id=self._ids["position"], opened=t)
+            position["avg"] = (position["avg"] * abs(position["size"]) + price * abs(qty)) / abs(size)
+            position["size"] = size
+
+        fees = round(contract.get("fees", 0.0) * order["size"], 2)
+        account["balance"] = round(account["balance"] + (pnl or 0.0) - fees, 2)
+        self._ids["trade"] += 1
+        self.trades.append({
+            "id": self._ids["trade"], "accountId": order["accountId"], "contractId": order["contractId"],
+            "creationTimestamp": _iso(t), "price": price, "profitAndLoss": pnl, "fees": fees,
+            "side": order["side"], "size": order["size"], "voided": False, "orderId": order["id"],
+        })
+
+        sibling = self.orders.get(order.get("_oco"))
+        if sibling and sibling["status"] == ORDER_OPEN:
+            self._cancel(sibling, t)
+        if not position["size"]:
+            # Позиция закрыта — висящие брекеты по ней больше не нужны
+            for other in [self.orders[i] for i in self.open_orders]:
+                if other.get("linkedOrderId") and (other["accountId"], other["contractId"]) == key:
+                    self._cancel(other, t)
+            return []
+        return self._brackets(order, index, price)
+
+    def _brackets(self, order: dict, index: int, price: float) -> list[dict]:
+        """SL/TP по тикам от цены исполнения входа; направление — по стороне входа."""
+        tick = self.contracts[order["contractId"]]["tickSize"]
+        direction = 1 if order["side"] == SIDE_BUY else -1
+        children = []
+        for key, sign, default_type in (("stopLossBracket", -1, TYPE_STOP), ("takeProfitBracket", 1, TYPE_LIMIT)):
+            bracket = order.get("_brackets", {}).get(key)
+            if not bracket or not bracket.get("ticks"):
+                continue
+            level = round(price + sign * direction * abs(bracket["ticks"]) * tick, 10)
+            order_type = bracket.get("type", default_type)
+            stop = order_type in (TYPE_STOP, TYPE_STOP_LIMIT)
+            # Брекет ссылается на вход id и тегом — по ним хендлеры и агент сопровождения находят SL/TP
+            tag = order.get("customTag")
+            children.append(self._new_order(
+                order["accountId"], order["contractId"], 1 - order["side"], order_type, order["size"],
+                limit_price=None if stop else level, stop_price=level if stop else None,
+                since=index + 1, linkedOrderId=order["id"],
+                customTag=f"{tag}-{'SL' if sign < 0 else 'TP'}" if tag else None,
+            ))
+        if len(children) == 2:
+            children[0]["_oco"], children[1]["_oco"] = children[1]["id"], children[0]["id"]
+        return children
+
+    # --- Эндпоинты ---
+
+    def _account(self, payload: dict) -> dict:
+        account = self.accounts.get(payload.get("accountId"))
+        if account is None:
+            raise SimError(f"Account {payload.get('accountId')} not found", 2)
+        return account
+
+    def _order(self, payload: dict) -> dict:
+        order = self.orders.get(payload.get("orderId"))
+        if order is None or order["accountId"] != payload.get("accountId"):
+            raise SimError(f"Order {payload.get('orderId')} not found", 2)
+        if order["status"] != ORDER_OPEN:
+            raise SimError(f"Order {order['id']} is not open", 3)
+        return order
+
+    @staticmethod
+    def _public(order: dict) -> dict:
+        return {k: v for k, v in order.items() if not k.startswith("_")}
+
+    def login(self, payload: dict) -> dict:
+        if self.credentials and self.credentials.get(payload.get("userName")) != payload.get("apiKey"):
+            raise SimError("Invalid credentials", 3)
+        token = uuid.uuid4().hex
+        self.tokens.add(token)
+        return {"token": token}
+
+    def account_search(self, payload: dict) -> dict:
+        return {"accounts": [dict(a) for a in self.accounts.values()]}
+
+    def contract_search(self, payload: dict) -> dict:
+        text = (payload.get("searchText") or "").upper()
+        found = [c for c in self.contracts.values()
+                 if text in (c["id"].upper(), c["symbol"].upper()) or c["name"].upper().startswith(text)]
+        return {"contracts": [{"id": c["id"], "name": c["name"], "description": c.get("description", c["name"]),
+                               "tickSize": c["tickSize"], "tickValue": c["tickValue"], "activeContract": True}
+                              for c in found]}
+
+    def position_search_open(self, payload: dict) -> dict:
+        account = self._account(payload)
+        positions = []
+        for (account_id, contract_id), p in self.positions.items():
+            if account_id == account["id"] and p["size"]:
+                positions.append({
+                    "id": p["id"], "accountId": account_id,
+                    "contractId": contract_id, "creationTimestamp": _iso(p["opened"]),
+                    "type": POSITION_LONG if p["size"] > 0 else POSITION_SHORT,
+                    "size": abs(p["size"]), "averagePrice": round(p["avg"], 6),
+                })
+        return {"positions": positions}
+
+    def order_search(self, payload: dict) -> dict:
+        account = self._account(payload)
+        start, end = self._window(payload, "startTimestamp", "endTimestamp")
+        return {"orders": [self._public(o) for o in self.orders.values() if o["accountId"] == account["id"]
+                           and start <= _epoch(o["creationTimestamp"]) <= end]}
+
+    def order_search_open(self, payload: dict) -> dict:
+        account = self._account(payload)
+        return {"orders": [self._public(self.orders[i]) for i in sorted(self.open_orders)
+                           if self.orders[i]["accountId"] == account["id"]]}
+
+    def order_place(self, payload: dict) -> dict:
+        account = self._account(payload)
+        contract = self.contracts.get(payload.get("contractId"))
+        if contract is None:
+            raise SimError(f"Contract {payload.get('contractId')} not found", 2)
+        if not account["canTrade"]:
+            raise SimError("Account cannot trade", 4)
+        order_type, size = payload.get("type"), int(payload.get("size") or 0)
+        if order_type not in (TYPE_LIMIT, TYPE_MARKET, TYPE_STOP) or size <= 0:
+            raise SimError(f"Invalid order: type={order_type}, size={size}", 5)
+        tick = contract["tickSize"]
+        prices = {}
+        for key, needed in (("limitPrice", TYPE_LIMIT), ("stopPrice", TYPE_STOP)):
+            if order_type == needed:
+                if payload.get(key) is None:
+                    raise SimError(f"{key} is required", 5)
+                prices[key] = round(round(payload[key] / tick) * tick, 10)
+        order = self._new_order(
+            account["id"], contract["id"], int(payload.get("side", SIDE_BUY)), order_type, size,
+            limit_price=prices.get("limitPrice"), stop_price=prices.get("stopPrice"),
+            customTag=payload.get("customTag"),
+            _brackets={k: payload[k] for k in ("stopLossBracket", "takeProfitBracket") if payload.get(k)},
+        )
+        self._advance()  # рыночный и «сквозной» лимит исполняются сразу
+        return {"orderId": order["id"]}
+
+    def order_modify(self, payload: dict) -> dict:
+        order = self._order(payload)
+        tick = self.contracts[order["contractId"]]["tickSize"]
+        for key in ("limitPrice", "stopPrice"):
+            if payload.get(key) is not None:
+                order[key] = round(round(payload[key] / tick) * tick, 10)
+        order["size"] = int(payload.get("size") or order["size"])
+        order["updateTimestamp"] = _iso(self.now())
+        order["_since"] = self.now() - self.t0
+        self._advance()
+        return {}
+
+    def order_cancel(self, payload: dict) -> dict:
+        self._cancel(self._order(payload), self.now())
+        return {}
+
+    def trade_search(self, payload: dict) -> dict:
+        account = self._account(payload)
+        start, end = self._window(payload, "startTimestamp", "endTimestamp")
+        return {"trades": [dict(t) for t in self.trades if t["accountId"] == account["id"]
+                           and start <= _epoch(t["creationTimestamp"]) <= end]}
+
+    def retrieve_bars(self, payload: dict) -> dict:
+        contract_id = payload.get("contractId")
+        if contract_id not in self.paths:
+            raise SimError(f"Contract {contract_id} not found", 2)
+        if payload.get("unit") not in UNIT_SECONDS:
+            raise SimError(f"Unsupported unit {payload.get('unit')}", 5)
+        size = UNIT_SECONDS[payload["unit"]] * max(int(payload.get("unitNumber") or 1), 1)
+        now = self.now()
+        start, end = self._window(payload, "startTime", "endTime")
+        first, last = start // size * size, end // size * size
+        if last < first:
+            return {"bars": []}
+        lo, hi = max(first - self.t0, 0), min(last + size - 1, now) - self.t0
+        prices, volumes = self.paths[contract_id][lo:hi + 1], self.volumes[contract_id][lo:hi + 1]
+        buckets = (self.t0 + lo + np.arange(prices.size)) // size * size
+        edges = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        closes = np.r_[edges[1:] - 1, prices.size - 1]
+        bars = np.column_stack((
+            buckets[edges], prices[edges], np.maximum.reduceat(prices, edges),
+            np.minimum.reduceat(prices, edges), prices[closes], np.add.reduceat(volumes, edges),
+        ))
+        if buckets[-1] + size - 1 > now and not payload.get("includePartialBar"):
+            bars = bars[:-1]
+        limit = int(payload.get("limit") or len(bars))
+        return {"bars": [{"t": _iso(t), "o": o, "h": h, "l": l, "c": c, "v": v}
+                         for t, o, h, l, c, v in bars[::-1][:limit].tolist()]}
+
+    def sim_state(self, payload: dict) -> dict:
+        now = self.now()
+        return {"time": _iso(now), "prices": {cid: self.price(cid, now) for cid in self.paths},
+                "openOrders": len(self.open_orders), "trades": len(self.trades)}
+
+    def sim_advance(self, payload: dict) -> dict:
+        self._offset += int(payload.get("seconds", 0))
+        self._advance()
+        return self.sim_state(payload)
+
+    ROUTES = {
+        "Auth/loginKey": login,
+        "Account/search": account_search,
+        "Contract/search": contract_search,
+        "Position/searchOpen": position_search_open,
+        "Order/search": order_search,
+        "Order/searchOpen": order_search_open,
+        "Order/place": order_place,
+        "Order/modify": order_modify,
+        "Order/cancel": order_cancel,
+        "Trade/search": trade_search,
+        "History/retrieveBars": retrieve_bars,
+        "Sim/state": sim_state,
+        "Sim/advance": sim_advance,
+    }
+
+    def _fault(self, endpoint: str) -> tuple[float, dict | None]:
+        """Задержка (с) и инжектируемая ошибка для запроса — из одного seeded RNG."""
+        latency = self.scenario["latency_ms"]
+        mean, jitter = latency.get(endpoint, latency.get("*", (0, 0)))
+        errors = self.scenario["errors"]
+        error = errors.get(endpoint, errors.get("*"))
+        with self._lock:
+            delay = max(self._rng.gauss(mean, jitter), 0.0) / 1000 if mean or jitter else 0.0
+            fail = error if error and self._rng.random() < error.get("rate", 0.0) else None
+        return delay, fail
+
+    def handle(self, endpoint: str, body: bytes, authorization: str | None = None) -> tuple[int, dict]:
+        """Запрос -> (HTTP-статус, JSON). Общий вход для HTTP-сервера и прямых вызовов."""
+        route = self.ROUTES.get(endpoint)
+        if route is None:
+            return 404, {"success": False, "errorCode": 404, "errorMessage": f"Unknown endpoint {endpoint}"}
+        delay, fail = self._fault(endpoint)
+        if delay:
+            time.sleep(delay)
+        if fail:
+            if fail.get("status", 200) != 200:
+                return fail["status"], {"success": False, "errorCode": fail["status"],
+                                        "errorMessage": fail.get("errorMessage", "Injected error")}
+            return 200, {"success": False, "errorCode": fail.get("errorCode", 1),
+                         "errorMessage": fail.get("errorMessage", "Injected error")}
+        try:
+            payload = json.loads(body or b"{}")
+        except json.JSONDecodeError:
+            return 400, {"success": False, "errorCode": 400, "errorMessage": "Invalid JSON"}
+
+        with self._lock:
+            if endpoint != "Auth/loginKey" and not endpoint.startswith("Sim/"):
+                token = (authorization or "").removeprefix("Bearer ").strip()
+                if token not in self.tokens:
+                    return 401, {"success": False, "errorCode": 401, "errorMessage": "Unauthorized"}
+            self._requests += 1
+            try:
+                if endpoint != "Auth/loginKey":
+                    self._advance()
+                result = route(self, payload)
+            except SimError as e:
+                return 200, {"success": False, "errorCode": e.code, "errorMessage": str(e)}
+        return 200, {**result, "success": True, "errorCode": 0, "errorMessage": None}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive для requests.Session клиента
+    disable_nagle_algorithm = True  # иначе заголовки и тело ответа ждут delayed ACK (~40 мс)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        endpoint = self.path.split("?")[0].strip("/").removeprefix("api/")
+        status, payload = self.server.simulator.handle(endpoint, body, self.headers.get("Authorization"))
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(scenario: dict | None = None, port: int = DEFAULT_PORT, verbose: bool = False) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+    server.daemon_threads = True
+    server.simulator = Simulator(scenario)
+    server.verbose = verbose
+    return server
+
+
+def start_in_thread(scenario: dict | None = None, port: int = 0) -> tuple[ThreadingHTTPServer, str]:
+    """Сервер в фоновом потоке (порт 0 — любой свободный). Возвращает (server, base_url)."""
+    server = make_server(scenario, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/api"
+
+
+def _scripted_session(simulator: Simulator) -> list[dict]:
+    """Фиксированная последовательность запросов: вход с брекетами и ожидание выхода."""
+    token = simulator.handle("Auth/loginKey", b"{}")[1]["token"]
+    auth = f"Bearer {token}"
+    contract = next(iter(simulator.contracts.values()))
+    account = json.dumps({"accountId": next(iter(simulator.accounts))}).encode()
+    price = simulator.price(contract["id"])
+    simulator.handle("Order/place", json.dumps({
+        **json.loads(account), "contractId": contract["id"], "side": SIDE_BUY, "type": TYPE_LIMIT, "size": 2,
+        "limitPrice": price - 10 * contract["tickSize"],
+        "stopLossBracket": {"ticks": -40, "type": TYPE_STOP}, "takeProfitBracket": {"ticks": 60, "type": TYPE_LIMIT},
+    }).encode(), auth)
+    for _ in range(2000):
+        simulator.handle("Position/searchOpen", account, auth)
+    return simulator.handle("Trade/search", account, auth)[1]["trades"]
+
+
+def benchmark(workers: int = 8, seconds: float = 5.0):
+    import requests
+
+    # Детерминизм: один и тот же сценарий и поток запросов -> те же сделки
+    scenario = {"start": "2025-06-02T13:30:00Z", "step_seconds": 5}
+    first, second = _scripted_session(Simulator(scenario)), _scripted_session(Simulator(scenario))
+    pnl = sum(t["profitAndLoss"] or 0 for t in first)
+    print(f"deterministic replay: {first == second} ({len(first)} trades, P&L {pnl:+.2f})")
+
+    server, url = start_in_thread()
+    contract_id = next(iter(server.simulator.contracts))
+    tick = server.simulator.contracts[contract_id]["tickSize"]
+    account_id = next(iter(server.simulator.accounts))
+    samples = {}
+
+    def worker(n: int):
+        http = requests.Session()
+        token = http.post(f"{url}/Auth/loginKey", json={"userName": f"bench{n}", "apiKey": "x"}).json()["token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        window = {"startTime": (now - timedelta(hours=3)).isoformat(timespec="milliseconds") + "Z",
+                  "endTime": now.isoformat(timespec="milliseconds") + "Z"}
+        calls = [
+            ("Account/search", {"onlyActiveAccounts": True}),
+            ("Position/searchOpen", {"accountId": account_id}),
+            ("History/retrieveBars", {"contractId": contract_id, "unit": 2, "unitNumber": 1, "limit": 120, **window}),
+            ("Order/searchOpen", {"accountId": account_id}),
+        ]
+        deadline = time.perf_counter() + seconds
+        local = {}
+        while time.perf_counter() < deadline:
+            for endpoint, payload in calls:
+                started = time.perf_counter()
+                http.post(f"{url}/{endpoint}", json=payload, headers=headers).raise_for_status()
+                local.setdefault(endpoint, []).append(time.perf_counter() - started)
+            started = time.perf_counter()
+            price = http.post(f"{url}/Sim/state", json={}).json()["prices"][contract_id]
+            order = http.post(f"{url}/Order/place", headers=headers, json={
+                "accountId": account_id, "contractId": contract_id, "side": SIDE_BUY, "type": TYPE_LIMIT, "size": 1,
+                "limitPrice": price - 50 * tick}).json()
+            http.post(f"{url}/Order/cancel", headers=headers, json={"accountId": account_id, "orderId": order["orderId"]})
+            local.setdefault("place+cancel", []).append(time.perf_counter() - started)
+        for endpoint, values in local.items():
+            samples.setdefault(endpoint, []).extend(values)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    total = sum(len(v) for v in samples.values())
+    print(f"{workers} clients x {seconds:.0f} s: {total} calls, {total / elapsed:.0f} calls/s")
+    for endpoint, values in sorted(samples.items()):
+        ms = np.array(values) * 1000
+        print(f"  {endpoint:22s} n={ms.size:6d}  p50 {np.percentile(ms, 50):6.2f} ms  p95 {np.percentile(ms, 95):6.2f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local TopstepX API simulator.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--scenario", help="JSON file or name from jafar/assets/sim_scenarios")
+    parser.add_argument("--speed", type=float, help="Simulated seconds per real second")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args(argv)
+
+    scenario = load_scenario(args.scenario)
+    if args.speed:
+        scenario["speed"] = args.speed
+    server = make_server(scenario, args.port, args.verbose)
+    simulator = server.simulator
+    print(f"TopstepX simulator on http://127.0.0.1:{args.port}/api — {_iso(simulator.now())}, "
+          f"{len(simulator.contracts)} contracts, {len(simulator.accounts)} accounts")
+    print(f"  export TOPSTEPX_API_BASE_URL=http://127.0.0.1:{args.port}/api")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        benchmark(*(int(a) for a in sys.argv[2:4]))
+    else:
+        main()
@@ -1,6 +1,17 @@
-import pyaudio
 import numpy as np
 
+
+def frame_rms(pcm_data: bytes) -> float:
+    """
+    RMS кадра int16 прямо из буфера микрофона: без struct.unpack и
+    промежуточного списка Python, одно скалярное произведение.
+    """
+    samples = np.frombuffer(pcm_data, dtype=np.int16).astype(np.float32)
+    if samples.size == 0:
+        return 0.0
+    return float(np.sqrt(np.dot(samples, samples) / samples.size))
+
+
 def calibrate_noise_level(mic_stream, frame_length, sample_rate, duration=2):
     """
     Calibrates the noise level of the environment using an existing audio stream.
@@ -20,14 +31,44 @@ def calibrate_noise_level(mic_stream, frame_length, sample_rate, duration=2):
         print("Не удалось получить аудиоданные для калибровки.")
         return 500
 
-    audio_data = np.frombuffer(b''.join(frames), dtype=np.int16)
-    
-    if audio_data.size == 0:
+    audio_data = b''.join(frames)
+
+    if not audio_data:
         print("Аудиоданные пусты после калибровки.")
         return 500
 
-    noise_level = np.sqrt(np.mean(audio_data.astype(float)**2))
+    noise_level = frame_rms(audio_data)
     # Увеличиваем множитель и добавляем минимальный порог для надежности
     silence_threshold = max(noise_level * 2.5, 50) 
     
     return silence_threshold
+
+
+if __name__ == "__main__":
+    # Бенчмарк метрики уровня: старый путь (struct + список + Queue.put на кадр)
+    # против frame_rms + записи в разделяемую память.
+    import struct
+    import time
+    import multiprocessing
+
+    from jafar.voice.telemetry import AudioLevelMeter
+
+    frame_length, iterations = 512, 2000
+    frame = np.random.randint(-3000, 3000, frame_length, dtype=np.int16).tobytes()
+
+    old_queue = multiprocessing.Queue()
+    old_queue.cancel_join_thread()  # читателя нет, как и в старом коде
+    start = time.perf_counter()
+    for _ in range(iterations):
+        pcm = struct.unpack_from("h" * frame_length, frame)
+        rms = np.sqrt(np.mean(np.array(pcm, dtype=float) ** 2))
+        old_queue.put({"type": "rms", "value": rms})
+    old_us = (time.perf_counter() - start) / iterations * 1e6
+
+    meter = AudioLevelMeter()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        meter.update(frame_rms(frame))
+    new_us = (time.perf_counter() - start) / iterations * 1e6
+
+    print(f"old: {old_us:.1f} us/frame, new: {new_us:.1f} us/frame ({old_us / new_us:.0f}x)")
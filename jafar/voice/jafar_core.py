@@ -5,26 +5,31 @@ import pvporcupine
 import struct
 import re
 import random
+import threading
 import traceback
-import numpy as np
 from dotenv import load_dotenv
-import google.generativeai as genai
 from thefuzz import fuzz
 
 # Локальные импорты
-from .speech import speak_text, stt_from_buffer
-from .audio_utils import calibrate_noise_level
-from jafar.cli.atrade_handlers import atrade_command
-from ..cli.interactive_analyzer import start_interactive_analysis
+from .speech import speak_text
+from .audio_utils import frame_rms
+from .telemetry import StatusChannel, poll_control
+from .stt_engine import get_engine as get_stt_engine
+from .vad import Endpointer, VadConfig
+from .tts_cache import prewarm_async
+from jafar.utils import cassette
+from jafar.utils.command_bus import BusClient, Intent, JobResult, Shutdown
 
 # --- Конфигурация ---
-genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+# Gemini и торговые хендлеры импортируются при первом использовании,
+# чтобы процесс голосового ассистента быстрее доходил до ожидания wake word.
 PICOVOICE_ACCESS_KEY = os.environ.get("PICOVOICE_ACCESS_KEY")
 
 # --- Глобальные переменные ---
 REC_RATE = 16000
 CONVERSATION_TIMEOUT_S = 20
-SILENCE_DURATION_S = 0.7
+# Сколько тишины ждать перед концом фразы (hangover VAD)
+VAD_HANGOVER_S = float(os.environ.get("VAD_HANGOVER_S", "0.35"))
 
 
 # --- Вспомогательная функция для нечеткого поиска ---
@@ -36,9 +41,63 @@ def is_command_present(text, keywords, threshold=75):
     return False
 
 
+# --- Шина команд ---
+def dispatch_intent(bus: BusClient | None, command: str, args: str):
+    """
+    Публикует намерение в шину команд: выполнит его основной процесс,
+    где уже загружены торговый стек и клиенты API. Без шины (автономный
+    запуск jafar_core) команда выполняется здесь же.
+    """
+    if bus is not None:
+        bus.publish(Intent(command, args))
+        return
+    from jafar.cli.command_router import run_command
+
+    # Распознанный текст с апострофами (bo'yicha) не должен проходить через shlex
+    run_command(command, args, interactive_session=False)
+
+
+def request_prefetch(bus: BusClient | None, *sources: str):
+    """
+    Начинает загрузку контекста анализа, пока пользователь ещё называет
+    инструмент. Без шины загрузка идёт в этом процессе.
+    """
+    try:
+        if bus is not None:
+            bus.prefetch(*sources)
+            return
+        from jafar.utils.prefetch import prefetch_context
+
+        prefetch_context(sources or ("news", "calendar", "account"))
+    except Exception as e:
+        print(f"[PREFETCH] {e}")
+
+
+def report_bus_events(bus: BusClient | None, interrupt_event) -> bool:
+    """Печатает результаты выполненных команд. Возвращает False, если шина закрыта."""
+    if bus is None:
+        return True
+    for event in bus.poll_events():
+        if isinstance(event, Shutdown):
+            return False
+        if isinstance(event, JobResult):
+            print(f"[BUS] {event.request_id}: {'OK' if event.ok else 'ERROR'} {event.error or ''}".rstrip())
+            if not event.ok:
+                speak_text("Buyruqni bajarishda xatolik yuz berdi.", interrupt_event)
+    return True
+
+
+def chat_reply(model, user_text_uzbek: str) -> str:
+    """Свободный ответ ассистента на узбекском (через кассету — для `jafar bench voice`)."""
+    prompt = f"You are a helpful assistant named Jafar. User asks in Uzbek: '{user_text_uzbek}'. Respond in Uzbek (Latin script)."
+    return cassette.call("gemini", "models/gemini-2.5-pro:generateContent", {"kind": "chat"},
+                         lambda: model.generate_content(prompt).text)
+
+
 # --- Основной цикл диалога ---
-def handle_conversation(mic_stream, porcupine, interrupt_event, queue):
-    """Управляет полным циклом диалога с динамической калибровкой шума и состоянием."""
+def handle_conversation(mic_stream, porcupine, interrupt_event, channel: StatusChannel, endpointer: Endpointer,
+                        bus: BusClient | None = None):
+    """Управляет полным циклом диалога: VAD-границы фраз, потоковое STT и состояние."""
     print("[DEBUG] ==> Entered handle_conversation.")
 
     is_speaking = False
@@ -47,18 +106,14 @@ def handle_conversation(mic_stream, porcupine, interrupt_event, queue):
     def speak_and_set_flag(text_func, text):
         nonlocal is_speaking
         is_speaking = True
-        queue.put({"type": "status", "value": "Говорю"})
+        channel.status("Говорю")
         result = text_func(text, interrupt_event)
         is_speaking = False
         return result
 
-    print("Динамическая калибровка...")
-    queue.put({"type": "status", "value": "Обработка"})
-    silence_threshold = calibrate_noise_level(
-        mic_stream, porcupine.frame_length, porcupine.sample_rate, duration=1.0
-    )
-    print(f"Новый порог тишины: {silence_threshold:.2f}")
+    import google.generativeai as genai
 
+    genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
     model_pro = genai.GenerativeModel("models/gemini-2.5-pro")
 
     last_interaction_time = time.time()
@@ -67,20 +122,16 @@ def handle_conversation(mic_stream, porcupine, interrupt_event, queue):
     while time.time() - last_interaction_time < CONVERSATION_TIMEOUT_S:
         print("[DEBUG] Top of the main loop. Listening...")
         print("Слушаю вашу команду...")
-        queue.put({"type": "status", "value": "Слушаю"})
-
-        # ... (audio recording logic from previous stable version) ...
-        frames = []
-        recording = False
-        silence_frames = 0
-        max_silence_frames = int(
-            (porcupine.sample_rate / porcupine.frame_length) * SILENCE_DURATION_S
-        )
-        warmup_frames_count = 0
-        MIN_WARMUP_FRAMES = 3
+        report_bus_events(bus, interrupt_event)
+        channel.status("Слушаю")
+
+        # Границы фразы определяет VAD: pre-roll, адаптивный шум, hangover
+        endpointer.reset()
+        stream = None
+        utterance = None
 
         print("[DEBUG] Starting audio recording loop...")
-        while True:
+        while utterance is None:
             if time.time() - last_interaction_time > CONVERSATION_TIMEOUT_S:
                 print("[DEBUG] Conversation timeout reached inside recording loop.")
                 return
@@ -89,30 +140,26 @@ def handle_conversation(mic_stream, porcupine, interrupt_event, queue):
             )
             if is_speaking:
                 continue
-            pcm = struct.unpack_from("h" * porcupine.frame_length, pcm_data)
-            rms = np.sqrt(np.mean(np.array(pcm, dtype=float) ** 2))
-            queue.put({"type": "rms", "value": rms})
-            if rms > silence_threshold:
-                silence_frames = 0
-                if not recording:
-                    warmup_frames_count += 1
-                    if warmup_frames_count >= MIN_WARMUP_FRAMES:
-                        print("[DEBUG] Recording started.")
-                        recording = True
-                if recording:
-                    frames.append(pcm_data)
-            elif recording:
-                silence_frames += 1
-                if silence_frames > max_silence_frames:
-                    print("[DEBUG] Silence detected. Exiting recording loop.")
-                    break
+            # Уровень — в разделяемую память, без IPC-сообщения на каждый кадр
+            channel.level(frame_rms(pcm_data))
+            event = endpointer.process(pcm_data)
+            if event is None:
+                continue
+            if event.kind == "start":
+                print("[DEBUG] Recording started.")
+                stream = get_stt_engine().start_stream(
+                    on_partial=lambda text: print(f"\r… {text}", end="", flush=True),
+                    language="uz",
+                )
+                stream.feed(event.audio)
+            elif event.kind == "continue":
+                stream.feed(event.audio)
             else:
-                warmup_frames_count = 0
+                print("[DEBUG] End of utterance. Exiting recording loop.")
+                utterance = event.audio
 
-        if not frames:
-            continue
-
-        user_text_uzbek = stt_from_buffer(None, b"".join(frames), "uz")
+        user_text_uzbek = stream.finish()
+        print()
 
         if not user_text_uzbek:
             print("Речь не распознана.")
@@ -134,6 +181,8 @@ def handle_conversation(mic_stream, porcupine, interrupt_event, queue):
         EXIT_KEYWORDS = ["xayr", "rahmat", "yetarli", "ko'rishguncha", "bo'ldi"]
 
         if is_command_present(user_text_uzbek_lower, SUPER_ANALYSIS_KEYWORDS):
+            # Новости, календарь и счёт не зависят от инструмента — грузим, пока спрашиваем
+            request_prefetch(bus, "news", "calendar", "account")
             speak_and_set_flag(speak_text, "Qaysi instrumentni tahlil qilamiz?")
             conversation_state = "awaiting_atrade_instrument"
         elif is_command_present(user_text_uzbek_lower, NEWS_KEYWORDS):
@@ -148,23 +197,20 @@ def handle_conversation(mic_stream, porcupine, interrupt_event, queue):
             speak_and_set_flag(
                 speak_text, f"{user_text_uzbek} uchun super tahlil boshlanmoqda..."
             )
-            atrade_command(user_text_uzbek)
+            dispatch_intent(bus, "atrade", user_text_uzbek)
             conversation_state = "normal"
         elif conversation_state == "awaiting_news_topic":
             speak_and_set_flag(
                 speak_text,
                 f"{user_text_uzbek} bo'yicha yangiliklar tahlilini boshlayapman.",
             )
-            start_interactive_analysis(user_text_uzbek)
+            dispatch_intent(bus, "analyze", user_text_uzbek)
             conversation_state = "normal"
 
         # 4. Агар ҳеч нарса мос келмаса, бу оддий чат
         else:
             print("Джафар думает...")
-            response = model_pro.generate_content(
-                f"You are a helpful assistant named Jafar. User asks in Uzbek: '{user_text_uzbek}'. Respond in Uzbek (Latin script)."
-            )
-            speak_and_set_flag(speak_text, response.text)
+            speak_and_set_flag(speak_text, chat_reply(model_pro, user_text_uzbek))
 
         last_interaction_time = time.time()
 
@@ -172,7 +218,9 @@ def handle_conversation(mic_stream, porcupine, interrupt_event, queue):
 
 
 # --- Точка входа ---
-def main(interrupt_event, queue, main_exit_event):
+def main(interrupt_event, status_queue, main_exit_event, bus_conn=None, control_queue=None, level_meter=None):
+    bus = BusClient(bus_conn) if bus_conn is not None else None
+    channel = StatusChannel(status_queue, level_meter)
     pa = None
     porcupine = None
     mic_stream = None
@@ -198,6 +246,11 @@ def main(interrupt_event, queue, main_exit_event):
                 sensitivities=[0.8],
             )
 
+        # STT-модель грузится и прогревается, пока ассистент ждёт wake word
+        threading.Thread(target=get_stt_engine().warm_up, name="stt-warmup", daemon=True).start()
+        # Приветствия и частые ответы синтезируются заранее и звучат без сетевой задержки
+        prewarm_async()
+
         pa = pyaudio.PyAudio()
         mic_stream = pa.open(
             rate=porcupine.sample_rate if porcupine else REC_RATE,
@@ -206,9 +259,15 @@ def main(interrupt_event, queue, main_exit_event):
             input=True,
             frames_per_buffer=porcupine.frame_length if porcupine else 512,
         )
+        # Уровень шума отслеживается и в ожидании wake word — без паузы на калибровку
+        endpointer = Endpointer(VadConfig(
+            sample_rate=porcupine.sample_rate if porcupine else REC_RATE,
+            frame_length=porcupine.frame_length if porcupine else 512,
+            hangover_s=VAD_HANGOVER_S,
+        ))
 
         print("Ожидание команды 'Джафар' или PTT...")
-        queue.put({"type": "status", "value": "Ожидание"})
+        channel.status("Ожидание")
 
         while not main_exit_event.is_set():
             # PTT or Wake Word check
@@ -220,15 +279,14 @@ def main(interrupt_event, queue, main_exit_event):
                 "h" * (porcupine.frame_length if porcupine else 512), pcm_data
             )
 
-            ptt_activated = False
-            try:
-                message = queue.get(block=False)
-                if message.get("type") == "ptt_activate":
-                    ptt_activated = True
-            except Exception:
-                pass
+            # PTT приходит по отдельной управляющей очереди, не за статусами
+            message = poll_control(control_queue)
+            ptt_activated = bool(message) and message.get("type") == "ptt_activate"
 
             wake_word_detected = porcupine and porcupine.process(pcm) >= 0
+            endpointer.observe(pcm_data)
+            if not report_bus_events(bus, interrupt_event):
+                bus = None
 
             if ptt_activated or wake_word_detected:
                 print(f"\nАктивация {'через PTT' if ptt_activated else 'по слову'}!")
@@ -241,9 +299,9 @@ def main(interrupt_event, queue, main_exit_event):
                     responses = [f"Labbay, {title}?", f"Eshitaman, {title}."]
                     speak_text(random.choice(responses), interrupt_event)
 
-                handle_conversation(mic_stream, porcupine, interrupt_event, queue)
+                handle_conversation(mic_stream, porcupine, interrupt_event, channel, endpointer, bus)
                 print("Ожидание команды 'Джафар' или PTT...")
-                queue.put({"type": "status", "value": "Ожидание"})
+                channel.status("Ожидание")
 
     except KeyboardInterrupt:
         print("\nВыход из jafar_core.")
@@ -257,4 +315,6 @@ def main(interrupt_event, queue, main_exit_event):
             mic_stream.close()
         if pa:
             pa.terminate()
+        if bus:
+            bus.close()
         print("Ресурсы jafar_core освобождены.")
@@ -0,0 +1,279 @@
+"""Воспроизведение речи из памяти через sounddevice, PyAudio или NullSink."""
+
+import io
+import os
+import sys
+import time
+import wave
+import threading
+from dataclasses import dataclass
+
+AUDIO_SINK = os.environ.get("JAFAR_AUDIO_SINK", "auto")
+BLOCK_SECONDS = 0.05
+
+
+@dataclass
+class Clip:
+    pcm: bytes
+    sample_rate: int
+    channels: int = 1
+    sample_width: int = 2
+
+    @property
+    def frame_bytes(self) -> int:
+        return self.channels * self.sample_width
+
+    @property
+    def duration(self) -> float:
+        return len(self.pcm) / self.frame_bytes / self.sample_rate if self.sample_rate else 0.0
+
+
+@dataclass
+class PlaybackResult:
+    backend: str
+    duration_s: float
+    played_s: float = 0.0
+    start_latency_s: float = 0.0
+    cancelled: bool = False
+
+
+def decode_audio(audio: bytes, sample_rate: int = 16000) -> Clip:
+    """WAV (RIFF) → Clip; байты без заголовка считаются моно int16 PCM с частотой sample_rate."""
+    if audio[:4] != b"RIFF":
+        return Clip(audio, sample_rate)
+    with wave.open(io.BytesIO(audio), "rb") as wf:
+        return Clip(wf.readframes(wf.getnframes()), wf.getframerate(), wf.getnchannels(), wf.getsampwidth())
+
+
+def _blocks(clip: Clip):
+    size = max(clip.frame_bytes, int(clip.sample_rate * BLOCK_SECONDS) * clip.frame_bytes)
+    for offset in range(0, len(clip.pcm), size):
+        yield clip.pcm[offset:offset + size]
+
+
+class AudioSink:
+    name = "base"
+
+    def _open(self, clip: Clip):
+        raise NotImplementedError
+
+    def _write(self, stream, block: bytes):
+        raise NotImplementedError
+
+    def _finish(self, stream, cancelled: bool):
+        pass
+
+    def play(self, clip: Clip, cancel_event=None) -> PlaybackResult:
+        started = time.perf_counter()
+        result = PlaybackResult(self.name, clip.duration)
+        stream = self._open(clip)
+        written = 0
+        try:
+            for block in _blocks(clip):
+                if cancel_event is not None and cancel_event.is_set():
+                    result.cancelled = True
+                    break
+                if not written:
+                    result.start_latency_s = time.perf_counter() - started
+                self._write(stream, block)
+                written += len(block)
+        finally:
+            self._finish(stream, result.cancelled)
+        result.played_s = written / clip.frame_bytes / clip.sample_rate if clip.sample_rate else 0.0
+        return result
+
+    def close(self):
+        pass
+
+
+class SoundDeviceSink(AudioSink):
+    name = "sounddevice"
+
+    def __init__(self):
+        import sounddevice
+
+        self._sd = sounddevice
+
+    def _open(self, clip: Clip):
+        dtype = {1: "int8", 2: "int16", 4: "int32"}[clip.sample_width]
+        stream = self._sd.RawOutputStream(samplerate=clip.sample_rate, channels=clip.channels, dtype=dtype)
+        stream.start()
+        return stream
+
+    def _write(self, stream, block: bytes):
+        stream.write(block)
+
+    def _finish(self, stream, cancelled: bool):
+        # abort() отбрасывает буфер устройства сразу, stop() доигрывает хвост
+        if cancelled:
+            stream.abort()
+        else:
+            stream.stop()
+        stream.close()
+
+
+class PyAudioSink(AudioSink):
+    """Держит открытый поток на формат: повторные клипы не платят за открытие устройства."""
+    name = "pyaudio"
+
+    def __init__(self):
+        import pyaudio
+
+        self._pa = pyaudio.PyAudio()
+        self._streams = {}
+
+    def _open(self, clip: Clip):
+        key = (clip.sample_rate, clip.channels, clip.sample_width)
+        stream = self._streams.get(key)
+        if stream is None:
+            stream = self._pa.open(
+                format=self._pa.get_format_from_width(clip.sample_width),
+                channels=clip.channels, rate=clip.sample_rate, output=True,
+            )
+            self._streams[key] = stream
+        elif stream.is_stopped():
+            stream.start_stream()
+        return stream
+
+    def _write(self, stream, block: bytes):
+        stream.write(block)
+
+    def _finish(self, stream, cancelled: bool):
+        if cancelled:
+            stream.stop_stream()
+
+    def close(self):
+        for stream in self._streams.values():
+            stream.close()
+        self._streams.clear()
+        self._pa.terminate()
+
+
+class NullSink(AudioSink):
+    """Ничего не воспроизводит; запоминает клипы. realtime=True — ждёт длительность клипа."""
+    name = "null"
+
+    def __init__(self, realtime: bool = False):
+        self.realtime = realtime
+        self.clips: list[Clip] = []
+        self.results: list[PlaybackResult] = []
+
+    def _open(self, clip: Clip):
+        self.clips.append(clip)
+        return clip
+
+    def _write(self, stream, block: bytes):
+        if self.realtime:
+            time.sleep(len(block) / stream.frame_bytes / stream.sample_rate)
+
+    def play(self, clip: Clip, cancel_event=None) -> PlaybackResult:
+        result = super().play(clip, cancel_event)
+        self.results.append(result)
+        return result
+
+
+def create_sink(name: str = AUDIO_SINK) -> AudioSink:
+    if name == "null":
+        return NullSink()
+    candidates = {"sounddevice": (SoundDeviceSink,), "pyaudio": (PyAudioSink,)}.get(name, (SoundDeviceSink, PyAudioSink))
+    for sink_class in candidates:
+        try:
+            return sink_class()
+        except Exception as e:
+            print(f"[playback] {sink_class.name} unavailable: {e}", file=sys.stderr)
+    print("[playback] No audio backend available, speech output is muted.", file=sys.stderr)
+    return NullSink()
+
+
+_sink: AudioSink | None = None
+_sink_lock = threading.Lock()
+# Один говорящий за раз: параллельные фразы встают в очередь, а не накладываются
+_play_lock = threading.Lock()
+_latencies: list[float] = []
+_latencies_lock = threading.Lock()
+
+
+def get_sink() -> AudioSink:
+    global _sink
+    with _sink_lock:
+        if _sink is None:
+            _sink = create_sink()
+        return _sink
+
+
+def set_sink(sink: AudioSink | None):
+    """Подменяет бэкенд процесса (например, NullSink в тестовом прогоне)."""
+    global _sink
+    with _sink_lock:
+        if _sink is not None and _sink is not sink:
+            _sink.close()
+        _sink = sink
+
+
+def _drop_sink(sink: AudioSink, error: Exception):
+    """Сломанный бэкенд (устройство пропало): закрывается, следующий клип создаст бэкенд заново."""
+    global _sink
+    print(f"[playback] {sink.name} failed: {error}; clip skipped", file=sys.stderr)
+    with _sink_lock:
+        if _sink is sink:
+            _sink = None
+    try:
+        sink.close()
+    except Exception:
+        pass
+
+
+def play(audio: bytes, cancel_event=None, sample_rate: int = 16000) -> PlaybackResult | None:
+    """
+    Проигрывает WAV/PCM из памяти. Блокирует до конца клипа или отмены.
+    Ошибка устройства не пробрасывается: клип уходит в NullSink.
+    """
+    if not audio:
+        return None
+    try:
+        clip = decode_audio(audio, sample_rate)
+    except (wave.Error, EOFError) as e:
+        print(f"Ошибка воспроизведения: неподдерживаемый формат аудио ({e})")
+        return None
+    with _play_lock:
+        if cancel_event is not None and cancel_event.is_set():
+            return PlaybackResult(get_sink().name, clip.duration, cancelled=True)
+        sink = get_sink()
+        try:
+            result = sink.play(clip, cancel_event)
+        except Exception as e:
+            _drop_sink(sink, e)
+            result = NullSink().play(clip, cancel_event)
+    with _latencies_lock:
+        _latencies.append(result.start_latency_s)
+        del _latencies[:-100]
+    return result
+
+
+def latency_stats() -> dict:
+    """Задержка старта по последним (до 100) клипам, в миллисекундах."""
+    with _latencies_lock:
+        ordered = sorted(_latencies)
+    if not ordered:
+        return {"clips": 0}
+    return {
+        "clips": len(ordered),
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+if __name__ == "__main__":
+    # Проверка бэкенда: python -m jafar.voice.playback [file.wav]
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "rb") as f:
+            data = f.read()
+    else:
+        import math
+        import struct
+
+        data = b"".join(struct.pack("<h", int(8000 * math.sin(2 * math.pi * 440 * n / 16000))) for n in range(8000))
+    for _ in range(3):
+        outcome = play(data)
+        print(f"{outcome.backend}: {outcome.played_s:.2f}s played, start latency {outcome.start_latency_s * 1000:.1f} ms")
+    print(latency_stats())
@@ -0,0 +1,249 @@
+"""Локальное распознавание речи (faster-whisper / whisper, запасной — Muxlisa).
+
+    python -m jafar.voice.stt_engine bench fixtures/*.wav
+"""
+
+import io
+import os
+import sys
+import time
+import wave
+import threading
+import numpy as np
+
+STT_PROVIDER = os.environ.get("STT_PROVIDER", "whisper")
+STT_MODEL_SIZE = os.environ.get("STT_MODEL_SIZE", "base")
+STT_COMPUTE_TYPE = os.environ.get("STT_COMPUTE_TYPE", "int8")
+STT_DEVICE = os.environ.get("STT_DEVICE", "cpu")
+MUXLISA_STT_URL = "https://service.muxlisa.uz/api/v2/stt"
+
+SAMPLE_RATE = 16000
+PARTIAL_INTERVAL_S = 0.6
+# Промежуточные гипотезы считаются по последним секундам, чтобы цена не росла с длиной фразы
+PARTIAL_WINDOW_S = 12.0
+
+
+def pcm_to_float(pcm: bytes) -> np.ndarray:
+    """int16 PCM → float32 в диапазоне [-1, 1], как ждут модели Whisper."""
+    return np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def pcm_to_wav_bytes(pcm: bytes, sample_rate: int = SAMPLE_RATE) -> bytes:
+    """Упаковывает моно int16 PCM в WAV в памяти."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def read_wav_pcm(path: str, sample_rate: int = SAMPLE_RATE) -> bytes:
+    """Читает WAV-фикстуру как моно int16 PCM нужной частоты (линейный ресемплинг)."""
+    with wave.open(str(path), "rb") as wf:
+        if wf.getsampwidth() != 2:
+            raise ValueError(f"{path}: ожидается 16-битный PCM")
+        channels, rate = wf.getnchannels(), wf.getframerate()
+        samples = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    if rate != sample_rate and samples.size:
+        duration = samples.size / rate
+        target = np.linspace(0.0, duration, int(duration * sample_rate), endpoint=False)
+        samples = np.interp(target, np.arange(samples.size) / rate, samples)
+    return samples.astype(np.int16).tobytes()
+
+
+def transcribe_muxlisa(pcm: bytes) -> str:
+    """Muxlisa STT: WAV собирается в памяти и отправляется без временного файла."""
+    import requests
+
+    api_key = os.environ.get("MUXLISA_API_KEY")
+    if not api_key:
+        print("Ошибка: API ключ для Muxlisa не найден в .env файле.")
+        return ""
+    files = {"audio": ("stt_input.wav", pcm_to_wav_bytes(pcm), "audio/wav")}
+    response = requests.post(MUXLISA_STT_URL, headers={"x-api-key": api_key}, files=files, timeout=30)
+    if response.status_code == 200:
+        return response.json().get("text", "")
+    print(f"Ошибка от Muxlisa STT API: {response.status_code} - {response.text}")
+    return ""
+
+
+class SttEngine:
+    """Один экземпляр модели на процесс; вызовы модели сериализуются замком."""
+
+    def __init__(self, provider: str = STT_PROVIDER, model_size: str = STT_MODEL_SIZE,
+                 compute_type: str = STT_COMPUTE_TYPE, device: str = STT_DEVICE, language: str = "uz"):
+        self.provider = provider
+        self.model_size = model_size
+        self.compute_type = compute_type
+        self.device = device
+        self.language = language
+        self.backend = None
+        self.load_seconds = 0.0
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._model_lock = threading.Lock()
+
+    @property
+    def supports_partials(self) -> bool:
+        return self.backend in ("faster-whisper", "whisper")
+
+    def load(self):
+        """Загружает модель (повторные вызовы ничего не делают). Возвращает self."""
+        with self._load_lock:
+            if self.backend is not None:
+                return self
+            start = time.perf_counter()
+            if self.provider == "muxlisa":
+                self.backend = "muxlisa"
+            else:
+                try:
+                    self._load_local_model()
+                except Exception as e:
+                    print(f"Локальная STT модель недоступна ({e}), распознавание через Muxlisa.")
+                    self._model = None
+                    self.backend = "muxlisa"
+            self.load_seconds = time.perf_counter() - start
+            if self.backend != "muxlisa":
+                print(f"STT модель загружена за {self.load_seconds:.1f} с ({self.backend}).")
+        return self
+
+    def _load_local_model(self):
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError:
+            import whisper  # тяжёлый импорт (torch)
+
+            print(f"faster-whisper не установлен, загрузка Whisper '{self.model_size}'...")
+            self._model = whisper.load_model(self.model_size, device=self.device)
+            self.backend = "whisper"
+            return
+        print(f"Загрузка faster-whisper '{self.model_size}' ({self.device}, {self.compute_type})...")
+        self._model = WhisperModel(self.model_size, device=self.device, compute_type=self.compute_type)
+        self.backend = "faster-whisper"
+
+    def warm_up(self):
+        """Прогоняет полсекунды тишины, чтобы первая реальная фраза не платила за инициализацию."""
+        self.load()
+        if self.supports_partials:
+            self.transcribe(bytes(SAMPLE_RATE), partial=True)
+        return self
+
+    def transcribe(self, pcm: bytes, language: str | None = None, partial: bool = False) -> str:
+        """Распознаёт моно int16 PCM 16 кГц. partial — быстрый режим для промежуточных гипотез."""
+        language = language or self.language
+        if not pcm:
+            return ""
+        try:
+            self.load()
+            if self.backend == "muxlisa":
+                return transcribe_muxlisa(pcm)
+            audio = pcm_to_float(pcm)
+            with self._model_lock:
+                if self.backend == "faster-whisper":
+                    segments, _ = self._model.transcribe(
+                        audio, language=language, beam_size=1 if partial else 5,
+                        condition_on_previous_text=False, without_timestamps=True,
+                    )
+                    return "".join(segment.text for segment in segments).strip()
+                result = self._model.transcribe(audio, fp16=False, language=language)
+                return result["text"].strip()
+        except Exception as e:
+            print(f"Ошибка STT ({self.backend}): {e}")
+            return ""
+
+    def start_stream(self, on_partial=None, language: str | None = None) -> "StreamingSession":
+        return StreamingSession(self, on_partial, language)
+
+
+class StreamingSession:
+    """
+    Накопитель одной фразы. `feed()` вызывается из цикла записи и никогда
+    не блокирует: промежуточное распознавание идёт в фоновом потоке, и
+    если предыдущее ещё не закончилось, новое не запускается.
+    `finish()` возвращает окончательный текст по всему буферу.
+    """
+
+    def __init__(self, engine: SttEngine, on_partial=None, language: str | None = None):
+        self._engine = engine
+        self._on_partial = on_partial
+        self._language = language
+        self._buffer = bytearray()
+        self._last_partial_size = 0
+        self._worker: threading.Thread | None = None
+        self._finished = threading.Event()
+        self.partial = ""
+
+    @property
+    def duration(self) -> float:
+        return len(self._buffer) / 2 / SAMPLE_RATE
+
+    def feed(self, pcm: bytes):
+        self._buffer += pcm
+        if not (self._on_partial and self._engine.supports_partials):
+            return
+        new_seconds = (len(self._buffer) - self._last_partial_size) / 2 / SAMPLE_RATE
+        if new_seconds >= PARTIAL_INTERVAL_S and not (self._worker and self._worker.is_alive()):
+            self._last_partial_size = len(self._buffer)
+            # Копируется только окно, а не вся фраза
+            window = bytes(self._buffer[-int(PARTIAL_WINDOW_S * SAMPLE_RATE) * 2:])
+            self._worker = threading.Thread(target=self._run_partial, args=(window,), daemon=True)
+            self._worker.start()
+
+    def _run_partial(self, pcm: bytes):
+        if self._finished.is_set():
+            return
+        text = self._engine.transcribe(pcm, self._language, partial=True)
+        if text and not self._finished.is_set():
+            self.partial = text
+            self._on_partial(text)
+
+    def finish(self) -> str:
+        self._finished.set()
+        return self._engine.transcribe(bytes(self._buffer), self._language)
+
+
+_engine: SttEngine | None = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> SttEngine:
+    """Общий движок процесса (модель ещё не загружена — вызовите load() / warm_up())."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = SttEngine()
+        return _engine
+
+
+def benchmark(paths: list[str], engine: SttEngine | None = None, language: str | None = None) -> list[dict]:
+    """Real-time factor по фикстурам: время распознавания / длительность аудио (<1 — быстрее реального)."""
+    engine = (engine or get_engine()).warm_up()
+    results = []
+    for path in paths:
+        pcm = read_wav_pcm(path)
+        duration = len(pcm) / 2 / SAMPLE_RATE
+        start = time.perf_counter()
+        text = engine.transcribe(pcm, language)
+        elapsed = time.perf_counter() - start
+        results.append({"file": str(path), "audio_s": duration, "decode_s": elapsed,
+                        "rtf": elapsed / duration if duration else 0.0, "text": text})
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "bench":
+        print("Usage: python -m jafar.voice.stt_engine bench <file.wav> [...]")
+        sys.exit(2)
+    engine = get_engine().load()
+    rows = benchmark(sys.argv[2:], engine)
+    print(f"backend={engine.backend} model={engine.model_size} load={engine.load_seconds:.2f}s")
+    for row in rows:
+        print(f"{row['rtf']:6.3f} RTF  {row['decode_s']:6.2f}s / {row['audio_s']:6.2f}s  {row['file']}: {row['text']}")
+    if rows:
+        total_audio = sum(row["audio_s"] for row in rows)
+        total_decode = sum(row["decode_s"] for row in rows)
+        print(f"overall RTF: {total_decode / total_audio:.3f}")
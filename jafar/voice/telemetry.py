@@ -0,0 +1,83 @@
+"""Телеметрия голосового процесса: уровень микрофона в разделяемой памяти и очереди статусов."""
+
+import queue
+import multiprocessing
+
+STATUS_QUEUE_SIZE = 32
+PTT_ACTIVATE = {"type": "ptt_activate"}
+_STATUS_BYTES = 64
+
+
+class AudioLevelMeter:
+    """
+    Последний RMS, пиковый RMS и счётчик кадров в разделяемой памяти.
+    Пишет один процесс, поэтому блокировки не нужны: читатель может увидеть
+    значение на кадр старее, что для индикатора уровня неважно.
+    """
+
+    def __init__(self, ctx=multiprocessing):
+        self._rms = ctx.Value("d", 0.0, lock=False)
+        self._peak = ctx.Value("d", 0.0, lock=False)
+        self._frames = ctx.Value("Q", 0, lock=False)
+        self._status = ctx.Array("c", _STATUS_BYTES, lock=False)
+
+    def update(self, rms: float):
+        self._rms.value = rms
+        if rms > self._peak.value:
+            self._peak.value = rms
+        self._frames.value += 1
+
+    def set_status(self, status: str):
+        self._status.value = status.encode("utf-8")[:_STATUS_BYTES - 1]
+
+    def read(self, reset_peak: bool = False) -> dict:
+        """Снимок {rms, peak, frames, status}; reset_peak — начать новый пиковый интервал."""
+        snapshot = {
+            "rms": self._rms.value,
+            "peak": self._peak.value,
+            "frames": self._frames.value,
+            "status": self._status.value.decode("utf-8", errors="ignore"),
+        }
+        if reset_peak:
+            self._peak.value = 0.0
+        return snapshot
+
+
+class StatusChannel:
+    """
+    Сторона голосового процесса: пишет уровень в метр, а статусы — в метр
+    и в ограниченную очередь. Если очередь полна (её никто не читает),
+    событие отбрасывается — голосовой цикл никогда не блокируется на IPC.
+    """
+
+    def __init__(self, status_queue=None, meter: AudioLevelMeter | None = None):
+        self._queue = status_queue
+        self._meter = meter
+
+    def level(self, rms: float):
+        if self._meter is not None:
+            self._meter.update(rms)
+
+    def status(self, value: str):
+        if self._meter is not None:
+            self._meter.set_status(value)
+        if self._queue is not None:
+            try:
+                self._queue.put_nowait({"type": "status", "value": value})
+            except queue.Full:
+                pass
+
+
+def poll_control(control_queue) -> dict | None:
+    """Следующее управляющее сообщение без ожидания (None, если очереди нет или она пуста)."""
+    if control_queue is None:
+        return None
+    try:
+        return control_queue.get_nowait()
+    except (queue.Empty, OSError, ValueError):
+        return None
+
+
+def request_ptt(control_queue):
+    """Активирует диалог так же, как wake word (для горячей клавиши / меню-бара)."""
+    control_queue.put(PTT_ACTIVATE)
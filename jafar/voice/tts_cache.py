@@ -0,0 +1,244 @@
+"""Кэш синтезированной речи по тексту, голосу и скорости.
+
+    python -m jafar.voice.tts_cache prewarm | stats | clear
+"""
+
+import os
+import sys
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+
+MUXLISA_TTS_URL = "https://service.muxlisa.uz/api/v2/tts"
+CACHE_DIR = Path(os.path.expanduser(os.environ.get("JAFAR_TTS_CACHE_DIR", "~/.jafar/tts_cache")))
+MAX_DISK_BYTES = int(float(os.environ.get("JAFAR_TTS_CACHE_MB", "200")) * 1024 * 1024)
+MAX_MEMORY_BYTES = 16 * 1024 * 1024
+
+DEFAULT_SPEAKER = 1
+# Скорость голосового ассистента (speech.speak_text); CLI-озвучка идёт со скоростью API по умолчанию
+VOICE_RATE = 1.2
+
+_GREETING_TITLES = ("janob", "maestro", "ustoz", "Timur aka")
+
+# Фиксированные фразы, которые звучат чаще всего: (текст, скорость)
+WARM_PHRASES = (
+    *((text, VOICE_RATE) for title in _GREETING_TITLES
+      for text in (f"Assalomu aleykum, {title}", f"Labbay, {title}?", f"Eshitaman, {title}.")),
+    ("Va alaykum assalom", VOICE_RATE),
+    ("Qaysi instrumentni tahlil qilamiz?", VOICE_RATE),
+    ("Qaysi mavzu bo'yicha yangiliklar kerak?", VOICE_RATE),
+    ("Yaxshi, janob.", VOICE_RATE),
+    ("Buyruqni bajarishda xatolik yuz berdi.", VOICE_RATE),
+    ("Позиция очилди!", None),
+    ("Диққат! Нарх стоп-лоссга яқинлашмоқда!", None),
+    ("Савдо ёпилди!", None),
+    ("Agent 001 ishga tushirildi.", None),
+    ("Jafar Super Agent ishga tushirildi. Bozor kuzatilmoqda.", None),
+    ("Skrinshot olish bekor qilindi.", None),
+)
+
+_APOSTROPHES = str.maketrans({"ʻ": "'", "ʼ": "'", "‘": "'", "’": "'", "`": "'"})
+
+
+def normalize_text(text: str) -> str:
+    """NFC, единый апостроф (o‘/oʻ/o'), схлопнутые пробелы — одинаковые фразы дают один ключ."""
+    text = unicodedata.normalize("NFC", text).translate(_APOSTROPHES)
+    return " ".join(text.split())
+
+
+def cache_key(text: str, speaker: int = DEFAULT_SPEAKER, rate: float | None = None) -> str:
+    raw = f"{normalize_text(text)}\x00{speaker}\x00{'' if rate is None else f'{rate:g}'}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def synthesize(text: str, speaker: int = DEFAULT_SPEAKER, rate: float | None = None) -> bytes | None:
+    """Запрос к Muxlisa TTS. Возвращает аудио (WAV) или None при ошибке."""
+    import requests
+
+    api_key = os.environ.get("MUXLISA_API_KEY")
+    if not api_key:
+        print("Ошибка: API ключ для Muxlisa не найден в .env файле.")
+        return None
+    payload = {"text": text, "speaker": speaker}
+    if rate is not None:
+        payload["rate"] = rate
+    try:
+        response = requests.post(
+            MUXLISA_TTS_URL, headers={"Content-Type": "application/json", "x-api-key": api_key},
+            json=payload, timeout=30,
+        )
+    except requests.exceptions.RequestException as e:
+        print(f"Сетевая ошибка при обращении к Muxlisa API: {e}")
+        return None
+    if response.status_code != 200:
+        print(f"Ошибка от Muxlisa API: {response.status_code} - {response.text}")
+        return None
+    return response.content
+
+
+class TtsCache:
+    """Кэш аудио: LRU в памяти поверх LRU на диске. Потокобезопасен."""
+
+    def __init__(self, directory: Path = CACHE_DIR, max_disk_bytes: int = MAX_DISK_BYTES,
+                 max_memory_bytes: int = MAX_MEMORY_BYTES):
+        self.directory = Path(directory)
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes: int | None = None  # считается при первой записи
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def path_for(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.wav"
+
+    def _remember(self, key: str, audio: bytes):
+        if len(audio) > self.max_memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = audio
+        self._memory_bytes += len(audio)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return audio
+            path = self.path_for(key)
+            try:
+                audio = path.read_bytes()
+                os.utime(path)  # отметка для LRU на диске
+            except OSError:
+                self.misses += 1
+                return None
+            self._remember(key, audio)
+            self.hits += 1
+            return audio
+
+    def put(self, key: str, audio: bytes) -> Path:
+        path = self.path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(audio)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._remember(key, audio)
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(f.stat().st_size for f in self._files())
+            else:
+                self._disk_bytes += len(audio)
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+        return path
+
+    def _files(self) -> list[Path]:
+        return list(self.directory.glob("*/*.wav")) if self.directory.exists() else []
+
+    def _evict_disk(self):
+        """Удаляет самые давно использованные файлы, пока кэш не станет меньше 90% лимита."""
+        entries = []
+        for path in self._files():
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        target = self.max_disk_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            path.unlink(missing_ok=True)
+            self._memory_bytes -= len(self._memory.pop(path.stem, b""))
+            total -= size
+        self._disk_bytes = total
+
+    def clear(self):
+        with self._lock:
+            for path in self._files():
+                path.unlink(missing_ok=True)
+            self._memory.clear()
+            self._memory_bytes = 0
+            self._disk_bytes = 0
+
+    def stats(self) -> dict:
+        files = self._files()
+        return {
+            "files": len(files),
+            "disk_bytes": sum(f.stat().st_size for f in files),
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+_cache: TtsCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> TtsCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = TtsCache()
+        return _cache
+
+
+def get_audio(text: str, speaker: int = DEFAULT_SPEAKER, rate: float | None = None) -> bytes | None:
+    """Аудио фразы: из кэша или синтез с сохранением в кэш."""
+    cache = get_cache()
+    key = cache_key(text, speaker, rate)
+    audio = cache.get(key)
+    if audio is None:
+        audio = synthesize(text, speaker, rate)
+        if audio:
+            cache.put(key, audio)
+    return audio
+
+
+def prewarm(phrases=WARM_PHRASES, speaker: int = DEFAULT_SPEAKER) -> int:
+    """Синтезирует фразы, которых ещё нет в кэше. Возвращает число новых синтезов."""
+    cache = get_cache()
+    synthesized = 0
+    for text, rate in phrases:
+        key = cache_key(text, speaker, rate)
+        if cache.path_for(key).exists():
+            continue
+        audio = synthesize(text, speaker, rate)
+        if audio:
+            cache.put(key, audio)
+            synthesized += 1
+    return synthesized
+
+
+def prewarm_async(phrases=WARM_PHRASES) -> threading.Thread | None:
+    """Прогрев в фоне, чтобы старт процесса не ждал сети."""
+    if not os.environ.get("MUXLISA_API_KEY"):
+        return None
+    thread = threading.Thread(target=prewarm, args=(phrases,), name="tts-prewarm", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if command == "prewarm":
+        print(f"Synthesized {prewarm()} of {len(WARM_PHRASES)} warm phrases.")
+    elif command == "clear":
+        get_cache().clear()
+        print("TTS cache cleared.")
+    else:
+        print(get_cache().stats())
@@ -0,0 +1,124 @@
+"""Конвейерная озвучка: следующее предложение синтезируется, пока играет текущее."""
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from .playback import play
+from .tts_cache import get_audio
+
+DEFAULT_MAX_AHEAD = 3
+DEFAULT_WORKERS = 2
+_END = object()
+
+
+class SpeechPipeline:
+    """
+    Использование:
+        with SpeechPipeline(interrupt_event) as pipeline:
+            for sentence in sentences:
+                pipeline.say(sentence)
+    Выход из `with` ждёт, пока всё будет проиграно (или прервано).
+    """
+
+    def __init__(self, interrupt_event=None, synth=None, player=None,
+                 max_ahead: int = DEFAULT_MAX_AHEAD, workers: int = DEFAULT_WORKERS, rate: float | None = None):
+        self._interrupt_event = interrupt_event
+        self._synth = synth or (lambda text: get_audio(text, rate=rate))
+        self._player = player or play
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tts-synth")
+        # Ограничение очереди = насколько синтез может уйти вперёд плеера
+        self._pending: queue.Queue = queue.Queue(maxsize=max_ahead)
+        self._player_thread = threading.Thread(target=self._play_loop, name="tts-player", daemon=True)
+        self._player_thread.start()
+        self.played = 0
+
+    @property
+    def interrupted(self) -> bool:
+        return self._interrupt_event is not None and self._interrupt_event.is_set()
+
+    def say(self, text: str) -> bool:
+        """Ставит предложение в очередь. Блокирует, только если синтез ушёл вперёд на max_ahead."""
+        if self.interrupted:
+            return False
+        if not text.strip():
+            return True
+        future = self._pool.submit(self._synth, text)
+        while not self.interrupted:
+            try:
+                self._pending.put(future, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        future.cancel()
+        return False
+
+    def _play_loop(self):
+        while True:
+            item = self._pending.get()
+            if item is _END:
+                return
+            if self.interrupted:
+                item.cancel()
+                continue
+            try:
+                audio = self._wait(item)
+            except Exception as e:
+                print(f"Ошибка синтеза речи: {e}")
+                continue
+            if audio and not self.interrupted:
+                try:
+                    self._player(audio, self._interrupt_event)
+                except Exception as e:
+                    # Поток плеера не должен умирать: say() и close() ждут именно его
+                    print(f"Ошибка воспроизведения речи: {e}")
+                    continue
+                self.played += 1
+
+    def _wait(self, future: Future) -> bytes | None:
+        # Короткие ожидания, чтобы прерывание срабатывало и во время синтеза
+        while True:
+            try:
+                return future.result(timeout=0.1)
+            except TimeoutError:
+                if self.interrupted:
+                    future.cancel()
+                    return None
+
+    def close(self, wait: bool = True):
+        """Заканчивает приём и (если wait) ждёт конца воспроизведения."""
+        while True:
+            try:
+                self._pending.put(_END, timeout=0.1)
+                break
+            except queue.Full:
+                if self.interrupted:
+                    self._drain()
+        if wait:
+            self._player_thread.join()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _drain(self):
+        while True:
+            try:
+                item = self._pending.get_nowait()
+            except queue.Empty:
+                return
+            if isinstance(item, Future):
+                item.cancel()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def speak_sentences(sentences, interrupt_event=None, synth=None, player=None, rate: float | None = None) -> int:
+    """Озвучивает последовательность предложений конвейером. Возвращает число проигранных."""
+    with SpeechPipeline(interrupt_event, synth=synth, player=player, rate=rate) as pipeline:
+        for sentence in sentences:
+            if not pipeline.say(sentence):
+                break
+    return pipeline.played
@@ -0,0 +1,231 @@
+"""Определение границ фразы (VAD) для голосового цикла.
+
+    python -m jafar.voice.vad eval fixtures/
+"""
+
+import sys
+import json
+import math
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+FRAME_LENGTH = 512  # кадр Porcupine
+
+
+@dataclass
+class VadConfig:
+    sample_rate: int = SAMPLE_RATE
+    frame_length: int = FRAME_LENGTH
+    pre_roll_s: float = 0.3
+    min_speech_s: float = 0.1        # столько речи подряд — начало фразы
+    hangover_s: float = 0.35         # столько не-речи подряд — конец фразы
+    max_utterance_s: float = 15.0
+    snr_db: float = 9.0              # порог энергии над уровнем шума
+    strong_snr_db: float = 18.0      # выше — речь без проверки спектра (шипящие)
+    max_flatness: float = 0.45
+    max_zcr: float = 0.35
+    noise_down: float = 0.3          # скорость опускания уровня шума
+    noise_up: float = 0.02           # скорость подъёма на кадрах без речи
+    noise_creep: float = 0.002       # медленный подъём во время «речи» (если шум вырос скачком)
+
+    def frames(self, seconds: float) -> int:
+        return max(1, math.ceil(seconds * self.sample_rate / self.frame_length))
+
+
+@dataclass
+class FrameFeatures:
+    energy_db: float
+    zcr: float
+    flatness: float
+
+
+@dataclass
+class VadEvent:
+    """start — начало фразы (audio: pre-roll), continue — очередной кадр, end — вся фраза."""
+    kind: str
+    audio: bytes
+
+
+def frame_features(pcm: bytes, sample_rate: int = SAMPLE_RATE) -> FrameFeatures:
+    samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+    if samples.size == 0:
+        return FrameFeatures(-120.0, 0.0, 1.0)
+    rms = math.sqrt(float(np.dot(samples, samples)) / samples.size)
+    zcr = np.count_nonzero(np.diff(np.signbit(samples))) / samples.size
+    spectrum = np.abs(np.fft.rfft(samples * np.hanning(samples.size))) ** 2 + 1e-12
+    # Плоскостность в речевой полосе 100–4000 Гц
+    freqs = np.fft.rfftfreq(samples.size, 1.0 / sample_rate)
+    band = spectrum[(freqs >= 100) & (freqs <= 4000)]
+    flatness = float(np.exp(np.mean(np.log(band))) / np.mean(band)) if band.size else 1.0
+    return FrameFeatures(20.0 * math.log10(rms + 1e-9), float(zcr), flatness)
+
+
+class Endpointer:
+    """
+    Конечный автомат тишина → речь → тишина. `process()` вызывается на
+    каждый кадр и возвращает VadEvent или None; `observe()` только
+    обновляет уровень шума (например, в цикле ожидания wake word).
+    """
+
+    def __init__(self, config: VadConfig | None = None):
+        self.config = config or VadConfig()
+        self.noise_floor_db: float | None = None
+        self._pre_roll = deque(maxlen=self.config.frames(self.config.pre_roll_s) + self.config.frames(self.config.min_speech_s))
+        self._onset_frames = self.config.frames(self.config.min_speech_s)
+        self._hangover_frames = self.config.frames(self.config.hangover_s)
+        self._max_frames = self.config.frames(self.config.max_utterance_s)
+        self.reset()
+
+    def reset(self):
+        """Сбрасывает состояние фразы; уровень шума сохраняется."""
+        self._pre_roll.clear()
+        self._utterance = bytearray()
+        self._in_speech = False
+        self._speech_run = 0
+        self._silence_run = 0
+        self._utterance_frames = 0
+
+    def classify(self, pcm: bytes) -> bool:
+        """Речь ли это, с обновлением уровня шума."""
+        cfg = self.config
+        features = frame_features(pcm, cfg.sample_rate)
+        if self.noise_floor_db is None:
+            self.noise_floor_db = features.energy_db
+        snr = features.energy_db - self.noise_floor_db
+        is_speech = snr > cfg.strong_snr_db or (
+            snr > cfg.snr_db and features.flatness < cfg.max_flatness and features.zcr < cfg.max_zcr
+        )
+        if features.energy_db < self.noise_floor_db:
+            rate = cfg.noise_down
+        else:
+            rate = cfg.noise_creep if is_speech else cfg.noise_up
+        self.noise_floor_db = max(-100.0, self.noise_floor_db + rate * (features.energy_db - self.noise_floor_db))
+        return is_speech
+
+    def observe(self, pcm: bytes):
+        self.classify(pcm)
+
+    def process(self, pcm: bytes) -> VadEvent | None:
+        is_speech = self.classify(pcm)
+
+        if not self._in_speech:
+            self._pre_roll.append(pcm)
+            self._speech_run = self._speech_run + 1 if is_speech else 0
+            if self._speech_run < self._onset_frames:
+                return None
+            self._in_speech = True
+            self._silence_run = 0
+            pre_roll = b"".join(self._pre_roll)
+            self._pre_roll.clear()
+            self._utterance = bytearray(pre_roll)
+            self._utterance_frames = len(pre_roll) // (2 * self.config.frame_length)
+            return VadEvent("start", pre_roll)
+
+        self._utterance += pcm
+        self._utterance_frames += 1
+        self._silence_run = 0 if is_speech else self._silence_run + 1
+        if self._silence_run >= self._hangover_frames or self._utterance_frames >= self._max_frames:
+            utterance = bytes(self._utterance)
+            self.reset()
+            return VadEvent("end", utterance)
+        return VadEvent("continue", pcm)
+
+
+# --- Офлайн-оценка ---
+
+def detect_segments(pcm: bytes, config: VadConfig | None = None) -> list[tuple[float, float]]:
+    """Прогоняет запись через Endpointer и возвращает найденные фразы (секунды)."""
+    config = config or VadConfig()
+    endpointer = Endpointer(config)
+    frame_bytes = config.frame_length * 2
+    frame_s = config.frame_length / config.sample_rate
+    segments, start = [], None
+    for index in range(len(pcm) // frame_bytes):
+        event = endpointer.process(pcm[index * frame_bytes:(index + 1) * frame_bytes])
+        if event is None:
+            continue
+        if event.kind == "start":
+            # Решение принято в конце этого кадра; pre-roll отодвигает начало назад
+            start = (index + 1) * frame_s - len(event.audio) / 2 / config.sample_rate
+        elif event.kind == "end":
+            segments.append((max(0.0, start), (index + 1) * frame_s))
+            start = None
+    if start is not None:
+        segments.append((max(0.0, start), len(pcm) / 2 / config.sample_rate))
+    return segments
+
+
+def _frame_mask(segments, n_frames: int, frame_s: float) -> np.ndarray:
+    mask = np.zeros(n_frames, dtype=bool)
+    for start, end in segments:
+        mask[int(start / frame_s):int(math.ceil(end / frame_s))] = True
+    return mask
+
+
+def evaluate_file(wav_path: str, config: VadConfig | None = None) -> dict:
+    """Сравнивает найденные фразы с разметкой `<имя>.json` (кадровые P/R/F1, обрезка начала, задержка конца)."""
+    from .stt_engine import read_wav_pcm
+
+    config = config or VadConfig()
+    pcm = read_wav_pcm(wav_path, config.sample_rate)
+    labels = json.loads(Path(wav_path).with_suffix(".json").read_text()).get("segments", [])
+    detected = detect_segments(pcm, config)
+
+    frame_s = config.frame_length / config.sample_rate
+    n_frames = len(pcm) // (config.frame_length * 2)
+    truth, found = _frame_mask(labels, n_frames, frame_s), _frame_mask(detected, n_frames, frame_s)
+    tp = int(np.count_nonzero(truth & found))
+    precision = tp / max(1, int(np.count_nonzero(found)))
+    recall = tp / max(1, int(np.count_nonzero(truth)))
+
+    # Для каждой размеченной фразы — ближайшая найденная с пересечением
+    clipped_ms, tail_ms = [], []
+    for start, end in labels:
+        overlapping = [seg for seg in detected if seg[0] < end and seg[1] > start]
+        if overlapping:
+            clipped_ms.append(max(0.0, overlapping[0][0] - start) * 1000)
+            tail_ms.append((overlapping[-1][1] - end) * 1000)
+    return {
+        "file": str(wav_path),
+        "labels": len(labels),
+        "detected": len(detected),
+        "missed": len(labels) - len(clipped_ms),
+        "precision": precision,
+        "recall": recall,
+        "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+        "onset_clip_ms": float(np.mean(clipped_ms)) if clipped_ms else 0.0,
+        "tail_latency_ms": float(np.mean(tail_ms)) if tail_ms else 0.0,
+    }
+
+
+def evaluate(paths: list[str], config: VadConfig | None = None) -> list[dict]:
+    files = []
+    for path in paths:
+        path = Path(path)
+        files.extend(sorted(path.glob("*.wav")) if path.is_dir() else [path])
+    return [evaluate_file(str(wav), config) for wav in files]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "eval":
+        print("Usage: python -m jafar.voice.vad eval <dir|file.wav> [...] [--hangover S]")
+        sys.exit(2)
+    args = sys.argv[2:]
+    config = VadConfig()
+    if "--hangover" in args:
+        index = args.index("--hangover")
+        config.hangover_s = float(args[index + 1])
+        del args[index:index + 2]
+    rows = evaluate(args, config)
+    for row in rows:
+        print(f"F1 {row['f1']:.3f}  P {row['precision']:.3f}  R {row['recall']:.3f}  "
+              f"missed {row['missed']}/{row['labels']}  clip {row['onset_clip_ms']:.0f} ms  "
+              f"tail {row['tail_latency_ms']:.0f} ms  {row['file']}")
+    if rows:
+        print(f"mean F1 {np.mean([r['f1'] for r in rows]):.3f}, "
+              f"mean tail latency {np.mean([r['tail_latency_ms'] for r in rows]):.0f} ms "
+              f"(hangover {config.hangover_s:.2f} s)")
@@ -3,14 +3,20 @@ from pathlib import Path
 from dotenv import load_dotenv
 import multiprocessing
 import sys
-from jafar.voice.jafar_core import main as voice_main
-from jafar.cli.main import main as cli_main
 
-def run_voice_assistant(interrupt_event, queue, main_exit_event):
+from jafar.utils.command_bus import BusExecutor
+from jafar.voice.telemetry import AudioLevelMeter, STATUS_QUEUE_SIZE
+
+# jafar.voice.jafar_core (pyaudio, porcupine, Gemini) is imported only inside
+# the voice process, and the CLI stack only in the main process.
+
+def run_voice_assistant(interrupt_event, status_queue, main_exit_event, bus_conn, control_queue, level_meter):
     """Wrapper to run the voice assistant in a separate process."""
     print("Starting voice assistant process...")
     try:
-        voice_main(interrupt_event, queue, main_exit_event)
+        from jafar.voice.jafar_core import main as voice_main
+
+        voice_main(interrupt_event, status_queue, main_exit_event, bus_conn, control_queue, level_meter)
     except KeyboardInterrupt:
         print("Voice assistant process interrupted.")
     finally:
@@ -20,6 +26,8 @@ def run_cli():
     """Wrapper to run the CLI."""
     print("Starting CLI...")
     try:
+        from jafar.cli.main import main as cli_main
+
         cli_main()
     except KeyboardInterrupt:
         print("\nCLI interrupted.")
@@ -38,14 +46,23 @@ if __name__ == "__main__":
     # Create multiprocessing components
     interrupt_event = multiprocessing.Event()
     main_exit_event = multiprocessing.Event()
-    queue = multiprocessing.Queue()
+    # Status changes (bounded, dropped when nobody reads them) and control
+    # messages such as PTT travel on separate queues; the mic level lives
+    # in shared memory instead of one queue message per audio frame.
+    status_queue = multiprocessing.Queue(maxsize=STATUS_QUEUE_SIZE)
+    control_queue = multiprocessing.Queue()
+    level_meter = AudioLevelMeter()
+    # Command bus: the voice process publishes intents, this process executes them
+    executor_conn, voice_conn = multiprocessing.Pipe(duplex=True)
 
     # Create and start the voice assistant process
     voice_process = multiprocessing.Process(
         target=run_voice_assistant,
-        args=(interrupt_event, queue, main_exit_event)
+        args=(interrupt_event, status_queue, main_exit_event, voice_conn, control_queue, level_meter)
     )
     voice_process.start()
+    voice_conn.close()  # the child owns this end now
+    bus_executor = BusExecutor(executor_conn).start()
 
     # Run the CLI in the main process
     run_cli()
@@ -53,6 +70,7 @@ if __name__ == "__main__":
     # When CLI exits, signal the voice assistant to exit
     print("CLI has exited. Signaling voice assistant to terminate...")
     main_exit_event.set()
+    bus_executor.stop()
 
     # Wait for the voice process to finish
     voice_process.join(timeout=5)